@@ -0,0 +1,86 @@
+import logging
+import sys
+from typing import List
+
+import click
+
+from benchmarks.suite import (
+    BENCHMARKS,
+    append_history,
+    compare,
+    create_record,
+    read_history,
+    run_suite,
+)
+from benchmarks.synthetic import PROFILES
+
+
+@click.command()
+@click.option("-w",
+              "--work-dir",
+              default=".benchmarks",
+              help="Directory for the synthetic rasters, reused across runs.")
+@click.option("-p",
+              "--profile",
+              multiple=True,
+              type=click.Choice(list(PROFILES)),
+              help="Synthetic country to run on. Defaults to all.")
+@click.option("-b",
+              "--benchmark",
+              multiple=True,
+              type=click.Choice(BENCHMARKS),
+              help="Benchmark to run. Defaults to all.")
+@click.option("-s",
+              "--scale",
+              default=1.0,
+              help="Factor applied to the raster dimensions.")
+@click.option("-r", "--repeat", default=3, help="Timed runs per benchmark.")
+@click.option("--history",
+              default="benchmarks/history.jsonl",
+              help="JSON lines file the results are appended to.")
+@click.option("--threshold",
+              default=0.1,
+              help="Slowdown, as a fraction, reported as a regression.")
+@click.option("--check",
+              is_flag=True,
+              default=False,
+              help="Exit with an error when a regression is found.")
+def main(work_dir: str, profile: List[str], benchmark: List[str], scale: float,
+         repeat: int, history: str, threshold: float, check: bool) -> None:
+    """Times the WorldPop pipeline on synthetic rasters served by a stub
+    API, and compares the results with the previous run at the same scale.
+    """
+    logging.basicConfig(level=logging.WARNING)
+    results = run_suite(work_dir,
+                        list(profile) or None,
+                        list(benchmark) or None, scale, repeat)
+    record = create_record(results, scale, repeat)
+
+    print(f"{'benchmark':<22}{'profile':<10}{'median s':>10}{'MB/s':>10}")
+    for result in record["results"]:
+        if "median" in result:
+            print(f"{result['benchmark']:<22}{result['profile']:<10}"
+                  f"{result['median']:>10.3f}{result['mb_per_s']:>10.1f}")
+        else:
+            print(f"{result['benchmark']:<22}{result['profile']:<10}"
+                  f"  {result['status']}: {result['error']}")
+
+    previous = [r for r in read_history(history) if r["scale"] == scale]
+    append_history(history, record)
+    if not previous:
+        return
+    regressions = 0
+    print(f"\nCompared with {previous[-1]['commit'] or 'unknown commit'} "
+          f"({previous[-1]['timestamp']})")
+    for row in compare(previous[-1], record, threshold):
+        flag = "  REGRESSION" if row["regression"] else ""
+        regressions += row["regression"]
+        print(f"{row['benchmark']:<22}{row['profile']:<10}"
+              f"{row['previous']:>10.3f}{row['current']:>10.3f}"
+              f"{row['ratio']:>8.2f}x{flag}")
+    if check and regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
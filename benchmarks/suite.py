@@ -0,0 +1,335 @@
+import json
+import logging
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import time
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timezone
+from tempfile import TemporaryDirectory
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import rasterio
+
+from benchmarks.synthetic import (
+    POPYEAR,
+    PROFILES,
+    SyntheticCountry,
+    country_metadata,
+    create_country,
+)
+from stactools.worldpop import __version__
+from stactools.worldpop.cog import create_cog, create_retiled_cogs
+from stactools.worldpop.mirror import mirror_collections
+from stactools.worldpop.populate import PopulateOptions, populate_collection
+from stactools.worldpop.stac import create_item
+from stactools.worldpop.work import list_work_units
+from tests.stub_api import StubAPI
+
+logger = logging.getLogger(__name__)
+
+BENCHMARKS = [
+    "mirror",
+    "create_item",
+    "create_cog",
+    "create_retiled_cogs",
+    "populate_collection",
+]
+# GDAL command line tools needed by each benchmark
+REQUIRED_TOOLS = {
+    "create_cog": ["gdal_translate"],
+    "create_retiled_cogs": ["gdal_retile.py", "gdal_translate"],
+}
+
+
+@dataclass
+class BenchmarkResult:
+    """Timings of one benchmark on one synthetic country.
+
+    Attributes:
+        benchmark (str): Name of the benchmark.
+        profile (str): Profile of the synthetic country.
+        status (str): "ok", "skipped" or "failed".
+        seconds (List[float]): Wall time of each repeat.
+        bytes (int): Size of the input rasters.
+        pixels (int): Number of pixels of the input rasters.
+        error (str): Why the benchmark was skipped or failed.
+    """
+    benchmark: str
+    profile: str
+    status: str = "ok"
+    seconds: List[float] = field(default_factory=list)
+    bytes: int = 0
+    pixels: int = 0
+    error: Optional[str] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        result = asdict(self)
+        if self.seconds:
+            median = statistics.median(self.seconds)
+            result["min"] = min(self.seconds)
+            result["median"] = median
+            result["mb_per_s"] = (self.bytes / 1e6 /
+                                  median if median > 0 else None)
+        return result
+
+
+def time_repeats(function: Callable[[], Any], repeat: int) -> List[float]:
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        seconds.append(time.perf_counter() - start)
+    return seconds
+
+
+def run_benchmark(result: BenchmarkResult, function: Callable[[], Any],
+                  repeat: int) -> BenchmarkResult:
+    missing = [
+        tool for tool in REQUIRED_TOOLS.get(result.benchmark, [])
+        if shutil.which(tool) is None
+    ]
+    if missing:
+        result.status = "skipped"
+        result.error = f"Missing {', '.join(missing)}"
+        return result
+    logger.info(f"Running {result.benchmark} on {result.profile}")
+    try:
+        result.seconds = time_repeats(function, repeat)
+    except Exception as e:
+        logger.exception(f"{result.benchmark} failed on {result.profile}")
+        result.status = "failed"
+        result.error = repr(e)
+    return result
+
+
+def _raster_size(paths: List[str]) -> Tuple[int, int]:
+    pixels = 0
+    for path in paths:
+        with rasterio.open(path) as src:
+            pixels += src.width * src.height
+    return sum(os.path.getsize(p) for p in paths), pixels
+
+
+def run_suite(work_dir: str,
+              profiles: Optional[List[str]] = None,
+              benchmarks: Optional[List[str]] = None,
+              scale: float = 1.0,
+              repeat: int = 3) -> List[BenchmarkResult]:
+    """Run the benchmarks on synthetic countries served by a stub API.
+
+    Rasters are generated once per scale in `work_dir` and reused by later
+    runs. They are mirrored from the stub API, and the other benchmarks read
+    them from that mirror, so no benchmark depends on the network.
+
+    Args:
+        work_dir (str): Directory for the synthetic rasters.
+        profiles (List[str], optional): Profiles of the synthetic countries.
+            Defaults to all profiles.
+        benchmarks (List[str], optional): Benchmarks to run. Defaults to all.
+        scale (float, optional): Factor applied to the raster dimensions.
+        repeat (int, optional): Number of timed runs of each benchmark.
+
+    Returns:
+        List[BenchmarkResult]: One result per benchmark and profile.
+    """
+    countries = [PROFILES[p] for p in (profiles or list(PROFILES))]
+    benchmarks = benchmarks or BENCHMARKS
+    raster_dir = os.path.join(work_dir, f"scale-{scale:g}")
+    rasters: Dict[str, List[str]] = {
+        c.profile: create_country(c, os.path.join(raster_dir, c.profile),
+                                  scale)
+        for c in countries
+    }
+    sizes = {
+        profile: _raster_size(paths)
+        for profile, paths in rasters.items()
+    }
+
+    def new_result(benchmark: str,
+                   country: SyntheticCountry) -> BenchmarkResult:
+        size, pixels = sizes[country.profile]
+        return BenchmarkResult(benchmark,
+                               country.profile,
+                               bytes=size,
+                               pixels=pixels)
+
+    results = []
+    with TemporaryDirectory() as tmp_dir:
+        source_root = os.path.join(tmp_dir, "mirror")
+        metadatas = {}
+        with StubAPI({}) as stub:
+            for country in countries:
+                urls = []
+                for path in rasters[country.profile]:
+                    url_path = f"/GIS/{country.iso3}/{os.path.basename(path)}"
+                    stub.files[url_path] = path
+                    urls.append(f"{stub.root}{url_path}")
+                metadatas[country.profile] = [country_metadata(country, urls)]
+                listing = stub.listings.setdefault(
+                    f"{country.project}/{country.category}", {})
+                listing[country.iso3] = metadatas[country.profile]
+
+            for country in countries:
+
+                def mirror(country: SyntheticCountry = country) -> None:
+                    shutil.rmtree(source_root, ignore_errors=True)
+                    mirror_collections(source_root,
+                                       [(country.project, country.category)],
+                                       iso3s=[country.iso3],
+                                       rasters=True,
+                                       api_url=stub.url)
+
+                if "mirror" in benchmarks:
+                    results.append(
+                        run_benchmark(new_result("mirror", country), mirror,
+                                      repeat))
+
+            shutil.rmtree(source_root, ignore_errors=True)
+            mirror_collections(source_root,
+                               sorted({(c.project, c.category)
+                                       for c in countries}),
+                               iso3s=[c.iso3 for c in countries],
+                               rasters=True,
+                               api_url=stub.url)
+
+        # The stub API is down, everything else reads from the mirror
+        for country in countries:
+            paths = rasters[country.profile]
+            output_dir = os.path.join(tmp_dir, "output", country.profile)
+
+            def item(country: SyntheticCountry = country) -> None:
+                create_item(country.project,
+                            country.category,
+                            country.iso3,
+                            POPYEAR,
+                            metadatas[country.profile],
+                            source_root=source_root)
+
+            def cog(paths: List[str] = paths,
+                    output_dir: str = output_dir) -> None:
+                os.makedirs(output_dir, exist_ok=True)
+                for path in paths:
+                    create_cog(
+                        path,
+                        os.path.join(
+                            output_dir,
+                            os.path.basename(path).replace(".tif",
+                                                           "_cog.tif")))
+
+            def retiled(paths: List[str] = paths,
+                        output_dir: str = output_dir) -> None:
+                shutil.rmtree(output_dir, ignore_errors=True)
+                os.makedirs(output_dir)
+                for path in paths:
+                    create_retiled_cogs(path, output_dir)
+
+            functions: Dict[str, Callable[[], Any]] = {
+                "create_item": item,
+                "create_cog": cog,
+                "create_retiled_cogs": retiled,
+            }
+            for name, function in functions.items():
+                if name in benchmarks:
+                    results.append(
+                        run_benchmark(new_result(name, country), function,
+                                      repeat))
+
+        # Populate a collection for each country, the way the
+        # populate-collection command does
+        if "populate_collection" in benchmarks:
+            for country in countries:
+
+                def populate(country: SyntheticCountry = country) -> None:
+                    units = [
+                        u for u in list_work_units(country.project,
+                                                   country.category, [POPYEAR],
+                                                   source_root=source_root)
+                        if u.iso3 == country.iso3
+                    ]
+                    populate_collection(
+                        country.project,
+                        country.category,
+                        os.path.join(tmp_dir, "stac", country.profile),
+                        options=PopulateOptions(source_root=source_root),
+                        units=units)
+
+                results.append(
+                    run_benchmark(new_result("populate_collection", country),
+                                  populate, repeat))
+    return results
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"],
+                              capture_output=True,
+                              text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def create_record(results: List[BenchmarkResult], scale: float,
+                  repeat: int) -> Dict[str, Any]:
+    """Return a history record of one run of the suite."""
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "version": __version__,
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "gdal": rasterio.__gdal_version__,
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "scale": scale,
+        "repeat": repeat,
+        "results": [r.to_dict() for r in results],
+    }
+
+
+def append_history(path: str, record: Dict[str, Any]) -> None:
+    """Append a record to a JSON lines history file."""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, "a") as f:
+        f.write(json.dumps(record, sort_keys=True) + "\n")
+
+
+def read_history(path: str) -> List[Dict[str, Any]]:
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def compare(previous: Dict[str, Any], current: Dict[str, Any],
+            threshold: float) -> List[Dict[str, Any]]:
+    """Compare the median times of two records.
+
+    Returns:
+        List[dict]: For each benchmark run in both records, the previous and
+        current median and their ratio, flagged as a regression when the
+        current median is more than `threshold` (a fraction) slower.
+    """
+    before = {
+        (r["benchmark"], r["profile"]): r
+        for r in previous["results"] if "median" in r
+    }
+    comparison = []
+    for result in current["results"]:
+        key = (result["benchmark"], result["profile"])
+        if key not in before or "median" not in result:
+            continue
+        ratio = result["median"] / before[key]["median"]
+        comparison.append({
+            "benchmark": key[0],
+            "profile": key[1],
+            "previous": before[key]["median"],
+            "current": result["median"],
+            "ratio": ratio,
+            "regression": ratio > 1 + threshold,
+        })
+    return comparison
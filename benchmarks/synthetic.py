@@ -0,0 +1,135 @@
+import math
+import os
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+import rasterio
+from rasterio.transform import from_origin
+
+# 3 arc seconds, the resolution of the 100m WorldPop rasters
+PIXEL_SIZE = 1 / 1200
+NODATA = -99999.0
+POPYEAR = "2020"
+# Rows written at once, and the size in pixels of the land mask cells
+STRIP_HEIGHT = 256
+CELL_SIZE = 64
+
+
+@dataclass
+class SyntheticCountry:
+    """A fake country shaped like the WorldPop rasters of a real one.
+
+    Attributes:
+        profile (str): Name of the profile, e.g. "island".
+        project (str): WorldPop project ID.
+        category (str): WorldPop category ID (member of `project`).
+        iso3 (str): Fake ISO3 code, not used by any real country.
+        shape (Tuple[int, int]): Height and width of the rasters at scale 1.
+        land (float): Fraction of the pixels with data.
+        files (List[str]): Names of the rasters, without extension.
+        origin (Tuple[float, float]): Longitude and latitude of the top left
+            corner.
+    """
+    profile: str
+    project: str
+    category: str
+    iso3: str
+    shape: Tuple[int, int]
+    land: float
+    files: List[str] = field(default_factory=list)
+    origin: Tuple[float, float] = (0.0, 0.0)
+
+    def scaled_shape(self, scale: float) -> Tuple[int, int]:
+        return (max(1, int(self.shape[0] * scale)),
+                max(1, int(self.shape[1] * scale)))
+
+
+PROFILES = {
+    # Small archipelago, mostly nodata
+    "island":
+    SyntheticCountry("island", "pop", "cic2020_UNadj_100m", "XIS",
+                     (1800, 1500), 0.03, ["xis_ppp_2020_UNadj_constrained"],
+                     (-61.0, 15.0)),
+    # Large country, mostly land
+    "dense":
+    SyntheticCountry("dense", "pop", "cic2020_UNadj_100m", "XDN", (8000, 8000),
+                     0.7, ["xdn_ppp_2020_UNadj_constrained"], (20.0, 10.0)),
+    # Age/sex structures, many files per country and year
+    "agesex":
+    SyntheticCountry(
+        "agesex", "age_structures", "ascicua_2020", "XAS", (2500, 2500), 0.4,
+        [f"xas_{s}_{a}_2020_constrained_UNadj" for s in "fm"
+         for a in [0, 1]], (100.0, 20.0)),
+}
+
+
+def write_synthetic_raster(path: str, shape: Tuple[int, int], land: float,
+                           origin: Tuple[float, float], seed: int) -> None:
+    """Write a float32 GeoTIFF of people per pixel, like WorldPop's.
+
+    Land is made of blocks of a coarse random mask so that data and nodata
+    come in contiguous areas, and population values are log-normal. The
+    raster is written in strips so that large ones fit in memory.
+    """
+    height, width = shape
+    rng = np.random.default_rng(seed)
+    coarse = rng.random(
+        (math.ceil(height / CELL_SIZE), math.ceil(width / CELL_SIZE)))
+    threshold = np.quantile(coarse, 1 - land) if land < 1 else -1
+    profile = {
+        "driver": "GTiff",
+        "dtype": "float32",
+        "count": 1,
+        "height": height,
+        "width": width,
+        "crs": "EPSG:4326",
+        "transform": from_origin(origin[0], origin[1], PIXEL_SIZE, PIXEL_SIZE),
+        "nodata": NODATA,
+        "compress": "LZW",
+    }
+    with rasterio.open(path, "w", **profile) as dst:
+        for row in range(0, height, STRIP_HEIGHT):
+            rows = min(STRIP_HEIGHT, height - row)
+            cells = coarse[np.arange(row, row + rows) // CELL_SIZE]
+            mask = np.repeat(cells > threshold, CELL_SIZE, axis=1)[:, :width]
+            data = rng.lognormal(0.0, 1.5, (rows, width)).astype("float32")
+            data[~mask] = NODATA
+            dst.write(data, 1, window=((row, row + rows), (0, width)))
+
+
+def create_country(country: SyntheticCountry, directory: str,
+                   scale: float) -> List[str]:
+    """Write the rasters of a synthetic country, unless already there.
+
+    Returns:
+        List[str]: Paths to the rasters.
+    """
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for seed, name in enumerate(country.files):
+        path = os.path.join(directory, f"{name}.tif")
+        if not os.path.exists(path):
+            write_synthetic_raster(f"{path}.part.tif",
+                                   country.scaled_shape(scale), country.land,
+                                   country.origin, seed)
+            os.replace(f"{path}.part.tif", path)
+        paths.append(path)
+    return paths
+
+
+def country_metadata(country: SyntheticCountry,
+                     urls: List[str]) -> Dict[str, Any]:
+    """Return WorldPop API metadata for a synthetic country."""
+    return {
+        "id": "0",
+        "title": f"Synthetic {country.profile} country {country.iso3}",
+        "desc": "Synthetic raster for benchmarks.",
+        "doi": "10.5258/SOTON/WP00685",
+        "citation": "Synthetic data.",
+        "popyear": POPYEAR,
+        "iso3": country.iso3,
+        "files": urls,
+        "url_img": "https://www.worldpop.org/tabs/gdata/img/0/0.png",
+        "url_summary": "https://www.worldpop.org/geodata/summary?id=0",
+    }
@@ -0,0 +1,268 @@
+import logging
+import math
+import os
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import List, Optional
+
+import numpy as np
+import rasterio
+from affine import Affine
+from pystac import Collection, Item, Link
+from rasterio.windows import Window
+
+from stactools.worldpop.cog import create_cog, download_tif
+from stactools.worldpop.constants import (
+    AGGREGATE_FACTOR,
+    AGGREGATE_WINDOW_SIZE,
+    COG_NODATA,
+    COLLECTIONS_METADATA,
+    WORLDPOP_NODATA,
+)
+from stactools.worldpop.populate import save_collection
+from stactools.worldpop.profiling import stage
+from stactools.worldpop.stac import create_collection, create_item
+from stactools.worldpop.stats import valid_mask
+from stactools.worldpop.thumbnail import thumbnail_path
+from stactools.worldpop.utils import get_popyears, source_href
+from stactools.worldpop.work import WorkUnit, list_work_units
+
+logger = logging.getLogger(__name__)
+
+
+def aggregated_gsd(project: str,
+                   category: str,
+                   factor: int = AGGREGATE_FACTOR) -> float:
+    gsd: float = COLLECTIONS_METADATA[project][category]["gsd"] * factor
+    return gsd
+
+
+def aggregate_block(data: np.ndarray, valid: np.ndarray,
+                    factor: int) -> np.ndarray:
+    """Sum the valid values of each `factor` x `factor` block of an array.
+
+    The array is padded with invalid values up to a multiple of `factor`.
+    Blocks without any valid value are set to the WorldPop nodata value.
+
+    Args:
+        data (np.ndarray): People per pixel.
+        valid (np.ndarray): Mask of the valid pixels of `data`.
+        factor (int): Number of pixels along each side of a block.
+
+    Returns:
+        np.ndarray: The float32 sums, `factor` times smaller on each side.
+    """
+    rows = math.ceil(data.shape[0] / factor)
+    cols = math.ceil(data.shape[1] / factor)
+    values = np.zeros((rows * factor, cols * factor), dtype=np.float64)
+    values[:data.shape[0], :data.shape[1]] = np.where(valid, data, 0)
+    any_valid = np.zeros(values.shape, dtype=bool)
+    any_valid[:data.shape[0], :data.shape[1]] = valid
+    sums = values.reshape(rows, factor, cols, factor).sum(axis=(1, 3))
+    has_data = any_valid.reshape(rows, factor, cols, factor).any(axis=(1, 3))
+    aggregated: np.ndarray = np.where(has_data, sums,
+                                      WORLDPOP_NODATA).astype(np.float32)
+    return aggregated
+
+
+def aggregate_raster(input_path: str,
+                     output_path: str,
+                     factor: int = AGGREGATE_FACTOR,
+                     window_size: int = AGGREGATE_WINDOW_SIZE) -> str:
+    """Sum the people of each `factor` x `factor` block of pixels of a raster.
+
+    Counts are summed rather than resampled, so the total population is kept.
+    The raster is reduced one window at a time, so that large countries fit
+    in memory. Nodata pixels are left out of the sums, and blocks without any
+    data are nodata.
+
+    Args:
+        input_path (str): Path to a WorldPop raster of people per pixel.
+        output_path (str): The path to which the aggregated GeoTIFF will be
+            written.
+        factor (int, optional): Number of pixels along each side of a block.
+        window_size (int, optional): Size in aggregated pixels of the windows
+            reduced at once.
+
+    Returns:
+        str: The path to the aggregated GeoTIFF.
+    """
+    logger.info(f"Aggregating {input_path} by {factor}")
+    with stage("aggregate", path=input_path), rasterio.open(input_path) as src:
+        height = math.ceil(src.height / factor)
+        width = math.ceil(src.width / factor)
+        profile = {
+            "driver": "GTiff",
+            "dtype": "float32",
+            "count": 1,
+            "width": width,
+            "height": height,
+            "crs": src.crs,
+            "transform": src.transform * Affine.scale(factor, factor),
+            "nodata": WORLDPOP_NODATA,
+            "tiled": True,
+            "compress": "DEFLATE",
+        }
+        nodata_values = [src.nodata, COG_NODATA, WORLDPOP_NODATA]
+        with rasterio.open(output_path, "w", **profile) as dst:
+            for row in range(0, height, window_size):
+                for col in range(0, width, window_size):
+                    window = Window(col * factor, row * factor,
+                                    window_size * factor,
+                                    window_size * factor).intersection(
+                                        Window(0, 0, src.width, src.height))
+                    data = src.read(1, window=window)
+                    aggregated = aggregate_block(
+                        data, valid_mask(data, nodata_values), factor)
+                    dst.write(aggregated,
+                              1,
+                              window=Window(col, row, aggregated.shape[1],
+                                            aggregated.shape[0]))
+    return output_path
+
+
+def create_aggregated_collection(project: str,
+                                 category: str,
+                                 factor: int = AGGREGATE_FACTOR) -> Collection:
+    """Create the STAC Collection of the aggregates of a WorldPop category.
+
+    The collection is `create_collection`'s, with its own ID, title and gsd,
+    and a link to the collection it is derived from.
+
+    Args:
+        project (str): WorldPop project ID.
+        category (str): WorldPop category ID (member of `project`).
+        factor (int, optional): Number of pixels along each side of the
+            aggregated blocks.
+
+    Returns:
+        Collection: STAC Collection object.
+    """
+    collection = create_collection(project, category)
+    gsd = aggregated_gsd(project, category, factor)
+    source_id = collection.id
+    collection.id = f"{source_id}_{gsd / 1000:g}km"
+    collection.title = f"{collection.title}, summed to {gsd:g}m"
+    collection.description = (
+        f"{collection.description}\n\nPopulation counts summed over blocks "
+        f"of {factor} x {factor} pixels of the {source_id} rasters.")
+    collection.summaries.add("gsd", [gsd])
+    collection.add_link(
+        Link(rel="derived_from",
+             target=f"../{source_id}/collection.json",
+             title=f"WorldPop {source_id}"))
+    return collection
+
+
+def aggregated_cog_folder(cog_destination: str, unit: WorkUnit,
+                          factor: int) -> str:
+    """Return the directory holding the aggregated COGs of one unit."""
+    return os.path.join(cog_destination, unit.project,
+                        f"{unit.category}_x{factor}", unit.iso3, unit.popyear)
+
+
+def create_aggregated_items(unit: WorkUnit,
+                            cog_destination: str,
+                            factor: int = AGGREGATE_FACTOR,
+                            statistics: bool = False,
+                            thumbnail: bool = False,
+                            source_root: Optional[str] = None) -> List[Item]:
+    """Aggregate the rasters of one unit into COGs and create their Item.
+
+    Args:
+        unit (WorkUnit): The project/category/iso3/popyear to aggregate.
+        cog_destination (str): The output directory for COGs.
+        factor (int, optional): Number of pixels along each side of the
+            aggregated blocks.
+        statistics (bool, optional): Store band statistics in the COGs.
+        thumbnail (bool, optional): Render a thumbnail for each COG.
+        source_root (str, optional): Local mirror to read the GeoTIFFs from.
+
+    Returns:
+        List[Item]: The created Item, empty if there is no metadata for the
+        unit's popyear.
+    """
+    folder = aggregated_cog_folder(cog_destination, unit, factor)
+    Path(folder).mkdir(parents=True, exist_ok=True)
+    cog_hrefs = []
+    for tif_href in unit.files:
+        name = os.path.basename(tif_href)[:-4]
+        cog_href = os.path.join(folder, f"{name}_x{factor}_cog.tif")
+        with TemporaryDirectory() as tmp_dir:
+            tif_path = download_tif(source_href(tif_href, source_root),
+                                    tmp_dir)
+            aggregated_path = aggregate_raster(
+                tif_path, os.path.join(tmp_dir, f"{name}_x{factor}.tif"),
+                factor)
+            create_cog(aggregated_path,
+                       cog_href,
+                       statistics=statistics,
+                       thumbnail=thumbnail)
+        cog_hrefs.append(cog_href)
+
+    thumbnail_href = None
+    if thumbnail:
+        thumbnail_href = thumbnail_path(min(cog_hrefs))
+    item = create_item(unit.project,
+                       unit.category,
+                       unit.iso3,
+                       unit.popyear,
+                       unit.metadatas,
+                       cog_hrefs,
+                       thumbnail_href=thumbnail_href)
+    if item is None:
+        return []
+    item.properties["gsd"] = aggregated_gsd(unit.project, unit.category,
+                                            factor)
+    return [item]
+
+
+def aggregate_collection(project: str,
+                         category: str,
+                         destination: str,
+                         cog_destination: str,
+                         api_key: str = "",
+                         factor: int = AGGREGATE_FACTOR,
+                         statistics: bool = False,
+                         thumbnail: bool = False,
+                         source_root: Optional[str] = None,
+                         units: Optional[List[WorkUnit]] = None) -> Collection:
+    """Create the collection of the aggregates of a WorldPop category and
+    populate it with Items.
+
+    Args:
+        project (str): WorldPop project ID.
+        category (str): WorldPop category ID (member of `project`).
+        destination (str): Directory used to store the STAC collections.
+        cog_destination (str): The output directory for COGs.
+        api_key (str, optional): A WorldPop API key.
+        factor (int, optional): Number of pixels along each side of the
+            aggregated blocks.
+        statistics (bool, optional): Store band statistics in the COGs.
+        thumbnail (bool, optional): Render a thumbnail for each COG.
+        source_root (str, optional): Local mirror to read the API and
+            GeoTIFFs from. The collection is then not validated.
+        units (List[WorkUnit], optional): The units to aggregate. Defaults to
+            every unit listed by the WorldPop API.
+
+    Returns:
+        Collection: The populated collection.
+    """
+    collection = create_aggregated_collection(project, category, factor)
+    collection_dest = os.path.join(destination, collection.id)
+    validate = source_root is None
+    if units is None:
+        units = list_work_units(project,
+                                category,
+                                get_popyears(collection),
+                                api_key,
+                                source_root=source_root)
+
+    for i, unit in enumerate(units, start=1):
+        print(f"Aggregating {unit.iso3}/{unit.popyear} {i}/{len(units)}")
+        for item in create_aggregated_items(unit, cog_destination, factor,
+                                            statistics, thumbnail,
+                                            source_root):
+            collection.add_item(item)
+    save_collection(collection, collection_dest, validate)
+    return collection
@@ -0,0 +1,399 @@
+import logging
+import math
+import struct
+import zlib
+from dataclasses import dataclass
+from typing import Any, BinaryIO, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from stactools.worldpop.profiling import stage
+from stactools.worldpop.storage import read_range
+
+logger = logging.getLogger(__name__)
+
+# TIFF tags read from the header of a COG
+NEW_SUBFILE_TYPE = 254
+IMAGE_WIDTH = 256
+IMAGE_LENGTH = 257
+BITS_PER_SAMPLE = 258
+COMPRESSION = 259
+SAMPLES_PER_PIXEL = 277
+PLANAR_CONFIGURATION = 284
+PREDICTOR = 317
+TILE_WIDTH = 322
+TILE_LENGTH = 323
+TILE_OFFSETS = 324
+TILE_BYTE_COUNTS = 325
+SAMPLE_FORMAT = 339
+MODEL_PIXEL_SCALE = 33550
+MODEL_TIEPOINT = 33922
+MODEL_TRANSFORMATION = 34264
+GDAL_NODATA = 42113
+
+# Size and numpy type code of the TIFF field types
+FIELD_TYPES = {
+    1: (1, "u1"),
+    2: (1, "S1"),
+    3: (2, "u2"),
+    4: (4, "u4"),
+    5: (8, "u4"),
+    6: (1, "i1"),
+    7: (1, "u1"),
+    8: (2, "i2"),
+    9: (4, "i4"),
+    10: (8, "i4"),
+    11: (4, "f4"),
+    12: (8, "f8"),
+    16: (8, "u8"),
+    17: (8, "i8"),
+    18: (8, "u8"),
+}
+
+COMPRESSION_NONE = 1
+COMPRESSION_DEFLATE = (8, 32946)
+# NewSubfileType bit of transparency masks, which are not indexed
+SUBFILE_MASK = 4
+
+SAMPLE_FORMATS = {1: "u", 2: "i", 3: "f"}
+
+# Layout of the sidecar: a header, the shape of each level, then the offsets
+# and byte counts of the blocks of each level, little-endian
+MAGIC = b"WPBLOCKS"
+VERSION = 1
+HEADER = struct.Struct("<8s8H7d")
+LEVEL = struct.Struct("<5I")
+
+
+def read_ifds(f: BinaryIO) -> Tuple[str, List[Dict[int, Any]]]:
+    """Read the tags of every image file directory of a TIFF or BigTIFF.
+
+    Only the directories and the arrays of their tags are read, never the
+    image data.
+
+    Returns:
+        tuple: The byte order, "<" or ">", and the tags of each directory.
+
+    Raises:
+        ValueError: If the file is not a TIFF.
+    """
+    head = f.read(16)
+    if head[:2] not in (b"II", b"MM"):
+        raise ValueError("Not a TIFF file")
+    order = "<" if head[:2] == b"II" else ">"
+    version = struct.unpack(order + "H", head[2:4])[0]
+    if version == 42:
+        offset = struct.unpack(order + "I", head[4:8])[0]
+        count_format, entry_format, next_format = "H", "HHI4s", "I"
+    elif version == 43:
+        offset = struct.unpack(order + "Q", head[8:16])[0]
+        count_format, entry_format, next_format = "Q", "HHQ8s", "Q"
+    else:
+        raise ValueError(f"Unknown TIFF version {version}")
+    count_size = struct.calcsize(order + count_format)
+    entry = struct.Struct(order + entry_format)
+    next_size = struct.calcsize(order + next_format)
+
+    ifds = []
+    while offset:
+        f.seek(offset)
+        count = struct.unpack(order + count_format, f.read(count_size))[0]
+        data = f.read(count * entry.size + next_size)
+        tags: Dict[int, Any] = {}
+        for index in range(count):
+            tag, field_type, length, value = entry.unpack_from(
+                data, index * entry.size)
+            if field_type not in FIELD_TYPES:
+                continue
+            item_size, code = FIELD_TYPES[field_type]
+            size = item_size * length
+            if size > len(value):
+                value_offset = struct.unpack(
+                    order + ("I" if version == 42 else "Q"), value)[0]
+                f.seek(value_offset)
+                value = f.read(size)
+            if field_type == 2:
+                tags[tag] = value[:size].rstrip(b"\0").decode("ascii")
+                continue
+            values = np.frombuffer(value[:size], dtype=order + code)
+            if field_type in (5, 10):
+                values = values[0::2] / values[1::2]
+            tags[tag] = values
+        ifds.append(tags)
+        offset = struct.unpack(order + next_format,
+                               data[count * entry.size:])[0]
+    return order, ifds
+
+
+def geotransform(tags: Dict[int, Any]) -> Tuple[float, ...]:
+    """Return the GDAL geotransform of the full resolution image."""
+    if MODEL_TRANSFORMATION in tags:
+        m = tags[MODEL_TRANSFORMATION]
+        return (m[3], m[0], m[1], m[7], m[4], m[5])
+    scale = tags[MODEL_PIXEL_SCALE]
+    tiepoint = tags[MODEL_TIEPOINT]
+    return (tiepoint[3] - tiepoint[0] * scale[0], scale[0], 0.0,
+            tiepoint[4] + tiepoint[1] * scale[1], 0.0, -scale[1])
+
+
+@dataclass
+class Level:
+    """One resolution of a COG, the full one first, then the overviews."""
+    width: int
+    height: int
+    tile_width: int
+    tile_height: int
+    offsets: np.ndarray
+    byte_counts: np.ndarray
+
+    @property
+    def tiles_across(self) -> int:
+        return math.ceil(self.width / self.tile_width)
+
+    @property
+    def tiles_down(self) -> int:
+        return math.ceil(self.height / self.tile_height)
+
+
+@dataclass
+class BlockIndex:
+    """Where the blocks of a COG are, and how to decode them.
+
+    Attributes:
+        levels (List[Level]): Full resolution then overviews, largest first.
+        compression (int): TIFF compression code.
+        predictor (int): TIFF predictor code.
+        dtype (str): Numpy type of the samples, with their byte order.
+        samples_per_pixel (int): Number of bands.
+        planar (bool): Whether bands are stored in separate blocks.
+        geotransform (tuple): GDAL geotransform of the full resolution.
+        nodata (float): Nodata value, or None.
+    """
+    levels: List[Level]
+    compression: int
+    predictor: int
+    dtype: str
+    samples_per_pixel: int
+    planar: bool
+    geotransform: Tuple[float, ...]
+    nodata: Optional[float]
+
+    @classmethod
+    def from_tiff(cls, f: BinaryIO) -> "BlockIndex":
+        """Index a tiled TIFF from its header.
+
+        Raises:
+            ValueError: If the TIFF is not tiled.
+        """
+        order, ifds = read_ifds(f)
+        images = [
+            tags for tags in ifds
+            if not int(tags.get(NEW_SUBFILE_TYPE, [0])[0]) & SUBFILE_MASK
+        ]
+        first = images[0]
+        if TILE_OFFSETS not in first:
+            raise ValueError("Only tiled TIFFs can be indexed")
+        levels = [
+            Level(int(tags[IMAGE_WIDTH][0]), int(tags[IMAGE_LENGTH][0]),
+                  int(tags[TILE_WIDTH][0]), int(tags[TILE_LENGTH][0]),
+                  tags[TILE_OFFSETS].astype("<u8"),
+                  tags[TILE_BYTE_COUNTS].astype("<u8")) for tags in images
+        ]
+        bits = int(first[BITS_PER_SAMPLE][0])
+        sample_format = int(first.get(SAMPLE_FORMAT, [1])[0])
+        nodata = first.get(GDAL_NODATA)
+        return cls(levels=levels,
+                   compression=int(first.get(COMPRESSION, [1])[0]),
+                   predictor=int(first.get(PREDICTOR, [1])[0]),
+                   dtype=(f"{order}{SAMPLE_FORMATS[sample_format]}"
+                          f"{bits // 8}"),
+                   samples_per_pixel=int(first.get(SAMPLES_PER_PIXEL, [1])[0]),
+                   planar=int(first.get(PLANAR_CONFIGURATION, [1])[0]) == 2,
+                   geotransform=geotransform(first),
+                   nodata=float(nodata) if nodata else None)
+
+    def to_bytes(self) -> bytes:
+        dtype = np.dtype(self.dtype)
+        header = HEADER.pack(MAGIC, VERSION, len(self.levels),
+                             self.compression, self.predictor,
+                             "uif".index(dtype.kind) + 1, dtype.itemsize,
+                             self.samples_per_pixel, (2 if self.planar else 1)
+                             | (0 if dtype.byteorder in "<=|" else 0x100),
+                             *self.geotransform,
+                             math.nan if self.nodata is None else self.nodata)
+        parts = [header]
+        for level in self.levels:
+            parts.append(
+                LEVEL.pack(level.width, level.height, level.tile_width,
+                           level.tile_height, len(level.offsets)))
+        for level in self.levels:
+            parts.append(level.offsets.astype("<u8").tobytes())
+            parts.append(level.byte_counts.astype("<u8").tobytes())
+        return b"".join(parts)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "BlockIndex":
+        """Read a sidecar written by `to_bytes`.
+
+        Raises:
+            ValueError: If `data` is not a block index.
+        """
+        if len(data) < HEADER.size or data[:len(MAGIC)] != MAGIC:
+            raise ValueError("Not a block index")
+        (_, version, count, compression, predictor, sample_format, item_size,
+         samples_per_pixel, layout, *values) = HEADER.unpack_from(data)
+        if version != VERSION:
+            raise ValueError(f"Unknown block index version {version}")
+        shapes = [
+            LEVEL.unpack_from(data, HEADER.size + index * LEVEL.size)
+            for index in range(count)
+        ]
+        position = HEADER.size + count * LEVEL.size
+        levels = []
+        for width, height, tile_width, tile_height, blocks in shapes:
+            arrays = []
+            for _ in range(2):
+                arrays.append(
+                    np.frombuffer(data, "<u8", blocks, position).copy())
+                position += 8 * blocks
+            levels.append(
+                Level(width, height, tile_width, tile_height, *arrays))
+        order = ">" if layout & 0x100 else "<"
+        nodata = values[6]
+        return cls(levels=levels,
+                   compression=compression,
+                   predictor=predictor,
+                   dtype=f"{order}{'uif'[sample_format - 1]}{item_size}",
+                   samples_per_pixel=samples_per_pixel,
+                   planar=(layout & 0xff) == 2,
+                   geotransform=tuple(values[:6]),
+                   nodata=None if math.isnan(nodata) else nodata)
+
+    def block_range(self,
+                    level: int,
+                    row: int,
+                    col: int,
+                    band: int = 1) -> Tuple[int, int]:
+        """Return the offset and size of a block in the COG."""
+        shape = self.levels[level]
+        index = row * shape.tiles_across + col
+        if self.planar:
+            index += (band - 1) * shape.tiles_across * shape.tiles_down
+        return (int(shape.offsets[index]), int(shape.byte_counts[index]))
+
+    def decode(self, data: bytes, level: int) -> np.ndarray:
+        """Decode one block of `level` into an array of shape (tile height,
+        tile width), or (tile height, tile width, bands) for interleaved
+        bands.
+
+        Raises:
+            ValueError: If the compression or predictor is not supported.
+        """
+        shape = self.levels[level]
+        if self.compression in COMPRESSION_DEFLATE:
+            data = zlib.decompress(data)
+        elif self.compression != COMPRESSION_NONE:
+            raise ValueError(f"Unsupported compression {self.compression}")
+        dtype = np.dtype(self.dtype)
+        samples = 1 if self.planar else self.samples_per_pixel
+        rows = shape.tile_height
+        width = shape.tile_width * samples
+        if self.predictor == 1:
+            values = np.frombuffer(data, dtype, rows * width)
+        elif self.predictor == 2:
+            # Horizontal differencing of the samples of each row
+            values = np.frombuffer(data, dtype, rows * width).reshape(
+                rows, shape.tile_width, samples)
+            values = np.cumsum(values, axis=1, dtype=dtype)
+        elif self.predictor == 3:
+            # Floating point predictor: the bytes of each row are split into
+            # planes, most significant first, and differenced
+            planes = np.frombuffer(data, np.uint8,
+                                   rows * width * dtype.itemsize).reshape(
+                                       rows, -1, samples)
+            planes = np.cumsum(planes, axis=1,
+                               dtype=np.uint8).reshape(rows, dtype.itemsize,
+                                                       width)
+            values = np.ascontiguousarray(planes.transpose(0, 2, 1)).view(
+                dtype.newbyteorder(">"))
+        else:
+            raise ValueError(f"Unsupported predictor {self.predictor}")
+        values = values.reshape(rows, shape.tile_width, samples)
+        return values[:, :, 0] if samples == 1 else values
+
+    def empty_block(self, level: int) -> np.ndarray:
+        """Return a block of `level` filled with nodata, or zeros."""
+        shape = self.levels[level]
+        samples = 1 if self.planar else self.samples_per_pixel
+        block = np.full((shape.tile_height, shape.tile_width, samples),
+                        0 if self.nodata is None else self.nodata,
+                        dtype=np.dtype(self.dtype))
+        return block[:, :, 0] if samples == 1 else block
+
+
+def block_index_path(cog_path: str) -> str:
+    """Return the path of the block index written next to a COG."""
+    return cog_path.rsplit(".", 1)[0] + ".blocks"
+
+
+def write_block_index(cog_path: str, index_path: Optional[str] = None) -> str:
+    """Index the blocks of a COG in a sidecar file, from its header only.
+
+    Returns:
+        str: The path of the sidecar, by default `block_index_path`.
+    """
+    index_path = index_path or block_index_path(cog_path)
+    with stage("block_index", path=cog_path) as record, open(cog_path,
+                                                             "rb") as f:
+        data = BlockIndex.from_tiff(f).to_bytes()
+        record.bytes = len(data)
+    with open(index_path, "wb") as f:
+        f.write(data)
+    return index_path
+
+
+class BlockReader:
+    """Reads blocks of a COG with one range request each, from its block
+    index, without GDAL or the TIFF header.
+
+    Args:
+        href (str): Path, http(s) or s3 url of the COG.
+        index_href (str, optional): Its block index. Defaults to
+            `block_index_path(href)`.
+    """
+    def __init__(self, href: str, index_href: Optional[str] = None) -> None:
+        self.href = href
+        index_href = index_href or block_index_path(href)
+        data = read_range(index_href)
+        if data is None:
+            raise FileNotFoundError(index_href)
+        self.index = BlockIndex.from_bytes(data)
+
+    def read_block(self,
+                   row: int,
+                   col: int,
+                   level: int = 0,
+                   band: int = 1) -> np.ndarray:
+        """Return the decoded block at `row`, `col` of `level`, 0 being the
+        full resolution. Blocks at the edges keep their padding."""
+        offset, size = self.index.block_range(level, row, col, band)
+        if size == 0:
+            # Sparse block, never written: all nodata
+            return self.index.empty_block(level)
+        with stage("block_read", href=self.href) as record:
+            data = read_range(self.href, offset, size)
+            if data is None:
+                raise FileNotFoundError(self.href)
+            record.bytes = len(data)
+        return self.index.decode(data, level)
+
+    def block_of(self, x: float, y: float, level: int = 0) -> Tuple[int, int]:
+        """Return the row and column of the block of `level` containing a
+        point given in the CRS of the COG."""
+        x0, dx, _, y0, _, dy = self.index.geotransform
+        shape = self.index.levels[level]
+        scale_x = self.index.levels[0].width / shape.width
+        scale_y = self.index.levels[0].height / shape.height
+        col = int((x - x0) / (dx * scale_x)) // shape.tile_width
+        row = int((y - y0) / (dy * scale_y)) // shape.tile_height
+        return row, col
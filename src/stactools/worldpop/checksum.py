@@ -0,0 +1,101 @@
+import hashlib
+import logging
+import os
+import threading
+from typing import Any, BinaryIO, Dict, Iterable, Optional
+
+from pystac import Item
+from pystac.extensions.file import FileExtension
+
+from stactools.worldpop.constants import MIRROR_FINGERPRINTS_FILE
+from stactools.worldpop.utils import get_metadata
+
+logger = logging.getLogger(__name__)
+
+# Multihash prefix of a sha2-256 digest: function code 0x12, 32 bytes
+SHA2_256_MULTIHASH = "1220"
+
+
+class StreamHash:
+    """Multihash checksum and size of bytes as they stream through, e.g.
+    while they are downloaded or uploaded, so that files are never read
+    again just to hash them."""
+    def __init__(self) -> None:
+        self._hash = hashlib.sha256()
+        self.size = 0
+
+    def update(self, chunk: bytes) -> None:
+        self._hash.update(chunk)
+        self.size += len(chunk)
+
+    @property
+    def checksum(self) -> str:
+        return SHA2_256_MULTIHASH + self._hash.hexdigest()
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"checksum": self.checksum, "size": self.size}
+
+
+class HashingReader:
+    """A binary file hashing what is read from it, in order."""
+    def __init__(self, f: BinaryIO) -> None:
+        self.f = f
+        self.stream_hash = StreamHash()
+
+    def read(self, size: int = -1) -> bytes:
+        chunk = self.f.read(size)
+        self.stream_hash.update(chunk)
+        return chunk
+
+
+_checksums: Dict[str, Dict[str, Any]] = {}
+_mirrors: Dict[str, Dict[str, Any]] = {}
+_checksums_lock = threading.Lock()
+
+
+def record_checksum(href: str, stream_hash: StreamHash) -> None:
+    """Remember the checksum of a file downloaded from or written to
+    `href` by this process, until `forget_checksums` is called."""
+    with _checksums_lock:
+        _checksums[href] = stream_hash.to_dict()
+
+
+def forget_checksums(hrefs: Iterable[str]) -> None:
+    """Forget the checksums recorded for `hrefs`, once they were used, so
+    that they do not pile up over a run."""
+    with _checksums_lock:
+        for href in hrefs:
+            _checksums.pop(href, None)
+
+
+def get_checksum(
+        href: str,
+        source_root: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """Return the checksum and size of `href`, if they were recorded while
+    it was streamed by this process or into the mirror at `source_root`."""
+    with _checksums_lock:
+        if href in _checksums:
+            return _checksums[href]
+        if source_root is None:
+            return None
+        if source_root not in _mirrors:
+            path = os.path.join(source_root, MIRROR_FINGERPRINTS_FILE)
+            _mirrors[source_root] = (get_metadata(path)
+                                     if os.path.exists(path) else {})
+        fingerprint = _mirrors[source_root].get(href, {})
+    if fingerprint.get("checksum") is None:
+        return None
+    return {"checksum": fingerprint["checksum"], "size": fingerprint["size"]}
+
+
+def add_file_fields(item: Item, asset_key: str,
+                    checksum: Optional[Dict[str, Any]]) -> None:
+    """Set `file:checksum` and `file:size` on an asset of `item`."""
+    if checksum is None:
+        return
+    extra_fields = item.assets[asset_key].extra_fields
+    extra_fields["file:checksum"] = checksum["checksum"]
+    extra_fields["file:size"] = checksum["size"]
+    schema_uri = FileExtension.get_schema_uri()
+    if schema_uri not in item.stac_extensions:
+        item.stac_extensions.append(schema_uri)
@@ -1,57 +1,112 @@
 import logging
+import math
 import os
 from glob import glob
 from subprocess import CalledProcessError, check_output
 from tempfile import TemporaryDirectory
-from typing import Dict, List
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlparse
 from zipfile import ZipFile
 
 import rasterio
 import requests
-
-from stactools.worldpop.constants import API_URL, TILING_PIXEL_SIZE
+from rasterio.windows import Window
+
+from stactools.worldpop.blockindex import write_block_index
+from stactools.worldpop.checksum import StreamHash, record_checksum
+from stactools.worldpop.constants import (
+    API_URL,
+    COG_BLOCK_SIZE,
+    COG_NODATA,
+    DOWNLOAD_CHUNK_SIZE,
+    TILING_PIXEL_SIZE,
+)
+from stactools.worldpop.profiling import stage
+from stactools.worldpop.stack import create_stack_vrt, sort_age_sex_paths
+from stactools.worldpop.stats import (
+    BandStatistics,
+    copy_with_statistics,
+    statistics_metadata_option,
+)
+from stactools.worldpop.storage import get_backend, is_remote
+from stactools.worldpop.thumbnail import create_thumbnail, thumbnail_path
+from stactools.worldpop.tiling import tile_size
 from stactools.worldpop.utils import get_iso3_list, get_metadata
 
 logger = logging.getLogger(__name__)
 
 
+def download_tif(access_url: str, tmp_dir: str) -> str:
+    """Download a GeoTIFF to a directory, unzipping it if needed, and return
+    its path.
+
+    Downloads are streamed to disk and hashed on the way, see
+    `checksum.get_checksum`.
+    """
+    # Extract filename from url
+    tmp_file = os.path.join(tmp_dir, access_url.split("/").pop())
+
+    if urlparse(access_url).scheme in ["http", "https"]:
+        logger.info("Downloading TIFF")
+        logger.debug(f"access_url: {access_url}")
+        stream_hash = StreamHash()
+        with stage("download", url=access_url) as record, requests.get(
+                access_url, stream=True) as resp:
+            if resp.status_code != 200:
+                raise AssertionError(
+                    f"{resp.status_code} code for file: {access_url}")
+            with open(tmp_file, "wb") as f:
+                logger.info("Writing TIFF")
+                logger.debug(f"tmp_file: {tmp_file}")
+                for chunk in resp.iter_content(DOWNLOAD_CHUNK_SIZE):
+                    f.write(chunk)
+                    stream_hash.update(chunk)
+            record.bytes = stream_hash.size
+        record_checksum(access_url, stream_hash)
+    else:
+        # Local file, e.g. from a mirror, read in place
+        tmp_file = access_url
+    if access_url.endswith(".zip"):
+        logger.info("Unzipping TIFF")
+        with ZipFile(tmp_file, "r") as zip_ref:
+            zip_ref.extractall(tmp_dir)
+        return glob(f"{tmp_dir}/*.tif").pop()
+    return tmp_file
+
+
 def download_create_cog(
     output_directory: str,
     access_url: str,
     retile: bool = False,
     raise_on_fail: bool = True,
     dry_run: bool = False,
+    statistics: bool = False,
+    thumbnail: bool = False,
+    tiling: str = "fixed",
+    block_index: bool = False,
 ) -> str:
     if dry_run:
         logger.info("Would have downloaded TIFF, created COG, and written COG")
         return output_directory
 
     with TemporaryDirectory() as tmp_dir:
-        # Extract filename from url
-        tmp_file = os.path.join(tmp_dir, access_url.split("/").pop())
-
-        logger.info("Downloading TIFF")
-        logger.debug(f"access_url: {access_url}")
-        resp = requests.get(access_url)
-
-        with open(tmp_file, "wb") as f:
-            logger.info("Writing TIFF")
-            logger.debug(f"tmp_file: {tmp_file}")
-            f.write(resp.content)
-        if access_url.endswith(".zip"):
-            logger.info("Unzipping TIFF")
-            with ZipFile(tmp_file, "r") as zip_ref:
-                zip_ref.extractall(tmp_dir)
-        file_name = glob(f"{tmp_dir}/*.tif").pop()
+        file_name = download_tif(access_url, tmp_dir)
         if retile:
             return create_retiled_cogs(file_name, output_directory,
-                                       raise_on_fail, dry_run)
+                                       raise_on_fail, dry_run, statistics,
+                                       thumbnail, tiling, block_index)
         else:
             output_file = os.path.join(
                 output_directory,
                 os.path.basename(file_name).replace(".tif", "") + "_cog.tif",
             )
-            return create_cog(file_name, output_file, raise_on_fail, dry_run)
+            return create_cog(file_name,
+                              output_file,
+                              raise_on_fail,
+                              dry_run,
+                              statistics,
+                              thumbnail=thumbnail,
+                              block_index=block_index)
 
 
 def create_retiled_cogs(
@@ -59,6 +114,10 @@ def create_retiled_cogs(
     output_directory: str,
     raise_on_fail: bool = True,
     dry_run: bool = False,
+    statistics: bool = False,
+    thumbnail: bool = False,
+    tiling: str = "fixed",
+    block_index: bool = False,
 ) -> str:
     """Split tiff into tiles and create COGs
 
@@ -69,6 +128,15 @@ def create_retiled_cogs(
             Defaults to True.
         dry_run (bool, optional): Run without downloading tif, creating COG,
             and writing COG. Defaults to False.
+        statistics (bool, optional): Compute band statistics from each tile
+            while it is checked for data and store them in its COG.
+            Defaults to False.
+        thumbnail (bool, optional): Render a PNG thumbnail of each tile.
+            Defaults to False.
+        tiling (str, optional): Tiling policy picking the tile size, see
+            `tiling.TILING_POLICIES`. Defaults to "fixed".
+        block_index (bool, optional): Write the block index sidecar of each
+            tile, see `blockindex.write_block_index`. Defaults to False.
 
     Returns:
         str: The path to the output COGs.
@@ -83,18 +151,21 @@ def create_retiled_cogs(
             logger.info("Retiling TIFF")
             logger.debug(f"input_path: {input_path}")
             logger.debug(f"output_directory: {output_directory}")
+            tile_width, tile_height = tile_size(input_path, tiling)
             with TemporaryDirectory() as tmp_dir:
                 cmd = [
                     "gdal_retile.py",
                     "-ps",
-                    str(TILING_PIXEL_SIZE[0]),
-                    str(TILING_PIXEL_SIZE[1]),
+                    str(tile_width),
+                    str(tile_height),
                     "-targetDir",
                     tmp_dir,
                     input_path,
                 ]
                 try:
-                    output = check_output(cmd)
+                    with stage("retile", path=input_path) as record:
+                        record.bytes = os.path.getsize(input_path)
+                        output = check_output(cmd)
                 except CalledProcessError as e:
                     output = e.output
                     raise
@@ -107,13 +178,25 @@ def create_retiled_cogs(
                         output_directory,
                         os.path.basename(f).replace(".tif", "") + "_cog.tif",
                     )
+                    tile_statistics = None
                     with rasterio.open(input_file, "r") as dataset:
-                        contains_data = dataset.read().any()
+                        data = dataset.read()
+                        contains_data = data.any()
+                        if contains_data and statistics:
+                            band_statistics = BandStatistics()
+                            band_statistics.update(
+                                data[0], [dataset.nodata, COG_NODATA])
+                            tile_statistics = band_statistics.to_dict()
                     # Exclude empty files
                     if contains_data:
                         logger.debug(f"Tile contains data: {input_file}")
-                        create_cog(input_file, output_file, raise_on_fail,
-                                   dry_run)
+                        create_cog(input_file,
+                                   output_file,
+                                   raise_on_fail,
+                                   dry_run,
+                                   precomputed_statistics=tile_statistics,
+                                   thumbnail=thumbnail,
+                                   block_index=block_index)
                     else:
                         logger.debug(f"Ignoring empty tile: {input_file}")
 
@@ -126,11 +209,149 @@ def create_retiled_cogs(
     return output_directory
 
 
+def cog_command(statistics: Optional[Dict[str, Any]] = None) -> List[str]:
+    """Return the gdal_translate command creating a COG, without the input
+    and output paths."""
+    cmd = [
+        "gdal_translate",
+        "-of",
+        "COG",
+        "-co",
+        "NUM_THREADS=ALL_CPUS",
+        "-co",
+        f"BLOCKSIZE={COG_BLOCK_SIZE}",
+        "-co",
+        "COMPRESS=DEFLATE",
+        "-co",
+        "LEVEL=9",
+        "-co",
+        "PREDICTOR=YES",
+        "-co",
+        "OVERVIEWS=IGNORE_EXISTING",
+        "-a_nodata",
+        str(COG_NODATA),
+    ]
+    if statistics is not None:
+        cmd += ["-mo", statistics_metadata_option(statistics)]
+    return cmd
+
+
+def translate(cmd: List[str], output_path: str, path: str) -> None:
+    """Run a gdal_translate command, without its output path, writing to
+    `output_path`.
+
+    Local COGs are written in place and not hashed, as reading them back
+    would cost a full pass. GDAL seeks while writing COGs, so those for an
+    object store are written to a temporary directory and uploaded by
+    `storage.S3Backend.put_file`, which records their checksum on the way.
+
+    Args:
+        cmd (List[str]): The command, see `cog_command`.
+        output_path (str): The path to which the COG will be written.
+        path (str): Path labelling the gdal_translate stage.
+    """
+    if not is_remote(output_path):
+        _run_translate(cmd + [output_path], output_path, path)
+        return
+    with TemporaryDirectory() as tmp_dir:
+        tmp_path = os.path.join(tmp_dir, os.path.basename(output_path))
+        _run_translate(cmd + [tmp_path], tmp_path, path)
+        get_backend(output_path).put_file(tmp_path, output_path)
+
+
+def _run_translate(cmd: List[str], written_path: str, path: str) -> None:
+    output = None
+    try:
+        with stage("gdal_translate", path=path) as record:
+            output = check_output(cmd)
+            record.bytes = os.path.getsize(written_path)
+    except CalledProcessError as e:
+        output = e.output
+        raise
+    finally:
+        logger.info(f"output: {str(output)}")
+
+
+def tile_windows(
+    width: int,
+    height: int,
+    tile_size: Tuple[int,
+                     int] = TILING_PIXEL_SIZE) -> List[Tuple[str, Window]]:
+    """Split a raster into tiles the way `gdal_retile.py` does.
+
+    Returns:
+        list: The name suffix of each tile, e.g. "_1_2" for the second tile
+        of the first row, and its window.
+    """
+    count_x = math.ceil(width / tile_size[0])
+    count_y = math.ceil(height / tile_size[1])
+    digits = len(str(max(count_x, count_y)))
+    tiles = []
+    for y in range(count_y):
+        for x in range(count_x):
+            window = Window(x * tile_size[0], y * tile_size[1],
+                            min(tile_size[0], width - x * tile_size[0]),
+                            min(tile_size[1], height - y * tile_size[1]))
+            tiles.append((f"_{y + 1:0{digits}d}_{x + 1:0{digits}d}", window))
+    return tiles
+
+
+def create_tile_cog(
+    input_path: str,
+    output_path: str,
+    window: Window,
+    statistics: bool = False,
+    thumbnail: bool = False,
+    block_index: bool = False,
+) -> Optional[str]:
+    """Create the COG of one tile of a TIFF, unless the tile is empty.
+
+    Tiles made this way match those of `create_retiled_cogs`, but can be
+    created concurrently.
+
+    Args:
+        input_path (str): Path to the input raster.
+        output_path (str): The path to which the COG will be written.
+        window (Window): The window of the tile, see `tile_windows`.
+        statistics (bool, optional): Compute band statistics from the tile
+            while it is checked for data. Defaults to False.
+        thumbnail (bool, optional): Render a PNG thumbnail of the tile.
+            Defaults to False.
+        block_index (bool, optional): Write the block index sidecar of the
+            tile. Defaults to False.
+
+    Returns:
+        str: The path to the COG, or None if the tile has no data.
+    """
+    tile_statistics = None
+    with rasterio.open(input_path) as dataset:
+        data = dataset.read(1, window=window)
+        contains_data = data.any()
+        if contains_data and statistics:
+            band_statistics = BandStatistics()
+            band_statistics.update(data, [dataset.nodata, COG_NODATA])
+            tile_statistics = band_statistics.to_dict()
+    if not contains_data:
+        logger.debug(f"Ignoring empty tile: {output_path}")
+        return None
+    return create_cog(input_path,
+                      output_path,
+                      precomputed_statistics=tile_statistics,
+                      thumbnail=thumbnail,
+                      window=window,
+                      block_index=block_index)
+
+
 def create_cog(
     input_path: str,
     output_path: str,
     raise_on_fail: bool = True,
     dry_run: bool = False,
+    statistics: bool = False,
+    precomputed_statistics: Optional[Dict[str, Any]] = None,
+    thumbnail: bool = False,
+    window: Optional[Window] = None,
+    block_index: bool = False,
 ) -> str:
     """Create COG from a TIFF
 
@@ -141,12 +362,28 @@ def create_cog(
             Defaults to True.
         dry_run (bool, optional): Run without downloading TIFF, creating COG,
             and writing COG. Defaults to False.
+        statistics (bool, optional): Compute band statistics (sum, count,
+            min, max, mean, histogram) and store them in the COG metadata.
+            Unless `precomputed_statistics` are given, as for tiles, the
+            input is copied block by block to a temporary GeoTIFF that
+            gdal_translate converts, and the statistics are computed from
+            the blocks as they are copied, so the input is still read once.
+            Defaults to False.
+        precomputed_statistics (dict, optional): Statistics already computed
+            by the caller, stored in the COG metadata as is.
+        thumbnail (bool, optional): Render a PNG thumbnail next to the COG
+            from its lowest resolution overview. Defaults to False.
+        window (Window, optional): Only convert this window of the input,
+            e.g. one tile.
+        block_index (bool, optional): Write a sidecar next to the COG with
+            the offsets and byte counts of its blocks at every level and its
+            geotransform, so that `blockindex.BlockReader` can fetch any
+            block with one range request. Defaults to False.
 
     Returns:
         str: The path to the output COG.
     """
 
-    output = None
     try:
         if dry_run:
             logger.info("Would have read TIFF, created COG, and written COG")
@@ -154,35 +391,136 @@ def create_cog(
             logger.info("Converting TIFF to COG")
             logger.debug(f"input_path: {input_path}")
             logger.debug(f"output_path: {output_path}")
-            cmd = [
-                "gdal_translate",
-                "-of",
-                "COG",
-                "-co",
-                "NUM_THREADS=ALL_CPUS",
-                "-co",
-                "BLOCKSIZE=512",
-                "-co",
-                "COMPRESS=DEFLATE",
-                "-co",
-                "LEVEL=9",
-                "-co",
-                "PREDICTOR=YES",
-                "-co",
-                "OVERVIEWS=IGNORE_EXISTING",
-                "-a_nodata",
-                "0",
-                input_path,
-                output_path,
-            ]
-
-            try:
-                output = check_output(cmd)
-            except CalledProcessError as e:
-                output = e.output
-                raise
-            finally:
-                logger.info(f"output: {str(output)}")
+            with TemporaryDirectory() as tmp_dir:
+                source_path = input_path
+                if precomputed_statistics is None and statistics:
+                    logger.info("Computing band statistics")
+                    source_path = os.path.join(tmp_dir, "source.tif")
+                    with stage("statistics", path=input_path):
+                        precomputed_statistics = copy_with_statistics(
+                            input_path, source_path)
+                cmd = cog_command(precomputed_statistics)
+                if window is not None:
+                    cmd += [
+                        "-srcwin",
+                        str(window.col_off),
+                        str(window.row_off),
+                        str(window.width),
+                        str(window.height),
+                    ]
+                cmd += [source_path]
+                translate(cmd, output_path, input_path)
+
+            if thumbnail:
+                with stage("thumbnail", path=output_path):
+                    create_thumbnail(output_path, thumbnail_path(output_path))
+            if block_index:
+                write_block_index(output_path)
+
+    except Exception:
+        logger.error("Failed to process {}".format(output_path))
+
+        if raise_on_fail:
+            raise
+
+    return output_path
+
+
+def download_create_stacked_cog(
+    output_path: str,
+    access_urls: List[str],
+    raise_on_fail: bool = True,
+    dry_run: bool = False,
+    statistics: bool = False,
+    thumbnail: bool = False,
+    block_index: bool = False,
+) -> str:
+    """Download the age/sex layers of a country and year and stack them in
+    a single multi-band COG. See `create_stacked_cog`."""
+    if dry_run:
+        logger.info(
+            "Would have downloaded TIFFs, created COG, and written COG")
+        return output_path
+
+    with TemporaryDirectory() as tmp_dir:
+        input_paths: List[str] = []
+        for access_url in access_urls:
+            download_dir = os.path.join(tmp_dir, str(len(input_paths)))
+            os.makedirs(download_dir)
+            input_paths.append(download_tif(access_url, download_dir))
+        return create_stacked_cog(input_paths, output_path, raise_on_fail,
+                                  dry_run, statistics, thumbnail, block_index)
+
+
+def create_stacked_cog(
+    input_paths: List[str],
+    output_path: str,
+    raise_on_fail: bool = True,
+    dry_run: bool = False,
+    statistics: bool = False,
+    thumbnail: bool = False,
+    block_index: bool = False,
+) -> str:
+    """Create a multi-band COG from the age/sex layers of a country and year
+
+    The layers become the bands of the COG, ordered by sex then age and
+    described by their age/sex class, e.g. "f_0". They are stacked through a
+    VRT, so gdal_translate streams them block by block into the
+    pixel-interleaved COG without an intermediate copy.
+
+    Args:
+        input_paths (List[str]): Paths to the age/sex layers.
+        output_path (str): The path to which the COG will be written.
+        raise_on_fail (bool, optional): Whether to raise error on failure.
+            Defaults to True.
+        dry_run (bool, optional): Run without creating COG, and writing COG.
+            Defaults to False.
+        statistics (bool, optional): Compute the statistics of each layer
+            while copying it block by block to the temporary GeoTIFF that is
+            stacked instead, and store them in the metadata of its band.
+            Defaults to False.
+        thumbnail (bool, optional): Render a PNG thumbnail of the total
+            population next to the COG. Defaults to False.
+        block_index (bool, optional): Write the block index sidecar of the
+            COG. Defaults to False.
+
+    Returns:
+        str: The path to the output COG.
+    """
+    try:
+        if dry_run:
+            logger.info("Would have read TIFFs, created COG, and written COG")
+        else:
+            logger.info(f"Stacking {len(input_paths)} TIFFs into a COG")
+            logger.debug(f"output_path: {output_path}")
+            input_paths = sort_age_sex_paths(input_paths)
+            band_statistics = None
+            with TemporaryDirectory() as tmp_dir:
+                if statistics:
+                    logger.info("Computing band statistics")
+                    band_statistics = []
+                    copy_paths = []
+                    for input_path in input_paths:
+                        # Named as the layer, whose age/sex class it tells
+                        copy_paths.append(
+                            os.path.join(tmp_dir,
+                                         os.path.basename(input_path)))
+                        with stage("statistics", path=input_path):
+                            band_statistics.append(
+                                copy_with_statistics(input_path,
+                                                     copy_paths[-1]))
+                    input_paths = copy_paths
+                vrt_path = create_stack_vrt(input_paths,
+                                            os.path.join(tmp_dir, "stack.vrt"),
+                                            band_statistics)
+                # The COG driver interleaves multi-band rasters by pixel
+                translate(cog_command() + [vrt_path], output_path, output_path)
+
+            if thumbnail:
+                with stage("thumbnail", path=output_path):
+                    create_thumbnail(output_path, thumbnail_path(output_path))
+            if block_index:
+                write_block_index(output_path)
 
     except Exception:
         logger.error("Failed to process {}".format(output_path))
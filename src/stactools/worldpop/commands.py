@@ -1,28 +1,201 @@
 import logging
 import os
 from datetime import datetime
-from pathlib import Path
-from typing import Any, List
+from typing import Any, List, Optional, Tuple
+from urllib.parse import urlparse
 
 import click
 
 from stactools.worldpop import cog
-from stactools.worldpop.cog import download_create_cog
-from stactools.worldpop.constants import API_URL, COLLECTIONS_METADATA
+from stactools.worldpop.aggregate import aggregate_collection
+from stactools.worldpop.constants import (
+    AGGREGATE_FACTOR,
+    COLLECTIONS_METADATA,
+    HEAD_CONCURRENCY,
+    SAMPLE_CACHE_BYTES,
+    UNIT_RETRIES,
+)
+from stactools.worldpop.crawler import crawl_metadata
+from stactools.worldpop.cube import add_cube_asset, create_cube, yearly_hrefs
+from stactools.worldpop.merge import merge_collections
+from stactools.worldpop.mirror import mirror_collections
+from stactools.worldpop.mosaic import (
+    add_mosaic_assets,
+    create_mosaic_cog,
+    create_mosaic_vrt,
+    find_country_cogs,
+    mosaic_grid,
+)
+from stactools.worldpop.plan import (
+    Calibration,
+    format_estimates,
+    plan_collections,
+)
+from stactools.worldpop.populate import (
+    PopulateOptions,
+    load_collection,
+    populate_collection,
+    retry_failed,
+    save_collection_assets,
+    sync_collection,
+)
+from stactools.worldpop.profiling import start_profiling, stop_profiling
+from stactools.worldpop.sample import BlockCache, sample_csv
 from stactools.worldpop.stac import create_collection, create_item
-from stactools.worldpop.utils import get_iso3_list, get_metadata, get_popyears
+from stactools.worldpop.tiling import TILING_POLICIES
+from stactools.worldpop.utils import (
+    get_metadata,
+    get_popyears,
+    metadata_url,
+    source_href,
+)
+from stactools.worldpop.work import WorkUnit, list_work_units, select_shard
 
 logger = logging.getLogger(__name__)
 
 
+def populate_options(function: Any) -> Any:
+    """Adds the options controlling Item creation to a populate command."""
+    options = [
+        click.option(
+            "-g",
+            "--create_cog",
+            help="Download and convert GeoTIFFs to COGs.",
+            is_flag=True,
+            default=False,
+        ),
+        click.option(
+            "-t",
+            "--tile",
+            help="Tile the tiff into many smaller files.",
+            is_flag=True,
+            default=False,
+        ),
+        click.option(
+            "-o",
+            "--cog_destination",
+            required=False,
+            help="The output directory for tiles.",
+        ),
+        click.option(
+            "--statistics",
+            help="Compute band statistics while creating COGs.",
+            is_flag=True,
+            default=False,
+        ),
+        click.option(
+            "--footprint",
+            help="Use a footprint of the valid data as Item geometry.",
+            is_flag=True,
+            default=False,
+        ),
+        click.option(
+            "--thumbnail",
+            help="Render a PNG thumbnail for each COG and use it in the Items.",
+            is_flag=True,
+            default=False,
+        ),
+        click.option(
+            "--source-root",
+            required=False,
+            help="Read the API and GeoTIFFs from a mirror instead.",
+        ),
+        click.option(
+            "--stack",
+            help=("Stack the age/sex layers of each country and year in one "
+                  "multi-band COG."),
+            is_flag=True,
+            default=False,
+        ),
+        click.option(
+            "--workers",
+            help=("Number of files or tiles converted at once, largest "
+                  "first."),
+            type=int,
+            default=1,
+        ),
+        click.option(
+            "--retries",
+            help=("Retries of a failed country/year, file or tile before it "
+                  "is quarantined in the failures report."),
+            type=int,
+            default=UNIT_RETRIES,
+        ),
+        click.option(
+            "--tiling",
+            help=("How tile sizes are picked with --tile: fixed 10000 pixel "
+                  "tiles, or adaptive, block-aligned tiles sized from each "
+                  "raster's dimensions and data density."),
+            type=click.Choice(TILING_POLICIES),
+            default="fixed",
+        ),
+        click.option(
+            "--block-index",
+            help=("Write a sidecar indexing the blocks of each COG and add it "
+                  "to the Items, for range reads without GDAL."),
+            is_flag=True,
+            default=False,
+        ),
+    ]
+    for option in reversed(options):
+        function = option(function)
+    return function
+
+
 def create_worldpop_command(cli: Any) -> Any:
     """Creates the WorldPop STAC."""
     @cli.group(
         "worldpop",
         short_help=("Commands for working with WorldPop data."),
     )
-    def worldpop() -> None:
-        pass
+    @click.option(
+        "--profile",
+        help="Print the time spent in each stage when done.",
+        is_flag=True,
+        default=False,
+    )
+    @click.option(
+        "--profile-log",
+        required=False,
+        help="Write a JSON line per stage run to this file.",
+    )
+    @click.option(
+        "--metrics-file",
+        required=False,
+        help="Write stage totals in Prometheus text format to this file.",
+    )
+    @click.pass_context
+    def worldpop(ctx: Any, profile: bool, profile_log: Optional[str],
+                 metrics_file: Optional[str]) -> None:
+        """Commands for working with WorldPop data.
+
+        Args:
+            profile (bool): Print a summary table of the pipeline stages
+                (API calls, downloads, gdal_translate, retiling, header reads,
+                collection saves, ...) when the command ends.
+            profile_log (str, optional): File to write each stage run to, as
+                JSON lines.
+            metrics_file (str, optional): File to write the stage totals to,
+                in Prometheus text format.
+        """
+        if not (profile or profile_log or metrics_file):
+            return
+        log = open(profile_log, "w") if profile_log else None
+        start_profiling(log)
+
+        def report() -> None:
+            profiler = stop_profiling()
+            if log is not None:
+                log.close()
+            if profiler is None:
+                return
+            if profile:
+                print(profiler.format_summary())
+            if metrics_file:
+                with open(metrics_file, "w") as f:
+                    f.write(profiler.to_prometheus())
+
+        ctx.call_on_close(report)
 
     @worldpop.command(
         "populate-collection",
@@ -53,109 +226,75 @@ def create_worldpop_command(cli: Any) -> Any:
                   required=False,
                   help="A WorldPop API key, required for >1000 calls per day.",
                   default="")
+    @populate_options
     @click.option(
-        "-g",
-        "--create_cog",
-        help="Download and convert GeoTIFFs to COGs.",
-        is_flag=True,
-        default=False,
-    )
-    @click.option(
-        "-t",
-        "--tile",
-        help="Tile the tiff into many smaller files.",
-        is_flag=True,
-        default=False,
-    )
-    @click.option(
-        "-o",
-        "--cog_destination",
+        "--shard",
         required=False,
-        help="The output directory for tiles.",
+        help=("Only create the Items of shard i/N of the work list, "
+              "balanced by file size. Merge shards with merge-collections."),
     )
     def populate_collection_command(project: str, category: str,
                                     destination: str, api_key: str,
                                     create_cog: bool, tile: bool,
-                                    cog_destination: str) -> Any:
+                                    cog_destination: str, statistics: bool,
+                                    footprint: bool, thumbnail: bool,
+                                    source_root: Optional[str], stack: bool,
+                                    workers: int, retries: int, tiling: str,
+                                    block_index: bool,
+                                    shard: Optional[str]) -> Any:
         """Creates a collection for one WorldPop project/category and populates it with items.
         Args:
             project (str): WorldPop project ID.
             category (str): WorldPop category ID (member of `project`).
             destination (str): Directory used to store the STAC collections.
         """
+        units = None
+        if shard is not None:
+            popyears = get_popyears(create_collection(project, category))
+            units = select_shard(list_work_units(project,
+                                                 category,
+                                                 popyears,
+                                                 api_key,
+                                                 source_root=source_root),
+                                 shard,
+                                 source_root=source_root)
         populate_collection_command_fn(project, category, destination, api_key,
-                                       create_cog, tile, cog_destination)
+                                       create_cog, tile, cog_destination,
+                                       statistics, footprint, thumbnail, units,
+                                       source_root, stack, workers, retries,
+                                       tiling, block_index)
 
-    def populate_collection_command_fn(project: str, category: str,
-                                       destination: str, api_key: str,
-                                       create_cog: bool, tile: bool,
-                                       cog_destination: str) -> Any:
-        collection = create_collection(project, category)
-        collection_dest = os.path.join(destination, collection.id)
-
-        popyears = get_popyears(collection)
-        iso3s = get_iso3_list(project, category)
-
-        # Populate collection with items
-        for i, iso3 in enumerate(iso3s, start=1):
-            print(f"Creating items for iso3 {i}/{len(iso3s)}: {iso3}")
-            metadata_url = f"{API_URL}/{project}/{category}?iso3={iso3}"
-            if api_key != "":
-                metadata_url += f"&key={api_key}"
-            metadatas = get_metadata(metadata_url)["data"]
-
-            for popyear in popyears:
-                # Get the specific metadata for a popyear
-                metadata_popyear = [
-                    m for m in metadatas if m["popyear"] == popyear
-                ]
-                if len(metadata_popyear) == 0:
-                    continue
-                metadata = metadata_popyear[0]
-
-                if create_cog:
-                    cog_popyear_folder = os.path.join(cog_destination, project,
-                                                      category, iso3, popyear)
-                    # Download GeoTIFFs and create COGs, tiling if requested
-                    cog_asset_folders = []
-                    for tif_href in metadata["files"]:
-                        # Create folder structure for COGs
-                        cog_asset_name = os.path.basename(tif_href).replace(
-                            ".tif", "")
-                        cog_asset_folder = os.path.join(
-                            cog_popyear_folder, cog_asset_name)
-                        cog_asset_folders += [cog_asset_folder]
-                        Path(cog_asset_folder).mkdir(parents=True,
-                                                     exist_ok=True)
-                        download_create_cog(output_directory=cog_asset_folder,
-                                            retile=tile,
-                                            access_url=tif_href)
-
-                    # Get all (possibly tiled) cog file names, grouped by data asset
-                    cog_items_hrefs = [[
-                        os.path.join(cog_asset_folder, cog_fname)
-                        for cog_fname in os.listdir(cog_asset_folder)
-                    ] for cog_asset_folder in cog_asset_folders]
-                    # Transpose list of lists to group by tile instead
-                    # See https://stackoverflow.com/questions/6473679/transpose-list-of-lists
-                    cog_hrefs_items: List[Any] = list(
-                        map(list, zip(*cog_items_hrefs)))
-                    # Create an Item for each tile
-                    for cog_hrefs in cog_hrefs_items:
-                        item = create_item(project, category, iso3, popyear,
-                                           metadatas, cog_hrefs, tile)
-                        if item is not None:
-                            collection.add_item(item)
-
-                else:
-                    item = create_item(project, category, iso3, popyear,
-                                       metadatas)
-                    if item is not None:
-                        collection.add_item(item)
-
-                collection.normalize_hrefs(collection_dest)
-                collection.save(dest_href=collection_dest)
-                collection.validate()
+    def populate_collection_command_fn(project: str,
+                                       category: str,
+                                       destination: str,
+                                       api_key: str,
+                                       create_cog: bool,
+                                       tile: bool,
+                                       cog_destination: str,
+                                       statistics: bool = False,
+                                       footprint: bool = False,
+                                       thumbnail: bool = False,
+                                       units: Optional[List[WorkUnit]] = None,
+                                       source_root: Optional[str] = None,
+                                       stack: bool = False,
+                                       workers: int = 1,
+                                       retries: int = UNIT_RETRIES,
+                                       tiling: str = "fixed",
+                                       block_index: bool = False) -> Any:
+        options = PopulateOptions(create_cog,
+                                  tile,
+                                  cog_destination,
+                                  statistics,
+                                  footprint,
+                                  thumbnail,
+                                  source_root,
+                                  stack,
+                                  workers,
+                                  retries,
+                                  tiling=tiling,
+                                  block_index=block_index)
+        populate_collection(project, category, destination, api_key, options,
+                            units)
 
     @worldpop.command(
         "populate-all-collections",
@@ -172,29 +311,23 @@ def create_worldpop_command(cli: Any) -> Any:
                   required=False,
                   help="A WorldPop API key, required for >1000 calls per day.",
                   default="")
+    @populate_options
     @click.option(
-        "-g",
-        "--create_cog",
-        help="Download and convert GeoTIFFs to COGs.",
-        is_flag=True,
-        default=False,
-    )
-    @click.option(
-        "-t",
-        "--tile",
-        help="Tile the tiff into many smaller files.",
-        is_flag=True,
-        default=False,
-    )
-    @click.option(
-        "-o",
-        "--cog_destination",
+        "--shard",
         required=False,
-        help="The output directory for tiles.",
+        help=("Only create the Items of shard i/N of the work list, "
+              "balanced by file size. Merge shards with merge-collections."),
     )
     def populate_all_collections_command(destination: str, api_key: str,
                                          create_cog: bool, tile: bool,
-                                         cog_destination: str) -> Any:
+                                         cog_destination: str,
+                                         statistics: bool, footprint: bool,
+                                         thumbnail: bool,
+                                         source_root: Optional[str],
+                                         stack: bool, workers: int,
+                                         retries: int, tiling: str,
+                                         block_index: bool,
+                                         shard: Optional[str]) -> Any:
         """Creates collections for all WorldPop projects/categories and populates them
          with items.
         Args:
@@ -203,10 +336,312 @@ def create_worldpop_command(cli: Any) -> Any:
         proj_cats = [(p, c) for p, cs in COLLECTIONS_METADATA.items()
                      for c in cs.keys()]
 
+        # Crawl the metadata of all projects/categories concurrently
+        index = crawl_metadata(proj_cats,
+                               api_key=api_key,
+                               source_root=source_root)
+        all_units = sum([
+            list_work_units(project, category,
+                            get_popyears(create_collection(project, category)),
+                            api_key, index) for project, category in proj_cats
+        ], [])
+        if shard is not None:
+            all_units = select_shard(all_units, shard, source_root=source_root)
+        units = {
+            (project, category): [
+                u for u in all_units
+                if (u.project, u.category) == (project, category)
+            ]
+            for project, category in proj_cats
+        }
+
         for project, category in proj_cats:
-            populate_collection_command_fn(project, category, destination,
-                                           api_key, create_cog, tile,
-                                           cog_destination)
+            populate_collection_command_fn(
+                project, category, destination, api_key, create_cog, tile,
+                cog_destination, statistics, footprint, thumbnail,
+                units[(project, category)], source_root, stack, workers,
+                retries, tiling, block_index)
+
+    @worldpop.command(
+        "plan",
+        short_help="Estimates the requirements of populating collections.",
+    )
+    @click.option("-p",
+                  "--project",
+                  required=False,
+                  help=("The WorldPop project to plan. Defaults to all "
+                        "projects/categories."),
+                  type=click.Choice(list(COLLECTIONS_METADATA.keys())))
+    @click.option(
+        "-c",
+        "--category",
+        required=False,
+        help="The category to plan within the chosen project.",
+        type=click.Choice(
+            sum([list(c.keys()) for c in COLLECTIONS_METADATA.values()], [])))
+    @click.option("-k",
+                  "--api_key",
+                  required=False,
+                  help="A WorldPop API key, required for >1000 calls per day.",
+                  default="")
+    @populate_options
+    @click.option(
+        "--calibration",
+        multiple=True,
+        help=("A --profile-log of a previous run to measure throughputs "
+              "from. May be given more than once."),
+    )
+    @click.option(
+        "--concurrency",
+        help="Number of HEAD requests sizing the source files at once.",
+        type=int,
+        default=HEAD_CONCURRENCY,
+    )
+    def plan_command(project: Optional[str], category: Optional[str],
+                     api_key: str, create_cog: bool, tile: bool,
+                     cog_destination: str, statistics: bool, footprint: bool,
+                     thumbnail: bool, source_root: Optional[str], stack: bool,
+                     workers: int, retries: int, tiling: str,
+                     block_index: bool, calibration: Tuple[str, ...],
+                     concurrency: int) -> Any:
+        """Prints the downloads, temporary disk, COG output, tile count and
+        wall time of populating collections with the given options, without
+        downloading or writing anything.
+
+        Args:
+            project (str): WorldPop project ID, or all projects.
+            category (str): WorldPop category ID (member of `project`).
+            calibration (Tuple[str]): Profile logs of previous runs.
+        """
+        proj_cats = [(p, c) for p, cs in COLLECTIONS_METADATA.items()
+                     for c in cs.keys()
+                     if project in (None, p) and category in (None, c)]
+        if not proj_cats:
+            raise ValueError(f"{category} is not a category of {project}")
+        options = PopulateOptions(create_cog,
+                                  tile,
+                                  cog_destination,
+                                  statistics,
+                                  footprint,
+                                  thumbnail,
+                                  source_root,
+                                  stack,
+                                  workers,
+                                  retries,
+                                  tiling=tiling,
+                                  block_index=block_index)
+        measured = (Calibration.from_profile_logs(list(calibration))
+                    if calibration else Calibration())
+        estimates = plan_collections(proj_cats, api_key, options, measured,
+                                     concurrency)
+        print(format_estimates(estimates))
+
+    @worldpop.command(
+        "sync",
+        short_help="Updates a STAC collection from the WorldPop API.",
+    )
+    @click.option("-p",
+                  "--project",
+                  required=False,
+                  help="The WorldPop project to sync.",
+                  type=click.Choice(list(COLLECTIONS_METADATA.keys())),
+                  default="pop")
+    @click.option(
+        "-c",
+        "--category",
+        required=False,
+        help="The category to sync within the chosen project.",
+        type=click.Choice(
+            sum([list(c.keys()) for c in COLLECTIONS_METADATA.values()], [])),
+        default="cic2020_UNadj_100m")
+    @click.option(
+        "-d",
+        "--destination",
+        required=True,
+        help="The output directory containing the STAC Collection.",
+    )
+    @click.option("-k",
+                  "--api_key",
+                  required=False,
+                  help="A WorldPop API key, required for >1000 calls per day.",
+                  default="")
+    @populate_options
+    def sync_command(project: str, category: str, destination: str,
+                     api_key: str, create_cog: bool, tile: bool,
+                     cog_destination: str, statistics: bool, footprint: bool,
+                     thumbnail: bool, source_root: Optional[str], stack: bool,
+                     workers: int, retries: int, tiling: str,
+                     block_index: bool) -> Any:
+        """Builds the Items of added or changed WorldPop units and removes the
+        Items of withdrawn ones, leaving the rest of the collection untouched.
+
+        Args:
+            project (str): WorldPop project ID.
+            category (str): WorldPop category ID (member of `project`).
+            destination (str): Directory used to store the STAC collections.
+        """
+        options = PopulateOptions(create_cog,
+                                  tile,
+                                  cog_destination,
+                                  statistics,
+                                  footprint,
+                                  thumbnail,
+                                  source_root,
+                                  stack,
+                                  workers,
+                                  retries,
+                                  tiling=tiling,
+                                  block_index=block_index)
+        sync_collection(project, category, destination, api_key, options)
+
+    @worldpop.command(
+        "retry-failed",
+        short_help="Rebuilds the units quarantined by an earlier run.",
+    )
+    @click.option("-p",
+                  "--project",
+                  required=False,
+                  help="The WorldPop project of the collection.",
+                  type=click.Choice(list(COLLECTIONS_METADATA.keys())),
+                  default="pop")
+    @click.option(
+        "-c",
+        "--category",
+        required=False,
+        help="The category of the collection within the chosen project.",
+        type=click.Choice(
+            sum([list(c.keys()) for c in COLLECTIONS_METADATA.values()], [])),
+        default="cic2020_UNadj_100m")
+    @click.option(
+        "-d",
+        "--destination",
+        required=True,
+        help="The output directory containing the STAC Collection.",
+    )
+    @click.option("-k",
+                  "--api_key",
+                  required=False,
+                  help="A WorldPop API key, required for >1000 calls per day.",
+                  default="")
+    @populate_options
+    def retry_failed_command(project: str, category: str, destination: str,
+                             api_key: str, create_cog: bool, tile: bool,
+                             cog_destination: str, statistics: bool,
+                             footprint: bool, thumbnail: bool,
+                             source_root: Optional[str], stack: bool,
+                             workers: int, retries: int, tiling: str,
+                             block_index: bool) -> Any:
+        """Rebuilds the units listed in the failures report of a collection,
+        adding their Items and leaving the rest of the collection untouched.
+
+        Args:
+            project (str): WorldPop project ID.
+            category (str): WorldPop category ID (member of `project`).
+            destination (str): Directory used to store the STAC collections.
+        """
+        options = PopulateOptions(create_cog,
+                                  tile,
+                                  cog_destination,
+                                  statistics,
+                                  footprint,
+                                  thumbnail,
+                                  source_root,
+                                  stack,
+                                  workers,
+                                  retries,
+                                  tiling=tiling,
+                                  block_index=block_index)
+        retry_failed(project, category, destination, api_key, options)
+
+    @worldpop.command(
+        "mirror",
+        short_help="Copies WorldPop API metadata and GeoTIFFs locally.",
+    )
+    @click.option("-p",
+                  "--project",
+                  required=False,
+                  help="The WorldPop project to mirror. Defaults to all.",
+                  type=click.Choice(list(COLLECTIONS_METADATA.keys())))
+    @click.option(
+        "-c",
+        "--category",
+        required=False,
+        help="The category to mirror within the chosen project.",
+        type=click.Choice(
+            sum([list(c.keys()) for c in COLLECTIONS_METADATA.values()], [])))
+    @click.option(
+        "-d",
+        "--destination",
+        required=True,
+        help="The directory of the mirror.",
+    )
+    @click.option("-k",
+                  "--api_key",
+                  required=False,
+                  help="A WorldPop API key, required for >1000 calls per day.",
+                  default="")
+    @click.option("-i",
+                  "--iso3",
+                  multiple=True,
+                  help="Only mirror this country. Can be repeated.")
+    @click.option("-y",
+                  "--popyear",
+                  multiple=True,
+                  help="Only mirror the GeoTIFFs of this year.")
+    @click.option(
+        "--rasters",
+        help="Also download the GeoTIFFs.",
+        is_flag=True,
+        default=False,
+    )
+    def mirror_command(project: Optional[str], category: Optional[str],
+                       destination: str, api_key: str, iso3: List[str],
+                       popyear: List[str], rasters: bool) -> Any:
+        """Copies the WorldPop API metadata, and optionally the GeoTIFFs, into
+        a local mirror that other commands can read with `--source-root`.
+
+        Args:
+            project (str, optional): WorldPop project ID.
+            category (str, optional): WorldPop category ID (member of
+                `project`).
+            destination (str): Directory of the mirror.
+            iso3 (List[str]): ISO3 codes of the countries to mirror.
+            popyear (List[str]): Population years of the GeoTIFFs to mirror.
+            rasters (bool): Also download the GeoTIFFs.
+        """
+        proj_cats = [(p, c) for p, cs in COLLECTIONS_METADATA.items()
+                     for c in cs.keys()
+                     if project in [None, p] and category in [None, c]]
+        if len(proj_cats) == 0:
+            raise ValueError(f"No category {category} in project {project}")
+        downloaded = mirror_collections(destination, proj_cats, api_key,
+                                        list(iso3) or None,
+                                        list(popyear) or None, rasters)
+        print(f"Mirrored {len(proj_cats)} collections, "
+              f"downloaded {len(downloaded)} files")
+
+    @worldpop.command(
+        "merge-collections",
+        short_help="Merges the STAC collections written by several shards.",
+    )
+    @click.option(
+        "-d",
+        "--destination",
+        required=True,
+        help="The output directory for the merged STAC collections.",
+    )
+    @click.argument("sources", nargs=-1, required=True)
+    def merge_collections_command(destination: str, sources: List[str]) -> Any:
+        """Merges the collections written by `populate-collection` or
+        `populate-all-collections` with `--shard`. Item files are copied
+        without being read or validated again.
+
+        Args:
+            destination (str): Directory used to store the STAC collections.
+            sources (List[str]): Destination directories of the shards.
+        """
+        for collection_id in merge_collections(list(sources), destination):
+            print(f"Merged collection {collection_id}")
 
     @worldpop.command(
         "create-collection",
@@ -294,9 +729,34 @@ def create_worldpop_command(cli: Any) -> Any:
         required=True,
         help="COG href",
     )
+    @click.option(
+        "--footprint",
+        help="Use a simplified footprint of the valid data as Item geometry.",
+        is_flag=True,
+        default=False,
+    )
+    @click.option(
+        "--thumbnail",
+        required=False,
+        help="Thumbnail href. Defaults to the WorldPop thumbnail.",
+    )
+    @click.option(
+        "--source-root",
+        required=False,
+        help="Read the API and GeoTIFFs from a mirror instead.",
+    )
+    @click.option(
+        "--block-index",
+        help="Add the block index sidecar written with the COG as an asset.",
+        is_flag=True,
+        default=False,
+    )
     def create_item_command(project: str, category: str, iso3: str,
                             popyear: str, destination: str, api_key: str,
-                            cog: str) -> Any:
+                            cog: str, footprint: bool,
+                            thumbnail: Optional[str],
+                            source_root: Optional[str],
+                            block_index: bool) -> Any:
         """Creates a STAC Item for one project/category/iso3/popyear.
 
         Args:
@@ -306,16 +766,19 @@ def create_worldpop_command(cli: Any) -> Any:
             popyear (str): Population year.
             destination (str): The output directory for the STAC json.
         """
-        metadata_url = f"{API_URL}/{project}/{category}?iso3={iso3}"
-        if api_key != "":
-            metadata_url += f"&key={api_key}"
-        metadatas = get_metadata(metadata_url)["data"]
+        metadatas = get_metadata(
+            metadata_url(project, category, iso3, api_key,
+                         source_root))["data"]
         item = create_item(project,
                            category,
                            iso3,
                            popyear,
                            metadatas,
-                           cog_hrefs=[cog])
+                           cog_hrefs=[cog],
+                           footprint=footprint,
+                           thumbnail_href=thumbnail,
+                           source_root=source_root,
+                           block_index=block_index)
         if item is None:
             raise AssertionError("Item cannot be created for these inputs.")
         else:
@@ -323,7 +786,8 @@ def create_worldpop_command(cli: Any) -> Any:
             item.set_self_href(item_path)
             item.make_asset_hrefs_relative()
             item.save_object()
-            item.validate()
+            if source_root is None:
+                item.validate()
 
     @worldpop.command(
         "create-cog",
@@ -348,7 +812,42 @@ def create_worldpop_command(cli: Any) -> Any:
         is_flag=True,
         default=False,
     )
-    def create_cog_command(destination: str, source: str, tile: bool) -> None:
+    @click.option(
+        "--statistics",
+        help="Compute band statistics and store them in the COG.",
+        is_flag=True,
+        default=False,
+    )
+    @click.option(
+        "--thumbnail",
+        help="Render a PNG thumbnail next to each COG.",
+        is_flag=True,
+        default=False,
+    )
+    @click.option(
+        "--source-root",
+        required=False,
+        help="Read a GeoTiff given by url from a mirror instead.",
+    )
+    @click.option(
+        "--tiling",
+        help=("How tile sizes are picked with --tile: fixed 10000 pixel "
+              "tiles, or adaptive, block-aligned tiles sized from the "
+              "raster's dimensions and data density."),
+        type=click.Choice(TILING_POLICIES),
+        default="fixed",
+    )
+    @click.option(
+        "--block-index",
+        help=("Write a sidecar indexing the blocks of each COG, for range "
+              "reads without GDAL."),
+        is_flag=True,
+        default=False,
+    )
+    def create_cog_command(destination: str, source: str, tile: bool,
+                           statistics: bool, thumbnail: bool,
+                           source_root: Optional[str], tiling: str,
+                           block_index: bool) -> None:
         """Generate a COG from a GeoTiff. The COG will be saved in the desination
         with `_cog.tif` appended to the name.
 
@@ -356,22 +855,397 @@ def create_worldpop_command(cli: Any) -> Any:
             destination (str): Local directory to save output COGs
             source (str, optional): An input WorldPop GeoTiff
             tile (bool, optional): Tile the tiff into many smaller files
+            statistics (bool, optional): Compute band statistics
+            thumbnail (bool, optional): Render a PNG thumbnail of each COG
+            source_root (str, optional): Mirror to read `source` from when
+                it is a url
+            tiling (str, optional): Tiling policy picking the tile size
+            block_index (bool, optional): Write the block index sidecar of
+                each COG
         """
-        create_cog_command_fn(destination, source, tile)
+        if source_root is not None and urlparse(source).scheme in [
+                "http", "https"
+        ]:
+            source = source_href(source, source_root)
+        create_cog_command_fn(destination, source, tile, statistics, thumbnail,
+                              tiling, block_index)
 
-    def create_cog_command_fn(destination: str, source: str,
-                              tile: bool) -> None:
+    def create_cog_command_fn(destination: str,
+                              source: str,
+                              tile: bool,
+                              statistics: bool = False,
+                              thumbnail: bool = False,
+                              tiling: str = "fixed",
+                              block_index: bool = False) -> None:
         if not os.path.isdir(destination):
             raise IOError(f'Destination folder "{destination}" not found')
 
         if source is None:
-            cog.download_create_cog(destination, source, retile=tile)
+            cog.download_create_cog(destination,
+                                    source,
+                                    retile=tile,
+                                    statistics=statistics,
+                                    thumbnail=thumbnail,
+                                    tiling=tiling,
+                                    block_index=block_index)
         elif tile:
-            cog.create_retiled_cogs(source, destination)
+            cog.create_retiled_cogs(source,
+                                    destination,
+                                    statistics=statistics,
+                                    thumbnail=thumbnail,
+                                    tiling=tiling,
+                                    block_index=block_index)
         else:
             output_path = os.path.join(
                 destination,
                 os.path.basename(source)[:-4] + "_cog.tif")
-            cog.create_cog(source, output_path)
+            cog.create_cog(source,
+                           output_path,
+                           statistics=statistics,
+                           thumbnail=thumbnail,
+                           block_index=block_index)
+
+    @worldpop.command(
+        "to-zarr",
+        short_help="Creates a multi-year Zarr datacube of one country.",
+    )
+    @click.option("-p",
+                  "--project",
+                  required=False,
+                  help="The WorldPop project of the yearly rasters.",
+                  type=click.Choice(list(COLLECTIONS_METADATA.keys())),
+                  default="pop")
+    @click.option(
+        "-c",
+        "--category",
+        required=False,
+        help="The category of the yearly rasters within the chosen project.",
+        type=click.Choice(
+            sum([list(c.keys()) for c in COLLECTIONS_METADATA.values()], [])),
+        default="wpgpunadj")
+    @click.option("-i",
+                  "--iso3",
+                  required=True,
+                  help="ISO3 code of the country.")
+    @click.option(
+        "-d",
+        "--destination",
+        required=True,
+        help="The directory containing the STAC collections.",
+    )
+    @click.option(
+        "-o",
+        "--output",
+        required=False,
+        help="Path of the Zarr store. Defaults to next to the collection.",
+    )
+    @click.option("-k",
+                  "--api_key",
+                  required=False,
+                  help="A WorldPop API key, required for >1000 calls per day.",
+                  default="")
+    @click.option("-y",
+                  "--popyear",
+                  multiple=True,
+                  help="Only include this year. Can be repeated.")
+    @click.option(
+        "--source-root",
+        required=False,
+        help="Read the API and GeoTIFFs from a mirror instead.",
+    )
+    def to_zarr_command(project: str, category: str, iso3: str,
+                        destination: str, output: Optional[str], api_key: str,
+                        popyear: List[str], source_root: Optional[str]) -> Any:
+        """Streams the yearly rasters of a country into one Zarr datacube
+        with dimensions (year, y, x), and adds it to the collection as an
+        asset. The collection is created if it does not exist.
+
+        Args:
+            project (str): WorldPop project ID.
+            category (str): WorldPop category ID (member of `project`).
+            iso3 (str): ISO3 code for a country.
+            destination (str): Directory used to store the STAC collections.
+            output (str, optional): Path of the Zarr store.
+            popyear (List[str]): Population years to include.
+        """
+        collection = load_collection(project, category, destination)
+        metadatas = get_metadata(
+            metadata_url(project, category, iso3, api_key,
+                         source_root))["data"]
+        hrefs = yearly_hrefs(metadatas, list(popyear) or None, source_root)
+        if output is None:
+            output = os.path.join(
+                os.path.dirname(collection.get_self_href() or ""),
+                f"{iso3}.zarr")
+        create_cube(hrefs, output)
+
+        add_cube_asset(collection, iso3, os.path.abspath(output))
+        save_collection_assets(collection, source_root is None)
+        print(f"Wrote {len(hrefs)} years of {iso3} to {output}")
+
+    @worldpop.command(
+        "build-mosaic",
+        short_help="Mosaics the country COGs of a category and year.",
+    )
+    @click.option("-p",
+                  "--project",
+                  required=False,
+                  help="The WorldPop project of the COGs.",
+                  type=click.Choice(list(COLLECTIONS_METADATA.keys())),
+                  default="pop")
+    @click.option(
+        "-c",
+        "--category",
+        required=False,
+        help="The category of the COGs within the chosen project.",
+        type=click.Choice(
+            sum([list(c.keys()) for c in COLLECTIONS_METADATA.values()], [])),
+        default="cic2020_UNadj_100m")
+    @click.option("-y", "--popyear", required=True, help="Population year.")
+    @click.option(
+        "-s",
+        "--cog_source",
+        required=True,
+        help="The COG destination of the populate commands.",
+    )
+    @click.option(
+        "-d",
+        "--destination",
+        required=True,
+        help="The directory containing the STAC collections.",
+    )
+    @click.option(
+        "--cog",
+        help="Also render the mosaic into a COG.",
+        is_flag=True,
+        default=False,
+    )
+    @click.option(
+        "--workers",
+        required=False,
+        type=int,
+        help="Threads rendering the COG. Defaults to the number of CPUs.",
+    )
+    @click.option(
+        "--asset",
+        required=False,
+        help=("The data asset to mosaic, for categories with several per "
+              "country, named after its GeoTIFF without the country prefix "
+              "(e.g. f_0_2020)."),
+    )
+    def build_mosaic_command(project: str, category: str, popyear: str,
+                             cog_source: str, destination: str, cog: bool,
+                             workers: Optional[int],
+                             asset: Optional[str]) -> Any:
+        """Writes a VRT over the COGs of all countries of a category and
+        year, optionally renders it into a COG, and adds them to the
+        collection as assets. The collection is created if it does not
+        exist.
+
+        Args:
+            project (str): WorldPop project ID.
+            category (str): WorldPop category ID (member of `project`).
+            popyear (str): Population year.
+            cog_source (str): Directory holding the country COGs.
+            destination (str): Directory used to store the STAC collections.
+            cog (bool): Also render the mosaic into a COG.
+            workers (int, optional): Threads rendering the COG.
+            asset (str, optional): Data asset to mosaic, for categories with
+                several per country.
+        """
+        collection = load_collection(project, category, destination)
+        paths = find_country_cogs(cog_source, project, category, popyear,
+                                  asset)
+        grid = mosaic_grid(paths)
+        collection_dest = os.path.dirname(collection.get_self_href() or "")
+        os.makedirs(collection_dest, exist_ok=True)
+        name = popyear if asset is None else asset
+        mosaic_path = os.path.join(collection_dest,
+                                   f"{category}_{name}_mosaic")
+        hrefs = [create_mosaic_vrt(grid, f"{mosaic_path}.vrt")]
+        if cog:
+            hrefs.append(
+                create_mosaic_cog(grid,
+                                  f"{mosaic_path}_cog.tif",
+                                  workers=workers))
+        add_mosaic_assets(collection, popyear, hrefs, asset)
+        save_collection_assets(collection)
+        print(f"Mosaicked {len(paths)} COGs into {', '.join(hrefs)}")
+
+    @worldpop.command(
+        "sample",
+        short_help="Samples a collection at the points of a CSV table.",
+    )
+    @click.option("-p",
+                  "--project",
+                  required=False,
+                  help="The WorldPop project of the collection.",
+                  type=click.Choice(list(COLLECTIONS_METADATA.keys())),
+                  default="pop")
+    @click.option(
+        "-c",
+        "--category",
+        required=False,
+        help="The category of the collection within the chosen project.",
+        type=click.Choice(
+            sum([list(c.keys()) for c in COLLECTIONS_METADATA.values()], [])),
+        default="cic2020_UNadj_100m")
+    @click.option("-y", "--popyear", required=True, help="Population year.")
+    @click.option(
+        "-d",
+        "--destination",
+        required=True,
+        help="The directory containing the STAC collections.",
+    )
+    @click.option("-i",
+                  "--points",
+                  required=True,
+                  help="CSV table of the points to sample.")
+    @click.option("-o",
+                  "--output",
+                  required=True,
+                  help="CSV table written with the sampled values.")
+    @click.option("--lon-column",
+                  help="Column of the longitudes.",
+                  default="lon")
+    @click.option("--lat-column",
+                  help="Column of the latitudes.",
+                  default="lat")
+    @click.option("--asset",
+                  required=False,
+                  help="Data asset to sample. Defaults to the first one.")
+    @click.option("--band",
+                  help="Band to sample, e.g. of stacked age/sex COGs.",
+                  type=int,
+                  default=1)
+    @click.option(
+        "--cache-size",
+        help="Megabytes of decoded blocks kept in memory.",
+        type=int,
+        default=SAMPLE_CACHE_BYTES // (1024 * 1024),
+    )
+    def sample_command(project: str, category: str, popyear: str,
+                       destination: str, points: str, output: str,
+                       lon_column: str, lat_column: str, asset: Optional[str],
+                       band: int, cache_size: int) -> Any:
+        """Samples the Items of one year of a collection at many points, e.g.
+        survey locations, reading each raster block once.
+
+        Args:
+            project (str): WorldPop project ID.
+            category (str): WorldPop category ID (member of `project`).
+            popyear (str): Population year.
+            destination (str): Directory containing the STAC collections.
+            points (str): CSV table with longitude and latitude columns.
+            output (str): CSV table written with `value` and `item` columns.
+        """
+        collection = load_collection(project, category, destination)
+        items = [
+            item for item in collection.get_all_items()
+            if item.properties.get("start_datetime", "").startswith(popyear)
+        ]
+        if not items:
+            raise ValueError(f"No Items of {popyear} in {collection.id}")
+        samples = sample_csv(items, points, output, lon_column, lat_column,
+                             asset, band, BlockCache(cache_size * 1024 * 1024))
+        found = sum(item_id is not None for item_id in samples.item_ids)
+        print(f"Sampled {found} of {len(samples.values)} points "
+              f"into {output}")
+
+    @worldpop.command(
+        "aggregate-collection",
+        short_help="Creates a collection of rasters summed to a coarser grid.",
+    )
+    @click.option("-p",
+                  "--project",
+                  required=False,
+                  help="The WorldPop project to aggregate.",
+                  type=click.Choice(list(COLLECTIONS_METADATA.keys())),
+                  default="pop")
+    @click.option(
+        "-c",
+        "--category",
+        required=False,
+        help="The category to aggregate within the chosen project.",
+        type=click.Choice(
+            sum([list(c.keys()) for c in COLLECTIONS_METADATA.values()], [])),
+        default="cic2020_UNadj_100m")
+    @click.option(
+        "-d",
+        "--destination",
+        required=True,
+        help="The output directory for the STAC collections.",
+    )
+    @click.option(
+        "-o",
+        "--cog_destination",
+        required=True,
+        help="The output directory for the aggregated COGs.",
+    )
+    @click.option("-k",
+                  "--api_key",
+                  required=False,
+                  help="A WorldPop API key, required for >1000 calls per day.",
+                  default="")
+    @click.option(
+        "-f",
+        "--factor",
+        required=False,
+        type=int,
+        default=AGGREGATE_FACTOR,
+        help="Pixels along each side of the summed blocks, 10 for 1km.",
+    )
+    @click.option(
+        "--statistics",
+        help="Compute band statistics while creating COGs.",
+        is_flag=True,
+        default=False,
+    )
+    @click.option(
+        "--thumbnail",
+        help="Render a PNG thumbnail for each COG and use it in the Items.",
+        is_flag=True,
+        default=False,
+    )
+    @click.option(
+        "--source-root",
+        required=False,
+        help="Read the API and GeoTIFFs from a mirror instead.",
+    )
+    @click.option(
+        "--shard",
+        required=False,
+        help="Only aggregate shard i/N of the work list.",
+    )
+    def aggregate_collection_command(project: str, category: str,
+                                     destination: str, cog_destination: str,
+                                     api_key: str, factor: int,
+                                     statistics: bool, thumbnail: bool,
+                                     source_root: Optional[str],
+                                     shard: Optional[str]) -> Any:
+        """Sums the people of blocks of pixels of the rasters of one WorldPop
+        project/category into COGs, e.g. 100m to 1km, and creates a derived
+        collection of them.
+
+        Args:
+            project (str): WorldPop project ID.
+            category (str): WorldPop category ID (member of `project`).
+            destination (str): Directory used to store the STAC collections.
+            cog_destination (str): The output directory for COGs.
+            factor (int): Number of pixels along each side of the blocks.
+        """
+        units = None
+        if shard is not None:
+            popyears = get_popyears(create_collection(project, category))
+            units = select_shard(list_work_units(project,
+                                                 category,
+                                                 popyears,
+                                                 api_key,
+                                                 source_root=source_root),
+                                 shard,
+                                 source_root=source_root)
+        aggregate_collection(project, category, destination, cog_destination,
+                             api_key, factor, statistics, thumbnail,
+                             source_root, units)
 
     return worldpop
@@ -127,3 +127,111 @@ COLLECTIONS_METADATA: Dict[str, Any] = {
 }
 
 TILING_PIXEL_SIZE = (10000, 10000)
+
+# Block size of the produced COGs. Adaptive tiles are a multiple of it.
+COG_BLOCK_SIZE = 512
+# Budgets of adaptive tiles: target size of a tile's COG, and largest size of
+# a tile read in memory at once
+TILE_TARGET_BYTES = 256 * 1024 * 1024
+TILE_MEMORY_BYTES = 1024 * 1024 * 1024
+# Estimated compressed size of a valid pixel relative to its raw size, and
+# the smallest valid fraction assumed, bounding the tiles of sparse rasters
+TILE_COMPRESSION_RATIO = 0.5
+TILE_MIN_DENSITY = 0.05
+
+# Nodata value assigned to produced COGs
+COG_NODATA = 0
+# Nodata value of the WorldPop GeoTIFFs, kept in the pixels of produced COGs
+WORLDPOP_NODATA = -99999.0
+
+# GDAL metadata item used to carry band statistics from COG creation to Items
+STATISTICS_TAG = "WORLDPOP_STATISTICS"
+HISTOGRAM_BUCKETS = 64
+
+# Footprints are vectorized from a nodata mask downsampled to at most
+# FOOTPRINT_MAX_SIZE pixels per side, then simplified to a bounded vertex count
+FOOTPRINT_MAX_SIZE = 1024
+FOOTPRINT_MAX_VERTICES = 500
+
+# Thumbnails use a fixed colour ramp of people per pixel, so that they can be
+# compared across countries, years and tiles
+THUMBNAIL_SIZE = 256
+THUMBNAIL_THRESHOLDS = [1, 5, 25, 100, 250, 1000]
+THUMBNAIL_COLORS = [
+    (255, 255, 204),
+    (255, 237, 160),
+    (254, 178, 76),
+    (253, 141, 60),
+    (240, 59, 32),
+    (189, 0, 38),
+    (128, 0, 38),
+]
+
+# File next to the collection JSON recording the source files of each unit
+SYNC_STATE_FILE = "worldpop-sync.json"
+
+# Number of concurrent HEAD requests used to get the size and ETag of files
+HEAD_CONCURRENCY = 8
+
+# Number of concurrent requests and requests per second to the WorldPop API
+API_CONCURRENCY = 8
+API_RATE_LIMIT = 10.0
+# Attempts for each API request answered with 429 or a 5xx code
+API_RETRIES = 5
+
+# File at the root of a local mirror recording the size, ETag and checksum
+# of the mirrored files, by url
+MIRROR_FINGERPRINTS_FILE = "fingerprints.json"
+# Size of the chunks in which downloads are streamed to disk and hashed
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Height and width of the chunks of Zarr datacubes. Chunks span all years so
+# that the time series of a pixel is a single read.
+CUBE_CHUNK_SIZE = 256
+# Number of chunks along x written at once, bounding the memory used to
+# years * CUBE_CHUNK_SIZE * CUBE_CHUNK_SIZE * CUBE_WINDOW_CHUNKS values
+CUBE_WINDOW_CHUNKS = 8
+CUBE_MEDIA_TYPE = "application/vnd+zarr"
+
+# Largest size of the decoded blocks kept in memory by `sample`
+SAMPLE_CACHE_BYTES = 256 * 1024 * 1024
+
+# Sidecars indexing the blocks of COGs, see `blockindex`
+BLOCK_INDEX_MEDIA_TYPE = "application/x-worldpop-block-index"
+
+# Size in pixels of the windows of global mosaics rendered in parallel
+MOSAIC_WINDOW_SIZE = 4096
+VRT_MEDIA_TYPE = "application/x-gdal-vrt"
+
+# Number of 100m pixels along each side of an aggregated pixel, and the size
+# in aggregated pixels of the windows reduced at once
+AGGREGATE_FACTOR = 10
+AGGREGATE_WINDOW_SIZE = 256
+
+# File next to the collection JSON listing the units that failed every
+# attempt, rebuilt by retry-failed
+FAILURES_FILE = "worldpop-failures.json"
+# Retries of a failed unit, file or tile, and the seconds to wait before the
+# first one, doubled before each of the next ones
+UNIT_RETRIES = 2
+UNIT_RETRY_BACKOFF = 30.0
+
+# Files above this size are uploaded to S3 in parts of S3_PART_SIZE bytes,
+# S3_UPLOAD_CONCURRENCY parts at a time
+S3_MULTIPART_THRESHOLD = 64 * 1024 * 1024
+S3_PART_SIZE = 16 * 1024 * 1024
+S3_UPLOAD_CONCURRENCY = 8
+# Number of files or STAC objects uploaded at once
+S3_PUT_CONCURRENCY = 16
+
+# Defaults of the calibration used by `plan` to estimate a run, replaced by
+# the values measured in the --profile-log of previous runs when given:
+# bytes per second downloaded, written as COGs and uploaded by one worker,
+# COG size over source size, seconds to create one Item, and bytes per pixel
+# of the compressed source GeoTIFFs, used to estimate their dimensions
+PLAN_DOWNLOAD_RATE = 20e6
+PLAN_COG_RATE = 15e6
+PLAN_UPLOAD_RATE = 50e6
+PLAN_COG_RATIO = 1.0
+PLAN_ITEM_SECONDS = 0.5
+PLAN_SOURCE_BYTES_PER_PIXEL = 1.0
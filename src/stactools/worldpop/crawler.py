@@ -0,0 +1,184 @@
+import asyncio
+import json
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+import aiohttp
+
+from stactools.worldpop.constants import (
+    API_CONCURRENCY,
+    API_RATE_LIMIT,
+    API_RETRIES,
+    API_URL,
+)
+from stactools.worldpop.profiling import StageRecord, stage
+from stactools.worldpop.utils import (
+    get_iso3_list,
+    get_metadata,
+    mirror_api_path,
+)
+
+logger = logging.getLogger(__name__)
+
+# API metadata of every iso3, by (project, category) then iso3
+MetadataIndex = Dict[Tuple[str, str], Dict[str, List[Any]]]
+
+
+class RateLimiter:
+    """Space out requests so that at most `rate` start per second."""
+    def __init__(self, rate: float) -> None:
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self) -> None:
+        async with self._lock:
+            now = asyncio.get_running_loop().time()
+            delay = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class MetadataCrawler:
+    """Fetch WorldPop API documents at bounded concurrency.
+
+    At most `concurrency` requests are in flight and at most `rate` start per
+    second. Requests answered with 429 or a 5xx code are retried with
+    exponential backoff, honouring the Retry-After header when present.
+    """
+    def __init__(self,
+                 session: aiohttp.ClientSession,
+                 api_url: str = API_URL,
+                 api_key: str = "",
+                 concurrency: int = API_CONCURRENCY,
+                 rate: float = API_RATE_LIMIT,
+                 retries: int = API_RETRIES) -> None:
+        self.session = session
+        self.api_url = api_url
+        self.api_key = api_key
+        self.retries = retries
+        self.requests = 0
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._limiter = RateLimiter(rate)
+
+    def _url(self, path: str, **params: str) -> str:
+        if self.api_key != "":
+            params["key"] = self.api_key
+        query = "&".join(f"{k}={v}" for k, v in params.items())
+        return f"{self.api_url}/{path}" + (f"?{query}" if query else "")
+
+    async def get_json(self, url: str) -> Any:
+        with stage("api", url=url) as record:
+            return await self._get_json(url, record)
+
+    async def _get_json(self, url: str, record: StageRecord) -> Any:
+        for attempt in range(1, self.retries + 1):
+            record.retries = attempt - 1
+            async with self._semaphore:
+                await self._limiter.wait()
+                self.requests += 1
+                async with self.session.get(url) as response:
+                    if response.status == 200:
+                        content = await response.read()
+                        record.bytes = len(content)
+                        return json.loads(content)
+                    retry_after = response.headers.get("Retry-After")
+                    status = response.status
+            if status != 429 and status < 500:
+                raise AssertionError(f"{status} code from API: {url}")
+            if attempt == self.retries:
+                break
+            delay = 2.0**(attempt - 1)
+            if retry_after is not None and retry_after.isdigit():
+                delay = float(retry_after)
+            logger.warning(f"{status} code from API, retrying in {delay}s: "
+                           f"{url}")
+            await asyncio.sleep(delay)
+        raise AssertionError(
+            f"{status} code from API after {self.retries} attempts: {url}")
+
+    async def get_iso3_list(self, project: str, category: str) -> List[str]:
+        data = (await
+                self.get_json(self._url(f"{project}/{category}")))["data"]
+        return list(sorted(set([d["iso3"] for d in data])))
+
+    async def get_metadatas(self, project: str, category: str,
+                            iso3: str) -> List[Any]:
+        url = self._url(f"{project}/{category}", iso3=iso3)
+        metadatas: List[Any] = (await self.get_json(url))["data"]
+        return metadatas
+
+    async def crawl(self, proj_cats: List[Tuple[str, str]]) -> MetadataIndex:
+        iso3_lists = await asyncio.gather(
+            *[self.get_iso3_list(p, c) for p, c in proj_cats])
+        keys = [(p, c, iso3)
+                for (p, c), iso3_list in zip(proj_cats, iso3_lists)
+                for iso3 in iso3_list]
+        metadatas = await asyncio.gather(
+            *[self.get_metadatas(p, c, iso3) for p, c, iso3 in keys])
+        index: MetadataIndex = {proj_cat: {} for proj_cat in proj_cats}
+        for (p, c, iso3), metadata in zip(keys, metadatas):
+            index[(p, c)][iso3] = metadata
+        return index
+
+
+async def crawl_metadata_async(proj_cats: List[Tuple[str, str]],
+                               api_url: str = API_URL,
+                               api_key: str = "",
+                               concurrency: int = API_CONCURRENCY,
+                               rate: float = API_RATE_LIMIT,
+                               timeout: Optional[float] = 60) -> MetadataIndex:
+    """Fetch the metadata of every iso3 of the given projects/categories.
+
+    Args:
+        proj_cats (List[Tuple[str, str]]): (project, category) pairs.
+        api_url (str, optional): Base url of the WorldPop REST API.
+        api_key (str, optional): A WorldPop API key.
+        concurrency (int, optional): Maximum number of requests in flight.
+        rate (float, optional): Maximum number of requests per second.
+        timeout (float, optional): Timeout of each request in seconds.
+
+    Returns:
+        MetadataIndex: The list of metadata dicts of each iso3, by
+        (project, category) then iso3.
+    """
+    client_timeout = aiohttp.ClientTimeout(total=timeout)
+    async with aiohttp.ClientSession(timeout=client_timeout) as session:
+        crawler = MetadataCrawler(session, api_url, api_key, concurrency, rate)
+        index = await crawler.crawl(proj_cats)
+    logger.info(f"Crawled {crawler.requests} API documents")
+    return index
+
+
+def read_mirror_metadata(proj_cats: List[Tuple[str, str]],
+                         source_root: str) -> MetadataIndex:
+    """Read the metadata of every iso3 of the given projects/categories from
+    a local mirror."""
+    index: MetadataIndex = {}
+    for project, category in proj_cats:
+        index[(project, category)] = {
+            iso3:
+            get_metadata(mirror_api_path(source_root, project, category,
+                                         iso3))["data"]
+            for iso3 in get_iso3_list(project, category, source_root)
+        }
+    return index
+
+
+def crawl_metadata(proj_cats: List[Tuple[str, str]],
+                   api_url: str = API_URL,
+                   api_key: str = "",
+                   concurrency: int = API_CONCURRENCY,
+                   rate: float = API_RATE_LIMIT,
+                   timeout: Optional[float] = 60,
+                   source_root: Optional[str] = None) -> MetadataIndex:
+    """Synchronous wrapper of `crawl_metadata_async`.
+
+    With `source_root`, the metadata is read from that local mirror instead.
+    """
+    if source_root is not None:
+        return read_mirror_metadata(proj_cats, source_root)
+    return asyncio.run(
+        crawl_metadata_async(proj_cats, api_url, api_key, concurrency, rate,
+                             timeout))
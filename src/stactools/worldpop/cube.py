@@ -0,0 +1,218 @@
+import logging
+from contextlib import ExitStack
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import rasterio
+from pystac import Asset, Collection
+from pystac.extensions.datacube import (
+    DatacubeExtension,
+    HorizontalSpatialDimension,
+    TemporalDimension,
+    Variable,
+)
+from rasterio.windows import Window
+
+from stactools.worldpop.constants import (
+    CUBE_CHUNK_SIZE,
+    CUBE_MEDIA_TYPE,
+    CUBE_WINDOW_CHUNKS,
+    WORLDPOP_EPSG,
+)
+from stactools.worldpop.profiling import stage
+from stactools.worldpop.utils import source_href
+
+try:
+    import zarr
+    from numcodecs import Blosc
+except ImportError:  # Optional, install with the zarr extra
+    zarr = None
+
+logger = logging.getLogger(__name__)
+
+CUBE_VARIABLE = "population"
+
+
+def require_zarr() -> None:
+    if zarr is None:
+        raise ImportError("zarr is required for datacubes, install it with "
+                          "`pip install stactools-worldpop[zarr]`")
+
+
+def yearly_hrefs(metadatas: List[Any],
+                 popyears: Optional[List[str]] = None,
+                 source_root: Optional[str] = None) -> Dict[str, str]:
+    """Return the href to read the raster of each year of a country from.
+
+    Args:
+        metadatas (list): List of metadata dicts of the country.
+        popyears (List[str], optional): Years to include. Defaults to all.
+        source_root (str, optional): Local mirror to read the rasters from.
+
+    Returns:
+        dict: Readable href of each population year.
+    """
+    hrefs = {}
+    for metadata in metadatas:
+        popyear = metadata["popyear"]
+        if popyears is not None and popyear not in popyears:
+            continue
+        if len(metadata["files"]) != 1:
+            raise ValueError(f"Expecting one raster per year but got "
+                             f"{len(metadata['files'])} for {popyear}")
+        if source_root is not None:
+            hrefs[popyear] = source_href(metadata["files"][0], source_root)
+        else:
+            # Use FTP server because HTTPS server doesn't work with
+            # rasterio.open
+            hrefs[popyear] = metadata["files"][0].replace(
+                "https://data", "ftp://ftp")
+    if not hrefs:
+        raise ValueError("No rasters found for the requested years")
+    return hrefs
+
+
+def create_cube(hrefs: Dict[str, str],
+                output_path: str,
+                chunk_size: int = CUBE_CHUNK_SIZE,
+                window_chunks: int = CUBE_WINDOW_CHUNKS) -> str:
+    """Stream the yearly rasters of a country into a Zarr datacube.
+
+    The cube holds a `population` array with dimensions (year, y, x) and
+    coordinate arrays for each dimension, following the xarray conventions.
+    Chunks span all years, so reading the time series of a pixel touches
+    one chunk. The rasters are read one window of chunks at a time, so the
+    country never needs to fit in memory.
+
+    Args:
+        hrefs (dict): Href of the raster of each population year. The
+            rasters must share their grid.
+        output_path (str): Path to which the Zarr store will be written.
+        chunk_size (int, optional): Height and width of the chunks.
+        window_chunks (int, optional): Number of chunks along x read and
+            written at once.
+
+    Returns:
+        str: The path to the Zarr store.
+    """
+    require_zarr()
+    years = sorted(hrefs)
+    with ExitStack() as exit_stack, stage("to_zarr",
+                                          path=output_path) as record:
+        sources = [
+            exit_stack.enter_context(rasterio.open(hrefs[year]))
+            for year in years
+        ]
+        first = sources[0]
+        for year, src in zip(years, sources):
+            if (src.shape != first.shape or src.transform != first.transform
+                    or src.crs != first.crs):
+                raise ValueError(
+                    f"Raster grid of {year} differs from {years[0]}: "
+                    f"{hrefs[year]}")
+        height, width = first.shape
+        transform = first.transform
+
+        logger.info(f"Writing {len(years)} years to {output_path}")
+        group = zarr.open_group(output_path, mode="w")
+        compressor = Blosc(cname="zstd", clevel=5, shuffle=Blosc.SHUFFLE)
+        cube = group.create_dataset(CUBE_VARIABLE,
+                                    shape=(len(years), height, width),
+                                    chunks=(len(years), chunk_size,
+                                            chunk_size),
+                                    dtype=first.dtypes[0],
+                                    compressor=compressor,
+                                    fill_value=first.nodata)
+        cube.attrs["_ARRAY_DIMENSIONS"] = ["year", "y", "x"]
+        coordinates = {
+            "year": np.array([int(year) for year in years], dtype="int32"),
+            "y": transform.f + (np.arange(height) + 0.5) * transform.e,
+            "x": transform.c + (np.arange(width) + 0.5) * transform.a,
+        }
+        for name, values in coordinates.items():
+            array = group.create_dataset(name,
+                                         data=values,
+                                         chunks=values.shape)
+            array.attrs["_ARRAY_DIMENSIONS"] = [name]
+        group.attrs["crs_wkt"] = first.crs.wkt
+        group.attrs["transform"] = list(transform)[:6]
+
+        window_width = chunk_size * window_chunks
+        for row_off in range(0, height, chunk_size):
+            rows = min(chunk_size, height - row_off)
+            for col_off in range(0, width, window_width):
+                cols = min(window_width, width - col_off)
+                window = Window(col_off, row_off, cols, rows)
+                block = np.stack(
+                    [src.read(1, window=window) for src in sources])
+                cube[:, row_off:row_off + rows, col_off:col_off + cols] = block
+        zarr.consolidate_metadata(output_path)
+        record.bytes = cube.nbytes_stored
+    return output_path
+
+
+def add_cube_asset(collection: Collection, iso3: str, href: str) -> Asset:
+    """Add a Zarr datacube of a country to a collection as an asset.
+
+    The dimensions and variable of the cube are described with the datacube
+    extension.
+
+    Args:
+        collection (Collection): The collection of the yearly rasters.
+        iso3 (str): ISO3 code of the country.
+        href (str): Href of the Zarr store created by `create_cube`.
+
+    Returns:
+        Asset: The added asset.
+    """
+    require_zarr()
+    group = zarr.open_consolidated(href, mode="r")
+    years = [str(year) for year in group["year"][:]]
+    x = group["x"][:]
+    y = group["y"][:]
+    transform = group.attrs["transform"]
+
+    asset = Asset(href=href,
+                  media_type=CUBE_MEDIA_TYPE,
+                  roles=["data"],
+                  title=f"{iso3} population {years[0]}-{years[-1]}")
+    collection.add_asset(f"{iso3}_zarr", asset)
+    cube_ext = DatacubeExtension.ext(asset, add_if_missing=True)
+    cube_ext.apply(dimensions={
+        "year":
+        TemporalDimension({
+            "type":
+            "temporal",
+            "extent":
+            [f"{years[0]}-01-01T00:00:00Z", f"{years[-1]}-01-01T00:00:00Z"],
+            "step":
+            "P1Y",
+        }),
+        "y":
+        HorizontalSpatialDimension({
+            "type": "spatial",
+            "axis": "y",
+            "extent": [float(y.min()), float(y.max())],
+            "step": transform[4],
+            "reference_system": WORLDPOP_EPSG,
+        }),
+        "x":
+        HorizontalSpatialDimension({
+            "type": "spatial",
+            "axis": "x",
+            "extent": [float(x.min()), float(x.max())],
+            "step": transform[0],
+            "reference_system": WORLDPOP_EPSG,
+        }),
+    },
+                   variables={
+                       CUBE_VARIABLE:
+                       Variable({
+                           "type":
+                           "data",
+                           "dimensions": ["year", "y", "x"],
+                           "description":
+                           "Estimated number of people per pixel",
+                       })
+                   })
+    return asset
@@ -0,0 +1,186 @@
+import logging
+from collections import Counter
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from pystac import Collection, Item, SpatialExtent, TemporalExtent
+from pystac.summaries import RangeSummary
+from pystac.utils import datetime_to_str, str_to_datetime
+
+from stactools.worldpop.constants import WORLDPOP_EXTENT
+
+logger = logging.getLogger(__name__)
+
+
+def unit_extent(items: List[Item]) -> Dict[str, Any]:
+    """Return the bbox, time interval and `proj:shape` range of the Items of
+    one unit, as stored in the sync state."""
+    bboxes = [item.bbox for item in items if item.bbox is not None]
+    shapes = [
+        list(item.properties["proj:shape"]) for item in items
+        if "proj:shape" in item.properties
+    ]
+    starts = [
+        item.common_metadata.start_datetime or item.datetime for item in items
+    ]
+    ends = [
+        item.common_metadata.end_datetime or item.datetime for item in items
+    ]
+    interval = None
+    if None not in starts + ends:
+        interval = [
+            datetime_to_str(min(d for d in starts if d is not None)),
+            datetime_to_str(max(d for d in ends if d is not None)),
+        ]
+    return {
+        "bbox": merge_bboxes(bboxes) if bboxes else None,
+        "interval": interval,
+        "shape": shape_range(shapes, shapes) if shapes else None,
+    }
+
+
+def merge_bboxes(bboxes: List[List[float]]) -> List[float]:
+    return [
+        min(b[0] for b in bboxes),
+        min(b[1] for b in bboxes),
+        max(b[2] for b in bboxes),
+        max(b[3] for b in bboxes),
+    ]
+
+
+def shape_range(minimums: List[List[int]],
+                maximums: List[List[int]]) -> Dict[str, List[int]]:
+    """Return the range of the rows and columns of shapes, element-wise."""
+    return {
+        "minimum": [min(s[0] for s in minimums),
+                    min(s[1] for s in minimums)],
+        "maximum": [max(s[0] for s in maximums),
+                    max(s[1] for s in maximums)],
+    }
+
+
+class CollectionExtents:
+    """Extents and summaries of the Items of a collection, kept up to date
+    as units are recorded and removed.
+
+    Adding a unit only widens the running aggregates. Removing one may
+    shrink them, so they are then recomputed from the extents of the
+    remaining units, once, when next applied. Neither reads the Items.
+    """
+    def __init__(self,
+                 units: Optional[Dict[str, Dict[str, Any]]] = None) -> None:
+        self.units: Dict[str, Dict[str, Any]] = {}
+        self._reset()
+        for key, unit in (units or {}).items():
+            self.add(key, unit)
+
+    def _reset(self) -> None:
+        self.iso3s: Dict[str, int] = Counter()
+        self.popyears: Dict[str, int] = Counter()
+        self.bbox: Optional[List[float]] = None
+        self.interval: Optional[List[str]] = None
+        self.shape: Optional[Dict[str, List[int]]] = None
+        # Units recorded before their extent was stored in the state
+        self.unknown = 0
+        self.stale = False
+
+    def add(self, key: str, unit: Dict[str, Any]) -> None:
+        """Add the unit of a sync state entry, replacing any previous one."""
+        if key in self.units:
+            self.remove(key)
+        self.units[key] = unit
+        if not unit["items"]:
+            return
+        self.iso3s[unit["iso3"]] += 1
+        self.popyears[unit["popyear"]] += 1
+        if "extent" not in unit:
+            self.unknown += 1
+            return
+        extent = unit["extent"]
+        if extent["bbox"] is not None:
+            self.bbox = merge_bboxes([extent["bbox"]] + (
+                [self.bbox] if self.bbox is not None else []))
+        if extent["interval"] is not None:
+            start, end = extent["interval"]
+            if self.interval is not None:
+                start = min(start, self.interval[0])
+                end = max(end, self.interval[1])
+            self.interval = [start, end]
+        if extent["shape"] is not None:
+            shapes = [extent["shape"]] + ([self.shape] if self.shape else [])
+            self.shape = shape_range([s["minimum"] for s in shapes],
+                                     [s["maximum"] for s in shapes])
+
+    def remove(self, key: str) -> None:
+        unit = self.units.pop(key, None)
+        if unit is None or not unit["items"]:
+            return
+        for counter, value in [(self.iso3s, unit["iso3"]),
+                               (self.popyears, unit["popyear"])]:
+            counter[value] -= 1
+            if counter[value] == 0:
+                del counter[value]
+        if "extent" not in unit:
+            self.unknown -= 1
+        else:
+            self.stale = True
+
+    def _recompute(self) -> None:
+        if self.stale:
+            units = self.units
+            self.units = {}
+            self._reset()
+            for key, unit in units.items():
+                self.add(key, unit)
+
+    def computed_extent(self) -> Optional[Dict[str, Any]]:
+        """Return the STAC extent of the Items, or None while it is not
+        known, i.e. without Items or with units recorded without their
+        extent."""
+        self._recompute()
+        if (not self.iso3s or self.unknown or self.bbox is None
+                or self.interval is None):
+            return None
+        return {
+            "spatial": {
+                "bbox": [self.bbox]
+            },
+            "temporal": {
+                "interval": [self.interval]
+            },
+        }
+
+    def apply(self, collection: Collection) -> None:
+        """Set the extents and summaries of `collection` from its units.
+
+        The spatial and temporal extents are left as they are while units
+        recorded without their extent remain, e.g. until they are synced.
+        Without any Items, the extents are reset to the whole world and an
+        open interval, and the summaries of Items are removed.
+        """
+        self._recompute()
+        summaries = collection.summaries
+        if not self.iso3s:
+            for key in ["worldpop:iso3", "worldpop:popyear", "proj:shape"]:
+                summaries.remove(key)
+            collection.extent.spatial = SpatialExtent([WORLDPOP_EXTENT])
+            interval: List[Optional[datetime]] = [None, None]
+            collection.extent.temporal = TemporalExtent([interval])
+            return
+        summaries.add("worldpop:iso3", sorted(self.iso3s))
+        summaries.add("worldpop:popyear", sorted(self.popyears))
+        if self.unknown:
+            logger.info(f"{self.unknown} units of {collection.id} have no "
+                        "recorded extent, keeping the collection extent")
+            return
+        if self.shape is not None:
+            summaries.add(
+                "proj:shape",
+                RangeSummary(self.shape["minimum"], self.shape["maximum"]))
+        if self.bbox is not None:
+            collection.extent.spatial = SpatialExtent([self.bbox])
+        if self.interval is not None:
+            collection.extent.temporal = TemporalExtent([[
+                str_to_datetime(self.interval[0]),
+                str_to_datetime(self.interval[1])
+            ]])
@@ -0,0 +1,98 @@
+import json
+import logging
+import os
+import time
+from typing import Any, Callable, Dict, List, Optional, TypeVar
+
+from stactools.worldpop.constants import (
+    FAILURES_FILE,
+    UNIT_RETRIES,
+    UNIT_RETRY_BACKOFF,
+)
+from stactools.worldpop.storage import delete, read_text, write_text
+from stactools.worldpop.sync import unit_key
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class UnitFailed(Exception):
+    """Raised by `with_retries` once every attempt of a unit failed."""
+    def __init__(self, name: str, attempts: int, error: Exception) -> None:
+        super().__init__(f"{name} failed after {attempts} attempts: "
+                         f"{error!r}")
+        self.attempts = attempts
+        self.error = error
+
+
+def with_retries(function: Callable[[], T],
+                 name: str,
+                 retries: int = UNIT_RETRIES,
+                 backoff: float = UNIT_RETRY_BACKOFF) -> T:
+    """Call `function`, retrying it with exponential backoff when it raises.
+
+    Args:
+        function (Callable): The work to do, e.g. converting one file.
+        name (str): Name of the work, for logging.
+        retries (int, optional): Number of retries after the first attempt.
+        backoff (float, optional): Seconds to wait before the first retry,
+            doubled before each of the next ones.
+
+    Raises:
+        UnitFailed: If the last attempt raised too, with its exception.
+    """
+    for attempt in range(1, retries + 2):
+        try:
+            return function()
+        except Exception as e:
+            if attempt > retries:
+                raise UnitFailed(name, attempt, e) from e
+            delay = backoff * 2**(attempt - 1)
+            logger.warning(f"{name} failed ({e!r}), retrying in {delay}s")
+            time.sleep(delay)
+    raise AssertionError("unreachable")
+
+
+class FailureReport:
+    """Units quarantined after failing every attempt, by unit key.
+
+    The report is stored next to the collection JSON, so that the run goes
+    on without the failed units and `retry-failed` can rebuild only them.
+    """
+    def __init__(self,
+                 units: Optional[Dict[str, Dict[str, Any]]] = None) -> None:
+        self.units: Dict[str, Dict[str, Any]] = units or {}
+
+    @classmethod
+    def load(cls, collection_dest: str) -> "FailureReport":
+        text = read_text(os.path.join(collection_dest, FAILURES_FILE))
+        if text is None:
+            return cls()
+        return cls(json.loads(text)["units"])
+
+    def save(self, collection_dest: str) -> None:
+        """Write the report, or remove it if no unit failed."""
+        path = os.path.join(collection_dest, FAILURES_FILE)
+        if not self.units:
+            delete(path)
+            return
+        write_text(path,
+                   json.dumps({"units": self.units}, indent=2, sort_keys=True))
+        print(f"{len(self.units)} units failed, see {path}. Rebuild them "
+              "with retry-failed.")
+
+    def record(self, iso3: str, popyear: str, error: UnitFailed) -> None:
+        logger.error(f"Quarantining {iso3}/{popyear}: {error}")
+        self.units[unit_key(iso3, popyear)] = {
+            "iso3": iso3,
+            "popyear": popyear,
+            "attempts": error.attempts,
+            "error": repr(error.error),
+        }
+
+    def remove(self, iso3: str, popyear: str) -> None:
+        self.units.pop(unit_key(iso3, popyear), None)
+
+    def keys(self) -> List[str]:
+        return sorted(self.units)
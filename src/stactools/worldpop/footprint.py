@@ -0,0 +1,141 @@
+import logging
+import math
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import rasterio
+from affine import Affine
+from rasterio.features import shapes
+from rasterio.windows import Window
+from shapely.geometry import box, mapping, shape
+from shapely.geometry.polygon import orient
+from shapely.ops import unary_union
+
+from stactools.worldpop.constants import (
+    COG_NODATA,
+    FOOTPRINT_MAX_SIZE,
+    FOOTPRINT_MAX_VERTICES,
+    WORLDPOP_NODATA,
+)
+from stactools.worldpop.stats import valid_mask
+
+logger = logging.getLogger(__name__)
+
+
+def read_valid_mask(src: Any, factor: int) -> Tuple[np.ndarray, Affine]:
+    """Return a mask of the valid pixels of band 1, downsampled by `factor`.
+
+    A downsampled pixel is valid if any of the source pixels it covers is
+    valid. When the raster has overviews, the mask is reduced in the same way
+    from the coarsest overview at most `factor` times coarser than the full
+    resolution, so only valid areas smaller than an overview pixel can be
+    missed.
+
+    Returns:
+        tuple: The mask and its affine transform.
+    """
+    # Produced COGs are tagged with COG_NODATA but keep WorldPop's nodata
+    nodata_values = [src.nodata, COG_NODATA, WORLDPOP_NODATA]
+    if factor == 1:
+        return valid_mask(src.read(1), nodata_values), src.transform
+    decimations = [d for d in src.overviews(1) if d <= factor]
+    if decimations:
+        decimation = max(decimations)
+        level = src.overviews(1).index(decimation)
+        with rasterio.open(src.name, overview_level=level) as overview:
+            return _reduce_valid_mask(overview, factor // decimation,
+                                      nodata_values)
+    return _reduce_valid_mask(src, factor, nodata_values)
+
+
+def _reduce_valid_mask(src: Any, factor: int,
+                       nodata_values: List[Any]) -> Tuple[np.ndarray, Affine]:
+    """Any-reduce the valid pixels of band 1 by `factor`, streaming strips of
+    rows aligned to the factor."""
+    height = math.ceil(src.height / factor)
+    width = math.ceil(src.width / factor)
+    mask = np.zeros((height, width), dtype=bool)
+    rows_per_strip = factor * max(1, 1024 // factor)
+    for row_off in range(0, src.height, rows_per_strip):
+        rows = min(rows_per_strip, src.height - row_off)
+        data = src.read(1, window=Window(0, row_off, src.width, rows))
+        valid = valid_mask(data, nodata_values)
+        padded = np.zeros((math.ceil(rows / factor) * factor, width * factor),
+                          dtype=bool)
+        padded[:rows, :src.width] = valid
+        reduced = padded.reshape(padded.shape[0] // factor, factor, width,
+                                 factor).any(axis=(1, 3))
+        start = row_off // factor
+        mask[start:start + reduced.shape[0]] = reduced
+    return mask, src.transform * Affine.scale(factor, factor)
+
+
+def create_footprint(
+        href: str,
+        max_size: int = FOOTPRINT_MAX_SIZE,
+        max_vertices: int = FOOTPRINT_MAX_VERTICES
+) -> Optional[Dict[str, Any]]:
+    """Create a simplified footprint of the valid data in a raster.
+
+    Args:
+        href (str): Path to the raster.
+        max_size (int, optional): Largest side, in pixels, of the downsampled
+            mask that is vectorized.
+        max_vertices (int, optional): Largest number of vertices in the
+            simplified footprint.
+
+    Returns:
+        dict: GeoJSON geometry of the footprint, or None if the raster does
+        not contain any valid data.
+    """
+    with rasterio.open(href) as src:
+        factor = max(1, math.ceil(max(src.width, src.height) / max_size))
+        mask, transform = read_valid_mask(src, factor)
+        bounds = box(*src.bounds)
+        src_width = src.width * abs(src.transform.a)
+        src_height = src.height * abs(src.transform.e)
+
+    if not mask.any():
+        return None
+
+    polygons = [
+        shape(geometry) for geometry, _ in shapes(
+            mask.astype(np.uint8), mask=mask, transform=transform)
+    ]
+    # Downsampled pixels on the last row and column may extend past the raster
+    footprint = unary_union(polygons).intersection(bounds)
+    if footprint.geom_type == "GeometryCollection":
+        footprint = unary_union(
+            [g for g in footprint.geoms if g.geom_type.endswith("Polygon")])
+
+    # Close gaps between nearby parts and simplify with a growing tolerance
+    # until the vertex count is bounded
+    tolerance = abs(transform.a)
+    simplified = footprint.simplify(tolerance)
+    max_tolerance = max(src_width, src_height)
+    while (_count_vertices(simplified) > max_vertices
+           and tolerance < max_tolerance):
+        tolerance *= 2
+        closed = footprint.buffer(tolerance, resolution=1,
+                                  join_style=2).buffer(-tolerance,
+                                                       resolution=1,
+                                                       join_style=2)
+        simplified = closed.intersection(bounds).simplify(tolerance)
+    if simplified.is_empty or _count_vertices(simplified) > max_vertices:
+        simplified = footprint.envelope
+
+    if simplified.geom_type == "Polygon":
+        simplified = orient(simplified)
+    else:
+        simplified = type(simplified)([orient(p) for p in simplified.geoms])
+    geometry: Dict[str, Any] = mapping(simplified)
+    return geometry
+
+
+def _count_vertices(geometry: Any) -> int:
+    if geometry.is_empty:
+        return 0
+    polygons = geometry.geoms if hasattr(geometry, "geoms") else [geometry]
+    return sum(
+        len(p.exterior.coords) + sum(len(i.coords) for i in p.interiors)
+        for p in polygons)
@@ -0,0 +1,174 @@
+import json
+import logging
+import os
+import shutil
+from typing import Any, Dict, List, Optional
+
+from stactools.worldpop.extents import (
+    CollectionExtents,
+    merge_bboxes,
+    shape_range,
+)
+from stactools.worldpop.failures import FailureReport
+from stactools.worldpop.sync import SyncState
+
+logger = logging.getLogger(__name__)
+
+COLLECTION_FILE = "collection.json"
+
+
+def _merge_intervals(
+        intervals: List[List[Optional[str]]]) -> List[Optional[str]]:
+    # ISO 8601 strings in UTC sort chronologically, None is open ended
+    starts = [i[0] for i in intervals]
+    ends = [i[1] for i in intervals]
+    return [
+        None if None in starts else min(s for s in starts if s is not None),
+        None if None in ends else max(e for e in ends if e is not None),
+    ]
+
+
+def _merge_summaries(summaries: List[Dict[str, Any]]) -> Dict[str, Any]:
+    merged: Dict[str, Any] = {}
+    for summary in summaries:
+        for key, value in summary.items():
+            if key not in merged:
+                merged[key] = value
+            elif isinstance(value, list):
+                merged[key] = merged[key] + [
+                    v for v in value if v not in merged[key]
+                ]
+            elif isinstance(value, dict) and isinstance(
+                    value.get("minimum"), list):
+                # e.g. proj:shape, whose rows and columns range separately
+                merged[key] = shape_range(
+                    [merged[key]["minimum"], value["minimum"]],
+                    [merged[key]["maximum"], value["maximum"]])
+            elif isinstance(value, dict) and "minimum" in value:
+                merged[key] = {
+                    "minimum": min(merged[key]["minimum"], value["minimum"]),
+                    "maximum": max(merged[key]["maximum"], value["maximum"]),
+                }
+    return merged
+
+
+def merge_collection_dicts(
+        collections: List[Dict[str, Any]],
+        extents: Optional[CollectionExtents] = None) -> Dict[str, Any]:
+    """Merge the JSON of shards of one collection.
+
+    Item links are combined and the extents and summaries are unioned.
+    Shards without Items are left out of the union, as their extents are
+    the static ones of an empty collection. Other fields are taken from the
+    first collection.
+
+    Args:
+        collections (List[Dict[str, Any]]): The collection JSON of each
+            shard.
+        extents (CollectionExtents, optional): Extents of the units of all
+            shards, used instead of the union when they are known.
+
+    Returns:
+        Dict[str, Any]: The merged collection JSON.
+    """
+    merged = dict(collections[0])
+    item_links = {}
+    for collection in collections:
+        for link in collection["links"]:
+            if link["rel"] == "item":
+                item_links[link["href"]] = link
+    merged["links"] = [
+        link for link in collections[0]["links"] if link["rel"] != "item"
+    ] + [item_links[href] for href in sorted(item_links)]
+
+    populated = [
+        c for c in collections if any(link["rel"] == "item"
+                                      for link in c["links"])
+    ] or collections[:1]
+    spatial = [b for c in populated for b in c["extent"]["spatial"]["bbox"]]
+    temporal = [
+        i for c in populated for i in c["extent"]["temporal"]["interval"]
+    ]
+    merged["extent"] = {
+        "spatial": {
+            "bbox": [merge_bboxes(spatial)]
+        },
+        "temporal": {
+            "interval": [_merge_intervals(temporal)]
+        },
+    }
+    if extents is not None:
+        merged["extent"] = extents.computed_extent() or merged["extent"]
+    if any("summaries" in c for c in populated):
+        merged["summaries"] = _merge_summaries(
+            [c.get("summaries", {}) for c in populated])
+    return merged
+
+
+def merge_collections(sources: List[str], destination: str) -> List[str]:
+    """Merge the collections written by several shards into one directory.
+
+    Each source is the destination directory of one shard. Item directories
+    are copied as is, and only the collection JSON files are read, so Items
+    are neither parsed nor validated again. Relative links from the Items to
+    their collection stay valid because the directory layout is kept.
+
+    Args:
+        sources (List[str]): Destination directories of the shards.
+        destination (str): Directory to write the merged collections to. It
+            may be one of the sources.
+
+    Returns:
+        List[str]: The ids of the merged collections.
+    """
+    collection_ids = sorted({
+        name
+        for source in sources
+        for name in os.listdir(source)
+        if os.path.exists(os.path.join(source, name, COLLECTION_FILE))
+    })
+    for collection_id in collection_ids:
+        logger.info(f"Merging collection {collection_id}")
+        collection_dest = os.path.join(destination, collection_id)
+        os.makedirs(collection_dest, exist_ok=True)
+        collections = []
+        states: Dict[str, Any] = {}
+        failures: Dict[str, Any] = {}
+        for source in sources:
+            collection_src = os.path.join(source, collection_id)
+            collection_path = os.path.join(collection_src, COLLECTION_FILE)
+            if not os.path.exists(collection_path):
+                continue
+            with open(collection_path) as f:
+                collection = json.load(f)
+            collections.append(collection)
+
+            states.update(SyncState.load(collection_src).units)
+            failures.update(FailureReport.load(collection_src).units)
+
+            if os.path.abspath(collection_src) == os.path.abspath(
+                    collection_dest):
+                continue
+            for link in collection["links"]:
+                if link["rel"] != "item":
+                    continue
+                item_folder = os.path.dirname(
+                    os.path.normpath(os.path.join(collection_src,
+                                                  link["href"])))
+                item_dest = os.path.join(
+                    collection_dest,
+                    os.path.relpath(item_folder, collection_src))
+                if os.path.isdir(item_dest):
+                    shutil.rmtree(item_dest)
+                shutil.copytree(item_folder, item_dest)
+
+        merged = merge_collection_dicts(
+            collections,
+            CollectionExtents(states) if states else None)
+        with open(os.path.join(collection_dest, COLLECTION_FILE), "w") as f:
+            json.dump(merged, f, indent=2)
+        if states:
+            SyncState(states).save(collection_dest)
+        if failures:
+            FailureReport(failures).save(collection_dest)
+    return collection_ids
@@ -0,0 +1,182 @@
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import requests
+
+from stactools.worldpop.checksum import StreamHash
+from stactools.worldpop.constants import (
+    API_URL,
+    DOWNLOAD_CHUNK_SIZE,
+    HEAD_CONCURRENCY,
+    MIRROR_FINGERPRINTS_FILE,
+)
+from stactools.worldpop.crawler import crawl_metadata
+from stactools.worldpop.profiling import stage
+from stactools.worldpop.utils import (
+    fingerprint_changed,
+    get_fingerprints,
+    get_metadata,
+    mirror_api_path,
+    mirror_file_path,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def _write_json(path: str, data: Any) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(data, f, indent=2)
+
+
+def _is_mirrored(source_root: str, url: str, fingerprints: Dict[str,
+                                                                Any]) -> bool:
+    path = mirror_file_path(source_root, url)
+    if url not in fingerprints or not os.path.exists(path):
+        return False
+    # Checked without reading the file, e.g. after a truncated copy
+    return fingerprints[url].get("size") in (None, os.path.getsize(path))
+
+
+def _listed_iso3s(path: str) -> List[str]:
+    if not os.path.exists(path):
+        return []
+    return [d["iso3"] for d in get_metadata(path)["data"]]
+
+
+def download_file(url: str, path: str) -> Dict[str, Any]:
+    """Stream a remote file to `path` and return its size, ETag and
+    checksum, hashed as it is written.
+
+    The file is written next to `path` first and moved in place once
+    complete, so an interrupted download is never mistaken for a mirrored
+    file.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    part_path = f"{path}.part"
+    stream_hash = StreamHash()
+    with stage("download",
+               url=url) as record, requests.get(url, stream=True) as response:
+        if response.status_code != 200:
+            raise AssertionError(
+                f"{response.status_code} code for file: {url}")
+        with open(part_path, "wb") as f:
+            for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                f.write(chunk)
+                stream_hash.update(chunk)
+        etag = response.headers.get("ETag")
+        record.bytes = stream_hash.size
+    os.replace(part_path, path)
+    return {
+        "size": stream_hash.size,
+        "etag": etag,
+        "checksum": stream_hash.checksum
+    }
+
+
+def mirror_collections(source_root: str,
+                       proj_cats: List[Tuple[str, str]],
+                       api_key: str = "",
+                       iso3s: Optional[List[str]] = None,
+                       popyears: Optional[List[str]] = None,
+                       rasters: bool = False,
+                       concurrency: int = HEAD_CONCURRENCY,
+                       api_url: str = API_URL) -> List[str]:
+    """Copy the API metadata, and optionally the GeoTIFFs, of WorldPop
+    projects/categories into a local mirror.
+
+    The mirror can then be given as `source_root` to build collections
+    without network access. Files already in the mirror with their recorded
+    size are not downloaded again, unless their size or ETag on the server
+    changed since, and the size, ETag and checksum of each mirrored file are
+    recorded as soon as it is downloaded so that `sync` can compare them.
+    Countries mirrored by earlier runs stay in the mirrored listings while
+    the API lists them.
+
+    Args:
+        source_root (str): Directory of the mirror.
+        proj_cats (List[Tuple[str, str]]): (project, category) pairs.
+        api_key (str, optional): A WorldPop API key.
+        iso3s (List[str], optional): Only mirror these countries. Defaults to
+            all countries.
+        popyears (List[str], optional): Only mirror the GeoTIFFs of these
+            years. Defaults to all years.
+        rasters (bool, optional): Also mirror the GeoTIFFs. Defaults to
+            False.
+        concurrency (int, optional): Number of concurrent downloads.
+        api_url (str, optional): Base url of the WorldPop REST API.
+
+    Returns:
+        List[str]: The urls of the GeoTIFFs that were downloaded.
+    """
+    index = crawl_metadata(proj_cats, api_url, api_key)
+    urls: Set[str] = set()
+    for (project, category), iso3_metadatas in index.items():
+        selected = sorted(iso3 for iso3 in iso3_metadatas
+                          if iso3s is None or iso3 in iso3s)
+        logger.info(f"Mirroring the metadata of {len(selected)} countries "
+                    f"for {project}/{category}")
+        listing_path = mirror_api_path(source_root, project, category)
+        listed = sorted(
+            set(selected) | {
+                iso3
+                for iso3 in _listed_iso3s(listing_path)
+                if iso3 in iso3_metadatas
+            })
+        _write_json(listing_path,
+                    {"data": [{
+                        "iso3": iso3
+                    } for iso3 in listed]})
+        for iso3 in selected:
+            metadatas = iso3_metadatas[iso3]
+            _write_json(mirror_api_path(source_root, project, category, iso3),
+                        {"data": metadatas})
+            urls.update(url for m in metadatas
+                        if popyears is None or m["popyear"] in popyears
+                        for url in m["files"])
+
+    fingerprints_path = os.path.join(source_root, MIRROR_FINGERPRINTS_FILE)
+    fingerprints: Dict[str, Any] = {}
+    if os.path.exists(fingerprints_path):
+        with open(fingerprints_path) as f:
+            fingerprints = json.load(f)
+
+    missing = []
+    if rasters:
+        mirrored = [
+            url for url in sorted(urls)
+            if _is_mirrored(source_root, url, fingerprints)
+        ]
+        # Files replaced on the server since they were mirrored
+        remote = get_fingerprints(mirrored, concurrency=concurrency)
+        changed = {
+            url
+            for url in mirrored
+            if fingerprint_changed(fingerprints[url], remote[url])
+        }
+        missing = sorted(urls - set(mirrored) | changed)
+    logger.info(f"Downloading {len(missing)} files")
+
+    def mirror_file(url: str) -> Dict[str, Any]:
+        return download_file(url, mirror_file_path(source_root, url))
+
+    error: Optional[Exception] = None
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = {executor.submit(mirror_file, url): url for url in missing}
+        try:
+            for future in as_completed(futures):
+                url = futures[future]
+                try:
+                    fingerprints[url] = future.result()
+                except Exception as e:
+                    logger.warning(f"Failed to mirror {url}: {e}")
+                    error = error or e
+        finally:
+            # Keep the fingerprints of the files downloaded before a failure
+            _write_json(fingerprints_path, fingerprints)
+    if error is not None:
+        raise error
+    return missing
@@ -0,0 +1,376 @@
+import logging
+import os
+import xml.etree.ElementTree as ET
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from glob import glob
+from subprocess import CalledProcessError, check_output
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import rasterio
+from affine import Affine
+from pystac import Asset, Collection, MediaType
+from rasterio.windows import Window
+
+from stactools.worldpop.cog import cog_command
+from stactools.worldpop.constants import (
+    COG_NODATA,
+    MOSAIC_WINDOW_SIZE,
+    VRT_MEDIA_TYPE,
+    WORLDPOP_NODATA,
+)
+from stactools.worldpop.profiling import stage
+from stactools.worldpop.stack import GDAL_DATA_TYPES
+from stactools.worldpop.stats import valid_mask
+
+logger = logging.getLogger(__name__)
+
+# Largest relative difference between the resolutions of mosaicked rasters
+RESOLUTION_TOLERANCE = 1e-6
+
+
+@dataclass
+class MosaicSource:
+    """A country raster and its position in the mosaic grid, in pixels."""
+    path: str
+    col_off: int
+    row_off: int
+    width: int
+    height: int
+
+    def overlap(self, window: Window) -> Optional[Tuple[Window, Window]]:
+        """Return the windows of the source and of `window` that overlap,
+        if any."""
+        col_start = max(self.col_off, window.col_off)
+        row_start = max(self.row_off, window.row_off)
+        col_stop = min(self.col_off + self.width,
+                       window.col_off + window.width)
+        row_stop = min(self.row_off + self.height,
+                       window.row_off + window.height)
+        if col_start >= col_stop or row_start >= row_stop:
+            return None
+        width, height = col_stop - col_start, row_stop - row_start
+        return (Window(col_start - self.col_off, row_start - self.row_off,
+                       width, height),
+                Window(col_start - window.col_off, row_start - window.row_off,
+                       width, height))
+
+
+@dataclass
+class MosaicGrid:
+    """The grid of a mosaic and the sources placed on it."""
+    transform: Affine
+    width: int
+    height: int
+    crs: Any
+    dtype: str
+    sources: List[MosaicSource] = field(default_factory=list)
+
+
+def country_asset(iso3: str, path: str) -> str:
+    """Return the name of the data asset of a country COG, or of the folder
+    holding its tiles, without the country prefix, e.g. "f_0_2020"."""
+    name = os.path.basename(path).replace("_cog.tif", "")
+    prefix = f"{iso3.lower()}_"
+    if name.lower().startswith(prefix):
+        name = name[len(prefix):]
+    return name
+
+
+def find_country_cogs(cog_destination: str,
+                      project: str,
+                      category: str,
+                      popyear: str,
+                      asset: Optional[str] = None) -> List[str]:
+    """Return the COGs of all countries of a category and year, as laid out
+    by the populate commands in `cog_destination`.
+
+    The COGs of a GeoTIFF, one or its tiles, are in a folder named after it.
+    Categories with several GeoTIFFs per country, such as the age/sex
+    classes of age structures, need `asset` to pick one of them.
+
+    Args:
+        cog_destination (str): The COG destination of the populate commands.
+        project (str): WorldPop project ID.
+        category (str): WorldPop category ID (member of `project`).
+        popyear (str): Population year.
+        asset (str, optional): Data asset to mosaic, named after its GeoTIFF
+            without the country prefix, e.g. "f_0_2020".
+
+    Raises:
+        ValueError: If `asset` is not given and a country has several data
+            assets, or no COG matches `asset`.
+    """
+    category_folder = os.path.join(cog_destination, project, category)
+    pattern = os.path.join(category_folder, "*", popyear, "**", "*_cog.tif")
+    assets: Dict[Tuple[str, str], List[str]] = defaultdict(list)
+    for path in sorted(glob(pattern, recursive=True)):
+        parts = os.path.relpath(path, category_folder).split(os.sep)
+        iso3 = parts[0]
+        # Folder of the COG or tiles of a GeoTIFF, or a stacked COG
+        assets[(iso3, country_asset(iso3, parts[2]))].append(path)
+
+    if asset is None:
+        iso3s = [iso3 for iso3, _ in assets]
+        if len(iso3s) > len(set(iso3s)):
+            names = sorted({name for _, name in assets})
+            raise ValueError(
+                f"Countries of {category} have several data assets, choose "
+                f"one of: {', '.join(names)}")
+        return sorted(path for paths in assets.values() for path in paths)
+
+    paths = sorted(path for (_, name), asset_paths in assets.items()
+                   if name == asset for path in asset_paths)
+    if not paths:
+        raise ValueError(f"No COGs of {category} {popyear} for {asset}")
+    return paths
+
+
+def mosaic_grid(paths: List[str]) -> MosaicGrid:
+    """Place rasters sharing their resolution and CRS on a common grid.
+
+    Only the headers are read. The grid covers the union of the rasters and
+    is aligned to the first one.
+
+    Raises:
+        ValueError: If the rasters have several bands, or their resolution or
+            CRS differ.
+    """
+    if not paths:
+        raise ValueError("No rasters to mosaic")
+    headers = []
+    for path in paths:
+        with rasterio.open(path) as src:
+            if src.count != 1:
+                raise ValueError(f"Cannot mosaic multi-band raster: {path}")
+            headers.append((path, src.transform, src.width, src.height,
+                            src.crs, src.dtypes[0]))
+    _, first, _, _, crs, dtype = headers[0]
+    res_x, res_y = first.a, first.e
+    for path, transform, _, _, src_crs, _ in headers:
+        if (abs(transform.a - res_x) > abs(res_x) * RESOLUTION_TOLERANCE
+                or abs(transform.e - res_y) > abs(res_y) * RESOLUTION_TOLERANCE
+                or src_crs != crs):
+            raise ValueError(f"Raster grid differs from {paths[0]}: {path}")
+
+    # Snap the origin of every raster to the grid of the first one
+    offsets = [(round(
+        (transform.c - first.c) / res_x), round(
+            (transform.f - first.f) / res_y))
+               for _, transform, _, _, _, _ in headers]
+    min_col = min(col for col, _ in offsets)
+    min_row = min(row for _, row in offsets)
+    sources = [
+        MosaicSource(path, col - min_col, row - min_row, width, height)
+        for (path, _, width, height, _, _), (col,
+                                             row) in zip(headers, offsets)
+    ]
+    return MosaicGrid(
+        transform=first * Affine.translation(min_col, min_row),
+        width=max(s.col_off + s.width for s in sources),
+        height=max(s.row_off + s.height for s in sources),
+        crs=crs,
+        dtype=dtype,
+        sources=sources,
+    )
+
+
+def create_mosaic_vrt(grid: MosaicGrid, vrt_path: str) -> str:
+    """Write a VRT mosaicking the sources of a grid.
+
+    Sources are referenced relative to the VRT. Pixels holding the WorldPop
+    nodata value are transparent, so that countries sharing a border do not
+    hide each other.
+
+    Returns:
+        str: The path to the VRT.
+    """
+    gdal_dtype = GDAL_DATA_TYPES[grid.dtype]
+    root = ET.Element("VRTDataset",
+                      rasterXSize=str(grid.width),
+                      rasterYSize=str(grid.height))
+    ET.SubElement(root, "SRS").text = grid.crs.wkt
+    ET.SubElement(root, "GeoTransform").text = ", ".join(
+        repr(v) for v in grid.transform.to_gdal())
+    band = ET.SubElement(root, "VRTRasterBand", dataType=gdal_dtype, band="1")
+    ET.SubElement(band, "NoDataValue").text = repr(float(COG_NODATA))
+    vrt_dir = os.path.dirname(os.path.abspath(vrt_path))
+    for source in grid.sources:
+        complex_source = ET.SubElement(band, "ComplexSource")
+        ET.SubElement(complex_source, "SourceFilename",
+                      relativeToVRT="1").text = os.path.relpath(
+                          os.path.abspath(source.path), vrt_dir)
+        ET.SubElement(complex_source, "SourceBand").text = "1"
+        ET.SubElement(complex_source,
+                      "SourceProperties",
+                      RasterXSize=str(source.width),
+                      RasterYSize=str(source.height),
+                      DataType=gdal_dtype)
+        ET.SubElement(complex_source,
+                      "SrcRect",
+                      xOff="0",
+                      yOff="0",
+                      xSize=str(source.width),
+                      ySize=str(source.height))
+        ET.SubElement(complex_source,
+                      "DstRect",
+                      xOff=str(source.col_off),
+                      yOff=str(source.row_off),
+                      xSize=str(source.width),
+                      ySize=str(source.height))
+        ET.SubElement(complex_source, "NODATA").text = repr(WORLDPOP_NODATA)
+    ET.ElementTree(root).write(vrt_path)
+    return vrt_path
+
+
+def render_window(grid: MosaicGrid, window: Window) -> Optional[np.ndarray]:
+    """Read the sources overlapping a window of the mosaic.
+
+    Returns:
+        np.ndarray: The window, or None if no source overlaps it.
+    """
+    data: Optional[np.ndarray] = None
+    for source in grid.sources:
+        overlap = source.overlap(window)
+        if overlap is None:
+            continue
+        src_window, dst_window = overlap
+        if data is None:
+            data = np.full((window.height, window.width),
+                           COG_NODATA,
+                           dtype=grid.dtype)
+        # Each read opens its own dataset, they cannot be shared by threads
+        with rasterio.open(source.path) as src:
+            values = src.read(1, window=src_window)
+            nodata = src.nodata
+        valid = valid_mask(values, [nodata, COG_NODATA, WORLDPOP_NODATA])
+        rows = slice(dst_window.row_off,
+                     dst_window.row_off + dst_window.height)
+        cols = slice(dst_window.col_off, dst_window.col_off + dst_window.width)
+        data[rows, cols] = np.where(valid, values, data[rows, cols])
+    return data
+
+
+def render_mosaic(grid: MosaicGrid,
+                  output_path: str,
+                  window_size: int = MOSAIC_WINDOW_SIZE,
+                  workers: Optional[int] = None) -> str:
+    """Render the mosaic of a grid into a tiled GeoTIFF.
+
+    Windows are read in parallel, each from the sources overlapping it only,
+    and written in order. Windows without sources are not written, and read
+    as nodata.
+
+    Args:
+        grid (MosaicGrid): The grid to render.
+        output_path (str): The path to which the GeoTIFF will be written.
+        window_size (int, optional): Size in pixels of the windows rendered
+            by each worker. Should be a multiple of 512.
+        workers (int, optional): Number of threads reading windows. Defaults
+            to the number of CPUs.
+
+    Returns:
+        str: The path to the GeoTIFF.
+    """
+    workers = workers or os.cpu_count() or 1
+    windows = [
+        Window(col, row, min(window_size, grid.width - col),
+               min(window_size, grid.height - row))
+        for row in range(0, grid.height, window_size)
+        for col in range(0, grid.width, window_size)
+    ]
+    profile = {
+        "driver": "GTiff",
+        "dtype": grid.dtype,
+        "count": 1,
+        "width": grid.width,
+        "height": grid.height,
+        "crs": grid.crs,
+        "transform": grid.transform,
+        "nodata": COG_NODATA,
+        "tiled": True,
+        "blockxsize": 512,
+        "blockysize": 512,
+        "compress": "DEFLATE",
+        "zlevel": 1,
+        "BIGTIFF": "IF_SAFER",
+        "SPARSE_OK": True,
+    }
+    logger.info(f"Rendering {len(windows)} windows of the mosaic")
+    with stage("mosaic_render", path=output_path), rasterio.open(
+            output_path, "w",
+            **profile) as dst, ThreadPoolExecutor(workers) as executor:
+        # Render a few windows ahead of the writer only, bounding memory
+        for start in range(0, len(windows), workers * 2):
+            batch = windows[start:start + workers * 2]
+            for window, data in zip(
+                    batch, executor.map(lambda w: render_window(grid, w),
+                                        batch)):
+                if data is not None:
+                    dst.write(data, 1, window=window)
+    return output_path
+
+
+def create_mosaic_cog(grid: MosaicGrid,
+                      output_path: str,
+                      window_size: int = MOSAIC_WINDOW_SIZE,
+                      workers: Optional[int] = None) -> str:
+    """Render the mosaic of a grid into a COG.
+
+    The mosaic is rendered in parallel windows into a temporary GeoTIFF next
+    to the output, then converted like the country COGs.
+
+    Returns:
+        str: The path to the COG.
+    """
+    tmp_path = f"{output_path}.tmp.tif"
+    output = None
+    try:
+        render_mosaic(grid, tmp_path, window_size, workers)
+        cmd = cog_command() + [tmp_path, output_path]
+        with stage("gdal_translate", path=output_path) as record:
+            output = check_output(cmd)
+            record.bytes = os.path.getsize(output_path)
+    except CalledProcessError as e:
+        output = e.output
+        raise
+    finally:
+        logger.info(f"output: {str(output)}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return output_path
+
+
+def add_mosaic_assets(collection: Collection,
+                      popyear: str,
+                      hrefs: List[str],
+                      asset: Optional[str] = None) -> None:
+    """Add the VRT and, if rendered, the COG of a mosaic to a collection.
+
+    Args:
+        collection (Collection): The collection of the country Items.
+        popyear (str): Population year of the mosaic.
+        hrefs (List[str]): Hrefs of the VRT and COG of the mosaic.
+        asset (str, optional): Data asset of the mosaic, for categories with
+            several per country.
+    """
+    name = f"mosaic_{popyear}"
+    title = f"Mosaic of all countries {popyear}"
+    if asset is not None:
+        name = f"mosaic_{asset}"
+        title = f"{title} ({asset})"
+    for href in hrefs:
+        if href.endswith(".vrt"):
+            key = name
+            media_type = VRT_MEDIA_TYPE
+        else:
+            key = f"{name}_cog"
+            media_type = MediaType.COG
+        collection.add_asset(
+            key,
+            Asset(href=os.path.abspath(href),
+                  media_type=media_type,
+                  roles=["data"],
+                  title=title))
@@ -0,0 +1,277 @@
+import json
+import logging
+import math
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from stactools.worldpop.constants import (
+    HEAD_CONCURRENCY,
+    PLAN_COG_RATE,
+    PLAN_COG_RATIO,
+    PLAN_DOWNLOAD_RATE,
+    PLAN_ITEM_SECONDS,
+    PLAN_SOURCE_BYTES_PER_PIXEL,
+    PLAN_UPLOAD_RATE,
+    TILING_PIXEL_SIZE,
+)
+from stactools.worldpop.crawler import crawl_metadata
+from stactools.worldpop.populate import PopulateOptions
+from stactools.worldpop.schedule import lpt_makespan
+from stactools.worldpop.stac import create_collection
+from stactools.worldpop.storage import is_remote
+from stactools.worldpop.tiling import choose_tile_size
+from stactools.worldpop.utils import get_popyears
+from stactools.worldpop.work import WorkUnit, fetch_sizes, list_work_units
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Calibration:
+    """Throughputs and ratios used to estimate a run.
+
+    Attributes:
+        download_rate (float): Bytes downloaded per second by one worker.
+        cog_rate (float): COG bytes written per second by gdal_translate.
+        upload_rate (float): Bytes uploaded per second, when COGs are written
+            to an object store.
+        cog_ratio (float): Size of the COGs over the size of their sources.
+        item_seconds (float): Seconds to create one Item.
+        source_bytes_per_pixel (float): Bytes per pixel of the compressed
+            source GeoTIFFs, used to estimate their dimensions.
+    """
+    download_rate: float = PLAN_DOWNLOAD_RATE
+    cog_rate: float = PLAN_COG_RATE
+    upload_rate: float = PLAN_UPLOAD_RATE
+    cog_ratio: float = PLAN_COG_RATIO
+    item_seconds: float = PLAN_ITEM_SECONDS
+    source_bytes_per_pixel: float = PLAN_SOURCE_BYTES_PER_PIXEL
+
+    @classmethod
+    def from_profile_logs(cls, paths: List[str]) -> "Calibration":
+        """Measure the calibration in the `--profile-log` files of previous
+        runs. Values without successful stage records keep their defaults.
+        """
+        totals: Dict[str, Dict[str, float]] = {}
+        for path in paths:
+            with open(path) as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    record = json.loads(line)
+                    if record.get("error") is not None:
+                        continue
+                    total = totals.setdefault(record["stage"], {
+                        "calls": 0,
+                        "seconds": 0.0,
+                        "bytes": 0
+                    })
+                    total["calls"] += 1
+                    total["seconds"] += record["seconds"]
+                    total["bytes"] += record["bytes"]
+
+        def rate(stage: str) -> Optional[float]:
+            total = totals.get(stage)
+            if total is None or total["seconds"] <= 0 or total["bytes"] <= 0:
+                return None
+            return total["bytes"] / total["seconds"]
+
+        calibration = cls()
+        for attribute, stage in [("download_rate", "download"),
+                                 ("cog_rate", "gdal_translate"),
+                                 ("upload_rate", "upload")]:
+            value = rate(stage)
+            if value is not None:
+                setattr(calibration, attribute, value)
+        if rate("download") is not None and rate("gdal_translate"):
+            calibration.cog_ratio = (totals["gdal_translate"]["bytes"] /
+                                     totals["download"]["bytes"])
+        if "header_read" in totals:
+            header_read = totals["header_read"]
+            calibration.item_seconds = (header_read["seconds"] /
+                                        header_read["calls"])
+        logger.info(f"Calibration from {len(paths)} profile logs: "
+                    f"{calibration}")
+        return calibration
+
+
+@dataclass
+class RunEstimate:
+    """Estimated requirements of populating collections.
+
+    Attributes:
+        collection (str): The collection, or "total".
+        units (int): Number of country/years.
+        unknown_sizes (int): Files whose size the server did not report,
+            left out of the byte counts.
+        download_bytes (int): Bytes of source GeoTIFFs to download.
+        temp_disk_peak (int): Largest local disk used at once by temporary
+            downloads and COGs staged for upload.
+        cog_bytes (int): Size of the COGs written.
+        tiles (int): Number of COGs written.
+        items (int): Number of Items created.
+        work_seconds (float): Time taken by one worker.
+        wall_seconds (float): Time taken by the given number of workers.
+    """
+    collection: str
+    units: int = 0
+    unknown_sizes: int = 0
+    download_bytes: int = 0
+    temp_disk_peak: int = 0
+    cog_bytes: int = 0
+    tiles: int = 0
+    items: int = 0
+    work_seconds: float = 0.0
+    wall_seconds: float = 0.0
+    task_seconds: List[float] = field(default_factory=list, repr=False)
+    task_disk: List[int] = field(default_factory=list, repr=False)
+
+
+def estimate_tiles(size: int, options: PopulateOptions,
+                   calibration: Calibration) -> int:
+    """Estimate the number of tiles of a source GeoTIFF from its size,
+    assuming a square raster."""
+    if not options.tile:
+        return 1
+    side = math.sqrt(size / calibration.source_bytes_per_pixel)
+    if options.tiling == "adaptive":
+        tile_width, tile_height = choose_tile_size(int(side), int(side))
+    else:
+        tile_width, tile_height = TILING_PIXEL_SIZE
+    return max(1, math.ceil(side / tile_width)) * max(
+        1, math.ceil(side / tile_height))
+
+
+def estimate_run(collection: str, units: List[WorkUnit],
+                 options: PopulateOptions,
+                 calibration: Calibration) -> RunEstimate:
+    """Estimate the requirements of populating a collection with `units`.
+
+    The sizes of the source files must have been fetched, see
+    `work.fetch_sizes`. Each file is downloaded and converted by one worker,
+    so the wall time is the makespan of the files run largest first. Tiles of
+    downloaded files are converted before other files are downloaded, see
+    `populate.unit_tasks`, so also in tiled runs no more files than workers
+    are on disk at once, and the temporary disk peaks when the largest files
+    are processed at once.
+
+    Args:
+        collection (str): Id of the collection.
+        units (List[WorkUnit]): Units of the collection.
+        options (PopulateOptions): Options of the run.
+        calibration (Calibration): Throughputs of previous runs.
+
+    Returns:
+        RunEstimate: The estimated requirements.
+    """
+    estimate = RunEstimate(collection, units=len(units))
+    staged = options.cog_destination is not None and is_remote(
+        options.cog_destination)
+    for unit in units:
+        stacked = options.stack and unit.project == "age_structures"
+        unit_tiles = []
+        for size in unit.file_sizes.values():
+            if size is None:
+                estimate.unknown_sizes += 1
+                size = 0
+            if not options.create_cog:
+                unit_tiles.append(1)
+                continue
+            cog_bytes = int(size * calibration.cog_ratio)
+            tiles = estimate_tiles(size, options, calibration)
+            seconds = (size / calibration.download_rate +
+                       cog_bytes / calibration.cog_rate)
+            if staged:
+                seconds += cog_bytes / calibration.upload_rate
+            estimate.download_bytes += size
+            estimate.cog_bytes += cog_bytes
+            estimate.task_seconds.append(seconds)
+            estimate.task_disk.append(size + (cog_bytes if staged else 0))
+            unit_tiles.append(tiles)
+        if stacked:
+            estimate.tiles += 1
+            items = 1
+        else:
+            estimate.tiles += sum(unit_tiles) if options.create_cog else 0
+            # Items group the tiles of the files of a unit
+            items = max(unit_tiles, default=0)
+        estimate.items += items
+        estimate.task_seconds.append(items * calibration.item_seconds)
+    estimate.work_seconds = sum(estimate.task_seconds)
+    estimate.wall_seconds = lpt_makespan(estimate.task_seconds,
+                                         options.workers)
+    estimate.temp_disk_peak = sum(
+        sorted(estimate.task_disk, reverse=True)[:options.workers])
+    return estimate
+
+
+def total_estimate(estimates: List[RunEstimate]) -> RunEstimate:
+    """Sum the estimates of collections populated one after the other."""
+    total = RunEstimate("total")
+    for estimate in estimates:
+        total.units += estimate.units
+        total.unknown_sizes += estimate.unknown_sizes
+        total.download_bytes += estimate.download_bytes
+        total.cog_bytes += estimate.cog_bytes
+        total.tiles += estimate.tiles
+        total.items += estimate.items
+        total.work_seconds += estimate.work_seconds
+        total.wall_seconds += estimate.wall_seconds
+        total.temp_disk_peak = max(total.temp_disk_peak,
+                                   estimate.temp_disk_peak)
+    return total
+
+
+def format_estimates(estimates: List[RunEstimate]) -> str:
+    """Return estimates as a table."""
+    lines = [
+        f"{'collection':<32}{'units':>7}{'unknown':>8}{'download GB':>12}"
+        f"{'temp GB':>9}{'COG GB':>9}{'tiles':>8}{'items':>8}"
+        f"{'work h':>9}{'wall h':>9}"
+    ]
+    for e in estimates:
+        lines.append(f"{e.collection:<32}{e.units:>7}{e.unknown_sizes:>8}"
+                     f"{e.download_bytes / 1e9:>12.2f}"
+                     f"{e.temp_disk_peak / 1e9:>9.2f}"
+                     f"{e.cog_bytes / 1e9:>9.2f}{e.tiles:>8}{e.items:>8}"
+                     f"{e.work_seconds / 3600:>9.2f}"
+                     f"{e.wall_seconds / 3600:>9.2f}")
+    return "\n".join(lines)
+
+
+def plan_collections(proj_cats: List[Tuple[str, str]],
+                     api_key: str = "",
+                     options: Optional[PopulateOptions] = None,
+                     calibration: Optional[Calibration] = None,
+                     concurrency: int = HEAD_CONCURRENCY) -> List[RunEstimate]:
+    """Estimate the requirements of populating collections, without
+    downloading or writing anything.
+
+    The work lists are crawled from the API and the sizes of their source
+    files fetched with HEAD requests, `concurrency` at once.
+
+    Args:
+        proj_cats (List[Tuple[str, str]]): Projects/categories to plan.
+        api_key (str, optional): A WorldPop API key.
+        options (PopulateOptions, optional): Options of the run.
+        calibration (Calibration, optional): Throughputs of previous runs.
+            Defaults to the `PLAN_*` constants.
+        concurrency (int, optional): Number of HEAD requests at once.
+
+    Returns:
+        List[RunEstimate]: One estimate per collection, then their total.
+    """
+    options = options or PopulateOptions()
+    calibration = calibration or Calibration()
+    index = crawl_metadata(proj_cats,
+                           api_key=api_key,
+                           source_root=options.source_root)
+    estimates = []
+    for project, category in proj_cats:
+        collection = create_collection(project, category)
+        units = list_work_units(project, category, get_popyears(collection),
+                                api_key, index)
+        fetch_sizes(units, concurrency, options.source_root)
+        estimates.append(
+            estimate_run(collection.id, units, options, calibration))
+    return estimates + [total_estimate(estimates)]
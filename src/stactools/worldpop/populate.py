@@ -0,0 +1,943 @@
+import logging
+import math
+import os
+import shutil
+from dataclasses import dataclass, replace
+from pathlib import Path
+from tempfile import mkdtemp
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    cast,
+)
+
+import pystac
+import rasterio
+from pystac import Collection, Item
+from pystac.layout import BestPracticesLayoutStrategy
+from pystac.link import HIERARCHICAL_LINKS, Link
+from pystac.utils import is_absolute_href, make_relative_href
+from rasterio.windows import Window
+
+from stactools.worldpop.checksum import (
+    add_file_fields,
+    forget_checksums,
+    get_checksum,
+)
+from stactools.worldpop.cog import (
+    create_tile_cog,
+    download_create_cog,
+    download_create_stacked_cog,
+    download_tif,
+    tile_windows,
+)
+from stactools.worldpop.constants import UNIT_RETRIES, UNIT_RETRY_BACKOFF
+from stactools.worldpop.failures import FailureReport, UnitFailed, with_retries
+from stactools.worldpop.profiling import stage
+from stactools.worldpop.schedule import Countdown, Task, run_lpt
+from stactools.worldpop.stac import (
+    ItemTemplate,
+    create_collection,
+    create_item,
+)
+from stactools.worldpop.storage import (
+    BackendStacIO,
+    delete,
+    is_remote,
+    read_text,
+    upload_files,
+)
+from stactools.worldpop.sync import (
+    SyncPlan,
+    SyncState,
+    adopt_items,
+    known_fingerprints,
+    plan_sync,
+    unit_key,
+    with_checksums,
+)
+from stactools.worldpop.thumbnail import thumbnail_path
+from stactools.worldpop.tiling import tile_size
+from stactools.worldpop.utils import get_popyears, source_href
+from stactools.worldpop.work import WorkUnit, fetch_sizes, list_work_units
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class PopulateOptions:
+    """Options controlling how the Items of a collection are created.
+
+    Attributes:
+        create_cog (bool): Download and convert GeoTIFFs to COGs.
+        tile (bool): Tile the GeoTIFFs into many smaller COGs.
+        cog_destination (str): The output directory for COGs.
+        statistics (bool): Compute band statistics while creating COGs.
+        footprint (bool): Use a footprint of the valid data as geometry.
+        thumbnail (bool): Render a thumbnail for each COG.
+        source_root (str): Local mirror to read the API and GeoTIFFs from,
+            see `mirror`. Collections are then not validated, as that fetches
+            the remote JSON schemas.
+        stack (bool): Stack the age/sex layers of each iso3/popyear in a
+            single multi-band COG. Only applies to age structures.
+        workers (int): Number of units, files or tiles processed at once,
+            largest first.
+        retries (int): Retries of a failed unit, file or tile before the
+            unit is quarantined in the failures report.
+        retry_backoff (float): Seconds to wait before the first retry,
+            doubled before each of the next ones.
+        tiling (str): Policy picking the size of the tiles, see
+            `tiling.TILING_POLICIES`.
+        block_index (bool): Write a block index sidecar for each COG and add
+            it to the Items, see `blockindex`.
+    """
+    create_cog: bool = False
+    tile: bool = False
+    cog_destination: Optional[str] = None
+    statistics: bool = False
+    footprint: bool = False
+    thumbnail: bool = False
+    source_root: Optional[str] = None
+    stack: bool = False
+    workers: int = 1
+    retries: int = UNIT_RETRIES
+    retry_backoff: float = UNIT_RETRY_BACKOFF
+    tiling: str = "fixed"
+    block_index: bool = False
+
+
+def cog_folder(cog_destination: str, project: str, category: str, iso3: str,
+               popyear: str) -> str:
+    """Return the directory holding the COGs of one iso3/popyear."""
+    return os.path.join(cog_destination, project, category, iso3, popyear)
+
+
+def stacked_cog_path(cog_popyear_folder: str, iso3: str, popyear: str) -> str:
+    """Return the path of the stacked age/sex COG of one iso3/popyear."""
+    return os.path.join(cog_popyear_folder,
+                        f"{iso3.lower()}_agesex_{popyear}_cog.tif")
+
+
+def create_unit_items(project: str, category: str, iso3: str, popyear: str,
+                      metadatas: List[Any],
+                      options: PopulateOptions) -> List[Item]:
+    """Create the Items of one project/category/iso3/popyear.
+
+    When COGs are requested the GeoTIFFs are downloaded and converted first,
+    and one Item is created per tile. Stacked age/sex COGs make one Item.
+
+    Args:
+        project (str): WorldPop project ID.
+        category (str): WorldPop category ID (member of `project`).
+        iso3 (str): ISO3 code for a country.
+        popyear (str): Population year.
+        metadatas (list): List of metadata dicts for `iso3`.
+        options (PopulateOptions): Options controlling Item creation.
+
+    Returns:
+        List[Item]: The created Items, empty if there is no metadata for
+        `popyear`.
+    """
+    # Get the specific metadata for a popyear
+    metadata_popyear = [m for m in metadatas if m["popyear"] == popyear]
+    if len(metadata_popyear) == 0:
+        return []
+    metadata = metadata_popyear[0]
+
+    if not options.create_cog:
+        item = create_item(project,
+                           category,
+                           iso3,
+                           popyear,
+                           metadatas,
+                           footprint=options.footprint,
+                           source_root=options.source_root)
+        return [item] if item is not None else []
+
+    if options.cog_destination is None:
+        raise ValueError("A COG destination is required to create COGs")
+    cog_popyear_folder = cog_folder(options.cog_destination, project, category,
+                                    iso3, popyear)
+    if options.stack and project == "age_structures":
+        if options.tile:
+            raise ValueError("Stacked COGs cannot be tiled")
+        # Stream all age/sex layers into one multi-band COG
+        Path(cog_popyear_folder).mkdir(parents=True, exist_ok=True)
+        access_urls = [
+            source_href(tif_href, options.source_root)
+            for tif_href in metadata["files"]
+        ]
+        cog_href = stacked_cog_path(cog_popyear_folder, iso3, popyear)
+        download_create_stacked_cog(cog_href,
+                                    access_urls,
+                                    statistics=options.statistics,
+                                    thumbnail=options.thumbnail,
+                                    block_index=options.block_index)
+        thumbnail_href = None
+        if options.thumbnail:
+            thumbnail_href = thumbnail_path(cog_href)
+        item = create_item(project,
+                           category,
+                           iso3,
+                           popyear,
+                           metadatas, [cog_href],
+                           footprint=options.footprint,
+                           thumbnail_href=thumbnail_href,
+                           block_index=options.block_index)
+        return [item] if item is not None else []
+
+    # Download GeoTIFFs and create COGs, tiling if requested
+    for tif_href in metadata["files"]:
+        download_create_cog(
+            output_directory=cog_asset_folder(cog_popyear_folder,
+                                              tif_href,
+                                              clear=True),
+            retile=options.tile,
+            access_url=source_href(tif_href, options.source_root),
+            statistics=options.statistics,
+            thumbnail=options.thumbnail,
+            tiling=options.tiling,
+            block_index=options.block_index)
+    return create_cog_items(project, category, iso3, popyear, metadatas,
+                            options)
+
+
+def cog_asset_folder(cog_popyear_folder: str,
+                     tif_href: str,
+                     clear: bool = False) -> str:
+    """Create and return the directory holding the COGs of one GeoTIFF.
+
+    Args:
+        cog_popyear_folder (str): Directory of the COGs of the iso3/popyear.
+        tif_href (str): Href of the GeoTIFF.
+        clear (bool, optional): Remove the COGs of a previous run first, so
+            that those of another tiling are not taken for tiles of this one.
+
+    Returns:
+        str: The directory.
+    """
+    cog_asset_name = os.path.basename(tif_href).replace(".tif", "")
+    folder = os.path.join(cog_popyear_folder, cog_asset_name)
+    if clear:
+        shutil.rmtree(folder, ignore_errors=True)
+    Path(folder).mkdir(parents=True, exist_ok=True)
+    return folder
+
+
+def create_cog_items(project: str, category: str, iso3: str, popyear: str,
+                     metadatas: List[Any],
+                     options: PopulateOptions) -> List[Item]:
+    """Create the Items of one iso3/popyear from its COGs, one per tile."""
+    assert options.cog_destination is not None
+    cog_popyear_folder = cog_folder(options.cog_destination, project, category,
+                                    iso3, popyear)
+    metadata = [m for m in metadatas if m["popyear"] == popyear][0]
+    cog_asset_folders = [
+        cog_asset_folder(cog_popyear_folder, tif_href)
+        for tif_href in metadata["files"]
+    ]
+
+    # Get all (possibly tiled) cog file names, grouped by data asset
+    cog_items_hrefs = [[
+        os.path.join(cog_asset_folder, cog_fname)
+        for cog_fname in sorted(os.listdir(cog_asset_folder))
+        if cog_fname.endswith("_cog.tif")
+    ] for cog_asset_folder in cog_asset_folders]
+    # Transpose list of lists to group by tile instead
+    # See https://stackoverflow.com/questions/6473679/transpose-list-of-lists
+    cog_hrefs_items: List[Any] = list(map(list, zip(*cog_items_hrefs)))
+    # Create an Item for each tile
+    template = ItemTemplate.create(project, category, iso3, popyear, metadatas)
+    if template is None:
+        return []
+    items = []
+    for cog_hrefs in cog_hrefs_items:
+        thumbnail_href = None
+        if options.thumbnail:
+            thumbnail_href = thumbnail_path(min(cog_hrefs))
+        items.append(
+            template.create_item(cog_hrefs,
+                                 options.tile,
+                                 options.footprint,
+                                 thumbnail_href,
+                                 block_index=options.block_index))
+    return items
+
+
+def remove_unit_cogs(project: str, category: str, iso3: str, popyear: str,
+                     options: PopulateOptions) -> None:
+    """Delete the COGs of one iso3/popyear, if any were created."""
+    if options.create_cog and options.cog_destination is not None:
+        delete(
+            cog_folder(options.cog_destination, project, category, iso3,
+                       popyear))
+
+
+def unit_tasks(unit: WorkUnit, options: PopulateOptions,
+               results: Dict[str, List[Item]],
+               failed: Dict[str, UnitFailed]) -> List[Task]:
+    """Split the work of one unit into tasks for `run_lpt`.
+
+    When COGs are created, each file is a task, and each tile of a file is a
+    task once the file is downloaded, so that huge countries are spread over
+    the pool. Tiles start before the files still to download, so that no
+    more files than workers are on local disk at once. The Items of the
+    unit are created by a last task, named after the unit, which stores
+    them in `results`.
+
+    Each task is retried on its own. Once one fails every attempt, the unit
+    is stored in `failed` and its remaining tasks are skipped, but the last
+    task still runs, so that temporary files are removed and the unit is
+    reported.
+
+    Args:
+        unit (WorkUnit): The unit to create Items for.
+        options (PopulateOptions): Options controlling Item creation.
+        results (dict): The Items of each finished unit, by unit key.
+        failed (dict): The error of each failed unit, by unit key.
+
+    Returns:
+        List[Task]: The first tasks of the unit.
+    """
+
+    def attempt(name: str, function: Callable[[], Any]) -> None:
+        if unit.key in failed:
+            return
+        try:
+            with_retries(function, name, options.retries,
+                         options.retry_backoff)
+        except UnitFailed as e:
+            failed[unit.key] = e
+
+    def create_items() -> List[Task]:
+        def run() -> None:
+            results[unit.key] = create_unit_items(unit.project, unit.category,
+                                                  unit.iso3, unit.popyear,
+                                                  unit.metadatas, options)
+
+        attempt(unit.key, run)
+        return []
+
+    stacked = options.stack and unit.project == "age_structures"
+    if (not options.create_cog or stacked
+            or unit.popyear not in [m["popyear"] for m in unit.metadatas]):
+        return [Task(unit.key, unit.size or 1, create_items)]
+
+    assert options.cog_destination is not None
+    cog_popyear_folder = cog_folder(options.cog_destination, unit.project,
+                                    unit.category, unit.iso3, unit.popyear)
+
+    def create_cog_items_task() -> List[Task]:
+        def run() -> None:
+            results[unit.key] = create_cog_items(unit.project, unit.category,
+                                                 unit.iso3, unit.popyear,
+                                                 unit.metadatas, options)
+
+        attempt(unit.key, run)
+        return []
+
+    # Items are cheap to create from the COGs, start them first
+    items_task = Task(unit.key, math.inf, create_cog_items_task, priority=1)
+    unit_countdown = Countdown(len(unit.files), lambda: [items_task])
+
+    def file_task(tif_href: str) -> Task:
+        folder = cog_asset_folder(cog_popyear_folder, tif_href)
+        access_url = source_href(tif_href, options.source_root)
+        name = f"{unit.key}/{os.path.basename(tif_href)}"
+        size = unit.file_sizes.get(tif_href) or 1
+
+        def convert() -> List[Task]:
+            cog_asset_folder(cog_popyear_folder, tif_href, clear=True)
+            attempt(
+                name,
+                lambda: download_create_cog(folder,
+                                            access_url,
+                                            retile=False,
+                                            raise_on_fail=True,
+                                            dry_run=False,
+                                            statistics=options.statistics,
+                                            thumbnail=options.thumbnail,
+                                            block_index=options.block_index))
+            return unit_countdown.done()
+
+        def download_and_split() -> List[Task]:
+            cog_asset_folder(cog_popyear_folder, tif_href, clear=True)
+            tmp_dir = mkdtemp()
+            input_path = ""
+            tiles: List[Tuple[str, Window]] = []
+
+            def download() -> None:
+                nonlocal input_path, tiles
+                input_path = download_tif(access_url, tmp_dir)
+                with rasterio.open(input_path) as src:
+                    width, height = src.width, src.height
+                tiles = tile_windows(width, height,
+                                     tile_size(input_path, options.tiling))
+
+            attempt(name, download)
+            if not tiles:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+                return unit_countdown.done()
+            area = sum(window.width * window.height for _, window in tiles)
+
+            def cleanup() -> List[Task]:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+                return unit_countdown.done()
+
+            file_countdown = Countdown(len(tiles), cleanup)
+
+            def tile_task(suffix: str, window: Window) -> Task:
+                tile_name = os.path.basename(input_path)[:-4] + suffix
+                output_path = os.path.join(folder, f"{tile_name}_cog.tif")
+
+                def convert_tile() -> List[Task]:
+                    attempt(
+                        f"{unit.key}/{tile_name}", lambda: create_tile_cog(
+                            input_path,
+                            output_path,
+                            window,
+                            statistics=options.statistics,
+                            thumbnail=options.thumbnail,
+                            block_index=options.block_index))
+                    return file_countdown.done()
+
+                return Task(f"{unit.key}/{tile_name}",
+                            size * window.width * window.height / area,
+                            convert_tile,
+                            priority=1)
+
+            return [tile_task(suffix, window) for suffix, window in tiles]
+
+        return Task(name, size,
+                    download_and_split if options.tile else convert)
+
+    return [file_task(tif_href) for tif_href in unit.files]
+
+
+def publish_cogs(items: List[Item], staging: str,
+                 cog_destination: str) -> None:
+    """Upload the staged COGs and thumbnails of Items to `cog_destination`
+    and point their assets to the uploaded files, with the checksums taken
+    while uploading them."""
+    files = set()
+    uploaded = []
+    staging = os.path.abspath(staging)
+    for item in items:
+        for key, asset in item.assets.items():
+            path = os.path.abspath(asset.href)
+            if not path.startswith(staging + os.sep):
+                continue
+            href = "/".join([cog_destination.rstrip("/")] +
+                            list(Path(os.path.relpath(path, staging)).parts))
+            files.add((path, href))
+            asset.href = href
+            uploaded.append((item, key, href))
+    upload_files(sorted(files))
+    for item, key, href in uploaded:
+        add_file_fields(item, key, get_checksum(href))
+    forget_checksums(href for _, href in files)
+
+
+def _source_urls(units: List[WorkUnit]) -> List[str]:
+    # Units of a year without files have none
+    return [
+        url for unit in units for m in unit.metadatas
+        if m["popyear"] == unit.popyear for url in m["files"]
+    ]
+
+
+def build_units(
+        units: List[WorkUnit], options: PopulateOptions,
+        failures: FailureReport) -> Iterator[Tuple[WorkUnit, List[Item]]]:
+    """Create the Items of units, yielding them unit by unit.
+
+    When `cog_destination` is in an object store, the COGs of each unit are
+    staged on local disk, uploaded once its Items are created, and removed.
+    The checksums of the files downloaded for a unit are forgotten once the
+    caller is done with it, e.g. once `sync` recorded them.
+    See `_build_units` for the rest.
+    """
+    if options.cog_destination is None or not is_remote(
+            options.cog_destination):
+        try:
+            for unit, items in _build_units(units, options, failures):
+                yield unit, items
+                forget_checksums(_source_urls([unit]))
+        finally:
+            # Including those of failed units
+            forget_checksums(_source_urls(units))
+        return
+
+    staging = mkdtemp()
+    try:
+        staged = replace(options, cog_destination=staging)
+        for unit, items in _build_units(units, staged, failures):
+            publish_cogs(items, staging, options.cog_destination)
+            delete(
+                cog_folder(staging, unit.project, unit.category, unit.iso3,
+                           unit.popyear))
+            yield unit, items
+            forget_checksums(_source_urls([unit]))
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+        forget_checksums(_source_urls(units))
+
+
+def _build_units(
+        units: List[WorkUnit], options: PopulateOptions,
+        failures: FailureReport) -> Iterator[Tuple[WorkUnit, List[Item]]]:
+    """Create the Items of units, yielding them unit by unit.
+
+    With more than one worker, units are split into files and tiles that are
+    processed concurrently, largest first, so that the largest countries do
+    not finish last on their own. Units are then yielded as they finish.
+
+    Failed units, files and tiles are retried with backoff. Units that fail
+    every attempt are not yielded but recorded in `failures`, and the run
+    goes on without them. Units that succeed are removed from `failures`.
+
+    Args:
+        units (List[WorkUnit]): The units to create Items for.
+        options (PopulateOptions): Options controlling Item creation.
+        failures (FailureReport): The report of the quarantined units.
+    """
+    if options.workers <= 1:
+        for i, unit in enumerate(units, start=1):
+            print(f"Creating items for {unit.iso3}/{unit.popyear} "
+                  f"{i}/{len(units)}")
+            try:
+                items = with_retries(
+                    lambda: create_unit_items(
+                        unit.project, unit.category, unit.iso3, unit.popyear,
+                        unit.metadatas, options), unit.key, options.retries,
+                    options.retry_backoff)
+            except UnitFailed as e:
+                failures.record(unit.iso3, unit.popyear, e)
+                continue
+            failures.remove(unit.iso3, unit.popyear)
+            yield unit, items
+        return
+
+    if any(unit.size is None for unit in units):
+        fetch_sizes(units, source_root=options.source_root)
+    results: Dict[str, List[Item]] = {}
+    failed: Dict[str, UnitFailed] = {}
+    by_key = {unit.key: unit for unit in units}
+    tasks = sum([unit_tasks(unit, options, results, failed) for unit in units],
+                [])
+    done = 0
+    for task in run_lpt(tasks, options.workers):
+        if task.name not in by_key:
+            continue
+        done += 1
+        unit = by_key[task.name]
+        if unit.key in failed:
+            failures.record(unit.iso3, unit.popyear, failed.pop(unit.key))
+            results.pop(unit.key, None)
+            continue
+        print(f"Created items for {unit.iso3}/{unit.popyear} "
+              f"{done}/{len(units)}")
+        failures.remove(unit.iso3, unit.popyear)
+        yield unit, results.pop(task.name)
+
+
+def link_dict(link: Link, href: str, owner_href: str) -> Dict[str, Any]:
+    """Return the dict of a link as `Link.to_dict` does, with the href of its
+    target given."""
+    if link.rel in HIERARCHICAL_LINKS and is_absolute_href(href):
+        href = make_relative_href(href, owner_href)
+    link_json: Dict[str, Any] = {"rel": str(link.rel), "href": href}
+    if link.media_type is not None:
+        link_json["type"] = str(link.media_type)
+    if link.title is not None:
+        link_json["title"] = link.title
+    link_json.update(link.extra_fields)
+    return link_json
+
+
+def links_dict(links: List[Link], owner_href: str, collection: Collection,
+               collection_href: str) -> List[Dict[str, Any]]:
+    """Return the dicts of the links of an object of `collection` saved at
+    `owner_href`, taking the href of the collection as given."""
+    links_json = []
+    for link in links:
+        target = link.target
+        if target is collection:
+            href = collection_href
+        elif isinstance(target, str):
+            href = target
+        else:
+            href = link.get_href(transform_href=False) or ""
+        links_json.append(link_dict(link, href, owner_href))
+    return links_json
+
+
+def item_dict(item: Item, collection: Collection,
+              collection_href: str) -> Dict[str, Any]:
+    """Return the dict of an Item of `collection` as `Collection.save` writes
+    it in a relative published collection.
+
+    pystac looks for the target of each non-hierarchical link, e.g. the
+    cite-as DOI, in the whole collection to decide whether to make it
+    relative, and for the self link of the collection among all its links,
+    which makes saving a collection quadratic in its Items. None of those
+    links point into the collection and its href is known, so links are
+    written here instead.
+    """
+    item_href = item.get_self_href()
+    assert item_href is not None
+    links, item.links = item.links, []
+    try:
+        item_json = item.to_dict(include_self_link=False,
+                                 transform_hrefs=False)
+    finally:
+        item.links = links
+    item_json["links"] = links_dict(
+        [link for link in links if link.rel != pystac.RelType.SELF], item_href,
+        collection, collection_href)
+    return item_json
+
+
+def collection_dict(collection: Collection,
+                    collection_href: str) -> Dict[str, Any]:
+    """Return the dict of a collection as `Collection.save_object` writes it.
+
+    pystac looks for the self link of the collection among all its links to
+    write each Item link, which is quadratic in its Items, so links are
+    written here as for `item_dict`.
+    """
+    links, collection.links = collection.links, []
+    try:
+        collection_json = collection.to_dict(include_self_link=False,
+                                             transform_hrefs=False)
+    finally:
+        collection.links = links
+    collection_json["links"] = links_dict(links, collection_href, collection,
+                                          collection_href)
+    return collection_json
+
+
+def save_collection(collection: Collection,
+                    collection_dest: str,
+                    validate: bool = True,
+                    items: Optional[List[Item]] = None) -> None:
+    """Write a collection and its Items to `collection_dest`.
+
+    Args:
+        collection (Collection): The collection to write.
+        collection_dest (str): Directory of the collection.
+        validate (bool, optional): Validate the collection once written.
+        items (List[Item], optional): The Items added to the collection
+            since it was last saved to `collection_dest`, the only ones
+            written then, e.g. to checkpoint a run after each unit. Defaults
+            to writing every Item that was read or added.
+    """
+    if is_remote(collection_dest):
+        # pystac joins urls like a browser, dropping a last segment without /
+        collection_dest = collection_dest.rstrip("/") + "/"
+    with stage("collection_save",
+               collection=collection.id), BackendStacIO() as stac_io:
+        if items is None:
+            collection.normalize_hrefs(collection_dest)
+            # Items loaded by `load_collection` and not read since are
+            # unchanged
+            items = [
+                cast(Item, link.target)
+                for link in collection.get_item_links() if link.is_resolved()
+            ]
+        else:
+            # The hrefs `normalize_hrefs` sets, for the new Items only
+            layout = BestPracticesLayoutStrategy()
+            collection.set_self_href(
+                layout.get_collection_href(collection,
+                                           collection_dest,
+                                           is_root=True))
+            for item in items:
+                item.set_self_href(layout.get_item_href(item, collection_dest))
+        collection_href = collection.get_self_href()
+        assert collection_href is not None
+        for item in items:
+            stac_io.write_text(
+                item.self_href,
+                stac_io.json_dumps(item_dict(item, collection,
+                                             collection_href)))
+        stac_io.write_text(
+            collection_href,
+            stac_io.json_dumps(collection_dict(collection, collection_href)))
+    if validate:
+        with stage("validate", collection=collection.id):
+            collection.validate()
+
+
+def load_collection(project: str, category: str,
+                    destination: str) -> Collection:
+    """Read the collection of a project/category from `destination`, or
+    create it if it was never saved there."""
+    collection = create_collection(project, category)
+    collection_dest = os.path.join(destination, collection.id)
+    collection_path = os.path.join(collection_dest, "collection.json")
+    try:
+        return Collection.from_file(collection_path, stac_io=BackendStacIO())
+    except FileNotFoundError:
+        collection.normalize_hrefs(collection_dest)
+        return collection
+
+
+def save_collection_assets(collection: Collection,
+                           validate: bool = True) -> None:
+    """Write the collection JSON returned by `load_collection` after adding
+    assets to it, leaving its Items untouched."""
+    collection.make_asset_hrefs_relative()
+    collection_path = collection.get_self_href()
+    with stage("collection_save",
+               collection=collection.id), BackendStacIO() as stac_io:
+        if collection_path is not None and read_text(
+                collection_path) is not None:
+            collection.save_object(stac_io=stac_io)
+        else:
+            collection.save(dest_href=os.path.dirname(collection_path or ""),
+                            stac_io=stac_io)
+    if validate:
+        with stage("validate", collection=collection.id):
+            collection.validate()
+
+
+def populate_collection(
+    project: str,
+    category: str,
+    destination: str,
+    api_key: str = "",
+    options: Optional[PopulateOptions] = None,
+    units: Optional[List[WorkUnit]] = None,
+) -> Collection:
+    """Create a collection for one WorldPop project/category and populate it
+    with Items.
+
+    Args:
+        project (str): WorldPop project ID.
+        category (str): WorldPop category ID (member of `project`).
+        destination (str): Directory used to store the STAC collections.
+        api_key (str, optional): A WorldPop API key.
+        options (PopulateOptions, optional): Options controlling Item
+            creation. Defaults to creating Items from the source GeoTIFFs.
+        units (List[WorkUnit], optional): The units to create Items for,
+            e.g. one shard of the work list. Defaults to every unit listed
+            by the WorldPop API.
+
+    Returns:
+        Collection: The populated collection.
+    """
+    options = options or PopulateOptions()
+    collection = create_collection(project, category)
+    collection_dest = os.path.join(destination, collection.id)
+    state = SyncState()
+    failures = FailureReport()
+    validate = options.source_root is None
+
+    if units is None:
+        units = list_work_units(project,
+                                category,
+                                get_popyears(collection),
+                                api_key,
+                                source_root=options.source_root)
+
+    # Populate collection with items
+    for unit, items in build_units(units, options, failures):
+        if len(items) == 0:
+            continue
+        for item in items:
+            collection.add_item(item)
+        state.record(unit.iso3, unit.popyear, unit.metadatas, items)
+
+        # Checkpoint, writing only the Items of this unit
+        state.extents.apply(collection)
+        save_collection(collection, collection_dest, False, items)
+    state.extents.apply(collection)
+    save_collection(collection, collection_dest, validate, [])
+    state.save(collection_dest)
+    failures.save(collection_dest)
+    return collection
+
+
+def sync_collection(
+    project: str,
+    category: str,
+    destination: str,
+    api_key: str = "",
+    options: Optional[PopulateOptions] = None,
+) -> SyncPlan:
+    """Bring an existing collection up to date with the WorldPop API.
+
+    Only units that were added or changed since the collection was populated
+    are built, and the Items of withdrawn units are removed. A collection
+    that does not exist yet is created.
+
+    Args:
+        project (str): WorldPop project ID.
+        category (str): WorldPop category ID (member of `project`).
+        destination (str): Directory used to store the STAC collections.
+        api_key (str, optional): A WorldPop API key.
+        options (PopulateOptions, optional): Options controlling Item
+            creation. Defaults to creating Items from the source GeoTIFFs.
+
+    Returns:
+        SyncPlan: The differences that were applied.
+    """
+    options = options or PopulateOptions()
+    collection = create_collection(project, category)
+    collection_dest = os.path.join(destination, collection.id)
+    collection_path = os.path.join(collection_dest, "collection.json")
+    if read_text(collection_path) is not None:
+        existing = pystac.read_file(collection_path, stac_io=BackendStacIO())
+        if not isinstance(existing, Collection):
+            raise AssertionError(f"Not a STAC Collection: {collection_path}")
+        collection = existing
+    state = SyncState.load(collection_dest)
+    failures = FailureReport.load(collection_dest)
+
+    # The years of the collection's extent are only those of its Items
+    plan = plan_sync(project,
+                     category,
+                     get_popyears(create_collection(project, category)),
+                     state,
+                     api_key,
+                     source_root=options.source_root)
+    if not state.units and read_text(collection_path) is not None:
+        # Populated before the sync state was kept
+        adopt_items(plan, state, list(collection.get_items()))
+    print(f"Sync {collection.id}: {len(plan.added)} added, "
+          f"{len(plan.changed)} changed, {len(plan.removed)} removed, "
+          f"{len(plan.unchanged)} unchanged")
+
+    stale = plan.removed + [
+        unit_key(iso3, popyear) for iso3, popyear in plan.changed
+    ]
+    for key in stale:
+        unit = state.units[key]
+        for item_id in state.remove(key):
+            collection.remove_item(item_id)
+            delete(os.path.join(collection_dest, item_id))
+        remove_unit_cogs(project, category, unit["iso3"], unit["popyear"],
+                         options)
+
+    work_units = []
+    for iso3, popyear in plan.added + plan.changed:
+        fingerprints = plan.fingerprints[unit_key(iso3, popyear)]
+        file_sizes = {url: f["size"] for url, f in fingerprints.items()}
+        sizes = list(file_sizes.values())
+        work_units.append(
+            WorkUnit(project, category, iso3, popyear, plan.metadatas[iso3],
+                     None if None in sizes else sum(sizes), file_sizes))
+    for work_unit, items in build_units(work_units, options, failures):
+        for item in items:
+            collection.add_item(item)
+        state.record(
+            work_unit.iso3, work_unit.popyear, work_unit.metadatas, items,
+            with_checksums(plan.fingerprints[unit_key(work_unit.iso3,
+                                                      work_unit.popyear)]))
+
+    # Record fingerprints of up to date units that did not have them yet
+    for iso3, popyear in plan.unchanged:
+        unit = state.units[unit_key(iso3, popyear)]
+        unit["fingerprints"] = known_fingerprints(
+            unit["fingerprints"], plan.fingerprints[unit_key(iso3, popyear)])
+
+    # Quarantined units that were withdrawn since cannot be retried
+    listed = {
+        unit_key(iso3, popyear)
+        for iso3, popyear in plan.added + plan.changed + plan.unchanged
+    }
+    for key in set(failures.keys()) - listed:
+        failures.units.pop(key)
+
+    state.extents.apply(collection)
+    save_collection(collection, collection_dest, options.source_root is None)
+    state.save(collection_dest)
+    failures.save(collection_dest)
+    return plan
+
+
+def retry_failed(
+    project: str,
+    category: str,
+    destination: str,
+    api_key: str = "",
+    options: Optional[PopulateOptions] = None,
+) -> FailureReport:
+    """Rebuild the units quarantined in the failures report of a collection.
+
+    The Items of the units that succeed are added to the collection, and the
+    units are removed from the report. The other Items are left untouched.
+
+    Args:
+        project (str): WorldPop project ID.
+        category (str): WorldPop category ID (member of `project`).
+        destination (str): Directory used to store the STAC collections.
+        api_key (str, optional): A WorldPop API key.
+        options (PopulateOptions, optional): Options controlling Item
+            creation. Defaults to creating Items from the source GeoTIFFs.
+
+    Returns:
+        FailureReport: The units that are still quarantined.
+    """
+    options = options or PopulateOptions()
+    collection = load_collection(project, category, destination)
+    collection_dest = os.path.join(destination, collection.id)
+    failures = FailureReport.load(collection_dest)
+    if not failures.units:
+        print(f"No failed units in {collection.id}")
+        return failures
+    state = SyncState.load(collection_dest)
+
+    quarantined = set(failures.keys())
+    popyears = get_popyears(create_collection(project, category))
+    units = [
+        unit for unit in list_work_units(project,
+                                         category,
+                                         popyears,
+                                         api_key,
+                                         source_root=options.source_root)
+        if unit_key(unit.iso3, unit.popyear) in quarantined
+    ]
+    listed = {unit_key(unit.iso3, unit.popyear) for unit in units}
+    for key in quarantined - listed:
+        logger.warning(f"{key} is no longer listed by the API, dropping it")
+        failures.units.pop(key)
+
+    # The units may have Items from a run before they were quarantined,
+    # looked up by ID rather than scanning the links for each new Item
+    item_links: Dict[str, Link] = {}
+    for link in collection.get_item_links():
+        link.resolve_stac_object(root=collection.get_root())
+        item_links[cast(Item, link.target).id] = link
+    stale: Set[int] = set()
+    rebuilt: List[Item] = []
+
+    print(f"Retrying {len(units)} failed units of {collection.id}")
+    for unit, items in build_units(units, options, failures):
+        for item in items:
+            if item.id in item_links:
+                link = item_links.pop(item.id)
+                cast(Item, link.target).set_parent(None)
+                stale.add(id(link))
+            collection.add_item(item)
+        rebuilt.extend(items)
+        state.record(unit.iso3, unit.popyear, unit.metadatas, items)
+    collection.links = [
+        link for link in collection.links if id(link) not in stale
+    ]
+
+    state.extents.apply(collection)
+    save_collection(collection,
+                    collection_dest,
+                    options.source_root is None,
+                    items=rebuilt)
+    state.save(collection_dest)
+    failures.save(collection_dest)
+    return failures
@@ -0,0 +1,169 @@
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, Iterator, List, Optional, TextIO
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None  # type: ignore
+
+logger = logging.getLogger(__name__)
+
+
+def _children_cpu_time() -> float:
+    """Return the CPU time used by terminated child processes so far."""
+    if resource is None:
+        return 0.0
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return float(usage.ru_utime + usage.ru_stime)
+
+
+@dataclass
+class StageRecord:
+    """Measurements of one run of a pipeline stage.
+
+    Attributes:
+        stage (str): Name of the stage, e.g. "download".
+        started (float): Unix time the stage started at.
+        seconds (float): Wall time.
+        bytes (int): Bytes read or written, set by the stage.
+        retries (int): Retried requests, set by the stage.
+        subprocess_cpu (float): CPU time of the subprocesses that finished
+            during the stage. Concurrent stages may count each other's.
+        error (str): Name of the exception raised by the stage, if any.
+        labels (dict): Context, such as the url or path processed.
+    """
+    stage: str
+    started: float = 0.0
+    seconds: float = 0.0
+    bytes: int = 0
+    retries: int = 0
+    subprocess_cpu: float = 0.0
+    error: Optional[str] = None
+    labels: Dict[str, str] = field(default_factory=dict)
+
+
+class Profiler:
+    """Collect stage records, optionally writing each as a JSON line."""
+    def __init__(self, log: Optional[TextIO] = None) -> None:
+        self.records: List[StageRecord] = []
+        self._log = log
+        self._lock = threading.Lock()
+
+    def add(self, record: StageRecord) -> None:
+        with self._lock:
+            self.records.append(record)
+            if self._log is not None:
+                self._log.write(json.dumps(asdict(record)) + "\n")
+                self._log.flush()
+
+    def summary(self) -> List[Dict[str, Any]]:
+        """Return the totals of each stage, slowest first."""
+        totals: Dict[str, Dict[str, Any]] = {}
+        for record in self.records:
+            total = totals.setdefault(
+                record.stage, {
+                    "stage": record.stage,
+                    "calls": 0,
+                    "errors": 0,
+                    "seconds": 0.0,
+                    "max_seconds": 0.0,
+                    "bytes": 0,
+                    "retries": 0,
+                    "subprocess_cpu": 0.0,
+                })
+            total["calls"] += 1
+            total["errors"] += record.error is not None
+            total["seconds"] += record.seconds
+            total["max_seconds"] = max(total["max_seconds"], record.seconds)
+            total["bytes"] += record.bytes
+            total["retries"] += record.retries
+            total["subprocess_cpu"] += record.subprocess_cpu
+        return sorted(totals.values(), key=lambda t: -t["seconds"])
+
+    def format_summary(self) -> str:
+        """Return the summary as a table."""
+        lines = [
+            f"{'stage':<18}{'calls':>7}{'errors':>7}{'total s':>10}"
+            f"{'mean s':>9}{'max s':>9}{'MB':>10}{'retries':>8}{'cpu s':>9}"
+        ]
+        for t in self.summary():
+            lines.append(f"{t['stage']:<18}{t['calls']:>7}{t['errors']:>7}"
+                         f"{t['seconds']:>10.2f}"
+                         f"{t['seconds'] / t['calls']:>9.3f}"
+                         f"{t['max_seconds']:>9.3f}{t['bytes'] / 1e6:>10.1f}"
+                         f"{t['retries']:>8}{t['subprocess_cpu']:>9.2f}")
+        return "\n".join(lines)
+
+    def to_prometheus(self, prefix: str = "worldpop") -> str:
+        """Return the totals of each stage in Prometheus text format, e.g.
+        for the textfile collector of the node exporter."""
+        metrics = [
+            ("calls", "calls_total", "Runs of each stage."),
+            ("errors", "errors_total", "Runs of each stage that failed."),
+            ("seconds", "seconds_total", "Wall time spent in each stage."),
+            ("bytes", "bytes_total", "Bytes moved by each stage."),
+            ("retries", "retries_total", "Requests retried by each stage."),
+            ("subprocess_cpu", "subprocess_cpu_seconds_total",
+             "CPU time of the subprocesses of each stage."),
+        ]
+        summary = self.summary()
+        lines = []
+        for key, name, description in metrics:
+            lines.append(f"# HELP {prefix}_stage_{name} {description}")
+            lines.append(f"# TYPE {prefix}_stage_{name} counter")
+            for t in summary:
+                lines.append(f'{prefix}_stage_{name}{{stage="{t["stage"]}"}} '
+                             f"{t[key]}")
+        return "\n".join(lines) + "\n"
+
+
+_profiler: Optional[Profiler] = None
+
+
+def start_profiling(log: Optional[TextIO] = None) -> Profiler:
+    """Start recording stages, and return the profiler recording them."""
+    global _profiler
+    _profiler = Profiler(log)
+    return _profiler
+
+
+def stop_profiling() -> Optional[Profiler]:
+    """Stop recording stages, and return the profiler that recorded them."""
+    global _profiler
+    profiler, _profiler = _profiler, None
+    return profiler
+
+
+@contextmanager
+def stage(name: str, **labels: Any) -> Iterator[StageRecord]:
+    """Measure a pipeline stage while profiling is started.
+
+    The yielded record can be updated with the bytes moved and the retries
+    of the stage. Without a started profiler nothing is measured.
+
+    Args:
+        name (str): Name of the stage.
+        **labels: Context added to the record.
+    """
+    record = StageRecord(name, labels={k: str(v) for k, v in labels.items()})
+    profiler = _profiler
+    if profiler is None:
+        yield record
+        return
+    record.started = time.time()
+    start = time.perf_counter()
+    cpu = _children_cpu_time()
+    try:
+        yield record
+    except BaseException as e:
+        record.error = type(e).__name__
+        raise
+    finally:
+        record.seconds = time.perf_counter() - start
+        record.subprocess_cpu = _children_cpu_time() - cpu
+        profiler.add(record)
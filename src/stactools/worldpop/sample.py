@@ -0,0 +1,257 @@
+import csv
+import logging
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+import numpy as np
+import rasterio
+from pystac import Item
+
+from stactools.worldpop.constants import SAMPLE_CACHE_BYTES, WORLDPOP_NODATA
+from stactools.worldpop.profiling import stage
+from stactools.worldpop.stats import valid_mask
+
+logger = logging.getLogger(__name__)
+
+
+class BlockCache:
+    """Decoded raster blocks, least recently used first out.
+
+    Blocks are keyed by (href, band, block row, block column) and their
+    decoded arrays are kept until `max_bytes` is exceeded, so that points
+    falling in the same block decode it once, including across calls.
+    """
+    def __init__(self, max_bytes: int = SAMPLE_CACHE_BYTES) -> None:
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._blocks: "OrderedDict[Tuple[str, int, int, int], np.ndarray]" = (
+            OrderedDict())
+        self._lock = threading.Lock()
+
+    def get(self, key: Tuple[str, int, int, int]) -> Optional[np.ndarray]:
+        with self._lock:
+            block = self._blocks.get(key)
+            if block is None:
+                self.misses += 1
+                return None
+            self._blocks.move_to_end(key)
+            self.hits += 1
+            return block
+
+    def put(self, key: Tuple[str, int, int, int], block: np.ndarray) -> None:
+        with self._lock:
+            if key in self._blocks:
+                return
+            self._blocks[key] = block
+            self.nbytes += block.nbytes
+            # Keep at least the block just decoded
+            while self.nbytes > self.max_bytes and len(self._blocks) > 1:
+                _, evicted = self._blocks.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+
+    def __len__(self) -> int:
+        return len(self._blocks)
+
+
+@dataclass
+class Samples:
+    """Values sampled at points.
+
+    Attributes:
+        values (np.ndarray): The value at each point, NaN where no Item has
+            data.
+        item_ids (np.ndarray): The id of the Item each value was read from,
+            None where no Item has data.
+    """
+    values: np.ndarray
+    item_ids: np.ndarray
+
+
+def data_asset_href(item: Item, asset: Optional[str] = None) -> str:
+    """Return the absolute href of an Item's data asset, by default the
+    first one.
+
+    Raises:
+        ValueError: If the Item has no such data asset.
+    """
+    if asset is not None:
+        if asset not in item.assets:
+            raise ValueError(f"Item {item.id} has no asset {asset}")
+        href = item.assets[asset].get_absolute_href()
+    else:
+        keys = sorted(key for key, a in item.assets.items()
+                      if "data" in (a.roles or []))
+        if not keys:
+            raise ValueError(f"Item {item.id} has no data asset")
+        href = item.assets[keys[0]].get_absolute_href()
+    if href is None:
+        raise ValueError(f"Item {item.id} has no absolute data asset href")
+    return href
+
+
+def sample_raster(href: str,
+                  lons: np.ndarray,
+                  lats: np.ndarray,
+                  band: int = 1,
+                  cache: Optional[BlockCache] = None) -> np.ndarray:
+    """Sample one raster at points given in its CRS.
+
+    The points are grouped by the block of the raster they fall in, and each
+    block is decoded once, or taken from `cache`.
+
+    Args:
+        href (str): Path or url of the raster.
+        lons (np.ndarray): X coordinates of the points.
+        lats (np.ndarray): Y coordinates of the points.
+        band (int, optional): Band to sample. Defaults to 1.
+        cache (BlockCache, optional): Cache of the decoded blocks.
+
+    Returns:
+        np.ndarray: The float64 value at each point, NaN outside the raster
+        and at nodata pixels, including the WorldPop nodata kept in the
+        pixels of produced COGs.
+    """
+    cache = cache if cache is not None else BlockCache()
+    values = np.full(len(lons), np.nan)
+    with rasterio.open(href) as src:
+        lons = np.asarray(lons, dtype=np.float64)
+        lats = np.asarray(lats, dtype=np.float64)
+        inverse = ~src.transform
+        cols = np.floor(inverse.a * lons + inverse.b * lats +
+                        inverse.c).astype(np.int64)
+        rows = np.floor(inverse.d * lons + inverse.e * lats +
+                        inverse.f).astype(np.int64)
+        inside = np.flatnonzero((cols >= 0) & (cols < src.width) & (rows >= 0)
+                                & (rows < src.height))
+        if not inside.size:
+            return values
+        block_height, block_width = src.block_shapes[band - 1]
+        block_rows = rows[inside] // block_height
+        block_cols = cols[inside] // block_width
+        blocks_per_row = -(-src.width // block_width)
+        block_ids, point_blocks = np.unique(block_rows * blocks_per_row +
+                                            block_cols,
+                                            return_inverse=True)
+        order = np.argsort(point_blocks, kind="stable")
+        bounds = np.searchsorted(point_blocks[order],
+                                 np.arange(len(block_ids) + 1))
+        for index, block_id in enumerate(block_ids):
+            block_row, block_col = divmod(int(block_id), blocks_per_row)
+            key = (href, band, block_row, block_col)
+            block = cache.get(key)
+            if block is None:
+                window = src.block_window(band, block_row, block_col)
+                with stage("block_read", href=href) as record:
+                    data = src.read(band, window=window)
+                    record.bytes = data.nbytes
+                block = data.astype(np.float64)
+                block[~valid_mask(
+                    data, [src.nodatavals[band -
+                                          1], WORLDPOP_NODATA])] = np.nan
+                cache.put(key, block)
+            points = inside[order[bounds[index]:bounds[index + 1]]]
+            values[points] = block[rows[points] - block_row * block_height,
+                                   cols[points] - block_col * block_width]
+    return values
+
+
+def sample_items(items: List[Item],
+                 lons: np.ndarray,
+                 lats: np.ndarray,
+                 asset: Optional[str] = None,
+                 band: int = 1,
+                 cache: Optional[BlockCache] = None) -> Samples:
+    """Sample the data of Items at many points at once.
+
+    Points are routed to the Items whose bbox contains them, from points
+    sorted by longitude so that each Item only looks at its own slice, and
+    each Item's raster is opened once for all of its points. Where the
+    bboxes of Items overlap, e.g. along borders, a point takes the value of
+    the first Item with data there.
+
+    Args:
+        items (List[Item]): Items of one year, in the CRS of the points.
+        lons (np.ndarray): Longitudes of the points.
+        lats (np.ndarray): Latitudes of the points.
+        asset (str, optional): Key of the data asset to sample. Defaults to
+            the first data asset of each Item.
+        band (int, optional): Band to sample, e.g. one age/sex class of a
+            stacked COG. Defaults to 1.
+        cache (BlockCache, optional): Cache of decoded blocks, which may be
+            shared between calls. Defaults to a new cache.
+
+    Returns:
+        Samples: The value at each point and the Item it was read from.
+    """
+    lons = np.asarray(lons, dtype=np.float64)
+    lats = np.asarray(lats, dtype=np.float64)
+    cache = cache if cache is not None else BlockCache()
+    values = np.full(len(lons), np.nan)
+    item_ids = np.full(len(lons), None, dtype=object)
+    order = np.argsort(lons, kind="stable")
+    sorted_lons = lons[order]
+    for item in items:
+        if item.bbox is None:
+            continue
+        west, south, east, north = item.bbox
+        start = np.searchsorted(sorted_lons, west, side="left")
+        stop = np.searchsorted(sorted_lons, east, side="right")
+        candidates = order[start:stop]
+        candidates = candidates[(lats[candidates] >= south)
+                                & (lats[candidates] <= north)
+                                & np.isnan(values[candidates])]
+        if not candidates.size:
+            continue
+        sampled = sample_raster(data_asset_href(item, asset), lons[candidates],
+                                lats[candidates], band, cache)
+        found = ~np.isnan(sampled)
+        values[candidates[found]] = sampled[found]
+        item_ids[candidates[found]] = item.id
+    logger.info(f"Sampled {len(lons)} points from {len(cache)} cached "
+                f"blocks, {cache.hits} hits and {cache.misses} misses")
+    return Samples(values, item_ids)
+
+
+def sample_csv(items: List[Item],
+               input_path: str,
+               output_path: str,
+               lon_column: str = "lon",
+               lat_column: str = "lat",
+               asset: Optional[str] = None,
+               band: int = 1,
+               cache: Optional[BlockCache] = None) -> Samples:
+    """Sample Items at the points of a CSV table, see `sample_items`.
+
+    The rows are written to `output_path` with the sampled `value`, empty
+    where no Item has data, and the `item` it was read from. Only the
+    coordinates are held in memory, the table is read again to write it.
+
+    Raises:
+        ValueError: If the table has no `lon_column` or `lat_column`.
+    """
+    with open(input_path, newline="") as f:
+        reader = csv.DictReader(f)
+        fieldnames = list(reader.fieldnames or [])
+        for column in [lon_column, lat_column]:
+            if column not in fieldnames:
+                raise ValueError(f"No column {column} in {input_path}")
+        coordinates = np.array(
+            [(float(row[lon_column]), float(row[lat_column]))
+             for row in reader],
+            dtype=np.float64).reshape(-1, 2)
+    samples = sample_items(items, coordinates[:, 0], coordinates[:, 1], asset,
+                           band, cache)
+    with open(input_path, newline="") as f, open(output_path, "w",
+                                                 newline="") as out:
+        writer = csv.DictWriter(out, fieldnames + ["value", "item"])
+        writer.writeheader()
+        for row, value, item_id in zip(csv.DictReader(f), samples.values,
+                                       samples.item_ids):
+            row["value"] = "" if np.isnan(value) else repr(float(value))
+            row["item"] = item_id or ""
+            writer.writerow(row)
+    return samples
@@ -0,0 +1,118 @@
+import heapq
+import logging
+import threading
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Future,
+    ThreadPoolExecutor,
+    wait,
+)
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterator, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Task:
+    """A piece of work with an estimated cost, e.g. one file of a unit.
+
+    Attributes:
+        name (str): Unique name, used to break ties between equal costs.
+        cost (float): Estimated cost, e.g. bytes to process.
+        run (Callable): Does the work and returns follow-up tasks, e.g. the
+            tile windows of a downloaded file, to schedule in turn.
+        priority (int): Tasks of a higher priority start before any of a
+            lower one, whatever their cost, e.g. the tiles of files already
+            downloaded before new downloads.
+    """
+    name: str
+    cost: float
+    run: Callable[[], List["Task"]]
+    priority: int = 0
+
+
+def _sort_key(task: Task) -> Tuple[int, float, str]:
+    return (-task.priority, -task.cost, task.name)
+
+
+def lpt_order(tasks: List[Task]) -> List[Task]:
+    """Sort tasks by priority, then largest first (longest processing time
+    first)."""
+    return sorted(tasks, key=_sort_key)
+
+
+def run_lpt(tasks: List[Task], workers: int) -> Iterator[Task]:
+    """Run tasks on a pool of threads, always starting the largest pending
+    task of the highest priority next.
+
+    Follow-up tasks returned by a task are queued with the others, so huge
+    units can be split once their size is known and keep the pool busy
+    until the end. Each task is yielded, in the calling thread, when it is
+    done. The first failure is raised once the running tasks finish.
+
+    Args:
+        tasks (List[Task]): The tasks to run.
+        workers (int): Number of threads.
+    """
+    queue: List[Tuple[Tuple[int, float, str], int, Task]] = []
+    counter = 0
+
+    def push(task: Task) -> None:
+        nonlocal counter
+        heapq.heappush(queue, (_sort_key(task), counter, task))
+        counter += 1
+
+    for task in tasks:
+        push(task)
+    running: Dict["Future[List[Task]]", Task] = {}
+    with ThreadPoolExecutor(workers) as executor:
+        while queue or running:
+            while queue and len(running) < workers:
+                task = heapq.heappop(queue)[-1]
+                logger.debug(f"Starting {task.name} (cost {task.cost:g})")
+                running[executor.submit(task.run)] = task
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                task = running.pop(future)
+                if future.exception() is not None:
+                    # Let the running tasks finish, but start no new ones
+                    queue.clear()
+                    wait(running)
+                    raise future.exception()  # type: ignore
+                for follow_up in future.result():
+                    push(follow_up)
+                yield task
+
+
+class Countdown:
+    """Thread-safe counter calling a function once it reaches zero.
+
+    Used to run the last step of a unit, e.g. creating its Items, once all
+    its files or tiles are done.
+    """
+    def __init__(self, count: int, then: Callable[[], List[Task]]) -> None:
+        self.count = count
+        self.then = then
+        self._lock = threading.Lock()
+
+    def add(self, count: int) -> None:
+        with self._lock:
+            self.count += count
+
+    def done(self) -> List[Task]:
+        """Count one step done, and return the follow-up tasks of `then` if
+        it was the last one."""
+        with self._lock:
+            self.count -= 1
+            last = self.count == 0
+        return self.then() if last else []
+
+
+def lpt_makespan(costs: List[float], workers: int) -> float:
+    """Return the time taken by `run_lpt` to run tasks of these costs, each
+    started on the least loaded of `workers` as the largest pending one."""
+    loads = [0.0] * max(workers, 1)
+    for cost in sorted(costs, reverse=True):
+        heapq.heapreplace(loads, loads[0] + cost)
+    return max(loads)
@@ -1,6 +1,6 @@
 import logging
 import os
-from typing import Any, List, Union
+from typing import Any, Dict, List, Optional, Tuple, Union
 
 import rasterio
 from pystac import (
@@ -12,12 +12,18 @@ from pystac import (
     SpatialExtent,
     TemporalExtent,
 )
+from pystac.extensions.eo import Band, EOExtension
 from pystac.extensions.item_assets import AssetDefinition, ItemAssetsExtension
 from pystac.extensions.projection import (
     ProjectionExtension,
     SummariesProjectionExtension,
 )
-from pystac.extensions.raster import RasterBand, RasterExtension
+from pystac.extensions.raster import (
+    Histogram,
+    RasterBand,
+    RasterExtension,
+    Statistics,
+)
 from pystac.extensions.scientific import ScientificExtension
 from pystac.item import Item
 from pystac.link import Link
@@ -25,8 +31,11 @@ from pystac.summaries import Summaries
 from pystac.utils import str_to_datetime
 from shapely.geometry import box
 
+from stactools.worldpop.blockindex import block_index_path
+from stactools.worldpop.checksum import add_file_fields, get_checksum
 from stactools.worldpop.constants import (
     API_URL,
+    BLOCK_INDEX_MEDIA_TYPE,
     COLLECTIONS_METADATA,
     KEYWORDS,
     LICENSE,
@@ -34,6 +43,11 @@ from stactools.worldpop.constants import (
     WORLDPOP_EPSG,
     WORLDPOP_EXTENT,
 )
+from stactools.worldpop.footprint import create_footprint
+from stactools.worldpop.profiling import stage
+from stactools.worldpop.stack import band_description
+from stactools.worldpop.stats import read_statistics
+from stactools.worldpop.utils import source_href
 
 logger = logging.getLogger(__name__)
 
@@ -118,13 +132,313 @@ def create_collection(project: str, category: str) -> Collection:
     return collection
 
 
+def create_raster_band(
+        nodata: Optional[float], dtype: Any,
+        band_statistics: Optional[Dict[str, Any]]) -> RasterBand:
+    """Returns the raster band of an asset, with its statistics if any."""
+    sampling: Any = "area"
+    rast_band = RasterBand.create(nodata=nodata,
+                                  data_type=dtype,
+                                  sampling=sampling)
+    if band_statistics is not None and band_statistics["count"] > 0:
+        rast_band.statistics = Statistics.create(
+            minimum=band_statistics["minimum"],
+            maximum=band_statistics["maximum"],
+            mean=band_statistics["mean"],
+            stddev=band_statistics["stddev"],
+            valid_percent=band_statistics["valid_percent"])
+        histogram = band_statistics["histogram"]
+        rast_band.histogram = Histogram.create(count=histogram["count"],
+                                               min=histogram["min"],
+                                               max=histogram["max"],
+                                               buckets=histogram["buckets"])
+    return rast_band
+
+
+def read_rasters(
+    tif_hrefs: List[str], read_href: str, statistics: bool
+) -> Tuple[Dict[str, Any], Dict[str, List[Optional[Dict[str, Any]]]], Dict[
+        str, List[str]]]:
+    """Read what the Items need from their rasters, opening each raster once.
+
+    Args:
+        tif_hrefs (List[str]): The data assets of the Item.
+        read_href (str): Where to read the first of `tif_hrefs` from.
+        statistics (bool): Whether to read the statistics and band
+            descriptions of every raster, or only the header of the first.
+
+    Returns:
+        tuple: The header of the first raster, the band statistics of each
+        raster and the band descriptions of each multi-band raster.
+    """
+    header: Dict[str, Any] = {}
+    asset_statistics: Dict[str, List[Optional[Dict[str, Any]]]] = {}
+    asset_bands: Dict[str, List[str]] = {}
+    for index, tif_href in enumerate(
+            tif_hrefs if statistics else tif_hrefs[:1]):
+        href = read_href if index == 0 else tif_href
+        with stage("header_read", href=href), rasterio.open(href) as src:
+            if index == 0:
+                header = {
+                    "bbox": list(src.bounds),
+                    "shape": src.shape,
+                    "transform": list(src.transform),
+                    "wkt": src.crs.wkt,
+                    "epsg": src.meta["crs"].to_epsg(),
+                    "nodata": src.nodata,
+                    "dtype": src.dtypes[0],
+                }
+            if not statistics:
+                continue
+            if src.count == 1:
+                asset_statistics[tif_href] = [read_statistics(src)]
+            else:
+                asset_statistics[tif_href] = [
+                    read_statistics(src, bidx) for bidx in src.indexes
+                ]
+                asset_bands[tif_href] = list(src.descriptions)
+    return header, asset_statistics, asset_bands
+
+
+class ItemTemplate:
+    """The parts of the Items of one project/category/iso3/popyear that do
+    not depend on their rasters.
+
+    They are built once, with the pystac extensions, and copied into each
+    Item, e.g. each tile of a country, which then only gets its own geometry,
+    projection and assets. Items are the same as when built one at a time.
+    """
+    def __init__(self, project: str, category: str, iso3: str, popyear: str,
+                 metadata: Dict[str, Any]) -> None:
+        self.project = project
+        self.category = category
+        self.iso3 = iso3
+        self.popyear = popyear
+        self.metadata = metadata
+        self.datetime = str_to_datetime(f"{popyear}-01-01T00:00:00Z")
+
+        # Item properties
+        self.properties = {
+            "title": metadata["title"],
+            "description": metadata["desc"],
+            "start_datetime": f"{popyear}-01-01T00:00:00Z",
+            "end_datetime": f"{popyear}-12-31T00:00:00Z",
+            "gsd": COLLECTIONS_METADATA[project][category]["gsd"],
+        }
+        item = Item(id="",
+                    geometry=None,
+                    bbox=None,
+                    datetime=self.datetime,
+                    properties=dict(self.properties))
+
+        # Create summary link
+        item.add_link(
+            Link(
+                rel="child",
+                target=metadata["url_summary"],
+                title="Summary Page",
+            ))
+
+        # Incluce scientific information
+        sci_ext = ScientificExtension.ext(item, add_if_missing=True)
+        sci_ext.doi = metadata["doi"]
+        sci_ext.citation = metadata["citation"]
+
+        # Include projection information, the same for all Items
+        proj_ext = ProjectionExtension.ext(item, add_if_missing=True)
+        proj_ext.epsg = WORLDPOP_EPSG
+
+        self.extension_properties = {
+            key: value
+            for key, value in item.properties.items()
+            if key not in self.properties
+        }
+        self.links = item.links
+        self.stac_extensions = item.stac_extensions
+
+    @classmethod
+    def create(cls, project: str, category: str, iso3: str, popyear: str,
+               metadatas: List[Any]) -> Optional["ItemTemplate"]:
+        """Returns the template of the Items of a (project, category, iso3,
+        popyear), or None if there is no metadata for `popyear`."""
+        # Get the specific metadata for a popyear
+        metadata_popyear = [m for m in metadatas if m["popyear"] == popyear]
+        if len(metadata_popyear) == 0:
+            print(
+                f"No metadata found for {project}/{category}/{iso3}/{popyear}")
+            return None
+        return cls(project, category, iso3, popyear, metadata_popyear[0])
+
+    def create_item(self,
+                    cog_hrefs: List[str] = [""],
+                    tiled: bool = False,
+                    footprint: bool = False,
+                    thumbnail_href: Optional[str] = None,
+                    source_root: Optional[str] = None,
+                    block_index: bool = False) -> Item:
+        """Returns a STAC Item from this template, see `create_item`."""
+        project, category = self.project, self.category
+        metadata = self.metadata
+
+        # Use cogs or source tif hrefs
+        if cog_hrefs[0] == "":
+            tif_hrefs = metadata["files"]
+        else:
+            tif_hrefs = cog_hrefs
+        if tiled:
+            tile_id = "_" + "_".join(tif_hrefs[0].split("_")[-3:-1])
+        else:
+            tile_id = ""
+
+        if cog_hrefs[0] == "" and source_root is not None:
+            read_href = source_href(tif_hrefs[0], source_root)
+        else:
+            # Use FTP server because HTTPS server doesn't work with rasterio.open
+            read_href = tif_hrefs[0].replace("https://data", "ftp://ftp")
+
+        # Read band statistics stored in the COGs by `create_cog`, and the
+        # age/sex classes of the bands of stacked COGs
+        header, asset_statistics, asset_bands = read_rasters(
+            tif_hrefs, read_href, cog_hrefs[0] != "")
+        bbox = header["bbox"]
+
+        # Create bbox and geometry
+        epsg = header["epsg"]
+        if epsg != WORLDPOP_EPSG:
+            raise AssertionError(
+                f"Expecting EPSG={WORLDPOP_EPSG} but got EPSG={epsg} for {project}/{category}"
+            )
+        geometry = None
+        if footprint:
+            with stage("footprint", href=read_href):
+                geometry = create_footprint(read_href)
+        if geometry is None:
+            polygon = box(*bbox, ccw=True)
+            coordinates = [list(i) for i in list(polygon.exterior.coords)]
+            geometry = {"type": "Polygon", "coordinates": [coordinates]}
+
+        # Item properties
+        properties = dict(self.properties)
+        band_statistics_list = [
+            stats for stats_list in asset_statistics.values()
+            for stats in stats_list
+        ]
+        if band_statistics_list and all(band_statistics_list):
+            properties["worldpop:total_population"] = sum(
+                stats["sum"] for stats in band_statistics_list
+                if stats is not None)
+        properties.update(self.extension_properties)
+        properties.update({
+            "proj:transform": header["transform"],
+            "proj:bbox": bbox,
+            "proj:wkt2": header["wkt"],
+            "proj:shape": header["shape"],
+        })
+
+        # Create item
+        stac_extensions = list(self.stac_extensions)
+        stac_extensions.append(RasterExtension.get_schema_uri())
+        if asset_bands:
+            stac_extensions.append(EOExtension.get_schema_uri())
+        item = Item(
+            id=f"{self.iso3}_{self.popyear}{tile_id}",
+            geometry=geometry,
+            bbox=bbox,
+            datetime=self.datetime,
+            properties=properties,
+            stac_extensions=stac_extensions,
+        )
+        for link in self.links:
+            item.add_link(link.clone())
+
+        # Include thumbnail
+        item.add_asset(
+            "thumbnail",
+            Asset(
+                href=thumbnail_href or metadata["url_img"],
+                media_type=MediaType.PNG,
+                roles=["thumbnail"],
+                title="WorldPop Thumbnail",
+            ),
+        )
+
+        # Include JSON metadata
+        item.add_asset(
+            "metadata",
+            Asset(
+                href=f"{API_URL}/{project}/{category}?iso3={self.iso3}",
+                media_type=MediaType.JSON,
+                roles=["metadata"],
+                title="WorldPop Metadata",
+            ),
+        )
+
+        # Create data assets
+        for tif_href in sorted(tif_hrefs):
+            try:
+                media_type = {
+                    "tif":
+                    MediaType.COG if cog_hrefs[0] != "" else MediaType.GEOTIFF,
+                    "zip": "application/zip"
+                }[tif_href[-3:].lower()]
+            except KeyError:
+                print(f"Unknown media type for {tif_href}")
+            title = os.path.basename(tif_href)[:-4]
+
+            # Include raster information
+            extra_fields: Dict[str, Any] = {
+                "raster:bands": [
+                    create_raster_band(header["nodata"], header["dtype"],
+                                       band_statistics).to_dict()
+                    for band_statistics in asset_statistics.get(
+                        tif_href, [None])
+                ]
+            }
+
+            # Describe the age/sex class of each band of stacked COGs
+            if tif_href in asset_bands:
+                extra_fields["eo:bands"] = [
+                    Band.create(name=name,
+                                description=band_description(name)).to_dict()
+                    for name in asset_bands[tif_href]
+                ]
+
+            item.add_asset(
+                title,
+                Asset(href=tif_href,
+                      media_type=media_type,
+                      roles=["data"],
+                      title=title,
+                      extra_fields=extra_fields))
+            # Checksums of files hashed while they were mirrored or written
+            add_file_fields(
+                item, title,
+                get_checksum(tif_href,
+                             source_root if cog_hrefs[0] == "" else None))
+
+            # Block offsets written next to the COG by `create_cog`
+            if block_index and cog_hrefs[0] != "":
+                item.add_asset(
+                    f"{title}_blocks",
+                    Asset(href=block_index_path(tif_href),
+                          media_type=BLOCK_INDEX_MEDIA_TYPE,
+                          roles=["index"],
+                          title=f"{title} block index"))
+
+        return item
+
+
 def create_item(project: str,
                 category: str,
                 iso3: str,
                 popyear: str,
                 metadatas: List[Any],
                 cog_hrefs: List[str] = [""],
-                tiled: bool = False) -> Union[Item, None]:
+                tiled: bool = False,
+                footprint: bool = False,
+                thumbnail_href: Optional[str] = None,
+                source_root: Optional[str] = None,
+                block_index: bool = False) -> Union[Item, None]:
     """Returns a STAC Item for a given (project, category, iso3, popyear).
 
     Args:
@@ -134,132 +448,25 @@ def create_item(project: str,
         popyear (str): Population year.
         metadatas (list): List of metadata dicts.
         tif_urls (List[str]): Paths to GeoTIFFs. If "", Item uses original GeoTIFF urls.
+            Statistics stored in the COGs by `create_cog` are added to the
+            raster bands and summed into `worldpop:total_population`. The
+            bands of stacked age/sex COGs are described with the EO
+            extension.
+        tiled (bool): Whether `cog_hrefs` are tiles of a larger raster.
+        footprint (bool): Use a simplified footprint of the valid data as
+            geometry instead of the bounding box.
+        thumbnail_href (str): Path to a thumbnail rendered by `create_cog`.
+            If None, Item uses the WorldPop thumbnail url.
+        source_root (str): Local mirror to read the original GeoTIFFs from.
+            Asset hrefs still point to the original urls, with the
+            `file:checksum` and `file:size` recorded by `mirror`.
+        block_index (bool): Add the block index sidecar written next to each
+            COG by `create_cog` as an asset, see `blockindex.BlockReader`.
     Returns:
         Item: STAC Item object.
     """
-
-    # Get the specific metadata for a popyear
-    metadata_popyear = [m for m in metadatas if m["popyear"] == popyear]
-    if len(metadata_popyear) == 0:
-        print(f"No metadata found for {project}/{category}/{iso3}/{popyear}")
+    template = ItemTemplate.create(project, category, iso3, popyear, metadatas)
+    if template is None:
         return None
-    metadata = metadata_popyear[0]
-
-    # Use cogs or source tif hrefs
-    if cog_hrefs[0] == "":
-        tif_hrefs = metadata["files"]
-    else:
-        tif_hrefs = cog_hrefs
-    if tiled:
-        tile_id = "_" + "_".join(tif_hrefs[0].split("_")[-3:-1])
-    else:
-        tile_id = ""
-
-    # Use FTP server because HTTPS server doesn't work with rasterio.open
-    with rasterio.open(tif_hrefs[0].replace("https://data",
-                                            "ftp://ftp")) as src:
-        bbox = src.bounds
-        shape = src.shape
-        transform = src.transform
-        wkt = src.crs.wkt
-        epsg = src.meta["crs"].to_epsg()
-        nodata = src.nodata
-        dtype = src.dtypes[0]
-
-    # Create bbox and geometry
-    if epsg != WORLDPOP_EPSG:
-        raise AssertionError(
-            f"Expecting EPSG={WORLDPOP_EPSG} but got EPSG={epsg} for {project}/{category}"
-        )
-    polygon = box(*bbox, ccw=True)
-    coordinates = [list(i) for i in list(polygon.exterior.coords)]
-    geometry = {"type": "Polygon", "coordinates": [coordinates]}
-
-    # Item properties
-    properties = {
-        "title": metadata["title"],
-        "description": metadata["desc"],
-        "start_datetime": f"{popyear}-01-01T00:00:00Z",
-        "end_datetime": f"{popyear}-12-31T00:00:00Z",
-        "gsd": COLLECTIONS_METADATA[project][category]["gsd"],
-    }
-
-    # Create item
-    item = Item(
-        id=f"{iso3}_{popyear}{tile_id}",
-        geometry=geometry,
-        bbox=bbox,
-        datetime=str_to_datetime(f"{popyear}, 1, 1"),
-        properties=properties,
-    )
-
-    # Create summary link
-    item.add_link(
-        Link(
-            rel="child",
-            target=metadata["url_summary"],
-            title="Summary Page",
-        ))
-
-    # Include thumbnail
-    item.add_asset(
-        "thumbnail",
-        Asset(
-            href=metadata["url_img"],
-            media_type=MediaType.PNG,
-            roles=["thumbnail"],
-            title="WorldPop Thumbnail",
-        ),
-    )
-
-    # Include JSON metadata
-    item.add_asset(
-        "metadata",
-        Asset(
-            href=f"{API_URL}/{project}/{category}?iso3={iso3}",
-            media_type=MediaType.JSON,
-            roles=["metadata"],
-            title="WorldPop Metadata",
-        ),
-    )
-
-    # Incluce scientific information
-    sci_ext = ScientificExtension.ext(item, add_if_missing=True)
-    sci_ext.doi = metadata["doi"]
-    sci_ext.citation = metadata["citation"]
-
-    # Include projection information
-    proj_ext = ProjectionExtension.ext(item, add_if_missing=True)
-    proj_ext.epsg = epsg
-    proj_ext.transform = transform
-    proj_ext.bbox = bbox
-    proj_ext.wkt2 = wkt
-    proj_ext.shape = shape
-
-    # Create data assets
-    for tif_href in sorted(tif_hrefs):
-        try:
-            media_type = {
-                "tif":
-                MediaType.COG if cog_hrefs[0] != "" else MediaType.GEOTIFF,
-                "zip": "application/zip"
-            }[tif_href[-3:].lower()]
-        except KeyError:
-            print(f"Unknown media type for {tif_href}")
-        title = os.path.basename(tif_href)[:-4]
-        data_asset = Asset(href=tif_href,
-                           media_type=media_type,
-                           roles=["data"],
-                           title=title)
-
-        item.add_asset(title, data_asset)
-
-        # Include raster information
-        sampling: Any = "area"
-        rast_band = RasterBand.create(nodata=nodata,
-                                      data_type=dtype,
-                                      sampling=sampling)
-        rast_ext = RasterExtension.ext(data_asset, add_if_missing=True)
-        rast_ext.bands = [rast_band]
-
-    return item
+    return template.create_item(cog_hrefs, tiled, footprint, thumbnail_href,
+                                source_root, block_index)
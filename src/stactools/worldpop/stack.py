@@ -0,0 +1,135 @@
+import json
+import logging
+import os
+import re
+import xml.etree.ElementTree as ET
+from typing import Any, Dict, List, Optional, Tuple
+
+import rasterio
+
+from stactools.worldpop.constants import STATISTICS_TAG
+
+logger = logging.getLogger(__name__)
+
+# Age/sex layers are named like abw_f_0_2020_constrained_UNadj.tif
+AGE_SEX_PATTERN = re.compile(r"^[a-z]{3}_([fm])_(\d+)_\d{4}", re.IGNORECASE)
+SEXES = {"f": "Female", "m": "Male"}
+# Oldest age class, which is open ended
+MAX_AGE = 80
+GDAL_DATA_TYPES = {
+    "float32": "Float32",
+    "float64": "Float64",
+    "int16": "Int16",
+    "int32": "Int32",
+    "uint8": "Byte",
+    "uint16": "UInt16",
+    "uint32": "UInt32",
+}
+
+
+def age_sex_class(path: str) -> Tuple[str, int]:
+    """Return the sex ("f" or "m") and lower age of an age/sex layer."""
+    match = AGE_SEX_PATTERN.match(os.path.basename(path))
+    if match is None:
+        raise ValueError(f"Not an age/sex layer: {path}")
+    return match.group(1).lower(), int(match.group(2))
+
+
+def band_name(sex: str, age: int) -> str:
+    return f"{sex}_{age}"
+
+
+def band_description(name: str) -> str:
+    """Return a description of the band of an age/sex class, e.g. "f_5"."""
+    sex, age_str = name.split("_")
+    age = int(age_str)
+    if age == 0:
+        ages = "under 1 year"
+    elif age == 1:
+        ages = "1 to 4 years"
+    elif age >= MAX_AGE:
+        ages = f"{age} years and over"
+    else:
+        ages = f"{age} to {age + 4} years"
+    return f"{SEXES[sex]} population aged {ages}"
+
+
+def sort_age_sex_paths(paths: List[str]) -> List[str]:
+    """Sort age/sex layers by sex then age."""
+    return sorted(paths, key=age_sex_class)
+
+
+def create_stack_vrt(
+        input_paths: List[str],
+        vrt_path: str,
+        band_statistics: Optional[List[Dict[str, Any]]] = None) -> str:
+    """Write a VRT stacking single-band rasters as the bands of one raster.
+
+    Each band is described by its age/sex class and, if given, carries the
+    band statistics stored by `create_cog` as band metadata. Nothing is read
+    but the headers, translating the VRT then streams the sources block by
+    block.
+
+    Args:
+        input_paths (List[str]): Paths to the age/sex layers, in band order.
+            They must share their grid.
+        vrt_path (str): Path to which the VRT will be written.
+        band_statistics (List[dict], optional): Statistics of each layer.
+
+    Returns:
+        str: The path to the VRT.
+    """
+    with rasterio.open(input_paths[0]) as src:
+        width, height = src.width, src.height
+        transform = src.transform
+        crs = src.crs
+
+    root = ET.Element("VRTDataset",
+                      rasterXSize=str(width),
+                      rasterYSize=str(height))
+    ET.SubElement(root, "SRS").text = crs.wkt
+    ET.SubElement(root, "GeoTransform").text = ", ".join(
+        repr(v) for v in transform.to_gdal())
+    for index, path in enumerate(input_paths, start=1):
+        with rasterio.open(path) as src:
+            if (src.width, src.height) != (width, height) or (
+                    src.transform != transform or src.crs != crs):
+                raise ValueError(
+                    f"Layer grid differs from {input_paths[0]}: {path}")
+            dtype = src.dtypes[0]
+            nodata = src.nodata
+            block_height, block_width = src.block_shapes[0]
+        gdal_dtype = GDAL_DATA_TYPES[dtype]
+        band = ET.SubElement(root,
+                             "VRTRasterBand",
+                             dataType=gdal_dtype,
+                             band=str(index))
+        ET.SubElement(band,
+                      "Description").text = band_name(*age_sex_class(path))
+        if nodata is not None:
+            ET.SubElement(band, "NoDataValue").text = repr(nodata)
+        if band_statistics is not None:
+            metadata = ET.SubElement(band, "Metadata")
+            ET.SubElement(metadata, "MDI",
+                          key=STATISTICS_TAG).text = (json.dumps(
+                              band_statistics[index - 1]))
+        source = ET.SubElement(band, "SimpleSource")
+        ET.SubElement(source, "SourceFilename",
+                      relativeToVRT="0").text = os.path.abspath(path)
+        ET.SubElement(source, "SourceBand").text = "1"
+        ET.SubElement(source,
+                      "SourceProperties",
+                      RasterXSize=str(width),
+                      RasterYSize=str(height),
+                      DataType=gdal_dtype,
+                      BlockXSize=str(block_width),
+                      BlockYSize=str(block_height))
+        for rect in ["SrcRect", "DstRect"]:
+            ET.SubElement(source,
+                          rect,
+                          xOff="0",
+                          yOff="0",
+                          xSize=str(width),
+                          ySize=str(height))
+    ET.ElementTree(root).write(vrt_path)
+    return vrt_path
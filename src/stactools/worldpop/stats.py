@@ -0,0 +1,200 @@
+import json
+import logging
+import math
+from typing import Any, Dict, Iterable, Optional
+
+import numpy as np
+import rasterio
+
+from stactools.worldpop.constants import (
+    COG_NODATA,
+    HISTOGRAM_BUCKETS,
+    STATISTICS_TAG,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def valid_mask(data: np.ndarray,
+               nodata_values: Iterable[Optional[float]]) -> np.ndarray:
+    """Return a mask of the finite pixels not equal to any nodata value."""
+    valid: np.ndarray = np.isfinite(data)
+    for nodata in nodata_values:
+        if nodata is not None:
+            valid &= data != nodata
+    return valid
+
+
+class StreamingHistogram:
+    """Equal-width histogram whose range grows as new values are seen.
+
+    The range is only ever widened by doubling the bucket width, so buckets
+    of the previous range always merge exactly into buckets of the new one
+    and no value needs to be seen twice.
+    """
+    def __init__(self, count: int = HISTOGRAM_BUCKETS) -> None:
+        if count < 2 or count % 2 != 0:
+            raise ValueError("Histogram bucket count must be an even number")
+        self.count = count
+        self.buckets = np.zeros(count, dtype=np.int64)
+        self.lower: Optional[float] = None
+        self.width = 0.0
+
+    @property
+    def upper(self) -> float:
+        if self.lower is None:
+            raise ValueError("Histogram is empty")
+        return self.lower + self.count * self.width
+
+    def _extend(self, minimum: float, maximum: float) -> None:
+        if self.lower is None:
+            self.lower = minimum
+            self.width = (maximum - minimum) / self.count or 1.0
+            # Make sure the maximum falls inside the last bucket
+            while self.upper <= maximum:
+                self.width *= 2
+            return
+        half = self.count // 2
+        while minimum < self.lower or maximum >= self.upper:
+            merged = self.buckets.reshape(half, 2).sum(axis=1)
+            self.buckets = np.zeros(self.count, dtype=np.int64)
+            if minimum < self.lower:
+                # Grow to the left: old range becomes the upper half
+                self.lower -= self.count * self.width
+                self.buckets[half:] = merged
+            else:
+                # Grow to the right: old range becomes the lower half
+                self.buckets[:half] = merged
+            self.width *= 2
+
+    def update(self, values: np.ndarray) -> None:
+        """Add an array of valid (unmasked, finite) values."""
+        if values.size == 0:
+            return
+        self._extend(float(values.min()), float(values.max()))
+        assert self.lower is not None
+        indices = ((values - self.lower) / self.width).astype(np.int64)
+        np.clip(indices, 0, self.count - 1, out=indices)
+        self.buckets += np.bincount(indices, minlength=self.count)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "min": self.lower,
+            "max": self.upper,
+            "buckets": [int(b) for b in self.buckets],
+        }
+
+
+class BandStatistics:
+    """Accumulates band statistics block by block in a single pass."""
+    def __init__(self, buckets: int = HISTOGRAM_BUCKETS) -> None:
+        self.count = 0
+        self.total = 0
+        self.sum = 0.0
+        self.sum_of_squares = 0.0
+        self.minimum = math.inf
+        self.maximum = -math.inf
+        self.histogram = StreamingHistogram(buckets)
+
+    def update(self, data: np.ndarray,
+               nodata_values: Iterable[Optional[float]]) -> None:
+        """Add a block of pixels, ignoring nodata and non-finite values."""
+        self.total += data.size
+        values = data[valid_mask(data, nodata_values)].astype(np.float64)
+        if values.size == 0:
+            return
+        self.count += values.size
+        self.sum += float(values.sum())
+        self.sum_of_squares += float(np.square(values).sum())
+        self.minimum = min(self.minimum, float(values.min()))
+        self.maximum = max(self.maximum, float(values.max()))
+        self.histogram.update(values)
+
+    def to_dict(self) -> Dict[str, Any]:
+        if self.count == 0:
+            return {"count": 0, "sum": 0.0, "valid_percent": 0.0}
+        mean = self.sum / self.count
+        variance = max(self.sum_of_squares / self.count - mean * mean, 0.0)
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "minimum": self.minimum,
+            "maximum": self.maximum,
+            "mean": mean,
+            "stddev": math.sqrt(variance),
+            "valid_percent": 100.0 * self.count / self.total,
+            "histogram": self.histogram.to_dict(),
+        }
+
+
+def compute_statistics(input_path: str) -> Dict[str, Any]:
+    """Compute statistics for the first band of a raster block by block.
+
+    Both the source nodata value and the nodata value assigned to produced
+    COGs are treated as missing data.
+
+    Args:
+        input_path (str): Path to the input raster.
+
+    Returns:
+        dict: Statistics in the form stored under ``STATISTICS_TAG``.
+    """
+    stats = BandStatistics()
+    with rasterio.open(input_path) as src:
+        nodata_values = [src.nodata, COG_NODATA]
+        for _, window in src.block_windows(1):
+            stats.update(src.read(1, window=window), nodata_values)
+    return stats.to_dict()
+
+
+def copy_with_statistics(input_path: str, output_path: str) -> Dict[str, Any]:
+    """Copy a raster to a GeoTIFF block by block, computing the statistics of
+    its first band from the blocks as they are copied.
+
+    gdal_translate then reads the copy, with the source layout and a fast
+    compression, so the input is decoded once with or without statistics.
+
+    Args:
+        input_path (str): Path to the input raster.
+        output_path (str): Path of the copy.
+
+    Returns:
+        dict: Statistics in the form stored under ``STATISTICS_TAG``.
+    """
+    stats = BandStatistics()
+    with rasterio.open(input_path) as src:
+        nodata_values = [src.nodata, COG_NODATA]
+        profile = dict(src.profile,
+                       driver="GTiff",
+                       compress="deflate",
+                       zlevel=1,
+                       bigtiff="IF_SAFER")
+        with rasterio.open(output_path, "w", **profile) as dst:
+            dst.update_tags(**src.tags())
+            for bidx in src.indexes:
+                dst.update_tags(bidx, **src.tags(bidx))
+            for _, window in src.block_windows(1):
+                data = src.read(window=window)
+                stats.update(data[0], nodata_values)
+                dst.write(data, window=window)
+    return stats.to_dict()
+
+
+def statistics_metadata_option(statistics: Dict[str, Any]) -> str:
+    """Return a ``KEY=VALUE`` string for gdal_translate's ``-mo`` option."""
+    return f"{STATISTICS_TAG}={json.dumps(statistics)}"
+
+
+def read_statistics(src: Any,
+                    bidx: Optional[int] = None) -> Optional[Dict[str, Any]]:
+    """Return the statistics stored in an open rasterio dataset, if any.
+
+    Statistics of the bands of a stacked COG are stored on each band, read
+    them by passing its index as `bidx`.
+    """
+    value = src.tags(bidx or 0).get(STATISTICS_TAG)
+    if value is None:
+        return None
+    statistics: Dict[str, Any] = json.loads(value)
+    return statistics
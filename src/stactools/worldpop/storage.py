@@ -0,0 +1,356 @@
+import hashlib
+import logging
+import mimetypes
+import os
+import shutil
+import threading
+from abc import ABC, abstractmethod
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+import requests
+from pystac.stac_io import DefaultStacIO
+
+from stactools.worldpop.checksum import (
+    HashingReader,
+    StreamHash,
+    record_checksum,
+)
+from stactools.worldpop.constants import (
+    BLOCK_INDEX_MEDIA_TYPE,
+    DOWNLOAD_CHUNK_SIZE,
+    S3_MULTIPART_THRESHOLD,
+    S3_PART_SIZE,
+    S3_PUT_CONCURRENCY,
+    S3_UPLOAD_CONCURRENCY,
+)
+from stactools.worldpop.profiling import stage
+
+try:
+    import boto3
+    from boto3.s3.transfer import TransferConfig
+    from botocore.exceptions import ClientError
+except ImportError:  # pragma: no cover
+    boto3 = None
+
+logger = logging.getLogger(__name__)
+
+MEDIA_TYPES = {
+    ".json": "application/json",
+    ".tif": "image/tiff; application=geotiff; profile=cloud-optimized",
+    ".png": "image/png",
+    ".blocks": BLOCK_INDEX_MEDIA_TYPE,
+}
+
+
+def is_remote(href: str) -> bool:
+    """Return whether an output href is in an object store."""
+    return urlparse(href).scheme == "s3"
+
+
+class Backend(ABC):
+    """Where the COGs and STAC JSON of a run are written.
+
+    Hrefs are local paths for `LocalBackend` and `s3://bucket/key` urls for
+    `S3Backend`, so callers keep joining them with `os.path.join`.
+    """
+    @abstractmethod
+    def put_file(self, path: str, href: str) -> None:
+        """Copy a local file to `href`, recording its checksum as it is
+        read, see `checksum.get_checksum`."""
+
+    @abstractmethod
+    def put_bytes(self, data: bytes, href: str) -> None:
+        """Write `data` to `href`."""
+
+    @abstractmethod
+    def get_bytes(self, href: str) -> Optional[bytes]:
+        """Return the content at `href`, or None if there is none."""
+
+    def get_range(self, href: str, start: int, length: int) -> Optional[bytes]:
+        """Return `length` bytes from `start` of the content at `href`."""
+        data = self.get_bytes(href)
+        return None if data is None else data[start:start + length]
+
+    @abstractmethod
+    def delete_prefix(self, href: str) -> None:
+        """Delete `href` and everything under it."""
+
+
+class LocalBackend(Backend):
+    """Output to the local file system, the default."""
+    def put_file(self, path: str, href: str) -> None:
+        if os.path.abspath(path) == os.path.abspath(href):
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(href)), exist_ok=True)
+        stream_hash = StreamHash()
+        with open(path, "rb") as src, open(href, "wb") as dst:
+            for chunk in iter(lambda: src.read(DOWNLOAD_CHUNK_SIZE), b""):
+                dst.write(chunk)
+                stream_hash.update(chunk)
+        record_checksum(href, stream_hash)
+
+    def put_bytes(self, data: bytes, href: str) -> None:
+        os.makedirs(os.path.dirname(os.path.abspath(href)), exist_ok=True)
+        with open(href, "wb") as f:
+            f.write(data)
+
+    def get_bytes(self, href: str) -> Optional[bytes]:
+        if not os.path.exists(href):
+            return None
+        with open(href, "rb") as f:
+            return f.read()
+
+    def get_range(self, href: str, start: int, length: int) -> Optional[bytes]:
+        if not os.path.exists(href):
+            return None
+        with open(href, "rb") as f:
+            f.seek(start)
+            return f.read(length)
+
+    def delete_prefix(self, href: str) -> None:
+        if os.path.isdir(href):
+            shutil.rmtree(href)
+        elif os.path.exists(href):
+            os.remove(href)
+
+
+def require_boto3() -> None:
+    if boto3 is None:
+        raise ImportError("Writing to S3 requires boto3, install "
+                          "stactools-worldpop[s3]")
+
+
+class S3Backend(Backend):
+    """Output to S3 or an S3-compatible store such as MinIO.
+
+    Files above `multipart_threshold` are uploaded in parts of `part_size`
+    bytes, `concurrency` parts at a time. The endpoint and credentials are
+    read by boto3 from the environment, e.g. `AWS_ENDPOINT_URL`.
+    """
+    def __init__(self,
+                 client: Any = None,
+                 multipart_threshold: int = S3_MULTIPART_THRESHOLD,
+                 part_size: int = S3_PART_SIZE,
+                 concurrency: int = S3_UPLOAD_CONCURRENCY) -> None:
+        require_boto3()
+        self.client = client or boto3.client(
+            "s3", endpoint_url=os.environ.get("AWS_ENDPOINT_URL"))
+        self.transfer_config = TransferConfig(
+            multipart_threshold=multipart_threshold,
+            multipart_chunksize=part_size,
+            max_concurrency=concurrency)
+
+    @staticmethod
+    def split(href: str) -> Tuple[str, str]:
+        """Return the bucket and key of an `s3://` url."""
+        parsed = urlparse(href)
+        return parsed.netloc, parsed.path.lstrip("/")
+
+    @staticmethod
+    def extra_args(href: str) -> Dict[str, str]:
+        content_type = MEDIA_TYPES.get(os.path.splitext(href)[1])
+        if content_type is None:
+            content_type = (mimetypes.guess_type(href)[0]
+                            or "application/octet-stream")
+        return {"ContentType": content_type}
+
+    def put_file(self, path: str, href: str) -> None:
+        bucket, key = self.split(href)
+        with stage("upload", href=href) as record, open(path, "rb") as f:
+            # Parts are read in order, and hashed as they are
+            reader = HashingReader(f)
+            self.client.upload_fileobj(reader,
+                                       bucket,
+                                       key,
+                                       ExtraArgs=self.extra_args(href),
+                                       Config=self.transfer_config)
+            record.bytes = reader.stream_hash.size
+        record_checksum(href, reader.stream_hash)
+
+    def put_bytes(self, data: bytes, href: str) -> None:
+        bucket, key = self.split(href)
+        self.client.put_object(Bucket=bucket,
+                               Key=key,
+                               Body=data,
+                               **self.extra_args(href))
+
+    def get_bytes(self, href: str) -> Optional[bytes]:
+        bucket, key = self.split(href)
+        try:
+            response = self.client.get_object(Bucket=bucket, Key=key)
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ["NoSuchKey", "404"]:
+                return None
+            raise
+        data: bytes = response["Body"].read()
+        return data
+
+    def get_range(self, href: str, start: int, length: int) -> Optional[bytes]:
+        bucket, key = self.split(href)
+        try:
+            response = self.client.get_object(
+                Bucket=bucket,
+                Key=key,
+                Range=f"bytes={start}-{start + length - 1}")
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ["NoSuchKey", "404"]:
+                return None
+            raise
+        data: bytes = response["Body"].read()
+        return data
+
+    def delete_prefix(self, href: str) -> None:
+        bucket, prefix = self.split(href)
+        paginator = self.client.get_paginator("list_objects_v2")
+        # Only the object itself and the objects in it as a folder
+        folder = prefix.rstrip("/") + "/"
+        for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+            keys = [
+                o["Key"] for o in page.get("Contents", [])
+                if o["Key"] == prefix or o["Key"].startswith(folder)
+            ]
+            if keys:
+                self.client.delete_objects(
+                    Bucket=bucket,
+                    Delete={"Objects": [{
+                        "Key": key
+                    } for key in keys]})
+
+
+_backends: Dict[str, Backend] = {}
+_backends_lock = threading.Lock()
+
+
+def get_backend(href: str) -> Backend:
+    """Return the backend writing to `href`, shared by the whole run."""
+    scheme = "s3" if is_remote(href) else "file"
+    with _backends_lock:
+        if scheme not in _backends:
+            _backends[scheme] = S3Backend() if scheme == "s3" else (
+                LocalBackend())
+        return _backends[scheme]
+
+
+def read_text(href: str) -> Optional[str]:
+    """Read a small text file, e.g. a state file, from any backend."""
+    data = get_backend(href).get_bytes(href)
+    return None if data is None else data.decode("utf-8")
+
+
+def read_range(href: str,
+               start: int = 0,
+               length: Optional[int] = None) -> Optional[bytes]:
+    """Read `length` bytes from `start` of a file, or all of it, with a
+    single request. Http(s) urls are read with a Range request.
+
+    Returns:
+        bytes: The content, or None if there is no file at `href`.
+    """
+    if urlparse(href).scheme in ["http", "https"]:
+        headers = {}
+        if length is not None:
+            headers["Range"] = f"bytes={start}-{start + length - 1}"
+        response = requests.get(href, headers=headers)
+        if response.status_code == 404:
+            return None
+        if response.status_code not in [200, 206]:
+            raise AssertionError(
+                f"{response.status_code} code for file: {href}")
+        # Servers may ignore the range and send the whole file
+        if response.status_code == 200 and length is not None:
+            return response.content[start:start + length]
+        return response.content
+    backend = get_backend(href)
+    if length is None:
+        return backend.get_bytes(href)
+    return backend.get_range(href, start, length)
+
+
+def write_text(href: str, text: str) -> None:
+    get_backend(href).put_bytes(text.encode("utf-8"), href)
+
+
+def delete(href: str) -> None:
+    get_backend(href).delete_prefix(href)
+
+
+def upload_files(files: List[Tuple[str, str]],
+                 concurrency: int = S3_PUT_CONCURRENCY) -> None:
+    """Copy local files to their hrefs, several at a time.
+
+    Args:
+        files (list): (local path, href) of each file.
+        concurrency (int, optional): Number of files copied at once. Large
+            files are also split into parts uploaded in parallel.
+    """
+    with ThreadPoolExecutor(concurrency) as executor:
+        for future in [
+                executor.submit(get_backend(href).put_file, path, href)
+                for path, href in files
+        ]:
+            future.result()
+
+
+class BackendStacIO(DefaultStacIO):
+    """StacIO writing STAC JSON to any backend.
+
+    Writes are handed to a pool of writers and waited for by `flush`, so
+    that serializing the next Items overlaps writing the previous ones.
+    Objects whose content did not change since this instance last wrote
+    them are not written again.
+    """
+    def __init__(self, concurrency: int = S3_PUT_CONCURRENCY) -> None:
+        super().__init__()
+        self._executor = ThreadPoolExecutor(concurrency)
+        self._futures: List["Future[None]"] = []
+        self._written: Dict[str, str] = {}
+        self._written_lock = threading.Lock()
+
+    def read_text_from_href(self, href: str) -> str:
+        if not is_remote(href):
+            return super().read_text_from_href(href)
+        text = read_text(href)
+        if text is None:
+            raise FileNotFoundError(href)
+        return text
+
+    def write_text_to_href(self, href: str, txt: str) -> None:
+        remote = is_remote(href)
+        data = txt.encode("utf-8")
+        digest = hashlib.sha256(data).hexdigest()
+        with self._written_lock:
+            # Local files may also have been removed by someone else
+            if self._written.get(href) == digest and (remote
+                                                      or os.path.exists(href)):
+                return
+            self._written[href] = digest
+        if remote:
+            self._futures.append(
+                self._executor.submit(get_backend(href).put_bytes, data, href))
+        else:
+            os.makedirs(os.path.dirname(os.path.abspath(href)), exist_ok=True)
+            self._futures.append(
+                self._executor.submit(super().write_text_to_href, href, txt))
+
+    def flush(self) -> None:
+        """Wait for the pending writes, raising the first error."""
+        futures, self._futures = self._futures, []
+        try:
+            for future in futures:
+                future.result()
+        except Exception:
+            # Let the failed objects be written again by the next save
+            with self._written_lock:
+                self._written.clear()
+            raise
+
+    def __enter__(self) -> "BackendStacIO":
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        try:
+            self.flush()
+        finally:
+            self._executor.shutdown()
@@ -0,0 +1,217 @@
+import json
+import logging
+import os
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+from pystac import Item
+
+from stactools.worldpop.checksum import get_checksum
+from stactools.worldpop.constants import HEAD_CONCURRENCY, SYNC_STATE_FILE
+from stactools.worldpop.extents import CollectionExtents, unit_extent
+from stactools.worldpop.storage import read_text, write_text
+from stactools.worldpop.utils import fingerprint_changed, get_fingerprints
+from stactools.worldpop.work import list_work_units
+
+logger = logging.getLogger(__name__)
+
+
+def unit_key(iso3: str, popyear: str) -> str:
+    """Return the key of one iso3/popyear, which is also its Item id."""
+    return f"{iso3}_{popyear}"
+
+
+class SyncState:
+    """Source files and remote fingerprints of the units in a collection.
+
+    The state is stored next to the collection JSON so that `sync` can tell
+    which units changed without reading the Items or the rasters. It also
+    keeps the extent of each unit, from which `extents` maintains the
+    extents and summaries of the collection.
+    """
+    def __init__(self,
+                 units: Optional[Dict[str, Dict[str, Any]]] = None) -> None:
+        self.units: Dict[str, Dict[str, Any]] = units or {}
+        self._extents: Optional[CollectionExtents] = None
+
+    @property
+    def extents(self) -> CollectionExtents:
+        """The extents and summaries of the units, maintained from here on."""
+        if self._extents is None:
+            self._extents = CollectionExtents(self.units)
+        return self._extents
+
+    @classmethod
+    def load(cls, collection_dest: str) -> "SyncState":
+        text = read_text(os.path.join(collection_dest, SYNC_STATE_FILE))
+        if text is None:
+            return cls()
+        return cls(json.loads(text)["units"])
+
+    def save(self, collection_dest: str) -> None:
+        write_text(os.path.join(collection_dest, SYNC_STATE_FILE),
+                   json.dumps({"units": self.units}, indent=2, sort_keys=True))
+
+    def record(self,
+               iso3: str,
+               popyear: str,
+               metadatas: List[Any],
+               items: List[Item],
+               fingerprints: Optional[Dict[str, Any]] = None) -> None:
+        files = [m["files"] for m in metadatas if m["popyear"] == popyear][0]
+        key = unit_key(iso3, popyear)
+        self.units[key] = {
+            "iso3": iso3,
+            "popyear": popyear,
+            "files": files,
+            "fingerprints": fingerprints or {},
+            "items": [item.id for item in items],
+            "extent": unit_extent(items) if items else None,
+        }
+        if self._extents is not None:
+            self._extents.add(key, self.units[key])
+
+    def remove(self, key: str) -> List[str]:
+        """Forget a unit and return the ids of its Items."""
+        if self._extents is not None:
+            self._extents.remove(key)
+        items: List[str] = self.units.pop(key)["items"]
+        return items
+
+
+@dataclass
+class SyncPlan:
+    """Differences between the WorldPop API and a collection's state.
+
+    Attributes:
+        added (list): (iso3, popyear) of units that are new in the API.
+        changed (list): (iso3, popyear) of units whose files changed.
+        removed (list): Keys of units that were withdrawn from the API.
+        unchanged (list): (iso3, popyear) of units that are up to date.
+        metadatas (dict): API metadata of every iso3, by iso3.
+        fingerprints (dict): Remote fingerprints of every file, by unit key.
+    """
+    added: List[Tuple[str, str]] = field(default_factory=list)
+    changed: List[Tuple[str, str]] = field(default_factory=list)
+    removed: List[str] = field(default_factory=list)
+    unchanged: List[Tuple[str, str]] = field(default_factory=list)
+    metadatas: Dict[str, List[Any]] = field(default_factory=dict)
+    fingerprints: Dict[str, Dict[str, Any]] = field(default_factory=dict)
+
+
+def adopt_items(plan: SyncPlan, state: SyncState, items: List[Item]) -> None:
+    """Record the Items of a collection populated before its sync state was
+    kept, so that they are neither added a second time nor left behind.
+
+    Listed units with Items are moved from `plan.added` to `plan.unchanged`
+    with their current fingerprints, and units that are no longer listed are
+    planned for removal.
+
+    Args:
+        plan (SyncPlan): The plan made against `state`, which is empty.
+        state (SyncState): The state to record the units in.
+        items (List[Item]): The Items of the collection.
+    """
+    unit_items: Dict[str, List[Item]] = {}
+    for item in items:
+        # Item ids are the unit key, followed by the tile for tiled COGs
+        key = "_".join(item.id.split("_")[:2])
+        unit_items.setdefault(key, []).append(item)
+    for iso3, popyear in list(plan.added):
+        key = unit_key(iso3, popyear)
+        if key in unit_items:
+            state.record(iso3, popyear, plan.metadatas[iso3],
+                         unit_items.pop(key), plan.fingerprints[key])
+            plan.added.remove((iso3, popyear))
+            plan.unchanged.append((iso3, popyear))
+    for key in sorted(unit_items):
+        iso3, popyear = key.split("_")
+        state.record(iso3, popyear, [{
+            "popyear": popyear,
+            "files": []
+        }], unit_items[key])
+        plan.removed.append(key)
+
+
+def known_fingerprints(stored: Dict[str, Any],
+                       remote: Dict[str, Any]) -> Dict[str, Any]:
+    """Return the remote fingerprints of files, keeping the stored ones of
+    files whose remote fingerprint is unknown, e.g. after a failed HEAD
+    request."""
+    return {
+        url:
+        (fingerprint if any(value is not None
+                            for value in fingerprint.values()) else stored.get(
+                                url, fingerprint))
+        for url, fingerprint in remote.items()
+    }
+
+
+def with_checksums(fingerprints: Dict[str, Any]) -> Dict[str, Any]:
+    """Add the checksums of the files downloaded while building a unit to
+    their fingerprints, so that the next sync can compare them."""
+    fingerprints = dict(fingerprints)
+    for url, fingerprint in fingerprints.items():
+        checksum = get_checksum(url)
+        if fingerprint.get("checksum") is None and checksum is not None:
+            fingerprints[url] = dict(fingerprint,
+                                     checksum=checksum["checksum"])
+    return fingerprints
+
+
+def plan_sync(project: str,
+              category: str,
+              popyears: List[str],
+              state: SyncState,
+              api_key: str = "",
+              concurrency: int = HEAD_CONCURRENCY,
+              source_root: Optional[str] = None) -> SyncPlan:
+    """Compare the WorldPop API listing with the state of a collection.
+
+    Units whose file urls differ from the state are changed. Otherwise the
+    size and ETag of each file are compared with the recorded ones.
+
+    Args:
+        project (str): WorldPop project ID.
+        category (str): WorldPop category ID (member of `project`).
+        popyears (List[str]): Population years of the collection.
+        state (SyncState): State of the existing collection.
+        api_key (str, optional): A WorldPop API key.
+        concurrency (int, optional): Number of concurrent HEAD requests.
+        source_root (str, optional): Local mirror to read the API and the
+            file fingerprints from.
+
+    Returns:
+        SyncPlan: The units to add, rebuild and remove.
+    """
+    plan = SyncPlan()
+    listed = []
+    for work_unit in list_work_units(project,
+                                     category,
+                                     popyears,
+                                     api_key,
+                                     source_root=source_root):
+        plan.metadatas[work_unit.iso3] = work_unit.metadatas
+        listed.append((work_unit.iso3, work_unit.popyear, work_unit.files))
+
+    # Fetch remote fingerprints concurrently, they are recorded for new and
+    # changed units too so that the next sync can compare against them
+    urls = sorted({url for _, _, files in listed for url in files})
+    remote = get_fingerprints(urls, source_root, concurrency)
+
+    for iso3, popyear, files in listed:
+        key = unit_key(iso3, popyear)
+        plan.fingerprints[key] = {url: remote[url] for url in files}
+        unit = state.units.get(key)
+        if unit is None:
+            plan.added.append((iso3, popyear))
+        elif unit["files"] != files or any(
+                fingerprint_changed(unit["fingerprints"].get(url, {}),
+                                    remote[url]) for url in files):
+            plan.changed.append((iso3, popyear))
+        else:
+            plan.unchanged.append((iso3, popyear))
+
+    listed_keys = {unit_key(iso3, popyear) for iso3, popyear, _ in listed}
+    plan.removed = sorted(set(state.units) - listed_keys)
+    return plan
@@ -0,0 +1,95 @@
+import logging
+import math
+
+import numpy as np
+import rasterio
+
+from stactools.worldpop.constants import (
+    COG_NODATA,
+    THUMBNAIL_COLORS,
+    THUMBNAIL_SIZE,
+    THUMBNAIL_THRESHOLDS,
+    WORLDPOP_NODATA,
+)
+from stactools.worldpop.stats import valid_mask
+
+logger = logging.getLogger(__name__)
+
+
+def thumbnail_path(cog_path: str) -> str:
+    """Return the path of the thumbnail rendered next to a COG."""
+    if cog_path.endswith("_cog.tif"):
+        return cog_path[:-len("_cog.tif")] + "_thumb.png"
+    return cog_path.rsplit(".", 1)[0] + "_thumb.png"
+
+
+def colorize(data: np.ndarray, nodata: float) -> np.ndarray:
+    """Apply the population colour ramp to an array of people per pixel.
+
+    Returns:
+        np.ndarray: RGBA array of shape (4, rows, cols). Nodata is transparent,
+        including the WorldPop nodata kept in the pixels of produced COGs.
+    """
+    lut = np.array(THUMBNAIL_COLORS, dtype=np.uint8)
+    classes = np.digitize(data, THUMBNAIL_THRESHOLDS)
+    rgba: np.ndarray = np.zeros((4, ) + data.shape, dtype=np.uint8)
+    rgba[:3] = np.moveaxis(lut[classes], -1, 0)
+    rgba[3] = np.where(valid_mask(data, [nodata, COG_NODATA, WORLDPOP_NODATA]),
+                       255, 0)
+    return rgba
+
+
+def total_population(data: np.ndarray, nodata: float) -> np.ndarray:
+    """Sum the bands of an array of people per pixel, e.g. of a stacked
+    age/sex COG, keeping pixels without any valid band as nodata."""
+    if data.shape[0] == 1:
+        band: np.ndarray = data[0]
+        return band
+    valid = valid_mask(data, [nodata, COG_NODATA, WORLDPOP_NODATA])
+    total: np.ndarray = np.where(valid, data, 0).sum(axis=0)
+    total[~valid.any(axis=0)] = COG_NODATA
+    return total
+
+
+def create_thumbnail(cog_path: str,
+                     output_path: str,
+                     size: int = THUMBNAIL_SIZE) -> str:
+    """Render a PNG thumbnail of a COG from its lowest resolution overview.
+
+    The bands of multi-band COGs are summed into the total population.
+
+    Args:
+        cog_path (str): Path to the COG.
+        output_path (str): Path to which the PNG will be written.
+        size (int, optional): Largest side of the thumbnail in pixels.
+
+    Returns:
+        str: The path to the thumbnail.
+    """
+    with rasterio.open(cog_path) as src:
+        overviews = src.overviews(1)
+        nodata = src.nodata
+
+    # Open the lowest resolution overview directly so that only its blocks
+    # are read. Rasters without overviews are small enough to read as is.
+    open_kwargs = {}
+    if overviews:
+        open_kwargs["overview_level"] = len(overviews) - 1
+    with rasterio.open(cog_path, **open_kwargs) as src:
+        scale = max(1, math.ceil(max(src.width, src.height) / size))
+        data = src.read(out_shape=(src.count, math.ceil(src.height / scale),
+                                   math.ceil(src.width / scale)))
+    data = total_population(data, nodata)
+
+    logger.info("Writing thumbnail")
+    logger.debug(f"output_path: {output_path}")
+    rgba = colorize(data, nodata)
+    with rasterio.open(output_path,
+                       "w",
+                       driver="PNG",
+                       width=rgba.shape[2],
+                       height=rgba.shape[1],
+                       count=4,
+                       dtype="uint8") as dst:
+        dst.write(rgba)
+    return output_path
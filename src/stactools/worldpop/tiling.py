@@ -0,0 +1,98 @@
+import logging
+import math
+from typing import Tuple
+
+import numpy as np
+import rasterio
+
+from stactools.worldpop.constants import (
+    COG_BLOCK_SIZE,
+    FOOTPRINT_MAX_SIZE,
+    TILE_COMPRESSION_RATIO,
+    TILE_MEMORY_BYTES,
+    TILE_MIN_DENSITY,
+    TILE_TARGET_BYTES,
+    TILING_PIXEL_SIZE,
+)
+from stactools.worldpop.footprint import read_valid_mask
+
+logger = logging.getLogger(__name__)
+
+# Tiling policies selectable with --tiling. "fixed" keeps the historical
+# TILING_PIXEL_SIZE tiles, and so the ids of the tiled Items.
+TILING_POLICIES = ["fixed", "adaptive"]
+
+
+def balanced_length(length: int, max_length: int, block_size: int) -> int:
+    """Return the block-aligned tile length splitting `length` into as few
+    tiles as `max_length` allows, as evenly as the blocks allow."""
+    count = math.ceil(length / max_length)
+    return min(max_length, math.ceil(length / count / block_size) * block_size)
+
+
+def choose_tile_size(width: int,
+                     height: int,
+                     density: float = 1.0,
+                     bytes_per_pixel: int = 4,
+                     target_bytes: int = TILE_TARGET_BYTES,
+                     memory_bytes: int = TILE_MEMORY_BYTES,
+                     block_size: int = COG_BLOCK_SIZE) -> Tuple[int, int]:
+    """Pick the size of the tiles of a raster.
+
+    Nodata pixels compress to almost nothing, so the size of a COG follows
+    its valid pixels: sparse rasters get larger tiles. Tiles are also bounded
+    by the memory used to read one at once. Rasters within both budgets are
+    not split. Otherwise tiles are a multiple of the COG block size, so that
+    only the blocks at the edges of the raster are partial, and are evened
+    out so that the last row and column are not slivers.
+
+    Args:
+        width (int): Width of the raster in pixels.
+        height (int): Height of the raster in pixels.
+        density (float, optional): Fraction of valid pixels.
+        bytes_per_pixel (int, optional): Size of a pixel of all bands.
+        target_bytes (int, optional): Target size of a tile's COG.
+        memory_bytes (int, optional): Largest size of a tile in memory.
+        block_size (int, optional): Block size of the COGs.
+
+    Returns:
+        tuple: Width and height of the tiles in pixels.
+    """
+    max_pixels = min(
+        memory_bytes / bytes_per_pixel,
+        target_bytes / (bytes_per_pixel * TILE_COMPRESSION_RATIO *
+                        max(density, TILE_MIN_DENSITY)))
+    if width * height <= max_pixels:
+        return width, height
+    side = max(block_size,
+               int(math.sqrt(max_pixels)) // block_size * block_size)
+    return (balanced_length(width, side, block_size),
+            balanced_length(height, side, block_size))
+
+
+def estimate_density(src: rasterio.DatasetReader) -> float:
+    """Estimate the fraction of valid pixels of band 1 from a downsampled
+    mask, which may overestimate it along the edges of the data."""
+    factor = max(1, math.ceil(max(src.width, src.height) / FOOTPRINT_MAX_SIZE))
+    mask, _ = read_valid_mask(src, factor)
+    return float(np.mean(mask)) if mask.size else 0.0
+
+
+def tile_size(input_path: str, policy: str = "fixed") -> Tuple[int, int]:
+    """Return the tile size of a raster under a tiling policy.
+
+    Raises:
+        ValueError: If the policy is not one of `TILING_POLICIES`.
+    """
+    if policy == "fixed":
+        return TILING_PIXEL_SIZE
+    if policy != "adaptive":
+        raise ValueError(f"Unknown tiling policy: {policy}")
+    with rasterio.open(input_path) as src:
+        density = estimate_density(src)
+        bytes_per_pixel = sum(np.dtype(dtype).itemsize for dtype in src.dtypes)
+        size = choose_tile_size(src.width, src.height, density,
+                                bytes_per_pixel)
+    logger.info(f"Tiling {input_path} ({density:.0%} valid) in tiles of "
+                f"{size[0]} x {size[1]}")
+    return size
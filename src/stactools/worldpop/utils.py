@@ -1,34 +1,165 @@
 import json
+import logging
 import os
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import Any, List
+from typing import Any, Dict, List, Optional
 from urllib.parse import urlparse
 
 import requests
 from pystac.collection import Collection
 
-from stactools.worldpop.constants import API_URL
+from stactools.worldpop.constants import (
+    API_URL,
+    HEAD_CONCURRENCY,
+    MIRROR_FINGERPRINTS_FILE,
+)
+from stactools.worldpop.profiling import stage
+
+logger = logging.getLogger(__name__)
 
 
 def get_metadata(url: str) -> Any:
     """Return dictionary from JSON file at given path."""
     scheme = urlparse(url).scheme
-    if scheme == "http" or scheme == "https":
-        response = requests.get(url)
-        if response.status_code != 200:
-            raise AssertionError(f"API URL not found: {url}")
-        return response.json()
-    else:
-        if not os.path.exists(url):
-            raise AssertionError(f"File path not found: {url}")
-        with open(url) as f:
-            return json.load(f)
+    with stage("api", url=url) as record:
+        if scheme == "http" or scheme == "https":
+            response = requests.get(url)
+            if response.status_code != 200:
+                raise AssertionError(f"API URL not found: {url}")
+            record.bytes = len(response.content)
+            return response.json()
+        else:
+            if not os.path.exists(url):
+                raise AssertionError(f"File path not found: {url}")
+            record.bytes = os.path.getsize(url)
+            with open(url) as f:
+                return json.load(f)
+
+
+def mirror_api_path(source_root: str,
+                    project: str,
+                    category: str,
+                    iso3: Optional[str] = None) -> str:
+    """Return the path of an API document in a local mirror.
+
+    The iso3 listing of a project/category is stored as
+    `api/{project}/{category}.json` and the metadata of one iso3 as
+    `api/{project}/{category}/{iso3}.json`.
+    """
+    if iso3 is None:
+        return os.path.join(source_root, "api", project, f"{category}.json")
+    return os.path.join(source_root, "api", project, category, f"{iso3}.json")
+
+
+def mirror_file_path(source_root: str, url: str) -> str:
+    """Return the path of a remote file in a local mirror.
+
+    Files are stored as `files/{host}/{path}`, so the urls in the API
+    metadata can be resolved without rewriting them.
+    """
+    parsed = urlparse(url)
+    return os.path.join(source_root, "files", parsed.netloc,
+                        *parsed.path.strip("/").split("/"))
+
+
+def source_href(url: str, source_root: Optional[str] = None) -> str:
+    """Return where to read a remote file from, its mirror copy if any."""
+    if source_root is None:
+        return url
+    return mirror_file_path(source_root, url)
+
+
+def metadata_url(project: str,
+                 category: str,
+                 iso3: str,
+                 api_key: str = "",
+                 source_root: Optional[str] = None) -> str:
+    """Return the API url of the metadata of one project/category/iso3, or
+    its path in the local mirror at `source_root`."""
+    if source_root is not None:
+        return mirror_api_path(source_root, project, category, iso3)
+    url = f"{API_URL}/{project}/{category}?iso3={iso3}"
+    if api_key != "":
+        url += f"&key={api_key}"
+    return url
 
 
-def get_iso3_list(project: str, category: str) -> List[str]:
+def get_remote_fingerprint(url: str) -> Dict[str, Optional[Any]]:
+    """Return the size and ETag of a remote file from a HEAD request."""
+    with stage("head", url=url):
+        response = requests.head(url, allow_redirects=True)
+    if response.status_code != 200:
+        raise AssertionError(f"{response.status_code} code for file: {url}")
+    size = response.headers.get("Content-Length")
+    return {
+        "size": int(size) if size is not None else None,
+        "etag": response.headers.get("ETag"),
+    }
+
+
+def get_fingerprints(
+        urls: List[str],
+        source_root: Optional[str] = None,
+        concurrency: int = HEAD_CONCURRENCY) -> Dict[str, Dict[str, Any]]:
+    """Return the size and ETag of remote files, by url.
+
+    HEAD requests are sent concurrently. With a local mirror, the
+    fingerprints recorded when the files were mirrored are returned instead,
+    and files that were not mirrored have an unknown size and ETag, as do
+    files whose HEAD request failed.
+    """
+    if source_root is not None:
+        path = os.path.join(source_root, MIRROR_FINGERPRINTS_FILE)
+        mirrored = get_metadata(path) if os.path.exists(path) else {}
+        return {
+            url: mirrored.get(url, {
+                "size": None,
+                "etag": None
+            })
+            for url in urls
+        }
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return dict(zip(urls, executor.map(_try_remote_fingerprint, urls)))
+
+
+def _try_remote_fingerprint(url: str) -> Dict[str, Optional[Any]]:
+    # One failed HEAD request must not abort a whole sync or plan
+    try:
+        return get_remote_fingerprint(url)
+    except Exception as e:
+        logger.warning(f"Unknown fingerprint for {url}: {e}")
+        return {"size": None, "etag": None}
+
+
+def fingerprint_changed(stored: Dict[str, Any], remote: Dict[str,
+                                                             Any]) -> bool:
+    """Return whether a file changed since `stored` was recorded, from its
+    current `remote` fingerprint."""
+    # The content decides when both sides know it, e.g. a file mirrored
+    # again with a new ETag but the same bytes is unchanged
+    if stored.get("checksum") and remote.get("checksum"):
+        return bool(stored["checksum"] != remote["checksum"])
+    # Only compare what both sides know about, so that units recorded
+    # without fingerprints, or after a failed HEAD request, are adopted
+    # instead of rebuilt
+    return any(
+        stored.get(key) is not None and stored[key] != value
+        for key, value in remote.items() if value is not None)
+
+
+def get_iso3_list(project: str,
+                  category: str,
+                  source_root: Optional[str] = None) -> List[str]:
     """Return a list of ISO3 country codes contained in a dataset/subset."""
+    if source_root is not None:
+        data = get_metadata(mirror_api_path(source_root, project,
+                                            category))["data"]
+        return list(sorted(set([d["iso3"] for d in data])))
     url = f"{API_URL}/{project}/{category}"
-    response = requests.get(url)
+    with stage("api", url=url) as record:
+        response = requests.get(url)
+        record.bytes = len(response.content)
     if response.status_code != 200:
         raise AssertionError(f"{response.status_code} code from API: {url}")
     data = response.json()["data"]
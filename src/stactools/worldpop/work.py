@@ -0,0 +1,135 @@
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+from stactools.worldpop.constants import HEAD_CONCURRENCY
+from stactools.worldpop.crawler import MetadataIndex, crawl_metadata
+from stactools.worldpop.utils import get_fingerprints
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class WorkUnit:
+    """One project/category/iso3/popyear to create Items for.
+
+    Attributes:
+        project (str): WorldPop project ID.
+        category (str): WorldPop category ID (member of `project`).
+        iso3 (str): ISO3 code for a country.
+        popyear (str): Population year.
+        metadatas (list): List of metadata dicts for `iso3`.
+        size (int): Total size of the source files in bytes, if known.
+        file_sizes (dict): Size of each source file in bytes, if known.
+    """
+    project: str
+    category: str
+    iso3: str
+    popyear: str
+    metadatas: List[Any] = field(default_factory=list, repr=False)
+    size: Optional[int] = None
+    file_sizes: Dict[str, Optional[int]] = field(default_factory=dict,
+                                                 repr=False)
+
+    @property
+    def key(self) -> str:
+        return f"{self.project}/{self.category}/{self.iso3}/{self.popyear}"
+
+    @property
+    def files(self) -> List[str]:
+        files: List[str] = [
+            m["files"] for m in self.metadatas if m["popyear"] == self.popyear
+        ][0]
+        return files
+
+
+def list_work_units(project: str,
+                    category: str,
+                    popyears: List[str],
+                    api_key: str = "",
+                    index: Optional[MetadataIndex] = None,
+                    source_root: Optional[str] = None) -> List[WorkUnit]:
+    """Return the units of one project/category listed by the WorldPop API.
+
+    Args:
+        project (str): WorldPop project ID.
+        category (str): WorldPop category ID (member of `project`).
+        popyears (List[str]): Population years of the collection.
+        api_key (str, optional): A WorldPop API key.
+        index (MetadataIndex, optional): Metadata already crawled for
+            `project`/`category`. Defaults to crawling the API.
+        source_root (str, optional): Local mirror to read the API from.
+
+    Returns:
+        List[WorkUnit]: Units in iso3 then popyear order.
+    """
+    if index is None:
+        index = crawl_metadata([(project, category)],
+                               api_key=api_key,
+                               source_root=source_root)
+    units = []
+    for iso3, metadatas in sorted(index[(project, category)].items()):
+        listed = {m["popyear"] for m in metadatas}
+        units += [
+            WorkUnit(project, category, iso3, popyear, metadatas)
+            for popyear in popyears if popyear in listed
+        ]
+    return units
+
+
+def fetch_sizes(units: List[WorkUnit],
+                concurrency: int = HEAD_CONCURRENCY,
+                source_root: Optional[str] = None) -> List[WorkUnit]:
+    """Set the size of each unit from HEAD requests on its source files."""
+    urls = sorted({url for unit in units for url in unit.files})
+    fingerprints = get_fingerprints(urls, source_root, concurrency)
+    for unit in units:
+        unit.file_sizes = {
+            url: fingerprints[url]["size"]
+            for url in unit.files
+        }
+        unit.size = sum(size or 0 for size in unit.file_sizes.values())
+    return units
+
+
+def parse_shard(shard: str) -> Tuple[int, int]:
+    """Parse a shard given as "i/N" into (i, N), with 1 <= i <= N."""
+    try:
+        index, count = (int(part) for part in shard.split("/"))
+    except ValueError:
+        raise ValueError(f"Shard must be given as i/N: {shard}")
+    if not 1 <= index <= count:
+        raise ValueError(f"Shard index must be between 1 and {count}: {shard}")
+    return index, count
+
+
+def partition(units: List[WorkUnit], count: int) -> List[List[WorkUnit]]:
+    """Split units into `count` shards of balanced total size.
+
+    Units are assigned largest first to the shard with the smallest total
+    (longest processing time first). Ties are broken by unit key and shard
+    index, so every node computes the same partition from the same listing.
+    Units of unknown size count as one byte.
+    """
+    shards: List[List[WorkUnit]] = [[] for _ in range(count)]
+    totals = [0] * count
+    for unit in sorted(units, key=lambda u: (-(u.size or 1), u.key)):
+        index = totals.index(min(totals))
+        shards[index].append(unit)
+        totals[index] += unit.size or 1
+    for shard in shards:
+        shard.sort(key=lambda u: u.key)
+    return shards
+
+
+def select_shard(units: List[WorkUnit],
+                 shard: str,
+                 concurrency: int = HEAD_CONCURRENCY,
+                 source_root: Optional[str] = None) -> List[WorkUnit]:
+    """Return the units of shard "i/N" of the full work list."""
+    index, count = parse_shard(shard)
+    fetch_sizes(units, concurrency, source_root)
+    selected = partition(units, count)[index - 1]
+    logger.info(f"Shard {shard}: {len(selected)} of {len(units)} units, "
+                f"{sum(u.size or 0 for u in selected)} bytes")
+    return selected
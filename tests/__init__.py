@@ -1,3 +1,119 @@
+import os
+import threading
+from tempfile import TemporaryDirectory
+from unittest.mock import patch
+
+import numpy as np
+import rasterio
+from rasterio.shutil import copy
 from stactools.testing import TestData
 
+from stactools.worldpop.populate import unit_tasks
+from stactools.worldpop.schedule import run_lpt
+
 test_data = TestData(__file__)
+
+TIF_PATH = test_data.get_path("data-files/abw_ppp_2020_UNadj_constrained.tif")
+NODATA = -99999.0
+
+
+def write_raster(path,
+                 data=None,
+                 transform=None,
+                 nodata=NODATA,
+                 window=None,
+                 cog=False,
+                 **options):
+    """Write a raster in EPSG:4326 for tests.
+
+    Args:
+        path (str): Where to write the raster.
+        data (np.ndarray, optional): One band (rows, cols) or several
+            (bands, rows, cols), of any dtype. Defaults to band 1 of the ABW
+            test GeoTIFF, or `window` of it.
+        transform (Affine, optional): Defaults to that of the ABW test
+            GeoTIFF, or of `window`.
+        nodata (float, optional): The nodata tag, e.g. COG_NODATA to tag it
+            like produced COGs.
+        window (Window, optional): Window of the ABW test GeoTIFF to write.
+        cog (bool, optional): Write a COG, with `options` as COG creation
+            options, e.g. BLOCKSIZE. Otherwise `options` are GTiff ones, e.g.
+            tiled.
+
+    Returns:
+        str: `path`.
+    """
+    if data is None or transform is None:
+        with rasterio.open(TIF_PATH) as src:
+            if data is None:
+                data = src.read(1, window=window)
+            if transform is None:
+                transform = (src.transform if window is None else
+                             src.window_transform(window))
+    data = np.asarray(data)
+    if data.ndim == 2:
+        data = data[np.newaxis]
+    profile = dict(driver="GTiff",
+                   dtype=data.dtype,
+                   count=data.shape[0],
+                   height=data.shape[1],
+                   width=data.shape[2],
+                   crs="EPSG:4326",
+                   transform=transform,
+                   nodata=nodata)
+    if not cog:
+        with rasterio.open(path, "w", **profile, **options) as dst:
+            dst.write(data)
+        return path
+    with TemporaryDirectory() as tmp_dir:
+        tif_path = os.path.join(tmp_dir, "raster.tif")
+        with rasterio.open(tif_path, "w", **profile) as dst:
+            dst.write(data)
+        copy(tif_path, path, driver="COG", **options)
+    return path
+
+
+def run_tiled_units(units, options):
+    """Run the tasks of `units` with `run_lpt`, downloading a 20 x 20 raster
+    for each file and converting its 10 x 10 tiles to empty files.
+
+    Returns:
+        Tuple[List[List[str]], dict]: The access urls of the source files on
+        disk after each download or conversion, and the results of the
+        units.
+    """
+    lock = threading.Lock()
+    downloaded = {}
+    snapshots = []
+
+    def on_disk():
+        with lock:
+            snapshots.append([
+                url for url, path in downloaded.items() if os.path.exists(path)
+            ])
+
+    def download_tif(access_url, tmp_dir):
+        path = write_raster(os.path.join(tmp_dir, "source.tif"),
+                            np.ones((20, 20), dtype="float32"))
+        with lock:
+            downloaded[access_url] = path
+        on_disk()
+        return path
+
+    def create_tile_cog(input_path, output_path, window, **kwargs):
+        on_disk()
+        with open(output_path, "w"):
+            pass
+
+    results = {}
+    tasks = sum([unit_tasks(unit, options, results, {}) for unit in units], [])
+    with patch("stactools.worldpop.populate.download_tif",
+               side_effect=download_tif), patch(
+                   "stactools.worldpop.populate.tile_size",
+                   return_value=(10, 10)), patch(
+                       "stactools.worldpop.populate.create_tile_cog",
+                       side_effect=create_tile_cog), patch(
+                           "stactools.worldpop.populate.create_cog_items",
+                           return_value=[]):
+        list(run_lpt(tasks, options.workers))
+    return snapshots, results
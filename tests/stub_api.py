@@ -0,0 +1,132 @@
+import json
+import os
+import shutil
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Union
+from urllib.parse import parse_qs, urlparse
+
+
+class StubAPI:
+    """A local stand-in for the WorldPop REST API, served from a thread.
+
+    `listings` holds the metadata dicts of each iso3 by "project/category",
+    as returned by `{api_url}/project/category?iso3=...`, and `files` the
+    content of files, or local paths to stream, served from `{root}/path`. Requests for other
+    paths are answered with 404. `fail` makes the first requests of a path
+    answer with the given status codes, and `delay` slows every answer.
+    HEAD requests of files are answered with their size and ETag.
+    """
+    def __init__(self,
+                 listings: Dict[str, Dict[str, List[Any]]],
+                 delay: float = 0.0) -> None:
+        self.listings = listings
+        self.files: Dict[str, Union[bytes, str]] = {}
+        self.delay = delay
+        self.fail: Dict[str, List[int]] = {}
+        self.requests: List[str] = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+        self._server: Optional[ThreadingHTTPServer] = None
+
+    @property
+    def root(self) -> str:
+        assert self._server is not None
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    @property
+    def url(self) -> str:
+        return f"{self.root}/rest/data"
+
+    def respond(self, path: str) -> Any:
+        parsed = urlparse(path)
+        parts = parsed.path.strip("/").split("/")
+        if len(parts) != 4 or parts[:2] != ["rest", "data"]:
+            return None
+        iso3_metadatas = self.listings.get("/".join(parts[2:]))
+        if iso3_metadatas is None:
+            return None
+        iso3 = parse_qs(parsed.query).get("iso3")
+        if iso3 is None:
+            return {"data": [{"iso3": i} for i in sorted(iso3_metadatas)]}
+        if iso3[0] not in iso3_metadatas:
+            return None
+        return {"data": iso3_metadatas[iso3[0]]}
+
+    def __enter__(self) -> "StubAPI":
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                with stub._lock:
+                    stub.requests.append(self.path)
+                    stub.in_flight += 1
+                    stub.max_in_flight = max(stub.max_in_flight,
+                                             stub.in_flight)
+                    failures = stub.fail.get(urlparse(self.path).path, [])
+                    status = failures.pop(0) if failures else None
+                try:
+                    time.sleep(stub.delay)
+                    content = stub.files.get(urlparse(self.path).path)
+                    if status is None and content is not None:
+                        self.send_file(content)
+                        return
+                    body = stub.respond(self.path)
+                    if status is None and body is None:
+                        status = 404
+                    if status is not None:
+                        self.send_response(status)
+                        self.send_header("Retry-After", "0")
+                        self.send_header("Content-Length", "0")
+                        self.end_headers()
+                        return
+                    content = json.dumps(body).encode()
+                    self.send_response(200)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(content)))
+                    self.end_headers()
+                    self.wfile.write(content)
+                finally:
+                    with stub._lock:
+                        stub.in_flight -= 1
+
+            def do_HEAD(self) -> None:
+                content = stub.files.get(urlparse(self.path).path)
+                if content is None:
+                    self.send_response(404)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                self.send_file(content, body=False)
+
+            def send_file(self,
+                          content: Union[bytes, str],
+                          body: bool = True) -> None:
+                size = (len(content) if isinstance(content, bytes) else
+                        os.path.getsize(content))
+                self.send_response(200)
+                self.send_header("Content-Length", str(size))
+                self.send_header("ETag", f'"{size}"')
+                self.end_headers()
+                if not body:
+                    return
+                if isinstance(content, bytes):
+                    self.wfile.write(content)
+                else:
+                    with open(content, "rb") as f:
+                        shutil.copyfileobj(f, self.wfile)
+
+            def log_message(self, *args: Any) -> None:
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self._server.serve_forever,
+                         daemon=True).start()
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        assert self._server is not None
+        self._server.shutdown()
+        self._server.server_close()
@@ -0,0 +1,93 @@
+import json
+import os
+import shutil
+import unittest
+from tempfile import TemporaryDirectory
+
+import numpy as np
+import rasterio
+
+from stactools.worldpop.aggregate import (
+    aggregate_block,
+    aggregate_collection,
+    aggregate_raster,
+    create_aggregated_collection,
+)
+from stactools.worldpop.utils import mirror_api_path, mirror_file_path
+from tests import test_data
+
+
+class AggregateTest(unittest.TestCase):
+    def test_aggregate_block(self):
+        data = np.arange(25, dtype="float32").reshape(5, 5)
+        valid = np.ones(data.shape, dtype=bool)
+        valid[0, :] = False
+        valid[3:, 3:] = False
+        aggregated = aggregate_block(data, valid, 3)
+        self.assertEqual(aggregated.dtype, np.float32)
+        self.assertEqual(aggregated.tolist(),
+                         [[5 + 6 + 7 + 10 + 11 + 12, 8 + 9 + 13 + 14],
+                          [15 + 16 + 17 + 20 + 21 + 22, -99999.0]])
+
+    def test_aggregate_raster(self):
+        path = test_data.get_path(
+            "data-files/abw_ppp_2020_UNadj_constrained.tif")
+        with rasterio.open(path) as src:
+            data = src.read(1)
+            total = data[data != src.nodata].sum(dtype=np.float64)
+            transform = src.transform
+        with TemporaryDirectory() as tmp_dir:
+            output_path = aggregate_raster(path,
+                                           os.path.join(tmp_dir, "abw.tif"),
+                                           window_size=7)
+            with rasterio.open(output_path) as src:
+                self.assertEqual(src.shape, (26, 24))
+                self.assertAlmostEqual(src.transform.a, transform.a * 10)
+                self.assertEqual(src.transform.c, transform.c)
+                aggregated = src.read(1)
+                valid = aggregated != src.nodata
+        self.assertTrue(0 < valid.mean() < 1)
+        self.assertAlmostEqual(aggregated[valid].sum(dtype=np.float64),
+                               total,
+                               delta=total * 1e-6)
+
+    def test_create_aggregated_collection(self):
+        collection = create_aggregated_collection("pop", "cic2020_UNadj_100m")
+        self.assertEqual(collection.id, "pop_cic2020_UNadj_100m_1km")
+        self.assertEqual(collection.summaries.get_list("gsd"), [1000])
+        self.assertEqual(
+            collection.get_single_link("derived_from").get_href(),
+            "../pop_cic2020_UNadj_100m/collection.json")
+
+    @unittest.skipIf(
+        shutil.which("gdal_translate") is None, "gdal_translate is required")
+    def test_aggregate_collection(self):
+        tif_path = test_data.get_path(
+            "data-files/abw_ppp_2020_UNadj_constrained.tif")
+        with TemporaryDirectory() as tmp_dir:
+            source_root = os.path.join(tmp_dir, "mirror")
+            api_path = mirror_api_path(source_root, "pop",
+                                       "cic2020_UNadj_100m", "ABW")
+            os.makedirs(os.path.dirname(api_path))
+            with open(
+                    test_data.get_path(
+                        "data-files/pop_cic2020_UNadj_100m_ABW.json")) as f:
+                metadatas = json.load(f)
+            with open(api_path, "w") as f:
+                json.dump(metadatas, f)
+            with open(
+                    mirror_api_path(source_root, "pop", "cic2020_UNadj_100m"),
+                    "w") as f:
+                json.dump({"data": [{"iso3": "ABW"}]}, f)
+            url = metadatas["data"][0]["files"][0]
+            os.makedirs(os.path.dirname(mirror_file_path(source_root, url)))
+            shutil.copy(tif_path, mirror_file_path(source_root, url))
+
+            collection = aggregate_collection("pop",
+                                              "cic2020_UNadj_100m",
+                                              os.path.join(tmp_dir, "stac"),
+                                              os.path.join(tmp_dir, "cogs"),
+                                              source_root=source_root)
+            items = list(collection.get_all_items())
+            self.assertEqual(len(items), 1)
+            self.assertEqual(items[0].properties["gsd"], 1000)
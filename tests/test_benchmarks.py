@@ -0,0 +1,54 @@
+import os
+import unittest
+from tempfile import TemporaryDirectory
+
+import rasterio
+
+from benchmarks.suite import (
+    append_history,
+    compare,
+    create_record,
+    read_history,
+    run_suite,
+)
+from benchmarks.synthetic import PROFILES, create_country
+
+
+class BenchmarksTest(unittest.TestCase):
+    def test_synthetic_country(self):
+        with TemporaryDirectory() as tmp_dir:
+            paths = create_country(PROFILES["agesex"], tmp_dir, 0.1)
+            self.assertEqual(len(paths), len(PROFILES["agesex"].files))
+            with rasterio.open(paths[0]) as src:
+                self.assertEqual(src.shape, (250, 250))
+                self.assertEqual(src.crs.to_epsg(), 4326)
+                data = src.read(1)
+            valid = data != src.nodata
+            self.assertTrue(0 < valid.mean() < 1)
+            self.assertTrue((data[valid] > 0).all())
+
+    def test_run_suite(self):
+        with TemporaryDirectory() as tmp_dir:
+            results = run_suite(tmp_dir, ["island", "agesex"],
+                                ["mirror", "create_item", "create_cog"],
+                                scale=0.02,
+                                repeat=2)
+            by_key = {(r.benchmark, r.profile): r for r in results}
+            self.assertEqual(len(by_key), 6)
+            for profile in ["island", "agesex"]:
+                for benchmark in ["mirror", "create_item"]:
+                    result = by_key[(benchmark, profile)]
+                    self.assertEqual(result.status, "ok", result.error)
+                    self.assertEqual(len(result.seconds), 2)
+            self.assertIn(by_key[("create_cog", "island")].status,
+                          ["ok", "skipped"])
+
+            history = os.path.join(tmp_dir, "history.jsonl")
+            record = create_record(results, 0.02, 2)
+            append_history(history, record)
+            append_history(history, record)
+            self.assertEqual(len(read_history(history)), 2)
+
+        comparison = compare(record, record, 0.1)
+        self.assertEqual(len(comparison), 4)
+        self.assertFalse(any(row["regression"] for row in comparison))
@@ -0,0 +1,163 @@
+import os
+import unittest
+from tempfile import TemporaryDirectory
+
+import numpy as np
+import rasterio
+
+from stactools.worldpop.blockindex import (
+    BlockIndex,
+    BlockReader,
+    block_index_path,
+    write_block_index,
+)
+from stactools.worldpop.constants import BLOCK_INDEX_MEDIA_TYPE
+from stactools.worldpop.stac import create_item
+from stactools.worldpop.storage import read_range
+from stactools.worldpop.utils import get_metadata
+from tests import TIF_PATH, test_data, write_raster
+
+
+def write_cog(path, dtype="float32", count=1, **options):
+    """Write the test GeoTIFF as a COG of `dtype` in 64 x 64 blocks, with
+    `count` bands scaled 1, 2, ..."""
+    with rasterio.open(TIF_PATH) as src:
+        data = src.read(1)
+    bands = np.stack([(data * band * 10).astype(dtype)
+                      for band in range(1, count + 1)])
+    return write_raster(path,
+                        bands,
+                        nodata=-9999,
+                        cog=True,
+                        BLOCKSIZE=64,
+                        **options)
+
+
+def assert_blocks_equal(test, reader, path):
+    """Compare every block read with `reader` to rasterio's."""
+    with rasterio.open(path) as src:
+        levels = [src] + [
+            rasterio.open(path, overview_level=i)
+            for i in range(len(src.overviews(1)))
+        ]
+        test.assertEqual(len(reader.index.levels), len(levels))
+        try:
+            for level, dataset in enumerate(levels):
+                shape = reader.index.levels[level]
+                test.assertEqual((shape.width, shape.height),
+                                 (dataset.width, dataset.height))
+                for row in range(shape.tiles_down):
+                    for col in range(shape.tiles_across):
+                        window = dataset.block_window(1, row, col)
+                        expected = dataset.read(window=window)
+                        block = reader.read_block(row, col, level)
+                        if block.ndim == 2:
+                            block = block[np.newaxis]
+                        else:
+                            block = block.transpose(2, 0, 1)
+                        np.testing.assert_array_equal(
+                            block[:, :window.height, :window.width], expected)
+        finally:
+            for dataset in levels[1:]:
+                dataset.close()
+
+
+class BlockIndexTest(unittest.TestCase):
+    def test_read_blocks(self):
+        cases = [
+            ("float32", 1, {
+                "COMPRESS": "DEFLATE",
+                "PREDICTOR": "YES"
+            }),
+            ("int16", 1, {
+                "COMPRESS": "DEFLATE",
+                "PREDICTOR": "YES"
+            }),
+            ("float32", 1, {
+                "COMPRESS": "NONE"
+            }),
+            # Pixel-interleaved bands, like stacked age/sex COGs
+            ("float32", 2, {
+                "COMPRESS": "DEFLATE"
+            }),
+        ]
+        with TemporaryDirectory() as tmp_dir:
+            for i, (dtype, count, options) in enumerate(cases):
+                with self.subTest(dtype=dtype, count=count, **options):
+                    path = write_cog(os.path.join(tmp_dir, f"{i}_cog.tif"),
+                                     dtype, count, **options)
+                    index_path = write_block_index(path)
+                    self.assertEqual(index_path,
+                                     os.path.join(tmp_dir, f"{i}_cog.blocks"))
+                    reader = BlockReader(path)
+                    self.assertEqual(reader.index.samples_per_pixel, count)
+                    self.assertEqual(reader.index.nodata, -9999)
+                    assert_blocks_equal(self, reader, path)
+
+    def test_index_round_trip(self):
+        with TemporaryDirectory() as tmp_dir:
+            path = write_cog(os.path.join(tmp_dir, "abw_cog.tif"),
+                             COMPRESS="DEFLATE",
+                             PREDICTOR="YES")
+            with open(path, "rb") as f:
+                index = BlockIndex.from_tiff(f)
+            with rasterio.open(path) as src:
+                np.testing.assert_allclose(index.geotransform,
+                                           src.transform.to_gdal())
+                self.assertEqual(len(index.levels), len(src.overviews(1)) + 1)
+            copied = BlockIndex.from_bytes(index.to_bytes())
+            self.assertEqual(len(copied.levels), len(index.levels))
+            for level, copied_level in zip(index.levels, copied.levels):
+                np.testing.assert_array_equal(level.offsets,
+                                              copied_level.offsets)
+                np.testing.assert_array_equal(level.byte_counts,
+                                              copied_level.byte_counts)
+            self.assertEqual(
+                (copied.compression, copied.predictor, copied.dtype,
+                 copied.geotransform, copied.nodata),
+                (index.compression, index.predictor, index.dtype,
+                 index.geotransform, index.nodata))
+
+            # The block holding a point
+            reader = BlockReader(path, write_block_index(path))
+            with rasterio.open(path) as src:
+                x, y = src.xy(100, 70)
+            self.assertEqual(reader.block_of(x, y), (1, 1))
+            self.assertEqual(reader.block_of(x, y, level=1), (0, 0))
+
+            with self.assertRaises(ValueError):
+                BlockIndex.from_bytes(b"not an index")
+            with open(TIF_PATH, "rb") as f:
+                # Striped, not tiled
+                with self.assertRaises(ValueError):
+                    BlockIndex.from_tiff(f)
+            with open(block_index_path(path), "rb") as f:
+                with self.assertRaises(ValueError):
+                    BlockIndex.from_tiff(f)
+
+    def test_read_range(self):
+        with TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "data.bin")
+            with open(path, "wb") as f:
+                f.write(bytes(range(10)))
+            self.assertEqual(read_range(path, 2, 3), bytes([2, 3, 4]))
+            self.assertEqual(read_range(path), bytes(range(10)))
+            self.assertIsNone(read_range(os.path.join(tmp_dir, "missing")))
+
+    def test_item_asset(self):
+        metadatas = get_metadata(
+            test_data.get_path(
+                "data-files/pop_cic2020_UNadj_100m_ABW.json"))["data"]
+        with TemporaryDirectory() as tmp_dir:
+            path = write_cog(os.path.join(tmp_dir, "abw_ppp_2020_cog.tif"))
+            write_block_index(path)
+            item = create_item("pop",
+                               "cic2020_UNadj_100m",
+                               "ABW",
+                               "2020",
+                               metadatas, [path],
+                               block_index=True)
+            asset = item.assets["abw_ppp_2020_cog_blocks"]
+            self.assertEqual(asset.href, block_index_path(path))
+            self.assertEqual(asset.media_type, BLOCK_INDEX_MEDIA_TYPE)
+            self.assertEqual(asset.roles, ["index"])
@@ -0,0 +1,113 @@
+import hashlib
+import os
+import unittest
+from tempfile import TemporaryDirectory
+from unittest.mock import patch
+
+import numpy as np
+import rasterio
+from rasterio.shutil import copy
+
+from stactools.worldpop.checksum import (
+    StreamHash,
+    get_checksum,
+    record_checksum,
+)
+from stactools.worldpop.cog import create_cog, download_tif
+from stactools.worldpop.failures import FailureReport
+from stactools.worldpop.populate import PopulateOptions, build_units
+from stactools.worldpop.stac import create_item
+from stactools.worldpop.stats import (
+    compute_statistics,
+    statistics_metadata_option,
+)
+from stactools.worldpop.utils import get_metadata
+from stactools.worldpop.work import WorkUnit
+from tests import TIF_PATH, test_data
+from tests.stub_api import StubAPI
+
+
+def fake_gdal_translate(cmd):
+    """Write the COG of a gdal_translate command with rasterio instead."""
+    copy(cmd[-2], cmd[-1], driver="COG")
+    return b""
+
+
+def sha256_multihash(path):
+    with open(path, "rb") as f:
+        return "1220" + hashlib.sha256(f.read()).hexdigest()
+
+
+class CogTest(unittest.TestCase):
+    def test_download_tif(self):
+        with TemporaryDirectory() as tmp_dir, StubAPI({}) as stub:
+            stub.files["/abw.tif"] = TIF_PATH
+            path = download_tif(f"{stub.root}/abw.tif", tmp_dir)
+            self.assertEqual(
+                get_checksum(f"{stub.root}/abw.tif"), {
+                    "checksum": sha256_multihash(TIF_PATH),
+                    "size": os.path.getsize(TIF_PATH)
+                })
+            self.assertEqual(sha256_multihash(path),
+                             sha256_multihash(TIF_PATH))
+
+            # Error pages are neither written as TIFFs nor hashed
+            with self.assertRaises(AssertionError):
+                download_tif(f"{stub.root}/missing.tif", tmp_dir)
+            self.assertIsNone(get_checksum(f"{stub.root}/missing.tif"))
+
+    @patch("stactools.worldpop.cog.check_output",
+           side_effect=fake_gdal_translate)
+    def test_local_cog(self, check_output):
+        metadatas = get_metadata(
+            test_data.get_path(
+                "data-files/pop_cic2020_UNadj_100m_ABW.json"))["data"]
+        with TemporaryDirectory() as tmp_dir:
+            cog_path = create_cog(TIF_PATH,
+                                  os.path.join(tmp_dir, "abw_cog.tif"))
+            # Written in place, not copied to be hashed
+            self.assertEqual(check_output.call_args.args[0][-1], cog_path)
+            self.assertEqual(os.listdir(tmp_dir), ["abw_cog.tif"])
+            item = create_item("pop", "cic2020_UNadj_100m", "ABW", "2020",
+                               metadatas, [cog_path])
+            self.assertNotIn("file:checksum",
+                             item.assets["abw_cog"].extra_fields)
+
+    @patch("stactools.worldpop.cog.check_output",
+           side_effect=fake_gdal_translate)
+    def test_statistics_single_read(self, check_output):
+        with TemporaryDirectory() as tmp_dir, patch(
+                "rasterio.open", wraps=rasterio.open) as open_:
+            cog_path = create_cog(TIF_PATH,
+                                  os.path.join(tmp_dir, "abw_cog.tif"),
+                                  statistics=True)
+            # gdal_translate reads the copy the statistics were taken from
+            self.assertNotEqual(check_output.call_args.args[0][-2], TIF_PATH)
+            opened = [call.args[0] for call in open_.call_args_list]
+            self.assertEqual(opened.count(TIF_PATH), 1)
+            cmd = check_output.call_args.args[0]
+            self.assertIn(
+                statistics_metadata_option(compute_statistics(TIF_PATH)),
+                cmd)
+            with rasterio.open(TIF_PATH) as src, rasterio.open(
+                    cog_path) as cog:
+                np.testing.assert_array_equal(src.read(), cog.read())
+                self.assertEqual(src.profile["nodata"],
+                                 cog.profile["nodata"])
+
+    def test_forget_checksums(self):
+        metadatas = [{"popyear": "2020", "files": ["https://a/abw.tif"]}]
+        unit = WorkUnit("pop", "cic2020_UNadj_100m", "ABW", "2020", metadatas)
+
+        def create_unit_items(*args):
+            stream_hash = StreamHash()
+            stream_hash.update(b"abw")
+            record_checksum("https://a/abw.tif", stream_hash)
+            return []
+
+        with patch("stactools.worldpop.populate.create_unit_items",
+                   side_effect=create_unit_items):
+            for _ in build_units([unit], PopulateOptions(), FailureReport()):
+                # Until the caller is done with the unit
+                self.assertIsNotNone(get_checksum("https://a/abw.tif"))
+        self.assertIsNone(get_checksum("https://a/abw.tif"))
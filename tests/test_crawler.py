@@ -0,0 +1,57 @@
+import unittest
+
+from stactools.worldpop.crawler import crawl_metadata
+from tests.stub_api import StubAPI
+
+
+def listing(iso3s):
+    return {
+        iso3: [{
+            "iso3": iso3,
+            "popyear": "2020",
+            "files": [f"https://data.worldpop.org/{iso3.lower()}_2020.tif"]
+        }]
+        for iso3 in iso3s
+    }
+
+
+class CrawlerTest(unittest.TestCase):
+    def setUp(self):
+        self.listings = {
+            "pop/wpgp": listing([f"A{i:02d}" for i in range(30)]),
+            "pop/cic2020_UNadj_100m": listing(["ABW", "AFG"]),
+        }
+
+    def test_crawl_metadata(self):
+        with StubAPI(self.listings, delay=0.02) as stub:
+            stub.fail["/rest/data/pop/cic2020_UNadj_100m"] = [503, 429]
+            index = crawl_metadata([("pop", "wpgp"),
+                                    ("pop", "cic2020_UNadj_100m")],
+                                   api_url=stub.url,
+                                   concurrency=4,
+                                   rate=1000)
+
+        self.assertEqual(sorted(index), [("pop", "cic2020_UNadj_100m"),
+                                         ("pop", "wpgp")])
+        self.assertEqual(index[("pop", "cic2020_UNadj_100m")],
+                         self.listings["pop/cic2020_UNadj_100m"])
+        self.assertEqual(len(index[("pop", "wpgp")]), 30)
+        # 2 listings, 32 metadata documents and 2 retried failures
+        self.assertEqual(len(stub.requests), 36)
+        self.assertLessEqual(stub.max_in_flight, 4)
+        self.assertGreater(stub.max_in_flight, 1)
+
+    def test_crawl_metadata_rate(self):
+        with StubAPI(self.listings) as stub:
+            crawl_metadata([("pop", "cic2020_UNadj_100m")],
+                           api_url=stub.url,
+                           api_key="secret",
+                           rate=20)
+        self.assertEqual(len(stub.requests), 3)
+        self.assertTrue(all("key=secret" in r for r in stub.requests))
+
+    def test_crawl_metadata_not_found(self):
+        with StubAPI(self.listings) as stub:
+            with self.assertRaises(AssertionError):
+                crawl_metadata([("pop", "missing")], api_url=stub.url)
+            self.assertEqual(len(stub.requests), 1)
@@ -0,0 +1,105 @@
+import json
+import os
+from tempfile import TemporaryDirectory
+
+import numpy as np
+import zarr
+from pystac import Collection
+from pystac.extensions.datacube import DatacubeExtension
+from rasterio.transform import from_origin
+from stactools.testing import CliTestCase
+
+from stactools.worldpop.commands import create_worldpop_command
+from stactools.worldpop.cube import create_cube, yearly_hrefs
+from stactools.worldpop.utils import mirror_api_path, mirror_file_path
+from tests import NODATA, write_raster
+
+
+def write_year(path, year, shape=(300, 200), origin=(-70.0, 12.6)):
+    data = np.arange(shape[0] * shape[1], dtype="float32").reshape(shape)
+    data += year
+    data[:, :10] = NODATA
+    write_raster(path, data, from_origin(origin[0], origin[1], 0.001, 0.001))
+    return data
+
+
+class CubeTest(CliTestCase):
+    def create_subcommand_functions(self):
+        return [create_worldpop_command]
+
+    def test_create_cube(self):
+        with TemporaryDirectory() as tmp_dir:
+            hrefs = {}
+            expected = []
+            for year in [2001, 2000]:
+                hrefs[str(year)] = os.path.join(tmp_dir, f"{year}.tif")
+                expected.insert(0, write_year(hrefs[str(year)], year))
+            cube_path = create_cube(hrefs,
+                                    os.path.join(tmp_dir, "cube.zarr"),
+                                    chunk_size=64,
+                                    window_chunks=2)
+
+            group = zarr.open_consolidated(cube_path, mode="r")
+            population = group["population"]
+            self.assertEqual(population.shape, (2, 300, 200))
+            self.assertEqual(population.chunks, (2, 64, 64))
+            self.assertEqual(population.fill_value, NODATA)
+            np.testing.assert_array_equal(population[:], np.stack(expected))
+            self.assertEqual(list(group["year"][:]), [2000, 2001])
+            self.assertAlmostEqual(group["x"][0], -69.9995)
+            self.assertAlmostEqual(group["y"][0], 12.5995)
+            self.assertEqual(population.attrs["_ARRAY_DIMENSIONS"],
+                             ["year", "y", "x"])
+
+            write_year(hrefs["2001"], 2001, shape=(300, 201))
+            with self.assertRaises(ValueError):
+                create_cube(hrefs, os.path.join(tmp_dir, "cube2.zarr"))
+
+    def test_yearly_hrefs(self):
+        metadatas = [{
+            "popyear": "2000",
+            "files": ["https://data.worldpop.org/a_2000.tif"]
+        }, {
+            "popyear": "2001",
+            "files": ["https://data.worldpop.org/a_2001.tif"]
+        }]
+        self.assertEqual(yearly_hrefs(metadatas, ["2001"]),
+                         {"2001": "ftp://ftp.worldpop.org/a_2001.tif"})
+        metadatas[0]["files"].append("https://data.worldpop.org/b.tif")
+        with self.assertRaises(ValueError):
+            yearly_hrefs(metadatas)
+
+    def test_to_zarr_command(self):
+        with TemporaryDirectory() as tmp_dir:
+            source_root = os.path.join(tmp_dir, "mirror")
+            metadatas = []
+            for year in ["2000", "2001"]:
+                url = f"https://data.worldpop.org/xyz_ppp_{year}.tif"
+                path = mirror_file_path(source_root, url)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                write_year(path, int(year))
+                metadatas.append({"popyear": year, "files": [url]})
+            api_path = mirror_api_path(source_root, "pop", "wpgpunadj", "XYZ")
+            os.makedirs(os.path.dirname(api_path))
+            with open(api_path, "w") as f:
+                json.dump({"data": metadatas}, f)
+            destination = os.path.join(tmp_dir, "stac")
+
+            result = self.run_command([
+                "worldpop", "to-zarr", "-i", "XYZ", "-d", destination,
+                "--source-root", source_root
+            ])
+
+            self.assertEqual(result.exit_code,
+                             0,
+                             msg="\n{}".format(result.output))
+            collection = Collection.from_file(
+                os.path.join(destination, "pop_wpgpunadj", "collection.json"))
+            asset = collection.assets["XYZ_zarr"]
+            self.assertEqual(asset.media_type, "application/vnd+zarr")
+            self.assertTrue(os.path.isdir(asset.get_absolute_href()))
+            cube_ext = DatacubeExtension.ext(asset)
+            self.assertEqual(cube_ext.dimensions["year"].extent,
+                             ["2000-01-01T00:00:00Z", "2001-01-01T00:00:00Z"])
+            self.assertEqual(cube_ext.variables["population"].dimensions,
+                             ["year", "y", "x"])
@@ -0,0 +1,88 @@
+import unittest
+from datetime import datetime
+
+from pystac import Item
+
+from stactools.worldpop.constants import WORLDPOP_EXTENT
+from stactools.worldpop.extents import unit_extent
+from stactools.worldpop.stac import create_collection
+from stactools.worldpop.sync import SyncState
+
+
+def item(item_id, bbox, popyear, shape):
+    return Item(item_id,
+                None,
+                bbox,
+                None, {"proj:shape": shape},
+                start_datetime=datetime(int(popyear), 1, 1),
+                end_datetime=datetime(int(popyear), 12, 31))
+
+
+def record(state, iso3, popyear, items):
+    state.record(iso3, popyear, [{
+        "popyear": popyear,
+        "files": [f"{iso3.lower()}_{popyear}.tif"]
+    }], items)
+
+
+class ExtentsTest(unittest.TestCase):
+    def test_unit_extent(self):
+        extent = unit_extent([
+            item("ABW_2020_1_1", [0, 0, 1, 1], "2020", [10, 20]),
+            item("ABW_2020_1_2", [1, -1, 2, 1], "2020", [12, 5]),
+        ])
+        self.assertEqual(extent["bbox"], [0, -1, 2, 1])
+        self.assertEqual(extent["interval"],
+                         ["2020-01-01T00:00:00Z", "2020-12-31T00:00:00Z"])
+        self.assertEqual(extent["shape"], {
+            "minimum": [10, 5],
+            "maximum": [12, 20]
+        })
+
+    def test_collection_extents(self):
+        state = SyncState()
+        record(state, "ABW", "2020",
+               [item("ABW_2020", [-70, 12, -69, 13], "2020", [255, 238])])
+        record(state, "AFG", "2019",
+               [item("AFG_2019", [60, 29, 75, 39], "2019", [8000, 12000])])
+        record(state, "AIA", "2020", [])
+
+        collection = create_collection("pop", "cic2020_UNadj_100m")
+        state.extents.apply(collection)
+        self.assertEqual(collection.extent.spatial.bboxes, [[-70, 12, 75, 39]])
+        self.assertEqual(
+            [d.year for d in collection.extent.temporal.intervals[0]],
+            [2019, 2020])
+        summaries = collection.summaries
+        self.assertEqual(summaries.lists["worldpop:iso3"], ["ABW", "AFG"])
+        self.assertEqual(summaries.lists["worldpop:popyear"], ["2019", "2020"])
+        self.assertEqual(summaries.ranges["proj:shape"].maximum, [8000, 12000])
+
+        # Removing a unit shrinks the extents, without reading Items
+        state.remove("AFG_2019")
+        state.extents.apply(collection)
+        self.assertEqual(collection.extent.spatial.bboxes,
+                         [[-70, 12, -69, 13]])
+        self.assertEqual(summaries.lists["worldpop:iso3"], ["ABW"])
+        self.assertEqual(summaries.ranges["proj:shape"].minimum, [255, 238])
+
+        # Without Items, nothing is left of the extents of removed units
+        state.remove("ABW_2020")
+        state.extents.apply(collection)
+        self.assertEqual(collection.extent.spatial.bboxes, [WORLDPOP_EXTENT])
+        self.assertEqual(collection.extent.temporal.intervals, [[None, None]])
+        for key in ["worldpop:iso3", "worldpop:popyear", "proj:shape"]:
+            self.assertNotIn(key, summaries.to_dict())
+        self.assertIsNone(state.extents.computed_extent())
+
+    def test_units_without_extent(self):
+        state = SyncState()
+        record(state, "ABW", "2020",
+               [item("ABW_2020", [-70, 12, -69, 13], "2020", [255, 238])])
+        # Recorded before extents were stored
+        del state.units["ABW_2020"]["extent"]
+        collection = create_collection("pop", "cic2020_UNadj_100m")
+        bboxes = collection.extent.spatial.bboxes
+        SyncState(state.units).extents.apply(collection)
+        self.assertEqual(collection.extent.spatial.bboxes, bboxes)
+        self.assertEqual(collection.summaries.lists["worldpop:iso3"], ["ABW"])
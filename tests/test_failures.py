@@ -0,0 +1,156 @@
+import json
+import os
+import shutil
+import unittest
+from tempfile import TemporaryDirectory
+from unittest.mock import patch
+
+from stactools.worldpop import populate
+from stactools.worldpop.failures import FailureReport, UnitFailed, with_retries
+from stactools.worldpop.populate import (
+    PopulateOptions,
+    populate_collection,
+    retry_failed,
+)
+from stactools.worldpop.utils import mirror_api_path, mirror_file_path
+from tests import test_data
+
+
+class FailuresTest(unittest.TestCase):
+    def test_with_retries(self):
+        calls = []
+
+        def flaky():
+            calls.append(1)
+            if len(calls) < 3:
+                raise IOError("connection reset")
+            return "done"
+
+        self.assertEqual(with_retries(flaky, "flaky", 2, 0), "done")
+        calls.clear()
+        with self.assertRaises(UnitFailed) as context:
+            with_retries(flaky, "flaky", 1, 0)
+        self.assertEqual(context.exception.attempts, 2)
+        self.assertIsInstance(context.exception.error, IOError)
+
+    def test_report_round_trip(self):
+        report = FailureReport()
+        report.record("ABW", "2020", UnitFailed("ABW", 3, ValueError("bad")))
+        with TemporaryDirectory() as tmp_dir:
+            report.save(tmp_dir)
+            loaded = FailureReport.load(tmp_dir)
+            self.assertEqual(loaded.units, report.units)
+            self.assertEqual(loaded.units["ABW_2020"]["attempts"], 3)
+            loaded.remove("ABW", "2020")
+            loaded.save(tmp_dir)
+            self.assertEqual(os.listdir(tmp_dir), [])
+
+
+class QuarantineTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = TemporaryDirectory()
+        self.source_root = os.path.join(self.tmp_dir.name, "mirror")
+        self.destination = os.path.join(self.tmp_dir.name, "stac")
+        with open(
+                test_data.get_path(
+                    "data-files/pop_cic2020_UNadj_100m_ABW.json")) as f:
+            metadatas = json.load(f)
+        # A second country sharing the raster of the first one
+        for iso3 in ["ABW", "AIA"]:
+            for metadata in metadatas["data"]:
+                metadata["iso3"] = iso3
+            api_path = mirror_api_path(self.source_root, "pop",
+                                       "cic2020_UNadj_100m", iso3)
+            os.makedirs(os.path.dirname(api_path), exist_ok=True)
+            with open(api_path, "w") as f:
+                json.dump(metadatas, f)
+        with open(
+                mirror_api_path(self.source_root, "pop", "cic2020_UNadj_100m"),
+                "w") as f:
+            json.dump({"data": [{"iso3": "ABW"}, {"iso3": "AIA"}]}, f)
+        url = metadatas["data"][0]["files"][0]
+        os.makedirs(os.path.dirname(mirror_file_path(self.source_root, url)))
+        shutil.copy(
+            test_data.get_path(
+                "data-files/abw_ppp_2020_UNadj_constrained.tif"),
+            mirror_file_path(self.source_root, url))
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def populate_with_failing_aia(self, options):
+        create_unit_items = populate.create_unit_items
+
+        def fail_aia(project, category, iso3, *args):
+            if iso3 == "AIA":
+                raise IOError("connection reset")
+            return create_unit_items(project, category, iso3, *args)
+
+        with patch("stactools.worldpop.populate.create_unit_items",
+                   side_effect=fail_aia) as mock:
+            collection = populate_collection("pop",
+                                             "cic2020_UNadj_100m",
+                                             self.destination,
+                                             options=options)
+        return collection, mock
+
+    def test_quarantine_and_retry(self):
+        for workers in [1, 2]:
+            with self.subTest(workers=workers):
+                options = PopulateOptions(source_root=self.source_root,
+                                          workers=workers,
+                                          retries=1,
+                                          retry_backoff=0)
+                collection, mock = self.populate_with_failing_aia(options)
+                collection_dest = os.path.join(self.destination, collection.id)
+                self.assertEqual(
+                    [item.id for item in collection.get_all_items()],
+                    ["ABW_2020"])
+                # One attempt for ABW, two for AIA
+                self.assertEqual(mock.call_count, 3)
+                report = FailureReport.load(collection_dest)
+                self.assertEqual(report.keys(), ["AIA_2020"])
+                self.assertIn("connection reset",
+                              report.units["AIA_2020"]["error"])
+
+                report = retry_failed("pop",
+                                      "cic2020_UNadj_100m",
+                                      self.destination,
+                                      options=options)
+                self.assertEqual(report.units, {})
+                self.assertEqual(
+                    sorted(item.id for item in populate.load_collection(
+                        "pop", "cic2020_UNadj_100m",
+                        self.destination).get_all_items()),
+                    ["ABW_2020", "AIA_2020"])
+                self.assertFalse(
+                    os.path.exists(
+                        os.path.join(collection_dest,
+                                     "worldpop-failures.json")))
+
+    def test_retry_replaces_items(self):
+        options = PopulateOptions(source_root=self.source_root)
+        collection = populate_collection("pop",
+                                         "cic2020_UNadj_100m",
+                                         self.destination,
+                                         options=options)
+        collection_dest = os.path.join(self.destination, collection.id)
+        # Quarantined after a run that created its Item
+        report = FailureReport()
+        report.record("AIA", "2020", UnitFailed("AIA", 1, IOError("reset")))
+        report.save(collection_dest)
+
+        # Scanning the links for each new Item is quadratic
+        with patch("pystac.Collection.get_item",
+                   side_effect=AssertionError), patch(
+                       "pystac.Collection.remove_item",
+                       side_effect=AssertionError):
+            report = retry_failed("pop",
+                                  "cic2020_UNadj_100m",
+                                  self.destination,
+                                  options=options)
+        self.assertEqual(report.units, {})
+        self.assertEqual(
+            sorted(item.id for item in populate.load_collection(
+                "pop", "cic2020_UNadj_100m",
+                self.destination).get_all_items()), ["ABW_2020", "AIA_2020"])
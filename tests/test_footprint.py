@@ -0,0 +1,96 @@
+import os.path
+import shutil
+import unittest
+from tempfile import TemporaryDirectory
+
+import numpy as np
+import rasterio
+from rasterio.enums import Resampling
+from shapely.geometry import Point, box, shape
+
+from stactools.worldpop import stac
+from stactools.worldpop.constants import COG_NODATA
+from stactools.worldpop.footprint import create_footprint
+from stactools.worldpop.utils import get_metadata
+from tests import NODATA, test_data, write_raster
+
+
+class FootprintTest(unittest.TestCase):
+    def setUp(self):
+        self.path = test_data.get_path(
+            "data-files/abw_ppp_2020_UNadj_constrained.tif")
+        with rasterio.open(self.path) as src:
+            self.bounds = box(*src.bounds)
+
+    def check_footprint(self, geometry, max_vertices):
+        footprint = shape(geometry)
+        self.assertTrue(footprint.is_valid)
+        self.assertLess(footprint.area, 0.8 * self.bounds.area)
+        self.assertTrue(self.bounds.buffer(1e-9).contains(footprint))
+        polygons = getattr(footprint, "geoms", [footprint])
+        self.assertLessEqual(sum(len(p.exterior.coords) for p in polygons),
+                             max_vertices)
+
+    def test_footprint_from_block_reads(self):
+        for max_size in [1024, 64]:
+            geometry = create_footprint(self.path,
+                                        max_size=max_size,
+                                        max_vertices=50)
+            self.check_footprint(geometry, 50)
+
+    def test_footprint_from_overviews(self):
+        with TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "overviews.tif")
+            shutil.copy(self.path, path)
+            with rasterio.open(path, "r+") as dst:
+                dst.build_overviews([2, 4], Resampling.nearest)
+            geometry = create_footprint(path, max_size=64, max_vertices=20)
+        self.check_footprint(geometry, 20)
+
+    def test_footprint_of_produced_cog(self):
+        # Produced COGs are tagged with COG_NODATA but keep WorldPop's nodata
+        with TemporaryDirectory() as tmp_dir:
+            path = write_raster(os.path.join(tmp_dir, "abw_cog.tif"),
+                                nodata=COG_NODATA,
+                                cog=True,
+                                BLOCKSIZE=64)
+            for max_size in [1024, 64]:
+                geometry = create_footprint(path,
+                                            max_size=max_size,
+                                            max_vertices=50)
+                self.check_footprint(geometry, 50)
+
+    def test_footprint_keeps_islands(self):
+        with rasterio.open(self.path) as src:
+            data = np.full((src.height, src.width), NODATA, dtype="float32")
+        # An island of 5 x 5 pixels, kept in the overviews up to 1/4
+        data[101:106, 53:58] = 1.0
+        with TemporaryDirectory() as tmp_dir:
+            path = write_raster(os.path.join(tmp_dir, "island_cog.tif"),
+                                data,
+                                nodata=COG_NODATA,
+                                cog=True,
+                                BLOCKSIZE=64,
+                                OVERVIEW_RESAMPLING="NEAREST")
+            with rasterio.open(path) as src:
+                self.assertEqual(src.overviews(1), [2, 4])
+                island = Point(*src.xy(103, 55))
+            geometry = create_footprint(path, max_size=16, max_vertices=20)
+        assert geometry is not None
+        footprint = shape(geometry)
+        self.assertTrue(footprint.intersects(island))
+        self.assertLess(footprint.area, 0.1 * self.bounds.area)
+
+    def test_create_item_with_footprint(self):
+        metadatas = get_metadata(
+            test_data.get_path(
+                "data-files/pop_cic2020_UNadj_100m_ABW.json"))["data"]
+        item = stac.create_item("pop",
+                                "cic2020_UNadj_100m",
+                                "ABW",
+                                "2020",
+                                metadatas, [self.path],
+                                footprint=True)
+        assert item is not None
+        self.assertEqual(list(item.bbox), list(self.bounds.bounds))
+        self.check_footprint(item.geometry, 500)
@@ -0,0 +1,146 @@
+import os
+import shutil
+import unittest
+from tempfile import TemporaryDirectory
+
+import rasterio
+from rasterio.shutil import copy
+from rasterio.windows import Window
+
+from stactools.worldpop.populate import save_collection
+from stactools.worldpop.stac import (
+    ItemTemplate,
+    create_collection,
+    create_item,
+)
+from stactools.worldpop.stack import create_stack_vrt, sort_age_sex_paths
+from stactools.worldpop.stats import (
+    compute_statistics,
+    statistics_metadata_option,
+)
+from stactools.worldpop.utils import get_metadata, mirror_file_path
+from tests import TIF_PATH, test_data, write_raster
+from tests.test_stack import write_layer
+
+ITEMS_PATH = test_data.get_path("data-files/items")
+
+
+def write_cog(path, window=None):
+    """Write a window of the test GeoTIFF with its statistics."""
+    # One compressed strip, as in the test GeoTIFF, so that statistics are
+    # summed in the same order
+    write_raster(path, window=window, compress="lzw", blockysize=255)
+    option = statistics_metadata_option(compute_statistics(path))
+    with rasterio.open(path, "r+") as dst:
+        dst.update_tags(**dict([option.split("=", 1)]))
+    return path
+
+
+def create_items(tmp_dir):
+    """Create Items of every kind from rasters written in `tmp_dir`."""
+    metadatas = get_metadata(
+        test_data.get_path(
+            "data-files/pop_cic2020_UNadj_100m_ABW.json"))["data"]
+    items = []
+
+    # Original GeoTIFF read from a mirror, with a footprint
+    source_root = os.path.join(tmp_dir, "mirror")
+    mirror_path = mirror_file_path(source_root, metadatas[0]["files"][0])
+    os.makedirs(os.path.dirname(mirror_path))
+    shutil.copy(TIF_PATH, mirror_path)
+    items.append(
+        create_item("pop",
+                    "cic2020_UNadj_100m",
+                    "ABW",
+                    "2020",
+                    metadatas,
+                    footprint=True,
+                    source_root=source_root))
+
+    # COG with statistics and a thumbnail
+    cog_path = write_cog(os.path.join(tmp_dir, "aia_ppp_2020_cog.tif"))
+    items.append(
+        create_item("pop",
+                    "cic2020_UNadj_100m",
+                    "AIA",
+                    "2020",
+                    metadatas, [cog_path],
+                    thumbnail_href=os.path.join(tmp_dir, "aia_ppp_2020.png")))
+
+    # Tiles
+    with rasterio.open(TIF_PATH) as src:
+        half = src.width // 2
+        windows = [
+            Window(0, 0, half, src.height),
+            Window(half, 0, src.width - half, src.height)
+        ]
+    for x, window in enumerate(windows, start=1):
+        tile_path = write_cog(
+            os.path.join(tmp_dir, f"aia_ppp_2020_1_{x}_cog.tif"), window)
+        items.append(
+            create_item("pop", "cic2020_UNadj_100m", "AIA", "2020", metadatas,
+                        [tile_path], True))
+
+    # Stacked age/sex COG
+    paths = sort_age_sex_paths([
+        write_layer(os.path.join(tmp_dir, f"xas_{s}_{a}_2020.tif"), value)
+        for value, (s, a) in enumerate([("m", 0), ("f", 1)], start=1)
+    ])
+    vrt_path = create_stack_vrt(paths, os.path.join(tmp_dir, "stack.vrt"),
+                                [compute_statistics(path) for path in paths])
+    stacked_path = os.path.join(tmp_dir, "xas_agesex_2020_cog.tif")
+    copy(vrt_path, stacked_path, driver="COG")
+    metadata = dict(metadatas[0], popyear="2020", files=paths)
+    items.append(
+        create_item("age_structures", "ascicua_2020", "XAS", "2020",
+                    [metadata], [stacked_path]))
+    return items
+
+
+def read_saved_items(collection_dest, tmp_dir):
+    """Return the JSON of the saved collection and Items, with `tmp_dir`
+    replaced so that it can be compared between runs."""
+    saved = {}
+    for root, _, files in os.walk(collection_dest):
+        for name in files:
+            with open(os.path.join(root, name)) as f:
+                saved[name] = f.read().replace(tmp_dir, "$TMP")
+    return saved
+
+
+class ItemsTest(unittest.TestCase):
+    def test_saved_items_are_unchanged(self):
+        with TemporaryDirectory() as tmp_dir:
+            collection = create_collection("pop", "cic2020_UNadj_100m")
+            for item in create_items(tmp_dir):
+                collection.add_item(item)
+            collection_dest = os.path.join(tmp_dir, "stac")
+            save_collection(collection, collection_dest, validate=False)
+            saved = read_saved_items(collection_dest, tmp_dir)
+
+        self.assertEqual(sorted(saved), sorted(os.listdir(ITEMS_PATH)))
+        for name, text in saved.items():
+            with open(os.path.join(ITEMS_PATH, name)) as f:
+                self.assertEqual(text, f.read(), name)
+
+    def test_template_is_reused(self):
+        metadatas = get_metadata(
+            test_data.get_path(
+                "data-files/pop_cic2020_UNadj_100m_ABW.json"))["data"]
+        template = ItemTemplate.create("pop", "cic2020_UNadj_100m", "ABW",
+                                       "2020", metadatas)
+        assert template is not None
+        with TemporaryDirectory() as tmp_dir:
+            cog_path = write_cog(os.path.join(tmp_dir, "abw_cog.tif"))
+            first = template.create_item([cog_path])
+            second = template.create_item([cog_path])
+        self.assertEqual(first.to_dict(), second.to_dict())
+        # Items do not share mutable parts of the template
+        first.properties["title"] = "Changed"
+        first.assets["abw_cog"].extra_fields["raster:bands"].clear()
+        self.assertNotEqual(second.properties["title"], "Changed")
+        self.assertEqual(
+            len(second.assets["abw_cog"].extra_fields["raster:bands"]), 1)
+        self.assertIsNone(
+            ItemTemplate.create("pop", "cic2020_UNadj_100m", "ABW", "1999",
+                                metadatas))
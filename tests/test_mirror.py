@@ -0,0 +1,160 @@
+import hashlib
+import json
+import os
+import unittest
+from tempfile import TemporaryDirectory
+from unittest.mock import patch
+
+from stactools.worldpop.constants import (
+    MIRROR_FINGERPRINTS_FILE,
+    SYNC_STATE_FILE,
+)
+from stactools.worldpop.mirror import mirror_collections
+from stactools.worldpop.populate import (
+    PopulateOptions,
+    populate_collection,
+    sync_collection,
+)
+from stactools.worldpop.sync import SyncState, plan_sync
+from stactools.worldpop.utils import get_iso3_list, mirror_file_path
+from tests import test_data
+from tests.stub_api import StubAPI
+
+
+class MirrorTest(unittest.TestCase):
+    def test_mirror_and_build_offline(self):
+        tif_path = test_data.get_path(
+            "data-files/abw_ppp_2020_UNadj_constrained.tif")
+        with open(
+                test_data.get_path(
+                    "data-files/pop_cic2020_UNadj_100m_ABW.json")) as f:
+            metadatas = json.load(f)["data"]
+
+        with TemporaryDirectory() as tmp_dir:
+            source_root = os.path.join(tmp_dir, "mirror")
+            with StubAPI({}) as stub:
+                url = f"{stub.root}/GIS/Population/abw_ppp_2020.tif"
+                for metadata in metadatas:
+                    metadata["files"] = [url]
+                stub.listings["pop/cic2020_UNadj_100m"] = {
+                    "ABW": metadatas,
+                    "AFG": [],
+                }
+                with open(tif_path, "rb") as f:
+                    stub.files["/GIS/Population/abw_ppp_2020.tif"] = f.read()
+
+                downloaded = mirror_collections(
+                    source_root, [("pop", "cic2020_UNadj_100m")],
+                    iso3s=["ABW"],
+                    rasters=True,
+                    api_url=stub.url)
+                self.assertEqual(downloaded, [url])
+                # Files already mirrored are not downloaded again
+                self.assertEqual(
+                    mirror_collections(source_root,
+                                       [("pop", "cic2020_UNadj_100m")],
+                                       iso3s=["ABW"],
+                                       rasters=True,
+                                       api_url=stub.url), [])
+
+            self.assertEqual(
+                get_iso3_list("pop", "cic2020_UNadj_100m", source_root),
+                ["ABW"])
+            self.assertEqual(
+                os.path.getsize(mirror_file_path(source_root, url)),
+                os.path.getsize(tif_path))
+            with open(tif_path, "rb") as f:
+                checksum = "1220" + hashlib.sha256(f.read()).hexdigest()
+
+            # The stub is down, any network call fails
+            destination = os.path.join(tmp_dir, "stac")
+            with patch("requests.get", side_effect=AssertionError):
+                collection = populate_collection(
+                    "pop",
+                    "cic2020_UNadj_100m",
+                    destination,
+                    options=PopulateOptions(source_root=source_root))
+                items = list(collection.get_all_items())
+                self.assertEqual([item.id for item in items], ["ABW_2020"])
+                self.assertEqual(items[0].assets["abw_ppp_2020"].href, url)
+                # Checksums taken while mirroring, the file is not read again
+                extra_fields = items[0].assets["abw_ppp_2020"].extra_fields
+                self.assertEqual(extra_fields["file:checksum"], checksum)
+                self.assertEqual(extra_fields["file:size"],
+                                 os.path.getsize(tif_path))
+
+                plan = plan_sync("pop",
+                                 "cic2020_UNadj_100m", ["2020"],
+                                 SyncState.load(
+                                     os.path.join(destination, collection.id)),
+                                 source_root=source_root)
+            self.assertEqual(plan.unchanged, [("ABW", "2020")])
+            self.assertEqual(plan.fingerprints["ABW_2020"][url]["size"],
+                             os.path.getsize(tif_path))
+            self.assertEqual(plan.fingerprints["ABW_2020"][url]["checksum"],
+                             checksum)
+
+            # A collection populated before the sync state was kept
+            collection_dest = os.path.join(destination, collection.id)
+            os.remove(os.path.join(collection_dest, SYNC_STATE_FILE))
+            plan = sync_collection(
+                "pop",
+                "cic2020_UNadj_100m",
+                destination,
+                options=PopulateOptions(source_root=source_root))
+            self.assertEqual((plan.added, plan.unchanged),
+                             ([], [("ABW", "2020")]))
+            with open(os.path.join(collection_dest, "collection.json")) as f:
+                links = json.load(f)["links"]
+            self.assertEqual(
+                [link["href"] for link in links if link["rel"] == "item"],
+                ["./ABW_2020/ABW_2020.json"])
+            self.assertEqual(list(SyncState.load(collection_dest).units),
+                             ["ABW_2020"])
+
+    def test_mirror_again(self):
+        with TemporaryDirectory() as tmp_dir, StubAPI({}) as stub:
+            urls = {
+                iso3: f"{stub.root}/GIS/{iso3.lower()}_2020.tif"
+                for iso3 in ["ABW", "AFG", "AGO"]
+            }
+            stub.listings["pop/cic2020_UNadj_100m"] = {
+                iso3: [{
+                    "popyear": "2020",
+                    "files": [url]
+                }]
+                for iso3, url in urls.items()
+            }
+            for iso3 in urls:
+                stub.files[f"/GIS/{iso3.lower()}_2020.tif"] = iso3.encode()
+
+            def mirror(iso3s):
+                return mirror_collections(tmp_dir,
+                                          [("pop", "cic2020_UNadj_100m")],
+                                          iso3s=iso3s,
+                                          rasters=True,
+                                          api_url=stub.url)
+
+            self.assertEqual(mirror(["ABW"]), [urls["ABW"]])
+            self.assertEqual(mirror(["AFG"]), [urls["AFG"]])
+            # Countries mirrored before are kept in the listing
+            self.assertEqual(
+                get_iso3_list("pop", "cic2020_UNadj_100m", tmp_dir),
+                ["ABW", "AFG"])
+
+            # Files replaced on the server are mirrored again
+            stub.files["/GIS/abw_2020.tif"] = b"ABW 2"
+            self.assertEqual(mirror(["ABW", "AFG"]), [urls["ABW"]])
+            with open(mirror_file_path(tmp_dir, urls["ABW"]), "rb") as f:
+                self.assertEqual(f.read(), b"ABW 2")
+
+            # A failed download keeps the fingerprints of the others
+            stub.files["/GIS/abw_2020.tif"] = b"ABW 33"
+            stub.fail["/GIS/ago_2020.tif"] = [500]
+            with self.assertRaises(AssertionError):
+                mirror(None)
+            with open(os.path.join(tmp_dir, MIRROR_FINGERPRINTS_FILE)) as f:
+                fingerprints = json.load(f)
+            self.assertEqual(fingerprints[urls["ABW"]]["size"], 6)
+            self.assertNotIn(urls["AGO"], fingerprints)
+            self.assertEqual(mirror(None), [urls["AGO"]])
@@ -0,0 +1,157 @@
+import os
+from tempfile import TemporaryDirectory
+from unittest.mock import patch
+
+import numpy as np
+import rasterio
+from pystac import Collection
+from rasterio.transform import from_origin
+from stactools.testing import CliTestCase
+
+from stactools.worldpop.commands import create_worldpop_command
+from stactools.worldpop.constants import COG_NODATA
+from stactools.worldpop.mosaic import (
+    create_mosaic_vrt,
+    find_country_cogs,
+    mosaic_grid,
+    render_mosaic,
+)
+from tests import NODATA, write_raster
+
+RESOLUTION = 1 / 1200
+
+
+def write_country_cog(cog_destination,
+                      iso3,
+                      value,
+                      col,
+                      row,
+                      shape,
+                      category=("pop", "cic2020_UNadj_100m"),
+                      asset="ppp_2020",
+                      tile=None):
+    """Write a fake country COG at a pixel offset of the WorldPop grid."""
+    folder = os.path.join(cog_destination, *category, iso3, "2020",
+                          f"{iso3.lower()}_{asset}")
+    os.makedirs(folder, exist_ok=True)
+    data = np.full(shape, value, dtype="float32")
+    # The last column is outside of the country
+    data[:, -1] = NODATA
+    name = f"{iso3.lower()}_{asset}" if tile is None else tile
+    write_raster(os.path.join(folder, f"{name}_cog.tif"),
+                 data,
+                 from_origin(10 + col * RESOLUTION, 5 - row * RESOLUTION,
+                             RESOLUTION, RESOLUTION),
+                 nodata=COG_NODATA)
+
+
+class MosaicTest(CliTestCase):
+    def create_subcommand_functions(self):
+        return [create_worldpop_command]
+
+    def setUp(self):
+        super().setUp()
+        self.tmp_dir = TemporaryDirectory()
+        self.cog_destination = os.path.join(self.tmp_dir.name, "cogs")
+        write_country_cog(self.cog_destination, "XAA", 1, 0, 0, (40, 30))
+        # Overlaps the nodata column of XAA
+        write_country_cog(self.cog_destination, "XBB", 2, 29, 10, (50, 20))
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+        super().tearDown()
+
+    def expected_mosaic(self):
+        expected = np.zeros((60, 49), dtype="float32")
+        expected[:40, :29] = 1
+        expected[10:60, 29:48] = 2
+        return expected
+
+    def test_mosaic(self):
+        paths = find_country_cogs(self.cog_destination, "pop",
+                                  "cic2020_UNadj_100m", "2020")
+        self.assertEqual(len(paths), 2)
+        grid = mosaic_grid(paths)
+        self.assertEqual((grid.height, grid.width), (60, 49))
+        self.assertEqual((grid.sources[1].col_off, grid.sources[1].row_off),
+                         (29, 10))
+
+        vrt_path = create_mosaic_vrt(
+            grid, os.path.join(self.tmp_dir.name, "mosaic.vrt"))
+        with rasterio.open(vrt_path) as src:
+            self.assertEqual(src.bounds.left, 10)
+            np.testing.assert_array_equal(src.read(1), self.expected_mosaic())
+
+        tif_path = render_mosaic(grid,
+                                 os.path.join(self.tmp_dir.name, "mosaic.tif"),
+                                 window_size=16,
+                                 workers=3)
+        with rasterio.open(tif_path) as src:
+            self.assertEqual(src.nodata, 0)
+            np.testing.assert_array_equal(src.read(1), self.expected_mosaic())
+
+    def test_build_mosaic_command(self):
+        destination = os.path.join(self.tmp_dir.name, "stac")
+        # Validation fetches the remote JSON schemas
+        with patch("pystac.Collection.validate") as validate:
+            result = self.run_command([
+                "worldpop", "build-mosaic", "-y", "2020", "-s",
+                self.cog_destination, "-d", destination
+            ])
+            validate.assert_called_once()
+
+        self.assertEqual(result.exit_code, 0, msg="\n{}".format(result.output))
+        collection = Collection.from_file(
+            os.path.join(destination, "pop_cic2020_UNadj_100m",
+                         "collection.json"))
+        asset = collection.assets["mosaic_2020"]
+        self.assertEqual(asset.media_type, "application/x-gdal-vrt")
+        with rasterio.open(asset.get_absolute_href()) as src:
+            np.testing.assert_array_equal(src.read(1), self.expected_mosaic())
+
+    def test_several_assets(self):
+        category = ("age_structures", "aswpgp")
+        for sex, value in (("f", 1), ("m", 2)):
+            write_country_cog(self.cog_destination, "XAA", value, 0, 0,
+                              (40, 30), category, f"{sex}_0_2020")
+            # A tiled country has one asset folder of several COGs
+            for i in range(2):
+                write_country_cog(self.cog_destination, "XBB", value,
+                                  29 + 10 * i, 10, (50, 10), category,
+                                  f"{sex}_0_2020", f"xbb_{sex}_0_2020_{i}")
+
+        with self.assertRaisesRegex(ValueError, "f_0_2020, m_0_2020"):
+            find_country_cogs(self.cog_destination, *category, "2020")
+        paths = find_country_cogs(self.cog_destination, *category, "2020",
+                                  "m_0_2020")
+        self.assertEqual(len(paths), 3)
+        self.assertTrue(all("_m_0_2020" in path for path in paths))
+        grid = mosaic_grid(paths)
+        self.assertEqual((grid.height, grid.width), (60, 49))
+        with self.assertRaises(ValueError):
+            find_country_cogs(self.cog_destination, *category, "2020",
+                              "f_5_2020")
+        # One data asset per country
+        self.assertEqual(
+            len(
+                find_country_cogs(self.cog_destination, "pop",
+                                  "cic2020_UNadj_100m", "2020")), 2)
+
+    def test_build_mosaic_command_asset(self):
+        for sex in ("f", "m"):
+            write_country_cog(self.cog_destination, "XCC", 3, 0, 0, (10, 10),
+                              ("age_structures", "aswpgp"), f"{sex}_0_2020")
+        destination = os.path.join(self.tmp_dir.name, "stac")
+        args = [
+            "worldpop", "build-mosaic", "-p", "age_structures", "-c", "aswpgp",
+            "-y", "2020", "-s", self.cog_destination, "-d", destination
+        ]
+        with patch("pystac.Collection.validate"):
+            with self.assertRaisesRegex(ValueError, "several data assets"):
+                self.run_command(args)
+            result = self.run_command(args + ["--asset", "f_0_2020"])
+        self.assertEqual(result.exit_code, 0, msg="\n{}".format(result.output))
+        collection = Collection.from_file(
+            os.path.join(destination, "age_structures_aswpgp",
+                         "collection.json"))
+        self.assertIn("mosaic_f_0_2020", collection.assets)
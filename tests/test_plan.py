@@ -0,0 +1,143 @@
+import json
+import os
+import unittest
+from dataclasses import replace
+from tempfile import TemporaryDirectory
+
+from stactools.worldpop.plan import (
+    Calibration,
+    estimate_run,
+    estimate_tiles,
+    format_estimates,
+    total_estimate,
+)
+from stactools.worldpop.populate import PopulateOptions
+from stactools.worldpop.schedule import lpt_makespan
+from stactools.worldpop.work import WorkUnit
+from tests import run_tiled_units
+
+
+def unit(iso3, *sizes):
+    return WorkUnit("pop",
+                    "wpgp",
+                    iso3,
+                    "2020",
+                    file_sizes={
+                        f"https://example.com/{iso3}_{i}.tif": size
+                        for i, size in enumerate(sizes)
+                    })
+
+
+class PlanTest(unittest.TestCase):
+    def test_calibration_from_profile_logs(self):
+        records = [
+            ("download", 2.0, 100, None),
+            ("download", 2.0, 100, None),
+            ("download", 1.0, 0, "timed out"),
+            ("gdal_translate", 5.0, 50, None),
+            ("header_read", 0.2, 0, None),
+            ("header_read", 0.4, 0, None),
+        ]
+        with TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "profile.jsonl")
+            with open(path, "w") as f:
+                for stage, seconds, size, error in records:
+                    f.write(
+                        json.dumps({
+                            "stage": stage,
+                            "started": 0.0,
+                            "seconds": seconds,
+                            "bytes": size,
+                            "retries": 0,
+                            "subprocess_cpu": 0.0,
+                            "error": error,
+                            "labels": {}
+                        }) + "\n")
+            calibration = Calibration.from_profile_logs([path])
+        self.assertEqual(calibration.download_rate, 50)
+        self.assertEqual(calibration.cog_rate, 10)
+        self.assertEqual(calibration.cog_ratio, 0.25)
+        self.assertAlmostEqual(calibration.item_seconds, 0.3)
+        # No upload records: the default is kept
+        self.assertEqual(calibration.upload_rate, Calibration().upload_rate)
+
+    def test_estimate_tiles(self):
+        calibration = Calibration(source_bytes_per_pixel=1.0)
+        options = PopulateOptions(tile=True)
+        self.assertEqual(estimate_tiles(25000**2, options, calibration), 9)
+        self.assertEqual(estimate_tiles(1000, options, calibration), 1)
+        self.assertEqual(
+            estimate_tiles(25000**2, PopulateOptions(), calibration), 1)
+
+    def test_estimate_run(self):
+        calibration = Calibration(download_rate=10,
+                                  cog_rate=5,
+                                  upload_rate=20,
+                                  cog_ratio=0.5,
+                                  item_seconds=1,
+                                  source_bytes_per_pixel=1.0)
+        units = [unit("ABW", 100, 40), unit("AIA", 60), unit("AND", None)]
+        options = PopulateOptions(create_cog=True,
+                                  cog_destination="s3://bucket/cogs",
+                                  workers=2)
+        estimate = estimate_run("worldpop-pop", units, options, calibration)
+        self.assertEqual(estimate.units, 3)
+        self.assertEqual(estimate.unknown_sizes, 1)
+        self.assertEqual(estimate.download_bytes, 200)
+        self.assertEqual(estimate.cog_bytes, 100)
+        self.assertEqual(estimate.tiles, 4)
+        self.assertEqual(estimate.items, 3)
+        # The two largest files are staged at once
+        self.assertEqual(estimate.temp_disk_peak, 150 + 90)
+        # 0.225 s/byte downloaded, converted and uploaded, 1 s per Item
+        self.assertAlmostEqual(estimate.work_seconds, 200 * 0.225 + 3)
+        self.assertAlmostEqual(estimate.wall_seconds, 24.5)
+
+        # Items only, without COGs
+        estimate = estimate_run("worldpop-pop", units, PopulateOptions(),
+                                calibration)
+        self.assertEqual(estimate.download_bytes, 0)
+        self.assertEqual(estimate.tiles, 0)
+        self.assertEqual(estimate.items, 3)
+
+        total = total_estimate([estimate, estimate])
+        self.assertEqual(total.items, 6)
+        table = format_estimates([estimate, total])
+        self.assertEqual(len(table.splitlines()), 3)
+
+    def test_estimate_tiled_run(self):
+        calibration = Calibration(source_bytes_per_pixel=1.0)
+        units = [
+            unit(f"A{i:02d}", *[(i * 4 + j + 1) * 10**8 for j in range(4)])
+            for i in range(25)
+        ]
+        options = PopulateOptions(create_cog=True,
+                                  tile=True,
+                                  cog_destination="cogs",
+                                  workers=4)
+        estimate = estimate_run("worldpop-pop", units, options, calibration)
+        self.assertGreater(estimate.tiles, 100)
+        # Tiles are converted before other files are downloaded, so only the
+        # four largest files are on disk at once, not the whole category
+        self.assertEqual(estimate.temp_disk_peak, (100 + 99 + 98 + 97) * 10**8)
+
+        # As the scheduler does
+        sizes = {
+            url: size
+            for u in units
+            for url, size in u.file_sizes.items()
+        }
+        for u in units:
+            u.metadatas = [{"popyear": "2020", "files": list(u.file_sizes)}]
+            u.size = sum(u.file_sizes.values())
+        with TemporaryDirectory() as tmp_dir:
+            snapshots, _ = run_tiled_units(
+                units, replace(options, cog_destination=tmp_dir))
+        self.assertLessEqual(
+            max(sum(sizes[url] for url in s) for s in snapshots),
+            estimate.temp_disk_peak)
+
+    def test_lpt_makespan(self):
+        self.assertEqual(lpt_makespan([3, 3, 2, 2, 2], 2), 7)
+        self.assertEqual(lpt_makespan([5, 1], 4), 5)
+        self.assertEqual(lpt_makespan([], 2), 0)
@@ -0,0 +1,71 @@
+import json
+import os
+import shutil
+from tempfile import TemporaryDirectory
+
+from stactools.testing import CliTestCase
+
+from stactools.worldpop.commands import create_worldpop_command
+from stactools.worldpop.profiling import stage, start_profiling, stop_profiling
+from stactools.worldpop.utils import mirror_api_path
+from tests import test_data
+
+
+class ProfilingTest(CliTestCase):
+    def create_subcommand_functions(self):
+        return [create_worldpop_command]
+
+    def test_stage(self):
+        with stage("download") as record:
+            record.bytes = 10
+        profiler = start_profiling()
+        try:
+            for size in [100, 200]:
+                with stage("download", url="a") as record:
+                    record.bytes = size
+                    record.retries = 1
+            with self.assertRaises(ValueError):
+                with stage("gdal_translate"):
+                    raise ValueError()
+        finally:
+            self.assertIs(stop_profiling(), profiler)
+
+        summary = {t["stage"]: t for t in profiler.summary()}
+        self.assertEqual(summary["download"]["calls"], 2)
+        self.assertEqual(summary["download"]["bytes"], 300)
+        self.assertEqual(summary["download"]["retries"], 2)
+        self.assertEqual(summary["gdal_translate"]["errors"], 1)
+        self.assertEqual(profiler.records[0].labels, {"url": "a"})
+        self.assertIn('worldpop_stage_bytes_total{stage="download"} 300',
+                      profiler.to_prometheus().splitlines())
+
+    def test_profile_command(self):
+        tif_path = test_data.get_path(
+            "data-files/abw_ppp_2020_UNadj_constrained.tif")
+        with TemporaryDirectory() as tmp_dir:
+            source_root = os.path.join(tmp_dir, "mirror")
+            api_path = mirror_api_path(source_root, "pop",
+                                       "cic2020_UNadj_100m", "ABW")
+            os.makedirs(os.path.dirname(api_path))
+            shutil.copy(
+                test_data.get_path(
+                    "data-files/pop_cic2020_UNadj_100m_ABW.json"), api_path)
+            log_path = os.path.join(tmp_dir, "profile.jsonl")
+            metrics_path = os.path.join(tmp_dir, "metrics.prom")
+
+            result = self.run_command([
+                "worldpop", "--profile", "--profile-log", log_path,
+                "--metrics-file", metrics_path, "create-item", "-d", tmp_dir,
+                "-o", tif_path, "--source-root", source_root
+            ])
+
+            self.assertEqual(result.exit_code,
+                             0,
+                             msg="\n{}".format(result.output))
+            with open(log_path) as f:
+                stages = [json.loads(line)["stage"] for line in f]
+            with open(metrics_path) as f:
+                metrics = f.read()
+        self.assertEqual(stages, ["api", "header_read"])
+        self.assertIn("header_read", result.output)
+        self.assertIn('worldpop_stage_calls_total{stage="api"} 1', metrics)
@@ -0,0 +1,180 @@
+import csv
+import os
+import unittest
+from datetime import datetime
+from tempfile import TemporaryDirectory
+
+import numpy as np
+import rasterio
+from pystac import Asset, Item
+from rasterio.transform import rowcol
+
+from stactools.worldpop.constants import COG_NODATA
+from stactools.worldpop.sample import (
+    BlockCache,
+    sample_csv,
+    sample_items,
+    sample_raster,
+)
+from tests import TIF_PATH, write_raster
+
+
+def write_tiled(path, value=None):
+    """Write the test GeoTIFF in 64 x 64 blocks, or a constant raster on
+    its grid."""
+    with rasterio.open(TIF_PATH) as src:
+        data = src.read(1)
+    if value is not None:
+        data[:] = value
+    return write_raster(path, data, tiled=True, blockxsize=64, blockysize=64)
+
+
+def raster_item(item_id, path):
+    with rasterio.open(path) as src:
+        bbox = list(src.bounds)
+    item = Item(item_id, None, bbox, datetime(2020, 1, 1), {})
+    item.add_asset("data", Asset(path, roles=["data"]))
+    item.add_asset("metadata", Asset("https://example.com",
+                                     roles=["metadata"]))
+    return item
+
+
+def random_points(count, seed=0):
+    with rasterio.open(TIF_PATH) as src:
+        bounds = src.bounds
+    rng = np.random.default_rng(seed)
+    return (rng.uniform(bounds.left, bounds.right,
+                        count), rng.uniform(bounds.bottom, bounds.top, count))
+
+
+class SampleTest(unittest.TestCase):
+    def test_sample_raster(self):
+        lons, lats = random_points(2000)
+        with TemporaryDirectory() as tmp_dir:
+            path = write_tiled(os.path.join(tmp_dir, "abw.tif"))
+            cache = BlockCache()
+            values = sample_raster(path, lons, lats, cache=cache)
+            with rasterio.open(path) as src:
+                expected = np.array(
+                    [v[0] for v in src.sample(zip(lons, lats))],
+                    dtype=np.float64)
+                expected[expected == src.nodata] = np.nan
+                rows, cols = rowcol(src.transform, lons, lats)
+            np.testing.assert_array_equal(values, expected)
+
+            # Each block is decoded once, then read from the cache
+            blocks = {(r // 64, c // 64) for r, c in zip(rows, cols)}
+            self.assertEqual(cache.misses, len(blocks))
+            self.assertEqual(len(cache), len(blocks))
+            sample_raster(path, lons, lats, cache=cache)
+            self.assertEqual(cache.misses, len(blocks))
+            self.assertEqual(cache.hits, len(blocks))
+
+            # Outside the raster
+            self.assertTrue(np.isnan(sample_raster(path, [0.0], [0.0]))[0])
+
+    def test_cache_is_bounded(self):
+        cache = BlockCache(max_bytes=100)
+        for i in range(3):
+            cache.put(("a", 1, 0, i), np.zeros(5))
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.nbytes, 80)
+        self.assertIsNone(cache.get(("a", 1, 0, 0)))
+        self.assertIsNotNone(cache.get(("a", 1, 0, 1)))
+        # The least recently used block is evicted first
+        cache.put(("a", 1, 0, 3), np.zeros(5))
+        self.assertIsNotNone(cache.get(("a", 1, 0, 1)))
+        self.assertIsNone(cache.get(("a", 1, 0, 2)))
+
+    def test_sample_items(self):
+        lons, lats = random_points(500)
+        lons = np.append(lons, 10.0)
+        lats = np.append(lats, 10.0)
+        with TemporaryDirectory() as tmp_dir:
+            items = [
+                raster_item("ABW_2020",
+                            write_tiled(os.path.join(tmp_dir, "abw.tif"))),
+                # Overlaps the first one, only used where it has no data
+                raster_item("XXX_2020",
+                            write_tiled(os.path.join(tmp_dir, "xxx.tif"),
+                                        7.0)),
+            ]
+            samples = sample_items(items, lons, lats)
+            expected = sample_raster(items[0].assets["data"].href, lons, lats)
+
+            from_first = ~np.isnan(expected)
+            self.assertTrue(from_first.any() and not from_first[:-1].all())
+            np.testing.assert_array_equal(samples.values[from_first],
+                                          expected[from_first])
+            self.assertTrue(all(samples.item_ids[from_first] == "ABW_2020"))
+            self.assertTrue(all(samples.values[:-1][~from_first[:-1]] == 7))
+            self.assertTrue(
+                all(samples.item_ids[:-1][~from_first[:-1]] == "XXX_2020"))
+            # Outside every Item
+            self.assertTrue(np.isnan(samples.values[-1]))
+            self.assertIsNone(samples.item_ids[-1])
+
+            with self.assertRaises(ValueError):
+                sample_items(items, lons, lats, asset="missing")
+
+    def test_sample_produced_cogs(self):
+        lons, lats = random_points(500)
+        with TemporaryDirectory() as tmp_dir:
+            # Produced COGs are tagged with COG_NODATA but keep WorldPop's
+            # nodata, their Items use relative hrefs
+            items = []
+            for item_id, value in [("ABW_2020", None), ("XXX_2020", 7.0)]:
+                with rasterio.open(TIF_PATH) as src:
+                    data = src.read(1)
+                if value is not None:
+                    data[:] = value
+                name = f"{item_id.lower()}_cog.tif"
+                write_raster(os.path.join(tmp_dir, name),
+                             data,
+                             nodata=COG_NODATA,
+                             cog=True,
+                             BLOCKSIZE=64)
+                item = raster_item(item_id, os.path.join(tmp_dir, name))
+                item.set_self_href(os.path.join(tmp_dir, f"{item_id}.json"))
+                item.make_asset_hrefs_relative()
+                self.assertFalse(os.path.isabs(item.assets["data"].href))
+                items.append(item)
+            values = sample_raster(os.path.join(tmp_dir, "abw_2020_cog.tif"),
+                                   lons, lats)
+            samples = sample_items(items, lons, lats)
+
+        from_first = ~np.isnan(values)
+        self.assertTrue(from_first.any() and not from_first.all())
+        np.testing.assert_array_equal(samples.values[from_first],
+                                      values[from_first])
+        self.assertTrue(all(samples.item_ids[from_first] == "ABW_2020"))
+        # WorldPop nodata falls through to the next Item
+        self.assertTrue(all(samples.values[~from_first] == 7))
+        self.assertTrue(all(samples.item_ids[~from_first] == "XXX_2020"))
+
+    def test_sample_csv(self):
+        lons, lats = random_points(20)
+        with TemporaryDirectory() as tmp_dir:
+            item = raster_item("ABW_2020",
+                               write_tiled(os.path.join(tmp_dir, "abw.tif")))
+            input_path = os.path.join(tmp_dir, "points.csv")
+            with open(input_path, "w", newline="") as f:
+                writer = csv.writer(f)
+                writer.writerow(["id", "x", "y"])
+                for i, (lon, lat) in enumerate(zip(lons, lats)):
+                    writer.writerow([i, lon, lat])
+            output_path = os.path.join(tmp_dir, "values.csv")
+            samples = sample_csv([item], input_path, output_path, "x", "y")
+            with open(output_path, newline="") as f:
+                rows = list(csv.DictReader(f))
+
+            self.assertEqual([row["id"] for row in rows],
+                             [str(i) for i in range(20)])
+            for row, value in zip(rows, samples.values):
+                if np.isnan(value):
+                    self.assertEqual((row["value"], row["item"]), ("", ""))
+                else:
+                    self.assertEqual(float(row["value"]), value)
+                    self.assertEqual(row["item"], "ABW_2020")
+            with self.assertRaises(ValueError):
+                sample_csv([item], input_path, output_path)
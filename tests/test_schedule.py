@@ -0,0 +1,110 @@
+import os
+import threading
+import unittest
+from tempfile import TemporaryDirectory
+
+from stactools.worldpop.cog import tile_windows
+from stactools.worldpop.populate import PopulateOptions, cog_folder
+from stactools.worldpop.schedule import Countdown, Task, lpt_order, run_lpt
+from stactools.worldpop.work import WorkUnit
+from tests import run_tiled_units
+
+
+class ScheduleTest(unittest.TestCase):
+    def test_lpt_order(self):
+        tasks = [Task("b", 1, list), Task("a", 3, list), Task("c", 3, list)]
+        self.assertEqual([t.name for t in lpt_order(tasks)], ["a", "c", "b"])
+
+    def test_run_lpt_follow_ups(self):
+        def split():
+            return [Task("big/1", 6, list), Task("big/2", 4, list)]
+
+        tasks = [
+            Task("small", 1, list),
+            Task("big", 10, split),
+            Task("medium", 5, list)
+        ]
+        names = [task.name for task in run_lpt(tasks, 1)]
+        self.assertEqual(names, ["big", "big/1", "medium", "big/2", "small"])
+
+    def test_run_lpt_priority(self):
+        def split():
+            return [Task("big/1", 1, list, priority=1)]
+
+        tasks = [Task("big", 10, split), Task("medium", 5, list)]
+        names = [task.name for task in run_lpt(tasks, 1)]
+        self.assertEqual(names, ["big", "big/1", "medium"])
+
+    def test_tiled_files_on_disk(self):
+        with TemporaryDirectory() as tmp_dir:
+            options = PopulateOptions(create_cog=True,
+                                      tile=True,
+                                      cog_destination=tmp_dir,
+                                      workers=4)
+            units = [
+                WorkUnit("pop", "cic2020_UNadj_100m", f"A{i:02d}", "2020",
+                         [{
+                             "popyear": "2020",
+                             "files": [f"a{i:02d}_{j}.tif" for j in range(4)]
+                         }], 400, {f"a{i:02d}_{j}.tif": 100
+                                   for j in range(4)}) for i in range(25)
+            ]
+            # A COG of an earlier run with another tiling
+            stale = os.path.join(
+                cog_folder(tmp_dir, "pop", "cic2020_UNadj_100m", "A00",
+                           "2020"), "a00_0", "a00_0_9_9_cog.tif")
+            os.makedirs(os.path.dirname(stale))
+            with open(stale, "w"):
+                pass
+
+            snapshots, results = run_tiled_units(units, options)
+
+            self.assertEqual(len(set(sum(snapshots, []))), 100)
+            self.assertEqual(len(results), 25)
+            self.assertLessEqual(max(len(s) for s in snapshots),
+                                 options.workers)
+            self.assertFalse(os.path.exists(stale))
+            self.assertEqual(len(os.listdir(os.path.dirname(stale))), 4)
+
+    def test_run_lpt_concurrent(self):
+        lock = threading.Lock()
+        ran = []
+
+        def run(name):
+            def f():
+                with lock:
+                    ran.append(name)
+                return []
+
+            return f
+
+        tasks = [Task(str(i), i, run(str(i))) for i in range(20)]
+        done = [task.name for task in run_lpt(tasks, 4)]
+        self.assertEqual(sorted(done), sorted(ran))
+        self.assertEqual(len(done), 20)
+
+    def test_run_lpt_raises(self):
+        def fail():
+            raise ValueError("failed")
+
+        tasks = [Task("fail", 2, fail), Task("ok", 1, list)]
+        with self.assertRaises(ValueError):
+            list(run_lpt(tasks, 1))
+
+    def test_countdown(self):
+        last = Task("last", 1, list)
+        countdown = Countdown(2, lambda: [last])
+        countdown.add(1)
+        self.assertEqual(countdown.done(), [])
+        self.assertEqual(countdown.done(), [])
+        self.assertEqual(countdown.done(), [last])
+
+    def test_tile_windows(self):
+        tiles = tile_windows(25, 10, (10, 10))
+        self.assertEqual([suffix for suffix, _ in tiles],
+                         ["_1_1", "_1_2", "_1_3"])
+        self.assertEqual(tiles[2][1].width, 5)
+        tiles = tile_windows(100, 15, (10, 10))
+        self.assertEqual(len(tiles), 20)
+        self.assertEqual(tiles[-1][0], "_02_10")
+        self.assertEqual(tiles[-1][1].height, 5)
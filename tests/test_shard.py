@@ -0,0 +1,158 @@
+import json
+import os
+import unittest
+from tempfile import TemporaryDirectory
+
+from stactools.worldpop.constants import WORLDPOP_EXTENT
+from stactools.worldpop.merge import merge_collections
+from stactools.worldpop.sync import SyncState
+from stactools.worldpop.work import WorkUnit, parse_shard, partition
+
+
+def write_shard(destination, item_ids, bbox, interval, shape):
+    collection_dest = os.path.join(destination, "pop_cic2020_UNadj_100m")
+    os.makedirs(collection_dest, exist_ok=True)
+    links = [{"rel": "root", "href": "./collection.json"}]
+    for item_id in item_ids:
+        os.makedirs(os.path.join(collection_dest, item_id))
+        with open(os.path.join(collection_dest, item_id, f"{item_id}.json"),
+                  "w") as f:
+            json.dump({"id": item_id}, f)
+        links.append({"rel": "item", "href": f"./{item_id}/{item_id}.json"})
+    collection = {
+        "id": "pop_cic2020_UNadj_100m",
+        "links": links,
+        "extent": {
+            "spatial": {
+                "bbox": [bbox]
+            },
+            "temporal": {
+                "interval": [interval]
+            },
+        },
+        "summaries": {
+            "worldpop:iso3": [item_id[:3] for item_id in item_ids],
+            "proj:shape": {
+                "minimum": shape,
+                "maximum": shape
+            },
+        },
+    }
+    with open(os.path.join(collection_dest, "collection.json"), "w") as f:
+        json.dump(collection, f)
+
+
+class ShardTest(unittest.TestCase):
+    def test_parse_shard(self):
+        self.assertEqual(parse_shard("2/3"), (2, 3))
+        for shard in ["0/3", "4/3", "2", "a/b"]:
+            with self.assertRaises(ValueError):
+                parse_shard(shard)
+
+    def test_partition(self):
+        sizes = {"CHN": 90, "IND": 80, "BRA": 40, "ABW": 5, "AIA": 5}
+        units = [
+            WorkUnit("pop", "cic2020_UNadj_100m", iso3, "2020", size=size)
+            for iso3, size in sizes.items()
+        ]
+
+        shards = partition(units, 2)
+
+        self.assertEqual([[u.iso3 for u in shard] for shard in shards],
+                         [["ABW", "AIA", "CHN"], ["BRA", "IND"]])
+        self.assertEqual(sorted(u.iso3 for s in shards for u in s),
+                         sorted(sizes))
+        self.assertEqual(partition(list(reversed(units)), 2), shards)
+
+    def test_merge_collections(self):
+        with TemporaryDirectory() as tmp_dir:
+            first = os.path.join(tmp_dir, "1")
+            second = os.path.join(tmp_dir, "2")
+            write_shard(first, ["ABW_2020"], [-70.1, 12.4, -69.8, 12.7],
+                        ["2020-01-01T00:00:00Z", "2020-12-31T23:59:59Z"],
+                        [255, 238])
+            write_shard(second, ["AFG_2020", "AGO_2020"],
+                        [11.6, -18.1, 74.9, 38.5],
+                        ["2020-01-01T00:00:00Z", "2020-12-31T23:59:59Z"],
+                        [8000, 100])
+
+            ids = merge_collections([first, second], first)
+
+            self.assertEqual(ids, ["pop_cic2020_UNadj_100m"])
+            collection_dest = os.path.join(first, ids[0])
+            with open(os.path.join(collection_dest, "collection.json")) as f:
+                collection = json.load(f)
+            for link in collection["links"]:
+                self.assertTrue(
+                    os.path.exists(os.path.join(collection_dest,
+                                                link["href"])))
+        self.assertEqual([link["href"] for link in collection["links"]][1:], [
+            "./ABW_2020/ABW_2020.json", "./AFG_2020/AFG_2020.json",
+            "./AGO_2020/AGO_2020.json"
+        ])
+        self.assertEqual(collection["extent"]["spatial"]["bbox"],
+                         [[-70.1, -18.1, 74.9, 38.5]])
+        self.assertEqual(collection["summaries"]["worldpop:iso3"],
+                         ["ABW", "AFG", "AGO"])
+        self.assertEqual(collection["summaries"]["proj:shape"], {
+            "minimum": [255, 100],
+            "maximum": [8000, 238]
+        })
+
+    def test_merge_empty_shard(self):
+        interval = ["2020-01-01T00:00:00Z", "2020-12-31T23:59:59Z"]
+        with TemporaryDirectory() as tmp_dir:
+            first = os.path.join(tmp_dir, "1")
+            second = os.path.join(tmp_dir, "2")
+            write_shard(first, ["ABW_2020"], [-70.1, 12.4, -69.8, 12.7],
+                        interval, [255, 238])
+            # The static extents of a shard without Items
+            write_shard(second, [], WORLDPOP_EXTENT, [interval[0], None],
+                        [1, 1])
+
+            ids = merge_collections([first, second], tmp_dir)
+            with open(os.path.join(tmp_dir, ids[0], "collection.json")) as f:
+                collection = json.load(f)
+            self.assertEqual(collection["extent"]["spatial"]["bbox"],
+                             [[-70.1, 12.4, -69.8, 12.7]])
+            self.assertEqual(collection["extent"]["temporal"]["interval"],
+                             [interval])
+            self.assertEqual(collection["summaries"]["proj:shape"]["minimum"],
+                             [255, 238])
+
+    def test_merge_state_extents(self):
+        with TemporaryDirectory() as tmp_dir:
+            first = os.path.join(tmp_dir, "1")
+            write_shard(first, ["ABW_2020"], WORLDPOP_EXTENT,
+                        ["2000-01-01T00:00:00Z", None], [255, 238])
+            extent = {
+                "bbox": [-70.1, 12.4, -69.8, 12.7],
+                "interval": ["2020-01-01T00:00:00Z", "2020-12-31T23:59:59Z"],
+                "shape": {
+                    "minimum": [255, 238],
+                    "maximum": [255, 238]
+                },
+            }
+            SyncState({
+                "ABW_2020": {
+                    "iso3": "ABW",
+                    "popyear": "2020",
+                    "items": ["ABW_2020"],
+                    "files": [],
+                    "fingerprints": {},
+                    "extent": extent,
+                }
+            }).save(os.path.join(first, "pop_cic2020_UNadj_100m"))
+
+            ids = merge_collections([first], tmp_dir)
+            with open(os.path.join(tmp_dir, ids[0], "collection.json")) as f:
+                collection = json.load(f)
+            self.assertEqual(
+                collection["extent"], {
+                    "spatial": {
+                        "bbox": [extent["bbox"]]
+                    },
+                    "temporal": {
+                        "interval": [extent["interval"]]
+                    },
+                })
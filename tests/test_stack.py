@@ -0,0 +1,116 @@
+import os
+import unittest
+from tempfile import TemporaryDirectory
+
+import numpy as np
+import rasterio
+from pystac.extensions.eo import EOExtension
+from pystac.extensions.raster import RasterExtension
+from rasterio.enums import Interleaving
+from rasterio.shutil import copy
+from rasterio.transform import from_origin
+
+from stactools.worldpop.stac import create_item
+from stactools.worldpop.stack import (
+    age_sex_class,
+    band_description,
+    create_stack_vrt,
+    sort_age_sex_paths,
+)
+from stactools.worldpop.stats import compute_statistics, read_statistics
+from stactools.worldpop.thumbnail import create_thumbnail
+from tests import NODATA, write_raster
+
+
+def write_layer(path, value, origin=(100.0, 20.0)):
+    data = np.full((64, 64), value, dtype="float32")
+    data[:8] = NODATA
+    return write_raster(path, data,
+                        from_origin(origin[0], origin[1], 0.01, 0.01))
+
+
+class StackTest(unittest.TestCase):
+    def test_age_sex_class(self):
+        self.assertEqual(
+            age_sex_class("/a/abw_m_15_2020_constrained_UNadj.tif"), ("m", 15))
+        self.assertEqual(
+            sort_age_sex_paths([
+                "abw_m_0_2020.tif", "abw_f_5_2020.tif", "abw_f_10_2020.tif",
+                "abw_f_1_2020.tif"
+            ]), [
+                "abw_f_1_2020.tif", "abw_f_5_2020.tif", "abw_f_10_2020.tif",
+                "abw_m_0_2020.tif"
+            ])
+        with self.assertRaises(ValueError):
+            age_sex_class("abw_ppp_2020_UNadj_constrained.tif")
+
+    def test_band_description(self):
+        self.assertEqual(band_description("f_0"),
+                         "Female population aged under 1 year")
+        self.assertEqual(band_description("m_5"),
+                         "Male population aged 5 to 9 years")
+        self.assertEqual(band_description("f_80"),
+                         "Female population aged 80 years and over")
+
+    def test_stacked_cog(self):
+        with TemporaryDirectory() as tmp_dir:
+            paths = sort_age_sex_paths([
+                write_layer(os.path.join(tmp_dir, f"xas_{s}_{a}_2020.tif"),
+                            value)
+                for value, (
+                    s, a) in enumerate([("m", 0), ("f", 1), ("f", 0)], start=1)
+            ])
+            band_statistics = [compute_statistics(path) for path in paths]
+            vrt_path = create_stack_vrt(paths,
+                                        os.path.join(tmp_dir, "stack.vrt"),
+                                        band_statistics)
+            cog_path = os.path.join(tmp_dir, "xas_agesex_2020_cog.tif")
+            copy(vrt_path, cog_path, driver="COG")
+
+            with rasterio.open(cog_path) as src:
+                self.assertEqual(src.count, 3)
+                self.assertEqual(src.descriptions, ("f_0", "f_1", "m_0"))
+                self.assertEqual(src.interleaving, Interleaving.pixel)
+                self.assertEqual(list(src.read()[:, 10, 10]), [3, 2, 1])
+                self.assertIsNone(read_statistics(src))
+                self.assertEqual(read_statistics(src, 2)["sum"], 2 * 56 * 64)
+
+            thumbnail_path = create_thumbnail(
+                cog_path, os.path.join(tmp_dir, "thumb.png"))
+            with rasterio.open(thumbnail_path) as src:
+                self.assertEqual(src.read(4)[0, 0], 0)
+                self.assertEqual(src.read(4)[-1, -1], 255)
+
+            metadata = {
+                "title": "Synthetic",
+                "desc": "Synthetic age/sex structures.",
+                "doi": "10.5258/SOTON/WP00685",
+                "citation": "Synthetic data.",
+                "popyear": "2020",
+                "files": paths,
+                "url_img": "https://www.worldpop.org/img.png",
+                "url_summary": "https://www.worldpop.org/summary",
+            }
+            item = create_item("age_structures", "ascicua_2020", "XAS", "2020",
+                               [metadata], [cog_path])
+
+        self.assertEqual(item.properties["worldpop:total_population"],
+                         6 * 56 * 64)
+        asset = item.assets["xas_agesex_2020_cog"]
+        raster_bands = RasterExtension.ext(asset).bands
+        self.assertEqual(len(raster_bands), 3)
+        self.assertEqual(raster_bands[2].statistics.maximum, 1)
+        eo_bands = EOExtension.ext(asset).bands
+        self.assertEqual([b.name for b in eo_bands], ["f_0", "f_1", "m_0"])
+        self.assertEqual(eo_bands[1].description,
+                         "Female population aged 1 to 4 years")
+
+    def test_grid_mismatch(self):
+        with TemporaryDirectory() as tmp_dir:
+            paths = [
+                write_layer(os.path.join(tmp_dir, "xas_f_0_2020.tif"), 1),
+                write_layer(os.path.join(tmp_dir, "xas_f_1_2020.tif"), 1,
+                            (101.0, 20.0)),
+            ]
+            with self.assertRaises(ValueError):
+                create_stack_vrt(paths, os.path.join(tmp_dir, "stack.vrt"))
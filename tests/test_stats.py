@@ -0,0 +1,80 @@
+import os.path
+import unittest
+from tempfile import TemporaryDirectory
+
+import numpy as np
+import rasterio
+
+from stactools.worldpop import stac
+from stactools.worldpop.constants import STATISTICS_TAG
+from stactools.worldpop.stats import (
+    BandStatistics,
+    StreamingHistogram,
+    compute_statistics,
+    statistics_metadata_option,
+)
+from stactools.worldpop.utils import get_metadata
+from tests import test_data
+
+
+class StatsTest(unittest.TestCase):
+    def test_streaming_histogram_matches_single_pass(self):
+        rng = np.random.default_rng(0)
+        blocks = [rng.uniform(lo, hi, 1000) for lo, hi in [(2, 3), (0, 50)]]
+        blocks.append(rng.uniform(-40, 1, 1000))
+
+        histogram = StreamingHistogram(16)
+        for block in blocks:
+            histogram.update(block)
+        result = histogram.to_dict()
+
+        expected, _ = np.histogram(np.concatenate(blocks),
+                                   bins=16,
+                                   range=(result["min"], result["max"]))
+        self.assertEqual(result["buckets"], list(expected))
+        self.assertEqual(sum(result["buckets"]), 3000)
+
+    def test_band_statistics_ignore_nodata(self):
+        stats = BandStatistics()
+        stats.update(np.array([[-99999.0, 0.0], [1.0, 3.0]]), [-99999.0, 0])
+        stats.update(np.array([[np.nan, 2.0]]), [-99999.0, 0])
+        result = stats.to_dict()
+        self.assertEqual(result["count"], 3)
+        self.assertEqual(result["sum"], 6.0)
+        self.assertEqual(result["minimum"], 1.0)
+        self.assertEqual(result["maximum"], 3.0)
+        self.assertEqual(result["mean"], 2.0)
+        self.assertEqual(result["valid_percent"], 50.0)
+
+    def test_create_item_reads_statistics(self):
+        path = test_data.get_path(
+            "data-files/abw_ppp_2020_UNadj_constrained.tif")
+        statistics = compute_statistics(path)
+        with rasterio.open(path) as src:
+            data = src.read(1)
+        valid = data[(data != src.nodata) & (data != 0)]
+        self.assertAlmostEqual(statistics["sum"], float(valid.sum()), 2)
+
+        with TemporaryDirectory() as tmp_dir:
+            cog_path = os.path.join(tmp_dir, "abw_cog.tif")
+            with rasterio.open(path) as src:
+                profile = src.profile
+            with rasterio.open(cog_path, "w", **profile) as dst:
+                dst.write(data, 1)
+                dst.update_tags(**dict(
+                    [statistics_metadata_option(statistics).split("=", 1)]))
+                self.assertIn(STATISTICS_TAG, dst.tags())
+
+            metadatas = get_metadata(
+                test_data.get_path(
+                    "data-files/pop_cic2020_UNadj_100m_ABW.json"))["data"]
+            item = stac.create_item("pop", "cic2020_UNadj_100m", "ABW", "2020",
+                                    metadatas, [cog_path])
+
+        assert item is not None
+        self.assertAlmostEqual(item.properties["worldpop:total_population"],
+                               statistics["sum"])
+        band = item.assets["abw_cog"].extra_fields["raster:bands"][0]
+        self.assertEqual(band["statistics"]["maximum"], statistics["maximum"])
+        self.assertEqual(sum(band["histogram"]["buckets"]),
+                         statistics["count"])
@@ -0,0 +1,265 @@
+import hashlib
+import json
+import os
+import threading
+import time
+import unittest
+from datetime import datetime
+from tempfile import TemporaryDirectory
+from unittest.mock import patch
+
+from pystac import Asset, Collection, Item
+
+from stactools.worldpop import populate, storage
+from stactools.worldpop.checksum import (
+    HashingReader,
+    StreamHash,
+    get_checksum,
+    record_checksum,
+)
+from stactools.worldpop.populate import (
+    load_collection,
+    publish_cogs,
+    save_collection,
+)
+from stactools.worldpop.stac import create_collection
+from stactools.worldpop.storage import (
+    Backend,
+    BackendStacIO,
+    LocalBackend,
+    S3Backend,
+)
+from stactools.worldpop.sync import SyncState
+
+try:
+    import boto3
+    from moto import mock_aws
+except ImportError:
+    mock_aws = None
+
+
+class MemoryBackend(Backend):
+    """An object store kept in memory, counting the PUTs."""
+    def __init__(self):
+        self.objects = {}
+        self.puts = []
+        self.lock = threading.Lock()
+
+    def put_file(self, path, href):
+        with open(path, "rb") as f:
+            reader = HashingReader(f)
+            self.put_bytes(reader.read(), href)
+        record_checksum(href, reader.stream_hash)
+
+    def put_bytes(self, data, href):
+        with self.lock:
+            self.objects[href] = data
+            self.puts.append(href)
+
+    def get_bytes(self, href):
+        return self.objects.get(href)
+
+    def delete_prefix(self, href):
+        for key in [k for k in self.objects if k.startswith(href)]:
+            del self.objects[key]
+
+
+def item(item_id):
+    return Item(item_id, None, None, datetime(2020, 1, 1), {})
+
+
+class StorageTest(unittest.TestCase):
+    def test_local_backend(self):
+        backend = LocalBackend()
+        with TemporaryDirectory() as tmp_dir:
+            href = os.path.join(tmp_dir, "a", "b.json")
+            self.assertIsNone(backend.get_bytes(href))
+            backend.put_bytes(b"{}", href)
+            self.assertEqual(backend.get_bytes(href), b"{}")
+            copy_href = os.path.join(tmp_dir, "a", "c.json")
+            backend.put_file(href, copy_href)
+            self.assertEqual(get_checksum(copy_href)["size"], 2)
+            backend.delete_prefix(os.path.join(tmp_dir, "a"))
+            self.assertEqual(os.listdir(tmp_dir), [])
+
+    def test_backend_abstract(self):
+        class PartialBackend(Backend):
+            def put_bytes(self, data, href):
+                pass
+
+        with self.assertRaises(TypeError):
+            PartialBackend()
+
+    def test_stac_io_written(self):
+        backend = MemoryBackend()
+        href = "s3://bucket/stac/collection.json"
+        with patch.dict(storage._backends, {"s3": backend}):
+            with BackendStacIO() as stac_io:
+                stac_io.write_text_to_href(href, "{}")
+                stac_io.write_text_to_href(href, "{}")
+            self.assertEqual(backend.puts, [href])
+            # Not remembered by the next instance
+            with BackendStacIO() as stac_io:
+                stac_io.write_text_to_href(href, "{}")
+            self.assertEqual(backend.puts, [href, href])
+
+    def test_remote_collection(self):
+        backend = MemoryBackend()
+        destination = "s3://bucket/stac"
+        with patch.dict(storage._backends, {"s3": backend}):
+            collection = create_collection("pop", "cic2020_UNadj_100m")
+            collection_dest = f"{destination}/{collection.id}"
+            collection.add_item(item("ABW_2020"))
+            save_collection(collection, collection_dest, validate=False)
+            self.assertEqual(
+                sorted(backend.puts),
+                [
+                    f"{collection_dest}/ABW_2020/ABW_2020.json",
+                    f"{collection_dest}/collection.json",
+                ],
+            )
+
+            # A checkpoint only writes the new Items and the collection
+            backend.puts.clear()
+            collection.add_item(item("AFG_2020"))
+            save_collection(collection,
+                            collection_dest,
+                            validate=False,
+                            items=[collection.get_item("AFG_2020")])
+            self.assertEqual(
+                sorted(backend.puts),
+                [
+                    f"{collection_dest}/AFG_2020/AFG_2020.json",
+                    f"{collection_dest}/collection.json",
+                ],
+            )
+
+            SyncState({
+                "ABW_2020": {
+                    "items": ["ABW_2020"]
+                }
+            }).save(collection_dest)
+            self.assertEqual(
+                SyncState.load(collection_dest).units["ABW_2020"],
+                {"items": ["ABW_2020"]})
+
+            loaded = load_collection("pop", "cic2020_UNadj_100m", destination)
+            self.assertEqual(sorted(i.id for i in loaded.get_items()),
+                             ["ABW_2020", "AFG_2020"])
+
+    def test_save_new_items(self):
+        with TemporaryDirectory() as tmp_dir:
+            first = os.path.join(tmp_dir, "first")
+            second = os.path.join(tmp_dir, "second")
+            collection = create_collection("pop", "cic2020_UNadj_100m")
+            collection.add_item(item("ABW_2020"))
+            save_collection(collection, first, False,
+                            list(collection.get_items()))
+
+            # Only the Items added since are serialized
+            collection.add_item(item("AFG_2020"))
+            with patch("stactools.worldpop.populate.item_dict",
+                       wraps=populate.item_dict) as item_dict:
+                save_collection(collection, first, False,
+                                [collection.get_item("AFG_2020")])
+            self.assertEqual([c.args[0].id for c in item_dict.call_args_list],
+                             ["AFG_2020"])
+
+            # As written by a full save
+            save_collection(collection, second, validate=False)
+            for path in [
+                    "collection.json", "ABW_2020/ABW_2020.json",
+                    "AFG_2020/AFG_2020.json"
+            ]:
+                with open(os.path.join(first, path)) as f, open(
+                        os.path.join(second, path)) as g:
+                    self.assertEqual(f.read().replace(first, second), g.read())
+
+    def test_save_time_linear(self):
+        def checkpoint_seconds(count):
+            collection = create_collection("pop", "cic2020_UNadj_100m")
+            with TemporaryDirectory() as tmp_dir:
+                for i in range(count):
+                    collection.add_item(item(f"ABW_{i}"))
+                save_collection(collection, tmp_dir, False,
+                                list(collection.get_items()))
+                seconds = []
+                for i in range(3):
+                    new_item = item(f"AFG_{i}")
+                    collection.add_item(new_item)
+                    start = time.perf_counter()
+                    with patch.object(
+                            Collection,
+                            "get_self_href",
+                            autospec=True,
+                            side_effect=Collection.get_self_href) as get_href:
+                        save_collection(collection, tmp_dir, False, [new_item])
+                    seconds.append(time.perf_counter() - start)
+                    # Not looked up once per Item link
+                    self.assertLess(get_href.call_count, 10)
+            return min(seconds)
+
+        # A quadratic save takes 64 times longer
+        self.assertLess(checkpoint_seconds(2000), 24 * checkpoint_seconds(250))
+
+    def test_publish_cogs(self):
+        backend = MemoryBackend()
+        with TemporaryDirectory() as staging, patch.dict(
+                storage._backends, {"s3": backend}):
+            cog_path = os.path.join(staging, "pop", "ABW", "abw_cog.tif")
+            os.makedirs(os.path.dirname(cog_path))
+            with open(cog_path, "wb") as f:
+                f.write(b"cog")
+            cog_item = item("ABW_2020")
+            cog_item.add_asset("abw", Asset(cog_path))
+            cog_item.add_asset("metadata",
+                               Asset("https://www.worldpop.org/rest/data"))
+
+            publish_cogs([cog_item], staging, "s3://bucket/cogs/")
+
+        href = "s3://bucket/cogs/pop/ABW/abw_cog.tif"
+        self.assertEqual(cog_item.assets["abw"].href, href)
+        self.assertEqual(backend.objects, {href: b"cog"})
+        self.assertEqual(cog_item.assets["metadata"].href,
+                         "https://www.worldpop.org/rest/data")
+        # Checksums are taken while uploading
+        stream_hash = StreamHash()
+        stream_hash.update(b"cog")
+        self.assertEqual(cog_item.assets["abw"].extra_fields["file:checksum"],
+                         stream_hash.checksum)
+        self.assertEqual(cog_item.assets["abw"].extra_fields["file:size"], 3)
+        self.assertNotIn("file:size", cog_item.assets["metadata"].extra_fields)
+        self.assertIn(
+            "https://stac-extensions.github.io/file/v2.1.0/schema.json",
+            cog_item.stac_extensions)
+
+    @unittest.skipIf(mock_aws is None, "boto3 and moto are required")
+    def test_s3_backend(self):
+        with mock_aws(), TemporaryDirectory() as tmp_dir:
+            client = boto3.client("s3", region_name="us-east-1")
+            client.create_bucket(Bucket="bucket")
+            backend = S3Backend(client,
+                                multipart_threshold=5 * 1024 * 1024,
+                                part_size=5 * 1024 * 1024)
+            path = os.path.join(tmp_dir, "large_cog.tif")
+            data = os.urandom(12 * 1024 * 1024)
+            with open(path, "wb") as f:
+                f.write(data)
+            backend.put_file(path, "s3://bucket/cogs/large_cog.tif")
+            self.assertEqual(
+                backend.get_bytes("s3://bucket/cogs/large_cog.tif"), data)
+            self.assertEqual(
+                get_checksum("s3://bucket/cogs/large_cog.tif")["checksum"],
+                "1220" + hashlib.sha256(data).hexdigest())
+            # Uploaded in 3 parts
+            head = client.head_object(Bucket="bucket",
+                                      Key="cogs/large_cog.tif")
+            self.assertTrue(head["ETag"].endswith('-3"'))
+
+            backend.put_bytes(
+                json.dumps({}).encode(), "s3://bucket/stac/collection.json")
+            backend.delete_prefix("s3://bucket/cogs")
+            self.assertIsNone(
+                backend.get_bytes("s3://bucket/cogs/large_cog.tif"))
+            self.assertIsNotNone(
+                backend.get_bytes("s3://bucket/stac/collection.json"))
@@ -0,0 +1,195 @@
+import unittest
+from datetime import datetime
+from tempfile import TemporaryDirectory
+from unittest.mock import patch
+
+from pystac import Item
+
+from stactools.worldpop.checksum import StreamHash, record_checksum
+from stactools.worldpop.sync import (
+    SyncPlan,
+    SyncState,
+    adopt_items,
+    known_fingerprints,
+    plan_sync,
+    with_checksums,
+)
+
+FILES = {
+    "ABW": "https://data.worldpop.org/abw_2020.tif",
+    "AFG": "https://data.worldpop.org/afg_2020.tif",
+    "AGO": "https://data.worldpop.org/ago_2020.tif",
+    "AIA": "https://data.worldpop.org/aia_2020.tif",
+}
+
+
+def metadatas(iso3):
+    return [{"popyear": "2020", "files": [FILES[iso3]]}]
+
+
+def item(item_id):
+    return Item(item_id, None, None, datetime(2020, 1, 1), {})
+
+
+class SyncTest(unittest.TestCase):
+    def setUp(self):
+        self.state = SyncState()
+        for iso3 in ["ABW", "AFG", "ALB"]:
+            url = FILES.get(iso3, "https://data.worldpop.org/alb_2020.tif")
+            fingerprints = {url: {"size": 10, "etag": "a"}}
+            self.state.record(iso3, "2020", [{
+                "popyear": "2020",
+                "files": [url]
+            }], [item(f"{iso3}_2020")], fingerprints)
+
+    def test_state_round_trip(self):
+        with TemporaryDirectory() as tmp_dir:
+            self.state.save(tmp_dir)
+            state = SyncState.load(tmp_dir)
+        self.assertEqual(state.units, self.state.units)
+        self.assertEqual(state.remove("ABW_2020"), ["ABW_2020"])
+
+    @patch("stactools.worldpop.utils.get_remote_fingerprint")
+    @patch("stactools.worldpop.work.crawl_metadata")
+    def test_plan_sync(self, crawl_metadata, get_remote_fingerprint):
+        crawl_metadata.return_value = {
+            ("pop", "cic2020_UNadj_100m"): {
+                iso3: metadatas(iso3)
+                for iso3 in ["ABW", "AFG", "AGO"]
+            }
+        }
+        get_remote_fingerprint.side_effect = lambda url: {
+            "size": 10,
+            "etag": "b" if url == FILES["AFG"] else "a"
+        }
+
+        plan = plan_sync("pop", "cic2020_UNadj_100m", ["2020"], self.state)
+
+        self.assertEqual(plan.added, [("AGO", "2020")])
+        self.assertEqual(plan.changed, [("AFG", "2020")])
+        self.assertEqual(plan.removed, ["ALB_2020"])
+        self.assertEqual(plan.unchanged, [("ABW", "2020")])
+        self.assertEqual(plan.fingerprints["AGO_2020"][FILES["AGO"]], {
+            "size": 10,
+            "etag": "a"
+        })
+
+    @patch("stactools.worldpop.utils.get_remote_fingerprint")
+    @patch("stactools.worldpop.work.crawl_metadata")
+    def test_plan_sync_checksums(self, crawl_metadata, get_remote_fingerprint):
+        crawl_metadata.return_value = {
+            ("pop", "cic2020_UNadj_100m"): {
+                iso3: metadatas(iso3)
+                for iso3 in ["ABW", "AFG"]
+            }
+        }
+        for iso3 in ["ABW", "AFG"]:
+            self.state.units[f"{iso3}_2020"]["fingerprints"][
+                FILES[iso3]]["checksum"] = "1220aa"
+        # Both were uploaded again, only AFG has new content
+        get_remote_fingerprint.side_effect = lambda url: {
+            "size": 10,
+            "etag": "b",
+            "checksum": "1220bb" if url == FILES["AFG"] else "1220aa"
+        }
+
+        plan = plan_sync("pop", "cic2020_UNadj_100m", ["2020"], self.state)
+
+        self.assertEqual(plan.changed, [("AFG", "2020")])
+        self.assertEqual(plan.unchanged, [("ABW", "2020")])
+
+    @patch("stactools.worldpop.utils.get_remote_fingerprint")
+    @patch("stactools.worldpop.work.crawl_metadata")
+    def test_plan_sync_unknown_stored(self, crawl_metadata,
+                                      get_remote_fingerprint):
+        crawl_metadata.return_value = {
+            ("pop", "cic2020_UNadj_100m"): {
+                iso3: metadatas(iso3)
+                for iso3 in ["ABW", "AFG"]
+            }
+        }
+        # Recorded after a failed HEAD request
+        self.state.units["ABW_2020"]["fingerprints"][FILES["ABW"]] = {
+            "size": None,
+            "etag": None
+        }
+        self.state.units["AFG_2020"]["fingerprints"][FILES["AFG"]] = {
+            "size": 10,
+            "etag": None
+        }
+        get_remote_fingerprint.return_value = {"size": 10, "etag": "a"}
+
+        plan = plan_sync("pop", "cic2020_UNadj_100m", ["2020"], self.state)
+
+        self.assertEqual(plan.changed, [])
+        self.assertEqual(plan.unchanged, [("ABW", "2020"), ("AFG", "2020")])
+
+    @patch("stactools.worldpop.utils.get_remote_fingerprint")
+    @patch("stactools.worldpop.work.crawl_metadata")
+    def test_plan_sync_failed_head(self, crawl_metadata,
+                                   get_remote_fingerprint):
+        crawl_metadata.return_value = {
+            ("pop", "cic2020_UNadj_100m"): {
+                iso3: metadatas(iso3)
+                for iso3 in ["ABW", "AFG"]
+            }
+        }
+
+        def head(url):
+            if url == FILES["AFG"]:
+                raise AssertionError(f"500 code for file: {url}")
+            return {"size": 10, "etag": "a"}
+
+        get_remote_fingerprint.side_effect = head
+
+        plan = plan_sync("pop", "cic2020_UNadj_100m", ["2020"], self.state)
+
+        # The unit whose fingerprint is unknown is left as it is
+        self.assertEqual(plan.unchanged, [("ABW", "2020"), ("AFG", "2020")])
+        self.assertEqual(plan.fingerprints["AFG_2020"][FILES["AFG"]], {
+            "size": None,
+            "etag": None
+        })
+        stored = self.state.units["AFG_2020"]["fingerprints"]
+        self.assertEqual(
+            known_fingerprints(stored, plan.fingerprints["AFG_2020"]), stored)
+
+    def test_adopt_items(self):
+        plan = SyncPlan(added=[("ABW", "2020"), ("AGO", "2020")],
+                        metadatas={
+                            "ABW": metadatas("ABW"),
+                            "AGO": metadatas("AGO")
+                        },
+                        fingerprints={
+                            "ABW_2020": {
+                                FILES["ABW"]: {
+                                    "size": 10,
+                                    "etag": "a"
+                                }
+                            },
+                            "AGO_2020": {}
+                        })
+        state = SyncState()
+        adopt_items(plan, state, [
+            item("ABW_2020_1_1"),
+            item("ABW_2020_1_2"),
+            item("ALB_2020"),
+        ])
+
+        self.assertEqual(plan.added, [("AGO", "2020")])
+        self.assertEqual(plan.unchanged, [("ABW", "2020")])
+        self.assertEqual(plan.removed, ["ALB_2020"])
+        self.assertEqual(state.units["ABW_2020"]["items"],
+                         ["ABW_2020_1_1", "ABW_2020_1_2"])
+        self.assertEqual(state.units["ABW_2020"]["files"], [FILES["ABW"]])
+        self.assertEqual(state.remove("ALB_2020"), ["ALB_2020"])
+
+    def test_with_checksums(self):
+        stream_hash = StreamHash()
+        stream_hash.update(b"tif")
+        record_checksum(FILES["AIA"], stream_hash)
+        fingerprints = with_checksums({FILES["AIA"]: {"size": 3}})
+        self.assertEqual(fingerprints[FILES["AIA"]], {
+            "size": 3,
+            "checksum": stream_hash.checksum
+        })
@@ -0,0 +1,76 @@
+import os.path
+import unittest
+from tempfile import TemporaryDirectory
+
+import numpy as np
+import rasterio
+from rasterio.shutil import copy
+
+from stactools.worldpop.constants import COG_NODATA, THUMBNAIL_COLORS
+from stactools.worldpop.thumbnail import (
+    colorize,
+    create_thumbnail,
+    thumbnail_path,
+    total_population,
+)
+from tests import NODATA, test_data, write_raster
+
+
+class ThumbnailTest(unittest.TestCase):
+    def test_thumbnail_path(self):
+        self.assertEqual(thumbnail_path("/a/abw_2020_cog.tif"),
+                         "/a/abw_2020_thumb.png")
+
+    def test_colorize(self):
+        rgba = colorize(np.array([[-99999.0, 0.5, 2000.0]]), -99999.0)
+        self.assertEqual(list(rgba[3, 0]), [0, 255, 255])
+        self.assertEqual(tuple(rgba[:3, 0, 1]), THUMBNAIL_COLORS[0])
+        self.assertEqual(tuple(rgba[:3, 0, 2]), THUMBNAIL_COLORS[-1])
+
+    def test_create_thumbnail_from_overview(self):
+        path = test_data.get_path(
+            "data-files/abw_ppp_2020_UNadj_constrained.tif")
+        with TemporaryDirectory() as tmp_dir:
+            cog_path = os.path.join(tmp_dir, "abw_cog.tif")
+            copy(path,
+                 cog_path,
+                 driver="COG",
+                 BLOCKSIZE=64,
+                 OVERVIEW_RESAMPLING="NEAREST")
+            with rasterio.open(cog_path) as src:
+                self.assertEqual(src.overviews(1), [2, 4])
+
+            output_path = create_thumbnail(cog_path,
+                                           thumbnail_path(cog_path),
+                                           size=32)
+            with rasterio.open(output_path) as src:
+                self.assertEqual(src.driver, "PNG")
+                self.assertEqual(src.count, 4)
+                self.assertLessEqual(max(src.width, src.height), 32)
+                alpha = src.read(4)
+            self.assertTrue((alpha == 255).any())
+            self.assertTrue((alpha == 0).any())
+
+    def test_thumbnail_of_produced_cog(self):
+        # Produced COGs are tagged with COG_NODATA but keep WorldPop's nodata
+        with TemporaryDirectory() as tmp_dir:
+            cog_path = write_raster(os.path.join(tmp_dir, "abw_cog.tif"),
+                                    nodata=COG_NODATA,
+                                    cog=True,
+                                    BLOCKSIZE=64,
+                                    OVERVIEW_RESAMPLING="NEAREST")
+            output_path = create_thumbnail(cog_path,
+                                           thumbnail_path(cog_path),
+                                           size=32)
+            with rasterio.open(output_path) as src:
+                alpha = src.read(4)
+        self.assertTrue((alpha == 255).any())
+        self.assertGreater((alpha == 0).mean(), 0.5)
+
+    def test_total_population_skips_nodata(self):
+        data = np.array([[[1.0, NODATA, NODATA]], [[2.0, 3.0, NODATA]]],
+                        dtype="float32")
+        total = total_population(data, COG_NODATA)
+        self.assertEqual(list(total[0]), [3.0, 3.0, COG_NODATA])
+        self.assertEqual(list(colorize(total, COG_NODATA)[3, 0]),
+                         [255, 255, 0])
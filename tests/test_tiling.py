@@ -0,0 +1,49 @@
+import math
+import unittest
+
+import rasterio
+
+from stactools.worldpop.constants import TILING_PIXEL_SIZE
+from stactools.worldpop.tiling import (
+    balanced_length,
+    choose_tile_size,
+    estimate_density,
+    tile_size,
+)
+from tests import test_data
+
+TIF_PATH = test_data.get_path("data-files/abw_ppp_2020_UNadj_constrained.tif")
+
+
+class TilingTest(unittest.TestCase):
+    def test_small_raster_is_not_split(self):
+        self.assertEqual(choose_tile_size(240, 260), (240, 260))
+
+    def test_tiles_are_block_aligned(self):
+        width, height = 60000, 25000
+        tile_width, tile_height = choose_tile_size(width, height)
+        self.assertEqual(tile_width % 512, 0)
+        self.assertEqual(tile_height % 512, 0)
+        self.assertLessEqual(tile_width * tile_height * 4, 1024**3)
+        # The last column is not a sliver
+        count = math.ceil(width / tile_width)
+        self.assertGreater(width - (count - 1) * tile_width, tile_width / 2)
+
+    def test_sparse_rasters_get_larger_tiles(self):
+        dense = choose_tile_size(60000, 60000, density=1.0)
+        sparse = choose_tile_size(60000, 60000, density=0.1)
+        self.assertGreater(sparse[0], dense[0])
+
+    def test_balanced_length(self):
+        self.assertEqual(balanced_length(10000, 8192, 512), 5120)
+        self.assertEqual(balanced_length(300, 8192, 512), 512)
+
+    def test_tile_size(self):
+        self.assertEqual(tile_size(TIF_PATH), TILING_PIXEL_SIZE)
+        with rasterio.open(TIF_PATH) as src:
+            shape = (src.width, src.height)
+            density = estimate_density(src)
+        self.assertTrue(0 < density < 1)
+        self.assertEqual(tile_size(TIF_PATH, "adaptive"), shape)
+        with self.assertRaises(ValueError):
+            tile_size(TIF_PATH, "square")